@@ -0,0 +1,98 @@
+"""
+Count the TCP connections opened against a local API stand-in when every call builds its own ApiClient (what the
+resource classes used to do) versus when all the calls go through the shared, pooled ApiClient.
+
+Usage (from containers/mlops): python -m benchmarks.bench_api_client --calls 200
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from kubernetes import client as K8SClient
+from utils.api_client import ApiClientSettings, RecordingClient, new_api_client
+
+
+class ApiStandIn(ThreadingHTTPServer):
+    """
+    Minimal HTTP/1.1 server answering every GET with a MachineLearningModel, counting the accepted connections.
+    """
+
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), ApiStandInHandler)
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class ApiStandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self) -> None:
+        name = self.path.split("?")[0].rstrip("/").split("/")[-1]
+        body = json.dumps(
+            {
+                "apiVersion": "blue.intranet/v1alpha1",
+                "kind": "MachineLearningModel",
+                "metadata": {"name": name, "namespace": "default", "resourceVersion": "1"},
+                "spec": {"image": "model:latest"},
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def run(server: ApiStandIn, calls: int, get_api: Callable[[], K8SClient.CustomObjectsApi]) -> dict:
+    server.connections = 0
+    started = time.monotonic()
+    for n in range(calls):
+        get_api().get_namespaced_custom_object("blue.intranet", "v1alpha1", "default", "machinelearningmodels", f"m{n}")
+    elapsed = time.monotonic() - started
+    return {"connections": server.connections, "seconds": round(elapsed, 3), "calls/s": round(calls / elapsed, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    arguments = parser.parse_args()
+
+    server = ApiStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    configuration = K8SClient.Configuration()
+    configuration.host = server.host
+
+    per_call = run(server, arguments.calls, lambda: K8SClient.CustomObjectsApi(K8SClient.ApiClient(configuration)))
+
+    shared = new_api_client(configuration, ApiClientSettings())
+    with RecordingClient(shared) as recorder:
+        pooled = run(server, arguments.calls, lambda: K8SClient.CustomObjectsApi(shared))
+
+    requests = {f"{verb} {plural}": count for (verb, plural), count in recorder.summary().items()}
+    print(json.dumps({"per_call_client": per_call, "shared_client": pooled, "requests": requests}))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
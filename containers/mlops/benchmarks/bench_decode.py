@@ -0,0 +1,101 @@
+"""
+Compare the decoding of API responses through the default path (kubernetes client json.loads + pydantic validation)
+with the trusted path (orjson + construct without validation), for a Model and for a VirtualService routing to many
+model versions.
+
+Usage (from containers/mlops): python -m benchmarks.bench_decode --repeat 2000 --routes 200
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Callable
+
+from resources.istio.virtual_service import V1Beta1VirtualService
+from resources.mlops.model import V1Alpha1Model
+from utils.decode import construct, loads
+
+
+def model_payload() -> dict:
+    return {
+        "apiVersion": "blue.intranet/v1alpha1",
+        "kind": "MachineLearningModel",
+        "metadata": {
+            "name": "titanic-rfc",
+            "namespace": "default",
+            "resourceVersion": "1",
+            "labels": {"model": "titanic-rfc"},
+            "finalizers": [],
+            "managedFields": [{"manager": "kopf", "operation": "Update", "fieldsV1": {}}],
+        },
+        "spec": {"image": "model:latest", "artifact": "s3://models/titanic", "command": ["serve"], "args": ["--port"]},
+        "status": {
+            "endpoint": "endpoint",
+            "endpoint_config": "endpoint-config",
+            "endpoint_config_version": "1",
+            "model": "titanic-rfc",
+            "version": "1",
+            "state": "available",
+        },
+    }
+
+
+def virtual_service_payload(routes: int) -> dict:
+    return {
+        "apiVersion": "networking.istio.io/v1beta1",
+        "kind": "VirtualService",
+        "metadata": {"name": "endpoint", "namespace": "default", "resourceVersion": "1", "labels": {}},
+        "spec": {
+            "gateways": ["endpoint-gateway"],
+            "hosts": ["*"],
+            "http": [
+                {
+                    "route": [
+                        {"destination": {"host": f"model-{n}", "port": {"number": 8080}}, "weight": 1}
+                        for n in range(routes)
+                    ]
+                }
+            ],
+        },
+    }
+
+
+def measure(repeat: int, decode: Callable[[], Any]) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        decode()
+    return round((time.perf_counter() - started) / repeat * 1e6, 1)
+
+
+def compare(name: str, format: Any, payload: dict, repeat: int) -> dict:
+    raw = json.dumps(payload).encode()
+    assert construct(format, loads(raw)).dict() == format.parse_obj(json.loads(raw)).dict()
+    return {
+        name: {
+            "validated_us": measure(repeat, lambda: format.parse_obj(json.loads(raw))),
+            "trusted_us": measure(repeat, lambda: construct(format, loads(raw))),
+        }
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--routes", type=int, default=200)
+    arguments = parser.parse_args()
+
+    results = {}
+    results.update(compare("model", V1Alpha1Model, model_payload(), arguments.repeat))
+    results.update(
+        compare(
+            "virtual_service",
+            V1Beta1VirtualService,
+            virtual_service_payload(arguments.routes),
+            arguments.repeat // 10 or 1,
+        )
+    )
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measure the reconcile throughput of the operator against the in-memory API server of benchmarks/fake_kubernetes.py:
+for every fleet size, seed that many endpoints (each with its endpoint config and base models), run the create
+pipeline of each one (Endpoint.create_handler, then the create_handler of the endpoint config version and of its model
+versions, as kopf would) and report the reconciles per second, the API calls per reconcile and the memory used.
+
+Usage (from containers/mlops):
+    python -m benchmarks.bench_reconcile --endpoints 10,1000,10000 --workers 8 --latency 0.002 --error-rate 0.01
+
+The throttling of the API server is modelled with --server-qps (429 with a Retry-After of --retry-after seconds above
+it) and the client-side rate limiter of the operator with --qps and --burst, e.g. --server-qps 400 --qps 300.
+"""
+
+import argparse
+import json
+import resource
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from benchmarks.fake_kubernetes import FakeKubernetes, seed_endpoint
+from resources import Endpoint, EndpointConfig
+from utils.ratelimit import RateLimiter
+
+
+def rss() -> int:
+    """
+    Resident set size of the process, in bytes (the peak one where /proc is not available).
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reconcile(namespace: str, name: str) -> None:
+    endpoint = Endpoint(name=name, namespace=namespace).create_handler()
+    endpoint_config = EndpointConfig(name=endpoint.body.status.endpoint_config_version, namespace=namespace)
+    endpoint_config.create_handler()
+    for model in endpoint_config.get_models():
+        model.create_handler()
+
+
+def run(fake: FakeKubernetes, endpoints: int, models: int, workers: int) -> Dict[str, float]:
+    names = [(f"ns-{n % 100}", f"endpoint-{n}") for n in range(endpoints)]
+    for namespace, name in names:
+        seed_endpoint(fake, namespace=namespace, name=name, models=models)
+    fake.reset_calls()
+
+    def attempt(key) -> bool:
+        try:
+            reconcile(*key)
+            return True
+        except Exception:
+            return False
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes = list(executor.map(attempt, names))
+    elapsed = time.monotonic() - started
+
+    calls = sum(fake.calls.values())
+    verbs: Counter = Counter()
+    for (verb, _), count in fake.calls.items():
+        verbs[verb] += count
+    return {
+        "endpoints": endpoints,
+        "failed": outcomes.count(False),
+        "seconds": round(elapsed, 3),
+        "reconciles/s": round(endpoints / elapsed, 1),
+        "calls/reconcile": round(calls / endpoints, 1),
+        "calls/reconcile by verb": {verb: round(count / endpoints, 1) for verb, count in sorted(verbs.items())},
+        "throttled": fake.throttled,
+        "objects": fake.count(),
+        "store_bytes": fake.size(),
+        "rss_bytes": rss(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default="10,1000", help="Comma separated fleet sizes, e.g. 10,1000,10000.")
+    parser.add_argument("--models", type=int, default=1, help="Models per endpoint config.")
+    parser.add_argument("--workers", type=int, default=1, help="Reconciles running concurrently.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API call.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of the API calls failing.")
+    parser.add_argument("--error-status", type=int, default=500, help="Status code of the failing calls.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-qps", type=float, default=0.0, help="Calls per second served before answering 429.")
+    parser.add_argument("--server-burst", type=int, default=100)
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of the 429 answers, in seconds.")
+    parser.add_argument("--qps", type=float, default=0.0, help="Client-side rate limit, 0 disables it.")
+    parser.add_argument("--burst", type=int, default=100)
+    arguments = parser.parse_args()
+
+    results: List[Dict[str, float]] = []
+    for endpoints in [int(size) for size in arguments.endpoints.split(",") if size]:
+        fake = FakeKubernetes(
+            latency=arguments.latency,
+            error_rate=arguments.error_rate,
+            error_status=arguments.error_status,
+            retry_after=arguments.retry_after,
+            seed=arguments.seed,
+            qps=arguments.server_qps,
+            burst=arguments.server_burst,
+        )
+        with fake.installed(rate_limiter=RateLimiter(qps={"*": arguments.qps}, burst={"*": arguments.burst})):
+            results.append(run(fake, endpoints, arguments.models, arguments.workers))
+        print(json.dumps(results[-1]), flush=True)
+
+
+if __name__ == "__main__":
+    main()
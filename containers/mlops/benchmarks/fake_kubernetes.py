@@ -0,0 +1,532 @@
+"""
+In-memory stand-in for the Kubernetes API server, plugged in at the REST layer of the kubernetes client: the generated
+CustomObjectsApi, CoreV1Api and AppsV1Api clients, the decoding and the instrumentation of the shared ApiClient all run
+as they do against a real cluster, only the HTTP round trip is replaced.
+
+It serves the blue.intranet and networking.istio.io custom resources and the core/apps kinds the resource classes use
+(persistent volumes and claims, services, deployments), with the API server semantics the operator relies on:
+resourceVersion and generation bookkeeping, 404/409 errors, merge and JSON patches, the status subresource, finalizers
+holding deletions, the garbage collection of the dependents of a deleted owner, label selectors and paging. Latency and error rates can be injected, and the API Priority and
+Fairness throttling can be modelled with a QPS limit answering 429 with a Retry-After header. Watches are not supported.
+"""
+
+import copy
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from kubernetes import client as K8SClient
+from kubernetes.client.rest import RESTResponse
+from resources.mlops import client as MLOpsClient
+from utils.api_client import ApiClientSettings, get_api_client, instrument, set_api_client
+from utils.metrics import describe_request
+from utils.ratelimit import RateLimiter, RetryPolicy, TokenBucket
+
+# Kinds without a status subresource for the purpose of the fake: a patch of the main resource keeps their status.
+CORE_GROUPS = ("", "apps")
+# The core kinds answer a deletion with the deleted object rather than a Status, as the API server does.
+RETURN_DELETED_OBJECT_GROUP = ""
+
+CollectionKey = Tuple[str, str]
+ObjectKey = Tuple[str, str]
+
+
+class _RawResponse:
+    """
+    The parts of a urllib3 response the kubernetes client reads.
+    """
+
+    def __init__(self, status: int, data: bytes, headers: Dict[str, str] = None) -> None:
+        self.status = status
+        self.reason = "OK" if status < 400 else "Error"
+        self.data = data
+        self.headers = {"content-type": "application/json", **(headers or {})}
+
+
+class FakeApiError(Exception):
+    def __init__(self, status: int, reason: str, message: str = "", headers: Dict[str, str] = None) -> None:
+        super().__init__(message or reason)
+        self.status = status
+        self.reason = reason
+        self.message = message or reason
+        self.headers = headers or {}
+
+
+def merge(target: Any, patch: Any) -> Any:
+    """
+    Apply a JSON merge patch (RFC 7386).
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge(result.get(key), value)
+    return result
+
+
+def _pointer(path: str) -> List[str]:
+    return [part.replace("~1", "/").replace("~0", "~") for part in path.split("/")[1:]]
+
+
+def json_patch(target: Any, operations: List[Dict[str, Any]]) -> Any:
+    """
+    Apply a JSON patch (RFC 6902), supporting the add, remove, replace and test operations.
+    """
+    target = copy.deepcopy(target)
+    for operation in operations:
+        *parents, last = _pointer(operation["path"])
+        node = target
+        try:
+            for part in parents:
+                node = node[int(part)] if isinstance(node, list) else node[part]
+        except (IndexError, KeyError, TypeError, ValueError):
+            raise FakeApiError(422, "Invalid", f"no value at {operation['path']}")
+        op = operation["op"]
+        if isinstance(node, list):
+            index = len(node) if last == "-" else int(last)
+            if op == "test":
+                if index >= len(node) or node[index] != operation["value"]:
+                    raise FakeApiError(422, "Invalid", f"test operation failed on {operation['path']}")
+            elif op == "add":
+                node.insert(index, operation["value"])
+            elif op == "remove":
+                node.pop(index)
+            elif op == "replace":
+                node[index] = operation["value"]
+        else:
+            if op == "test":
+                if node.get(last) != operation["value"]:
+                    raise FakeApiError(422, "Invalid", f"test operation failed on {operation['path']}")
+            elif op in ("add", "replace"):
+                node[last] = operation["value"]
+            elif op == "remove":
+                if last not in node:
+                    raise FakeApiError(422, "Invalid", f"no value at {operation['path']}")
+                del node[last]
+    return target
+
+
+def matches(labels: Dict[str, str], selector: Optional[str]) -> bool:
+    """
+    Check labels against a label selector made of key=value, key!=value and key requirements.
+    """
+    for requirement in filter(None, (selector or "").split(",")):
+        if "!=" in requirement:
+            key, value = requirement.split("!=", 1)
+            if labels.get(key) == value:
+                return False
+        elif "=" in requirement:
+            key, value = requirement.replace("==", "=").split("=", 1)
+            if labels.get(key) != value:
+                return False
+        elif requirement.startswith("!"):
+            if requirement[1:] in labels:
+                return False
+        elif requirement not in labels:
+            return False
+    return True
+
+
+class FakeKubernetes:
+    """
+    In-memory API server.
+    @param latency: Seconds every call takes, to model the round trip to a real API server.
+    @param error_rate: Share of the calls failing with error_status before reaching the store.
+    @param error_status: Status code of the injected errors (e.g. 429 to model throttling, 500 for server errors).
+    @param retry_after: Retry-After header of the 429 errors, injected or throttled, in seconds.
+    @param seed: Seed of the error injection, for reproducible runs.
+    @param qps: Calls per second served before answering 429, as the API Priority and Fairness of a real API server
+    would; 0 (the default) disables the throttling.
+    @param burst: Calls served at once before the QPS limit applies.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        retry_after: int = 1,
+        seed: Optional[int] = None,
+        qps: float = 0.0,
+        burst: int = 1,
+    ) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.throttle = TokenBucket(qps, burst)
+        self.throttled = 0
+
+        self.lock = threading.RLock()
+        # Objects are kept encoded, as etcd does: reads can't alias the stored state and the memory is accounted for.
+        self.objects: Dict[CollectionKey, Dict[ObjectKey, bytes]] = {}
+        self.resource_version = 0
+        self.calls: Counter = Counter()
+
+    # Store access, for seeding the fake and checking its state in tests.
+
+    def create(self, group: str, version: str, plural: str, body: dict, namespace: str = None) -> dict:
+        """
+        Create an object directly in the store, e.g. the custom resources a user would have applied.
+        """
+        with self.lock:
+            return self._create((group, plural), namespace, copy.deepcopy(body), self._api_version(group, version))
+
+    def get(self, group: str, plural: str, name: str, namespace: str = None) -> Optional[dict]:
+        with self.lock:
+            data = self.objects.get((group, plural), {}).get((namespace or "", name))
+            return json.loads(data) if data is not None else None
+
+    def list(self, group: str, plural: str, namespace: str = None) -> List[dict]:
+        with self.lock:
+            return [
+                json.loads(data)
+                for (ns, _), data in self.objects.get((group, plural), {}).items()
+                if namespace is None or ns == namespace
+            ]
+
+    def count(self) -> int:
+        with self.lock:
+            return sum(len(objects) for objects in self.objects.values())
+
+    def size(self) -> int:
+        """
+        Bytes held by the store.
+        """
+        with self.lock:
+            return sum(len(data) for objects in self.objects.values() for data in objects.values())
+
+    def reset_calls(self) -> None:
+        with self.lock:
+            self.calls.clear()
+            self.throttled = 0
+
+    # REST layer.
+
+    def api_client(
+        self,
+        settings: ApiClientSettings = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry: Optional[RetryPolicy] = None,
+    ) -> K8SClient.ApiClient:
+        """
+        Build an ApiClient answered by this fake, instrumented and retrying like the one of the operator. The calls are
+        not rate limited unless a limiter is given, so the tests and benchmarks run as fast as the fake answers.
+        """
+        configuration = K8SClient.Configuration(host="http://fake-kubernetes")
+        api_client = K8SClient.ApiClient(configuration)
+        api_client.rest_client.request = self.request
+        rate_limiter = rate_limiter or RateLimiter(qps={}, burst={})
+        return instrument(api_client, settings or ApiClientSettings(), rate_limiter, retry)
+
+    @contextmanager
+    def installed(
+        self, rate_limiter: Optional[RateLimiter] = None, retry: Optional[RetryPolicy] = None
+    ) -> Iterator["FakeKubernetes"]:
+        """
+        Make this fake the process wide ApiClient for the duration of the block.
+        """
+        set_api_client(self.api_client(rate_limiter=rate_limiter, retry=retry))
+        try:
+            yield self
+        finally:
+            set_api_client(None)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Dict[str, str] = None,
+        body: Any = None,
+        post_params: Any = None,
+        _request_timeout: Any = None,
+    ) -> RESTResponse:
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.calls[describe_request(method, url)] += 1
+            try:
+                if not self.throttle.try_acquire():
+                    self.throttled += 1
+                    raise FakeApiError(429, "TooManyRequests", headers={"Retry-After": str(self.retry_after)})
+                if self.error_rate and self.random.random() < self.error_rate:
+                    raise FakeApiError(
+                        self.error_status,
+                        "TooManyRequests" if self.error_status == 429 else "InternalError",
+                        headers={"Retry-After": str(self.retry_after)} if self.error_status == 429 else None,
+                    )
+                status, result = self._handle(method.upper(), url, (headers or {}).get("Content-Type"), body)
+                response = _RawResponse(status, json.dumps(result).encode())
+            except FakeApiError as err:
+                status_body = {
+                    "kind": "Status",
+                    "apiVersion": "v1",
+                    "metadata": {},
+                    "status": "Failure",
+                    "message": err.message,
+                    "reason": err.reason,
+                    "code": err.status,
+                }
+                response = _RawResponse(err.status, json.dumps(status_body).encode(), err.headers)
+        return RESTResponse(response)
+
+    @staticmethod
+    def _api_version(group: str, version: str) -> str:
+        return f"{group}/{version}" if group else version
+
+    @staticmethod
+    def _parse(url: str) -> Tuple[str, str, Optional[str], str, Optional[str], Optional[str], Dict[str, str]]:
+        """
+        Split a request URL into (group, version, namespace, plural, name, subresource, query).
+        """
+        parts = urlsplit(url)
+        segments = [segment for segment in parts.path.split("/") if segment]
+        if segments[0] == "api":
+            group, version, segments = "", segments[1], segments[2:]
+        else:
+            group, version, segments = segments[1], segments[2], segments[3:]
+        namespace = None
+        if segments[0] == "namespaces" and len(segments) > 2:
+            namespace, segments = segments[1], segments[2:]
+        plural = segments[0]
+        name = segments[1] if len(segments) > 1 else None
+        subresource = segments[2] if len(segments) > 2 else None
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        return group, version, namespace, plural, name, subresource, query
+
+    def _handle(self, method: str, url: str, content_type: Optional[str], body: Any) -> Tuple[int, Any]:
+        group, version, namespace, plural, name, subresource, query = self._parse(url)
+        collection = (group, plural)
+        api_version = self._api_version(group, version)
+
+        if method == "GET" and query.get("watch", "").lower() == "true":
+            raise FakeApiError(405, "MethodNotAllowed", "watches are not supported by the fake")
+        if method == "GET" and name is None:
+            return 200, self._list(collection, namespace, query, api_version)
+        if method == "POST":
+            return 201, self._create(collection, namespace, body, api_version)
+
+        obj = self._read(collection, namespace, name)
+        if method == "GET":
+            return 200, obj
+        if method == "PUT":
+            return 200, self._replace(collection, namespace, obj, body, subresource)
+        if method == "PATCH":
+            return 200, self._patch(collection, namespace, obj, body, content_type, subresource)
+        if method == "DELETE":
+            return 200, self._delete(collection, namespace, obj)
+        raise FakeApiError(405, "MethodNotAllowed", f"{method} is not supported by the fake")
+
+    def _read(self, collection: CollectionKey, namespace: Optional[str], name: str) -> dict:
+        data = self.objects.get(collection, {}).get((namespace or "", name))
+        if data is None:
+            raise FakeApiError(404, "NotFound", f'{collection[1]} "{name}" not found')
+        return json.loads(data)
+
+    def _store(self, collection: CollectionKey, obj: dict) -> dict:
+        self.resource_version += 1
+        obj["metadata"]["resourceVersion"] = str(self.resource_version)
+        key = (obj["metadata"].get("namespace") or "", obj["metadata"]["name"])
+        self.objects.setdefault(collection, {})[key] = json.dumps(obj).encode()
+        return obj
+
+    def _list(self, collection: CollectionKey, namespace: Optional[str], query: Dict[str, str], api_version: str):
+        items = [
+            json.loads(data)
+            for (ns, _), data in sorted(self.objects.get(collection, {}).items())
+            if namespace is None or ns == namespace
+        ]
+        items = [item for item in items if matches(item["metadata"].get("labels") or {}, query.get("labelSelector"))]
+
+        metadata = {"resourceVersion": str(self.resource_version)}
+        offset = int(query.get("continue") or 0)
+        limit = int(query.get("limit") or 0)
+        if limit:
+            if offset + limit < len(items):
+                metadata["continue"] = str(offset + limit)
+            items = items[offset : offset + limit]
+        return {"apiVersion": api_version, "kind": "List", "metadata": metadata, "items": items}
+
+    def _create(self, collection: CollectionKey, namespace: Optional[str], body: Any, api_version: str) -> dict:
+        obj = copy.deepcopy(body)
+        metadata = obj.setdefault("metadata", {})
+        if namespace:
+            metadata["namespace"] = namespace
+        if (metadata.get("namespace") or "", metadata["name"]) in self.objects.get(collection, {}):
+            raise FakeApiError(409, "AlreadyExists", f'{collection[1]} "{metadata["name"]}" already exists')
+        obj.setdefault("apiVersion", api_version)
+        metadata.pop("resourceVersion", None)
+        metadata["uid"] = str(uuid.uuid4())
+        metadata["generation"] = 1
+        metadata["creationTimestamp"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return self._store(collection, obj)
+
+    def _update(self, collection: CollectionKey, old: dict, new: dict) -> dict:
+        """
+        Store the new state of an object: bump its generation if the spec changed, and drop it if it is being
+        deleted and no finalizer holds it anymore.
+        """
+        new["metadata"]["uid"] = old["metadata"]["uid"]
+        new["metadata"]["creationTimestamp"] = old["metadata"]["creationTimestamp"]
+        new["metadata"]["generation"] = old["metadata"].get("generation", 1) + (old.get("spec") != new.get("spec"))
+        if old["metadata"].get("deletionTimestamp"):
+            new["metadata"]["deletionTimestamp"] = old["metadata"]["deletionTimestamp"]
+            if not new["metadata"].get("finalizers"):
+                self._remove(collection, new)
+                return new
+        return self._store(collection, new)
+
+    def _replace(self, collection: CollectionKey, namespace: Optional[str], obj: dict, body: Any, subresource):
+        expected = (body.get("metadata") or {}).get("resourceVersion")
+        if expected and expected != obj["metadata"]["resourceVersion"]:
+            raise FakeApiError(409, "Conflict", "the object has been modified; please apply your changes again")
+        new = copy.deepcopy(body)
+        if subresource == "status":
+            new = {**obj, "status": new.get("status")}
+        elif collection[0] not in CORE_GROUPS and "status" in obj:
+            new["status"] = obj["status"]
+        return self._update(collection, obj, new)
+
+    def _patch(self, collection, namespace, obj: dict, body: Any, content_type: Optional[str], subresource) -> dict:
+        if isinstance(body, list) or content_type == "application/json-patch+json":
+            new = json_patch(obj, body)
+        else:
+            expected = ((body or {}).get("metadata") or {}).get("resourceVersion")
+            if expected and expected != obj["metadata"]["resourceVersion"]:
+                raise FakeApiError(409, "Conflict", "the object has been modified; please apply your changes again")
+            new = merge(obj, body)
+
+        if subresource == "status":
+            new = {**obj, "status": new.get("status")}
+        elif collection[0] not in CORE_GROUPS:
+            # Custom resources with a status subresource ignore the status in patches of the main resource.
+            new["status"] = obj.get("status")
+            if new["status"] is None:
+                del new["status"]
+        return self._update(collection, obj, new)
+
+    def _delete(self, collection: CollectionKey, namespace: Optional[str], obj: dict) -> dict:
+        if obj["metadata"].get("finalizers"):
+            if not obj["metadata"].get("deletionTimestamp"):
+                obj["metadata"]["deletionTimestamp"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                obj = self._store(collection, obj)
+            return obj
+        self._remove(collection, obj)
+        if collection[0] == RETURN_DELETED_OBJECT_GROUP:
+            return obj
+        return {"kind": "Status", "apiVersion": "v1", "metadata": {}, "status": "Success"}
+
+    def _remove(self, collection: CollectionKey, obj: dict) -> None:
+        self.resource_version += 1
+        self.objects.get(collection, {}).pop((obj["metadata"].get("namespace") or "", obj["metadata"]["name"]), None)
+        self._collect_dependents(obj["metadata"].get("uid"))
+
+    def _collect_dependents(self, uid: Optional[str]) -> None:
+        """
+        Delete the dependents of a removed owner right away, as the garbage collector of the API server eventually does
+        with the background propagation: the dependents are deleted in turn, their finalizers holding them. A dependent
+        having other owners only loses its reference to the removed one.
+        """
+        if not uid:
+            return
+        for collection, objects in list(self.objects.items()):
+            for data in list(objects.values()):
+                if uid.encode() not in data:
+                    continue
+                dependent = json.loads(data)
+                references = dependent["metadata"].get("ownerReferences") or []
+                remaining = [reference for reference in references if reference.get("uid") != uid]
+                if len(remaining) == len(references):
+                    continue
+                if remaining:
+                    dependent["metadata"]["ownerReferences"] = remaining
+                    self._store(collection, dependent)
+                else:
+                    self._delete(collection, dependent["metadata"].get("namespace"), dependent)
+
+
+def seed_endpoint(fake: FakeKubernetes, namespace: str, name: str, models: int = 1) -> None:
+    """
+    Create the custom resources a user applies for an endpoint: its models, an endpoint config routing to them and the
+    endpoint itself, as in k8s/91-93.
+    """
+    for n in range(models):
+        fake.create(
+            MLOpsClient.GROUP,
+            MLOpsClient.VERSION,
+            MLOpsClient.MODEL_PLURAL,
+            {
+                "kind": MLOpsClient.MODEL_KIND,
+                "metadata": {"name": f"{name}-model-{n}", "namespace": namespace, "labels": {}, "finalizers": []},
+                "spec": {
+                    "image": "quay.io/bdobrica/ml-operator-tools:model-latest",
+                    "artifact": f"s3://models/{name}-model-{n}",
+                    "command": None,
+                    "args": None,
+                },
+                "status": {
+                    "endpoint": None,
+                    "endpoint_config": None,
+                    "endpoint_config_version": None,
+                    "model": f"{name}-model-{n}",
+                    "version": None,
+                    "state": None,
+                },
+            },
+            namespace=namespace,
+        )
+    fake.create(
+        MLOpsClient.GROUP,
+        MLOpsClient.VERSION,
+        MLOpsClient.ENDPOINT_CONFIG_PLURAL,
+        {
+            "kind": MLOpsClient.ENDPOINT_CONFIG_KIND,
+            "metadata": {"name": f"{name}-config", "namespace": namespace, "labels": {}, "finalizers": []},
+            "spec": {
+                "models": [
+                    {
+                        "model": f"{name}-model-{n}",
+                        "weight": 100 // models,
+                        "cpus": "100m",
+                        "memory": "256Mi",
+                        "instances": 1,
+                        "size": "1Gi",
+                        "path": "/opt/models",
+                    }
+                    for n in range(models)
+                ]
+            },
+            "status": {
+                "endpoint": None,
+                "endpoint_config": f"{name}-config",
+                "version": None,
+                "model_versions": None,
+                "state": None,
+            },
+        },
+        namespace=namespace,
+    )
+    fake.create(
+        MLOpsClient.GROUP,
+        MLOpsClient.VERSION,
+        MLOpsClient.ENDPOINT_PLURAL,
+        {
+            "kind": MLOpsClient.ENDPOINT_KIND,
+            "metadata": {"name": name, "namespace": namespace, "labels": {}, "finalizers": []},
+            "spec": {"config": f"{name}-config", "host": f"{name}.example.com"},
+            "status": {"endpoint_config_version": None, "state": None},
+        },
+        namespace=namespace,
+    )
@@ -1,20 +1,204 @@
 #!/usr/bin/env python
 import logging
-import time
+import os
+from functools import partial
 from typing import Tuple
 
 import kopf
-from kubernetes import client as K8SClient
 from kubernetes import config as K8SConfig
 from kubernetes.client.rest import ApiException
 from resources import Endpoint, EndpointConfig, Model
+from resources.istio import client as IstioClient
+from resources.mlops import client as MLOpsClient
+from resources.model_monitor import ModelMonitor
+from resources.sweeper import start_sweeper
 from utils import DiffLineType
+from utils.coalesce import Coalescer
+from utils.concurrency import run_bounded
+from utils.conflicts import is_conflict, retry_on_conflict
+from utils.generation import changes_paths, generation_patch, is_observed, observed_generation
+from utils.informer import label_indexer, owner_index, owner_indexer, start_informers
+from utils.metrics import observe_dropped_event, start_metrics_server, timed
+from utils.patch import finalizers_patch, with_resource_version
+from utils.ratelimit import is_retryable, retry_after
+from utils.sharding import foreign_finalizers, get_coordinator, owns, start_sharding
+from utils.startup import Phase, timeline
+from utils.tracing import traced_handler
+from utils.workqueue import Lane, WorkQueue
 
-K8SConfig.load_incluster_config()
+model_monitor = ModelMonitor()
+coalescer = Coalescer()
+work_queue = WorkQueue()
 
+timeline.mark(Phase.IMPORTS)
 
-@kopf.on.create("machinelearningendpoint")
-def ml_endpoint_create_fn(name: str, namespace: str, spec: dict, meta: dict, **kwargs):
+
+@kopf.on.startup()
+def configure_fn(settings: kopf.OperatorSettings, **kwargs):
+    """
+    Sharding is opt-in: set MLOPS_SHARDS to spread the namespaces over several replicas, see utils/sharding.py. Each
+    replica then uses its own kopf finalizer, as kopf removes its finalizer from the objects it doesn't handle.
+
+    The informers are opt-in: set MLOPS_INFORMERS=true to serve the custom resource reads from an in-process cache
+    kept in sync by one watch per plural. MLOPS_INFORMERS_NAMESPACE restricts the watches to a single namespace.
+
+    The Prometheus metrics are served on MLOPS_METRICS_PORT (9090 by default, 0 disables them), see utils/metrics.py.
+
+    The orphan sweeper runs every MLOPS_ORPHAN_SWEEP_INTERVAL seconds (600 by default, 0 disables it), see
+    resources/sweeper.py.
+
+    The cluster configuration is loaded here rather than at import, so mlops.py can be imported without a cluster (see
+    the import time budget in utils/startup.py). kopf runs the startup handlers before logging in.
+    """
+    K8SConfig.load_incluster_config()
+    start_metrics_server()
+    work_queue.stats.export()
+
+    coordinator = start_sharding()
+    if coordinator:
+        settings.persistence.finalizer = coordinator.finalizer
+
+    if os.environ.get("MLOPS_INFORMERS", "false").lower() == "true":
+        namespace = os.environ.get("MLOPS_INFORMERS_NAMESPACE") or None
+        start_informers(
+            MLOpsClient.GROUP,
+            MLOpsClient.VERSION,
+            [MLOpsClient.MODEL_PLURAL, MLOpsClient.ENDPOINT_CONFIG_PLURAL, MLOpsClient.ENDPOINT_PLURAL],
+            namespace=namespace,
+            indexers={
+                MLOpsClient.MODEL_PLURAL: {
+                    **{label: label_indexer(label) for label in MLOpsClient.MODEL_OWNER_LABELS},
+                    owner_index(MLOpsClient.ENDPOINT_CONFIG_KIND): owner_indexer(MLOpsClient.ENDPOINT_CONFIG_KIND),
+                }
+            },
+        )
+        start_informers(
+            IstioClient.GROUP,
+            IstioClient.VERSION,
+            [IstioClient.VIRTUAL_SERVICE_PLURAL, IstioClient.GATEWAY_PLURAL],
+            namespace=namespace,
+        )
+
+    start_sweeper()
+    timeline.mark(Phase.STARTUP)
+
+
+@kopf.on.probe(id="work_queue")
+def work_queue_probe_fn(**kwargs):
+    """
+    Queue depth and wait times per lane, reported on the kopf liveness endpoint (--liveness).
+    """
+    return work_queue.stats.as_dict()
+
+
+@kopf.on.probe(id="startup")
+def startup_probe_fn(**kwargs):
+    """
+    Seconds from the start of the process to each startup phase reached so far, see utils/startup.py.
+    """
+    return timeline.as_dict()
+
+
+def owned_by_replica(namespace: str, **kwargs) -> bool:
+    """
+    Filter of all the handlers: in sharding mode, a replica only handles the objects of the namespaces it owns.
+    """
+    return owns(namespace)
+
+
+def spec_changed(resource: kopf.Resource, diff: Tuple[DiffLineType], meta: dict, status: dict, **kwargs) -> bool:
+    """
+    Filter of the update handlers: only a change of the spec, of a generation not reconciled yet, is handled. The events
+    caused by the operator writing the labels of its objects, or replayed for a generation already reconciled, are
+    dropped, see utils/generation.py.
+    """
+    if not changes_paths(diff):
+        observe_dropped_event(resource.plural, "unwatched")
+        return False
+    if is_observed(meta, status):
+        observe_dropped_event(resource.plural, "observed")
+        return False
+    return True
+
+
+async def observe_generation(plural: str, name: str, namespace: str, status: dict, generation: int):
+    """
+    Record the generation reconciled in status.observedGeneration, written through the status subresource which doesn't
+    call the update handlers. A reconcile replacing the object (e.g. a new model version) leaves nothing to record.
+    """
+    if not generation or generation <= observed_generation(status):
+        return
+
+    try:
+        await run_bounded(
+            MLOpsClient.V1Alpha1Api().patch_namespaced_status, name, namespace, generation_patch(generation), plural
+        )
+    except ApiException as err:
+        if err.status != 404:
+            raise
+
+
+async def release_foreign_finalizers(plural: str, name: str, namespace: str, meta: dict):
+    coordinator = get_coordinator()
+    if not coordinator:
+        return
+
+    if not foreign_finalizers(meta.get("finalizers"), coordinator.finalizer):
+        return
+
+    api = MLOpsClient.V1Alpha1Api()
+    current = [meta]
+
+    def write():
+        finalizers = current[0].get("finalizers")
+        patch = finalizers_patch(finalizers, remove=foreign_finalizers(finalizers, coordinator.finalizer))
+        if patch:
+            api.patch_namespaced(
+                name, namespace, with_resource_version(patch, current[0].get("resourceVersion")), plural
+            )
+
+    def refresh():
+        current[0] = (api.read_namespaced(name, namespace, plural, fresh=True) or {}).get("metadata") or {}
+
+    await run_bounded(retry_on_conflict, write, refresh, resource=plural)
+
+
+def handler_error(err: ApiException) -> Exception:
+    """
+    The error raised by a handler for a failed API call: a write still conflicting after its retries, or a call still
+    throttled or failing transiently after the client retries (see utils/ratelimit.py), is retried by kopf later on,
+    after Retry-After if the API server sent one; anything else fails the handler for good.
+    """
+    if is_conflict(err):
+        return kopf.TemporaryError(err, delay=5)
+    # Reconciles are idempotent as a whole, unlike a single create: classify the status as for an idempotent call.
+    if is_retryable("GET", err.status):
+        return kopf.TemporaryError(err, delay=retry_after(err.headers) or 10)
+    return kopf.PermanentError(err)
+
+
+@kopf.on.event("machinelearningendpoint", when=owned_by_replica)
+@kopf.on.event("machinelearningendpointconfig", when=owned_by_replica)
+@kopf.on.event("machinelearningmodel", when=owned_by_replica)
+async def shard_takeover_fn(name: str, namespace: str, meta: dict, resource: kopf.Resource, **kwargs):
+    """
+    When a shard moves to this replica, release the finalizers of its previous owners. Objects being deleted keep them
+    until their delete handler is done.
+    """
+    timeline.mark(Phase.FIRST_WATCH)
+    if meta.get("deletionTimestamp"):
+        return
+
+    try:
+        await release_foreign_finalizers(resource.plural, name, namespace, meta)
+    except ApiException as err:
+        logging.error(err)
+
+
+@kopf.on.create("machinelearningendpoint", when=owned_by_replica)
+@timed
+@traced_handler
+async def ml_endpoint_create_fn(name: str, namespace: str, spec: dict, meta: dict, status: dict, **kwargs):
     """
     Create a new Machine Learning Endpoint. While there are additional custom resources (Models and EndpointConfig)
     when those are created no K8S resources are assigned to them, except for the CRD itself.
@@ -25,106 +209,193 @@ def ml_endpoint_create_fn(name: str, namespace: str, spec: dict, meta: dict, **k
     logging.info(f"Meta: {meta}")
     logging.info(f"Kwargs: {kwargs}")
 
+    async def reconcile():
+        endpoint = await run_bounded(Endpoint, name=name, namespace=namespace)
+        return await endpoint.create_handler_async()
+
     try:
-        _ = Endpoint(name=name, namespace=namespace).create_handler()
+        _ = await work_queue.submit((MLOpsClient.ENDPOINT_PLURAL, namespace, name), reconcile, Lane.ROLLOUT)
+        await observe_generation(MLOpsClient.ENDPOINT_PLURAL, name, namespace, status, meta.get("generation"))
     except ApiException as err:
         logging.error(err)
-        raise kopf.PermanentError(err)
+        raise handler_error(err)
 
 
-@kopf.on.update("machinelearningendpoint")
-def ml_endpoint_update_fn(name: str, namespace: str, diff: Tuple[DiffLineType], **kwargs):
+@kopf.on.update("machinelearningendpoint", when=kopf.all_([owned_by_replica, spec_changed]))
+@timed
+@traced_handler
+async def ml_endpoint_update_fn(
+    name: str, namespace: str, diff: Tuple[DiffLineType], meta: dict, status: dict, **kwargs
+):
     logging.info(f"Updating endpoint {name} in namespace {namespace}")
     logging.info(f"Diff: {diff}")
     logging.info(f"Meta: {meta}")
     logging.info(f"Kwargs: {kwargs}")
 
+    async def reconcile():
+        endpoint = await run_bounded(Endpoint, name, namespace)
+        return await endpoint.update_handler_async(diff)
+
     try:
-        _ = Endpoint(name, namespace).update_handler(diff)
+        _ = await work_queue.submit((MLOpsClient.ENDPOINT_PLURAL, namespace, name), reconcile, Lane.UPDATE)
+        await observe_generation(MLOpsClient.ENDPOINT_PLURAL, name, namespace, status, meta.get("generation"))
     except ApiException as err:
         logging.error(err)
-        raise kopf.PermanentError(err)
+        raise handler_error(err)
 
 
-@kopf.on.delete("machinelearningendpoint")
-def ml_endpoint_delete_fn(name: str, namespace: str, **kwargs):
+@kopf.on.delete("machinelearningendpoint", when=owned_by_replica)
+@timed
+@traced_handler
+async def ml_endpoint_delete_fn(name: str, namespace: str, meta: dict, **kwargs):
     logging.info(f"Delete endpoint {name} in namespace {namespace}")
     logging.info(f"Kwargs: {kwargs}")
 
+    async def reconcile():
+        endpoint = await run_bounded(Endpoint, name, namespace)
+        _ = await endpoint.delete_handler_async()
+        await release_foreign_finalizers(MLOpsClient.ENDPOINT_PLURAL, name, namespace, meta)
+
     try:
-        _ = Endpoint(name, namespace).delete_handler()
+        await work_queue.submit((MLOpsClient.ENDPOINT_PLURAL, namespace, name), reconcile, Lane.DELETE)
     except ApiException as err:
         logging.error(err)
-        raise kopf.PermanentError(err)
+        raise handler_error(err)
+
+
+async def update_endpoint_config(name: str, namespace: str, diff: Tuple[DiffLineType]) -> EndpointConfig:
+    """
+    The reconcile of a coalesced endpoint config update: the new variants are rolled out concurrently.
+    """
+    endpoint_config = await run_bounded(EndpointConfig, name, namespace)
+    return await endpoint_config.update_handler_async(diff)
 
 
-@kopf.on.update("machinelearningendpointconfig")
-def ml_endpoint_config_update_fn(name: str, namespace: str, diff: Tuple[DiffLineType], **kwargs):
+@kopf.on.update("machinelearningendpointconfig", when=kopf.all_([owned_by_replica, spec_changed]))
+@timed
+@traced_handler
+async def ml_endpoint_config_update_fn(
+    name: str, namespace: str, diff: Tuple[DiffLineType], old: dict, meta: dict, status: dict, **kwargs
+):
+    """
+    Bursts of updates (e.g. a pipeline tweaking the weights several times in a row) are coalesced into a single
+    reconcile of the net change, see utils/coalesce.py.
+    """
     logging.info(f"Updating endpoint config {name} in namespace {namespace}")
     logging.info(f"Kwargs: {kwargs}")
 
+    key = (MLOpsClient.ENDPOINT_CONFIG_PLURAL, namespace, name)
+    lane = Lane.WEIGHTS if EndpointConfig.is_weight_only(diff) else Lane.ROLLOUT
     try:
-        _ = EndpointConfig(name, namespace).update_handler(diff)
+        _ = await coalescer.reconcile(
+            key,
+            meta.get("generation", 0),
+            old,
+            read=lambda: MLOpsClient.V1Alpha1Api().read_namespaced(name, namespace, MLOpsClient.ENDPOINT_CONFIG_PLURAL),
+            handler=partial(update_endpoint_config, name, namespace),
+            submit=lambda reconcile: work_queue.submit(key, reconcile, lane),
+        )
+        await observe_generation(
+            MLOpsClient.ENDPOINT_CONFIG_PLURAL, name, namespace, status, coalescer.reconciled.get(key)
+        )
     except ApiException as err:
         logging.error(err)
-        raise kopf.PermanentError(err)
+        raise handler_error(err)
 
 
-@kopf.on.delete("machinelearningendpointconfig")
-def ml_endpoint_config_delete_fn(name: str, namespace: str, **kwargs):
+@kopf.on.delete("machinelearningendpointconfig", when=owned_by_replica)
+@timed
+@traced_handler
+async def ml_endpoint_config_delete_fn(name: str, namespace: str, meta: dict, **kwargs):
     logging.info(f"Delete endpoint config {name} in namespace {namespace}")
     logging.info(f"Kwargs: {kwargs}")
 
+    key = (MLOpsClient.ENDPOINT_CONFIG_PLURAL, namespace, name)
+    coalescer.forget(key)
+
+    async def reconcile():
+        endpoint_config = await run_bounded(EndpointConfig, name, namespace)
+        _ = await endpoint_config.delete_handler_async()
+        await release_foreign_finalizers(MLOpsClient.ENDPOINT_CONFIG_PLURAL, name, namespace, meta)
+
     try:
-        _ = EndpointConfig(name, namespace).delete_handler()
+        await work_queue.submit(key, reconcile, Lane.DELETE)
     except ApiException as err:
         logging.error(err)
-        raise kopf.PermanentError(err)
+        raise handler_error(err)
 
 
-@kopf.on.update("machinelearningmodel")
-def ml_model_update_fn(name: str, namespace: str, diff: Tuple[DiffLineType], **kwargs):
+async def update_model(name: str, namespace: str, diff: Tuple[DiffLineType]) -> Model:
+    """
+    The reconcile of a coalesced model update: the endpoint config versions using the model roll it out concurrently.
+    """
+    model = await run_bounded(Model, name, namespace)
+    return await model.update_handler_async(diff)
+
+
+@kopf.on.update("machinelearningmodel", when=kopf.all_([owned_by_replica, spec_changed]))
+@timed
+@traced_handler
+async def ml_model_update_fn(
+    name: str, namespace: str, diff: Tuple[DiffLineType], spec: dict, meta: dict, old: dict, status: dict, **kwargs
+):
     logging.info(f"Updating model {name} in namespace {namespace}")
     logging.info(f"Spec: {spec}")
     logging.info(f"Meta: {meta}")
     logging.info(f"Kwargs: {kwargs}")
 
+    key = (MLOpsClient.MODEL_PLURAL, namespace, name)
     try:
-        _ = Model(name, namespace).update_handler(diff)
+        _ = await coalescer.reconcile(
+            key,
+            meta.get("generation", 0),
+            old,
+            read=lambda: MLOpsClient.V1Alpha1Api().read_namespaced(name, namespace, MLOpsClient.MODEL_PLURAL),
+            handler=partial(update_model, name, namespace),
+            submit=lambda reconcile: work_queue.submit(key, reconcile, Lane.ROLLOUT),
+        )
+        await observe_generation(MLOpsClient.MODEL_PLURAL, name, namespace, status, coalescer.reconciled.get(key))
     except ApiException as err:
         logging.error(err)
-        raise kopf.PermanentError(err)
+        raise handler_error(err)
 
 
-@kopf.on.delete("machinelearningmodel")
-def ml_model_delete_fn(name: str, namespace: str, diff: Tuple[DiffLineType], **kwargs):
+@kopf.on.delete("machinelearningmodel", when=owned_by_replica)
+@timed
+@traced_handler
+async def ml_model_delete_fn(name: str, namespace: str, diff: Tuple[DiffLineType], meta: dict, **kwargs):
     logging.info("Delete model {name} in namespace {namespace}")
     logging.info(f"Kwargs: {kwargs}")
 
+    key = (MLOpsClient.MODEL_PLURAL, namespace, name)
+    coalescer.forget(key)
+
+    async def reconcile():
+        model = await run_bounded(Model, name, namespace)
+        _ = await model.delete_handler_async()
+        await release_foreign_finalizers(MLOpsClient.MODEL_PLURAL, name, namespace, meta)
+
     try:
-        _ = Model(name, namespace).delete_handler()
+        await work_queue.submit(key, reconcile, Lane.DELETE)
     except ApiException as err:
         logging.error(err)
-        raise kopf.PermanentError(err)
-
-
-@kopf.daemon("machinelearningmodel")
-def monitor_deployment(spec, **kwargs):
-    api = K8SClient.AppsV1Api()
-    deployment_name = spec["deploymentName"]
-    deployment_namespace = spec["deploymentNamespace"]
-    while True:
-        deployment_status = api.read_namespaced_deployment_status(name=deployment_name, namespace=deployment_namespace)
-        replicas = deployment_status.status.replicas
-        updated_replicas = deployment_status.status.updated_replicas
-        available_replicas = deployment_status.status.available_replicas
-        if replicas == updated_replicas == available_replicas:
-            print(f"Deployment {deployment_name} is ready!")
-            return
-        else:
-            print(
-                f"Deployment {deployment_name} is not ready yet. "
-                f"Replicas: {replicas}, updated replicas: {updated_replicas}, "
-                f"available replicas: {available_replicas}"
-            )
-        time.sleep(10)
+        raise handler_error(err)
+
+
+@kopf.on.event("apps", "v1", "deployments", labels={"model": kopf.PRESENT}, when=owned_by_replica)
+@timed
+@traced_handler
+async def monitor_deployment_fn(type: str, body: dict, **kwargs):
+    """
+    A single watch over the model deployments replaces polling each of them: readiness transitions are written to the
+    owning model's status.state as soon as the deployment converges.
+    """
+    timeline.mark(Phase.FIRST_WATCH)
+    try:
+        model = await run_bounded(model_monitor.observe, type, body)
+    except ApiException as err:
+        logging.error(err)
+        return
+
+    if model:
+        logging.info(f"Model {model.named_version} in namespace {model.namespace} is {model.body.status.state}")
@@ -1,9 +1,17 @@
+import asyncio
+from functools import cached_property
 from typing import Any, Tuple
 
 from resources.endpoint_config import EndpointConfig
 from resources.istio_gateway import IstioGateway
 from resources.mlops import client as MLOpsClient
+from resources.planner import plan_endpoint
 from utils import DiffLine, DiffLineType
+from utils.concurrency import gather_bounded, run_bounded
+from utils.conflicts import retry_on_conflict
+from utils.owners import is_owned, owner_references
+from utils.patch import DELTA_FIELDS, merge_patch, split_status, with_resource_version
+from utils.tracing import traced
 
 
 class Endpoint:
@@ -14,11 +22,19 @@ class Endpoint:
 
         self.gateway_name = f"{self.name}-gw"
         self.endpoint_config_name = None
-        if self.body and self.body.spec:
+        if self.body and self.body.status and self.body.status.endpoint_config_version:
+            # The endpoint config version cloned for this endpoint, which owns the model versions and virtual service.
+            self.endpoint_config_name = self.body.status.endpoint_config_version
+        elif self.body and self.body.spec:
             self.endpoint_config_name = self.body.spec.config
 
-        self.gateway = IstioGateway(name=self.gateway_name, namespace=self.namespace)
-        self.endpoint_config = EndpointConfig(name=self.endpoint_config_name, namespace=self.namespace)
+    @cached_property
+    def gateway(self) -> IstioGateway:
+        return IstioGateway(name=self.gateway_name, namespace=self.namespace)
+
+    @cached_property
+    def endpoint_config(self) -> EndpointConfig:
+        return EndpointConfig(name=self.endpoint_config_name, namespace=self.namespace)
 
     def get_body(self, config: str, host: str, config_version: str = None) -> MLOpsClient.V1Alpha1Endpoint:
         return MLOpsClient.V1Alpha1Endpoint(
@@ -38,11 +54,19 @@ class Endpoint:
         return self
 
     def delete(self) -> "Endpoint":
+        """
+        Delete the endpoint with a single call: its gateway, endpoint config version and everything the latter owns are
+        deleted by the garbage collector of the API server, see utils/owners.py.
+        """
         if not self.body or not self.body.metadata or not self.body.metadata.name:
             return self
 
         api = MLOpsClient.V1Alpha1Api()
-        api.delete_namespaced_endpoint(name=self.body.metadata.name, namespace=self.body.metadata.namespace)
+        api.delete_namespaced_endpoint(
+            name=self.body.metadata.name,
+            namespace=self.body.metadata.namespace,
+            propagation_policy=MLOpsClient.BACKGROUND_PROPAGATION,
+        )
         self.body = None
         return self
 
@@ -51,18 +75,39 @@ class Endpoint:
             return self
 
         api = MLOpsClient.V1Alpha1Api()
-        body = self.get_body(
-            config=config or self.body.spec.config,
-            host=host or self.body.spec.host,
-            config_version=config_version or self.body.status.endpoint_config_version,
-        )
-        self.body = api.patch_namespaced_endpoint(
-            name=self.body.metadata.name,
-            namespace=self.body.metadata.namespace,
-            body=body,
+
+        def write() -> None:
+            if not self.body:
+                return
+            body = self.get_body(
+                config=config or self.body.spec.config,
+                host=host or self.body.spec.host,
+                config_version=config_version or self.body.status.endpoint_config_version,
+            )
+            patch, status = split_status(merge_patch(self.body.dict(), body.dict(include=DELTA_FIELDS)))
+            if patch:
+                self.body = api.patch_namespaced_endpoint(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+            if status:
+                self.body = api.patch_namespaced_endpoint_status(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(status, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.ENDPOINT_PLURAL)
+        return self
+
+    def refresh(self) -> "Endpoint":
+        self.body = MLOpsClient.V1Alpha1Api().read_namespaced_endpoint(
+            name=self.name, namespace=self.namespace, fresh=True
         )
         return self
 
+    @traced
     def create_handler(self) -> "Endpoint":
         if not self.body:
             return self
@@ -72,6 +117,7 @@ class Endpoint:
                 labels={"endpoint": self.body.metadata.name},
                 hosts=[self.body.spec.host],
                 port=8080,
+                owner_references=owner_references(self.body),
             )
 
         if (
@@ -82,39 +128,136 @@ class Endpoint:
         ):
             self.endpoint_config = EndpointConfig(
                 name=self.body.spec.config, namespace=self.body.metadata.namespace
-            ).clone(endpoint=self.body.metadata.name)
+            ).clone(endpoint=self.body.metadata.name, owner_references=owner_references(self.body))
             self.update(config_version=self.endpoint_config.body.metadata.name)
 
         return self
 
+    @traced
+    async def create_handler_async(self) -> "Endpoint":
+        """
+        Same as create_handler, but the gateway and the endpoint config clone are created concurrently.
+        """
+        if not self.body:
+            return self
+
+        gateway, endpoint_config = await gather_bounded([lambda: self.gateway, lambda: self.endpoint_config])
+        clone = (
+            not endpoint_config.body
+            or not endpoint_config.body.status
+            or endpoint_config.body.status.endpoint != self.body.metadata.name
+        )
+
+        coroutines = []
+        if not gateway.body:
+            coroutines.append(
+                run_bounded(
+                    gateway.create,
+                    labels={"endpoint": self.body.metadata.name},
+                    hosts=[self.body.spec.host],
+                    port=8080,
+                    owner_references=owner_references(self.body),
+                )
+            )
+        if clone:
+            coroutines.append(
+                run_bounded(
+                    lambda: EndpointConfig(name=self.body.spec.config, namespace=self.body.metadata.namespace).clone(
+                        endpoint=self.body.metadata.name, owner_references=owner_references(self.body)
+                    )
+                )
+            )
+
+        results = await asyncio.gather(*coroutines)
+        if clone:
+            self.endpoint_config = results[-1]
+            await run_bounded(self.update, config_version=self.endpoint_config.body.metadata.name)
+
+        return self
+
+    @traced
     def delete_handler(self) -> "Endpoint":
+        """
+        An endpoint config version cloned with an owner reference comes with an owned gateway: both are deleted by the
+        garbage collector along with the endpoint. Only the endpoints created before the owner references are torn
+        down here.
+        """
+        if is_owned(self.endpoint_config.body):
+            return self
         self.endpoint_config.delete_handler()
         self.endpoint_config.delete()
         self.gateway.delete()
         return self
 
+    @traced
+    async def delete_handler_async(self) -> "Endpoint":
+        """
+        Same as delete_handler, but the endpoint config's resources are torn down concurrently with the gateway.
+        """
+        endpoint_config = await run_bounded(lambda: self.endpoint_config)
+        if is_owned(endpoint_config.body):
+            return self
+        await asyncio.gather(
+            endpoint_config.delete_handler_async(),
+            run_bounded(lambda: self.gateway.delete()),
+        )
+        await run_bounded(endpoint_config.delete)
+        return self
+
+    @traced
     def update_handler(self, diff: Tuple[DiffLineType, ...]) -> "Endpoint":
-        self.gateway.update(labels={"endpoint": self.body.metadata.name}, hosts=[self.body.spec.host], port=8080)
-
-        try:
-            endpoint_config_diff = next(
-                filter(
-                    lambda line: line.action == "change" and line.path == ("spec", "config"),
-                    map(
-                        lambda line: DiffLine.from_tuple(line),
-                        diff,
-                    ),
-                )
+        """
+        A new endpoint config is cloned for the endpoint and its model versions are created (or shared, see
+        EndpointConfig.create_model_version), then the planner converges the gateway, the virtual service and the model
+        versions. The previous endpoint config version cloned for this endpoint goes last, the garbage collector deleting
+        the model versions only it used.
+        """
+        if not self.body:
+            return self
+
+        config = DiffLine.from_iter(diff, "change", ("spec", "config"))
+        previous = self.endpoint_config if config else None
+        if previous and (not previous.body or not previous.body.status or previous.body.status.endpoint != self.name):
+            previous = None
+        if config:
+            self.endpoint_config = (
+                EndpointConfig(name=config.new_value, namespace=self.namespace)
+                .clone(endpoint=self.name, owner_references=owner_references(self.body))
+                .create_handler()
             )
-        except StopIteration:
+            self.update(config_version=self.endpoint_config.body.metadata.name)
+
+        plan_endpoint(self).apply()
+
+        if previous and previous.body.metadata.name != self.endpoint_config.body.metadata.name:
+            previous.delete()
+        return self
+
+    @traced
+    async def update_handler_async(self, diff: Tuple[DiffLineType, ...]) -> "Endpoint":
+        """
+        Same as update_handler, but the model versions of the new endpoint config are created and deployed
+        concurrently, leaving the planner only the gateway and the resources already converged to check.
+        """
+        if not self.body:
             return self
 
-        endpoint_config = (
-            EndpointConfig(name=endpoint_config_diff.new_value, namespace=self.namespace)
-            .create()
-            .create_handler(endpoint=self.name, hosts=[self.body.spec.host])
-        )
+        config = DiffLine.from_iter(diff, "change", ("spec", "config"))
+        previous = await run_bounded(lambda: self.endpoint_config) if config else None
+        if previous and (not previous.body or not previous.body.status or previous.body.status.endpoint != self.name):
+            previous = None
+        if config:
+            endpoint_config = await run_bounded(EndpointConfig, name=config.new_value, namespace=self.namespace)
+            endpoint_config = await run_bounded(
+                endpoint_config.clone, endpoint=self.name, owner_references=owner_references(self.body)
+            )
+            self.endpoint_config = await endpoint_config.create_handler_async()
+            versions = await self.endpoint_config.get_models_async()
+            await asyncio.gather(*(version.create_handler_async() for version in versions))
+            await run_bounded(self.update, config_version=self.endpoint_config.body.metadata.name)
+
+        await run_bounded(lambda: plan_endpoint(self).apply())
 
-        self.endpoint_config.add_finalizers([f"started:{endpoint_config.name}"]).delete()
-        self.endpoint_config = endpoint_config
+        if previous and previous.body.metadata.name != self.endpoint_config.body.metadata.name:
+            await run_bounded(previous.delete)
         return self
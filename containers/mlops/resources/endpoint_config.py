@@ -1,9 +1,27 @@
+import asyncio
+import json
+import logging
+from functools import cached_property, partial
 from typing import Any, Dict, List, Optional, Tuple
 
+from kubernetes import client as K8SClient
 from resources.istio_virtual_service import IstioVirtualService
 from resources.mlops import client as MLOpsClient
 from resources.model import Model
-from utils import DiffLine, DiffLineType, get_version
+from utils import DiffLine, DiffLineType, get_content_version, get_version
+from utils.concurrency import gather_bounded, run_bounded
+from utils.conflicts import retry_on_conflict
+from utils.metrics import observe_model_version
+from utils.owners import is_owned, owner_references
+from utils.patch import DELTA_FIELDS, finalizers_patch, merge_patch, split_status, with_resource_version
+from utils.tracing import traced
+
+# The classes of change of a model entry of an endpoint config, from the cheapest to apply to the most expensive (see
+# EndpointConfig.get_changes).
+UNCHANGED: str = "unchanged"
+REWEIGHT: str = "reweight"
+RESCALE: str = "rescale"
+REDEPLOY: str = "redeploy"
 
 
 class EndpointConfig:
@@ -40,13 +58,19 @@ class EndpointConfig:
             name=self.named_version,
             namespace=self.namespace,
         )
-        if self.body and self.body.status:
+        # The endpoint configs applied by a user have no status but the generation the operator observed.
+        if self.body and self.body.status and self.body.status.endpoint_config:
             self.name = self.body.status.endpoint_config
             self.version = self.body.status.version
 
         self.virtual_service_name: str = self.named_version
 
-        self.virtual_service = IstioVirtualService(self.virtual_service_name, self.namespace)
+    @cached_property
+    def virtual_service(self) -> IstioVirtualService:
+        """
+        The virtual service is read from the API on first access only and memoized afterwards.
+        """
+        return IstioVirtualService(self.virtual_service_name, self.namespace)
 
     def get_models(self, models: List[Dict[str, str]] = None) -> List[Model]:
         """
@@ -60,17 +84,165 @@ class EndpointConfig:
         if not self.body:
             return []
 
-        variants = []
-        for n, model in enumerate(models or self.body.spec.models):
-            variants.append(
-                Model(
-                    name=self.body.status.model_versions[n]
-                    if self.body and self.body.status and len(self.body.status.model_versions or []) > n
-                    else model.model,
-                    namespace=self.namespace,
+        bodies = self.get_model_version_bodies()
+        return [
+            Model(name=name, namespace=self.namespace, body=bodies.get(name)) for name in self.get_model_names(models)
+        ]
+
+    def get_model_names(self, models: List[Dict[str, str]] = None) -> List[str]:
+        """
+        The name of each model of the endpoint config: the model version created for it if any, otherwise the name of
+        the model it was configured with.
+
+        :param models: A list of models to use instead of the models associated with the endpoint config.
+        :return: A list of model names.
+        """
+        model_versions = (self.body.status.model_versions if self.body.status else None) or []
+        return [
+            model_versions[n] if len(model_versions) > n else model.model
+            for n, model in enumerate(models or self.body.spec.models)
+        ]
+
+    def get_model_version_bodies(self) -> Dict[str, MLOpsClient.V1Alpha1Model]:
+        """
+        Read all the model versions of this endpoint config at once. The model versions it controls carry its
+        endpoint_config_version label, the ones it shares with other endpoint config versions (see create_model_version)
+        only its owner reference, so they are looked up by owner when the label misses some of them. Each lookup is a
+        single list call, or a lookup in the model informer indexes when the informers are enabled. Model versions
+        created before the label and the owner references were introduced are missing from the result and get read one
+        by one by the caller.
+
+        :return: The model version bodies, by name.
+        """
+        if not self.body.status or not self.body.status.model_versions:
+            return {}
+
+        api = MLOpsClient.V1Alpha1Api()
+        name = self.body.metadata.name
+        bodies = {
+            body.metadata.name: body
+            for body in api.list_namespaced_models_by_label("endpoint_config_version", name, namespace=self.namespace)
+        }
+        if not set(self.body.status.model_versions) <= set(bodies):
+            bodies.update(
+                (body.metadata.name, body)
+                for body in api.list_namespaced_models_by_owner(
+                    MLOpsClient.ENDPOINT_CONFIG_KIND, name, namespace=self.namespace
                 )
             )
-        return variants
+        return bodies
+
+    async def get_models_async(self, models: List[Dict[str, str]] = None) -> List[Model]:
+        """
+        Same as get_models, but the models are read concurrently.
+
+        :param models: A list of models to use instead of the models associated with the endpoint config.
+        :return: A list of Model objects.
+        """
+        if not self.body:
+            return []
+
+        bodies = await run_bounded(self.get_model_version_bodies)
+        return await gather_bounded(
+            [
+                partial(Model, name=name, namespace=self.namespace, body=bodies.get(name))
+                for name in self.get_model_names(models)
+            ]
+        )
+
+    @staticmethod
+    def is_weight_only(diff: Optional[Tuple[DiffLineType, ...]]) -> bool:
+        """
+        Check if a diff only changes the weights of the models, which doesn't require any new model version.
+
+        :param diff: The diff between the old and new versions of the CRD as a list of DiffLine objects (see utils.py).
+        :return: True if only the weights of the models changed.
+        """
+        lines = [DiffLine.from_tuple(line) for line in diff or ()]
+        if len(lines) != 1 or lines[0].action != "change" or lines[0].path != ("spec", "models"):
+            return False
+
+        changes = EndpointConfig.get_changes(lines[0].old_value, lines[0].new_value)
+        return changes is not None and all(change in (UNCHANGED, REWEIGHT) for change in changes)
+
+    @staticmethod
+    def get_changes(
+        old_models: Optional[List[Dict[str, Any]]], new_models: Optional[List[Dict[str, Any]]]
+    ) -> Optional[List[str]]:
+        """
+        Classify the change of each model entry of an endpoint config, matched by model name (see match_models), so
+        reordering the entries changes none of them:
+        - UNCHANGED;
+        - REWEIGHT when only its weight changed, which only needs the virtual service route weights patched;
+        - RESCALE when its number of instances changed too, which only needs its deployment scaled;
+        - REDEPLOY for anything else (model, resources, size, path), which needs a new model version.
+
+        :param old_models: The old model entries, as dicts.
+        :param new_models: The new model entries, as dicts.
+        :return: The class of change of each new entry, None if models were added, removed or swapped.
+        """
+        old_models, new_models = old_models or [], new_models or []
+        matched = EndpointConfig.match_models(old_models, new_models)
+        if matched is None:
+            return None
+
+        changes = []
+        for old_model, new_model in zip([old_models[n] for n in matched], new_models):
+            if old_model == new_model:
+                changes.append(UNCHANGED)
+            elif EndpointConfig.variant(old_model) == EndpointConfig.variant(new_model):
+                changes.append(REWEIGHT)
+            elif EndpointConfig.variant({**old_model, "instances": None}) == EndpointConfig.variant(
+                {**new_model, "instances": None}
+            ):
+                changes.append(RESCALE)
+            else:
+                changes.append(REDEPLOY)
+        return changes
+
+    @staticmethod
+    def match_models(
+        old_models: Optional[List[Dict[str, Any]]], new_models: Optional[List[Dict[str, Any]]]
+    ) -> Optional[List[int]]:
+        """
+        Match the new model entries of an endpoint config with the old ones of the same model, whatever their position.
+        The entries of a model configured more than once are matched with an identical entry first, then with an entry
+        of the same variant, then in order.
+
+        :param old_models: The old model entries, as dicts.
+        :param new_models: The new model entries, as dicts.
+        :return: The position of the old entry matched with each new entry, None if models were added, removed or
+        swapped.
+        """
+        old_models, new_models = old_models or [], new_models or []
+        if len(old_models) != len(new_models):
+            return None
+
+        matched: List[Optional[int]] = [None] * len(new_models)
+        unmatched = list(range(len(old_models)))
+        for key in (lambda model: model, EndpointConfig.variant, lambda model: model.get("model")):
+            for n, new_model in enumerate(new_models):
+                if matched[n] is not None:
+                    continue
+                for m in unmatched:
+                    if key(old_models[m]) == key(new_model):
+                        matched[n] = m
+                        unmatched.remove(m)
+                        break
+        if unmatched:
+            return None
+        return matched
+
+    @staticmethod
+    def variant(model: Dict[str, Any]) -> str:
+        """
+        The key of a model entry of an endpoint config, ignoring its weight: the entries of the same variant are served
+        by the same model version.
+
+        :param model: The model entry, as a dict.
+        :return: The key of the variant.
+        """
+        return json.dumps({**model, "weight": None}, sort_keys=True)
 
     def get_body(
         self,
@@ -78,6 +250,7 @@ class EndpointConfig:
         endpoint: Optional[str] = None,
         model_versions: Optional[List[str]] = None,
         state: Optional[str] = None,
+        owner_references: Optional[List[Dict[str, Any]]] = None,
     ) -> MLOpsClient.V1Alpha1EndpointConfig:
         """
         Method used to create the Kubernetes API request body for creating/updating an endpoint config.
@@ -88,12 +261,14 @@ class EndpointConfig:
         :param model_versions: A list of model versions for each model provided in the models parameter. The order of
         the model versions must match the order of the models.
         :param state: The state of the endpoint config.
+        :param owner_references: The owner references of the endpoint config, to the endpoint a version is cloned for.
         :return: A Kubernetes API request body for creating/updating an endpoint config.
         """
         return MLOpsClient.V1Alpha1EndpointConfig(
             metadata=MLOpsClient.V1Alpha1ObjectMeta(
                 name=self.named_version,
                 namespace=self.namespace,
+                ownerReferences=owner_references or [],
                 labels={
                     "endpoint_config": self.name,
                     **({"version": self.version} if self.version else {}),
@@ -118,7 +293,7 @@ class EndpointConfig:
         """
         api = MLOpsClient.V1Alpha1Api()
 
-        if self.body and self.body.status:
+        if self.body and self.body.status and self.body.status.endpoint:
             return api.read_namespaced_endpoint(name=self.body.status.endpoint, namespace=self.namespace)
 
         return None
@@ -129,6 +304,7 @@ class EndpointConfig:
         endpoint: Optional[str] = None,
         model_versions: Optional[List[str]] = None,
         state: Optional[str] = None,
+        owner_references: Optional[List[Dict[str, Any]]] = None,
     ) -> "EndpointConfig":
         """
         Method used for creating the EndpointConfig associated kubernetes resource. The method does not create any
@@ -141,6 +317,7 @@ class EndpointConfig:
         :param model_versions: A list of model versions for each model provided in the models parameter. The order of
         the model versions must match the order of the models.
         :param state: The state of the endpoint config.
+        :param owner_references: The owner references of the endpoint config (see utils/owners.py).
         :return: An EndpointConfig object (reference to self for easy chaining).
         """
         if self.body:
@@ -151,17 +328,20 @@ class EndpointConfig:
             endpoint=endpoint,
             model_versions=model_versions,
             state=state,
+            owner_references=owner_references,
         )
         api = MLOpsClient.V1Alpha1Api()
         self.body = api.create_namespaced_endpoint_config(namespace=self.namespace, body=body)
         return self
 
+    @traced
     def clone(
         self,
         models: List[Dict[str, str]] = None,
         endpoint: Optional[str] = None,
         model_versions: Optional[List[str]] = None,
         state: Optional[str] = None,
+        owner_references: Optional[List[Dict[str, Any]]] = None,
     ):
         """
         This method is intended on a kubernetes resource that already exists. It will create a new kubernetes resource
@@ -174,6 +354,7 @@ class EndpointConfig:
         :param model_versions: A list of model versions for each model provided in the models parameter. The order of
         the model versions must match the order of the models.
         :param state: The state of the endpoint config.
+        :param owner_references: The owner references of the new resource, to the endpoint it is cloned for.
         :return: An EndpointConfig object reference to the new resource.
         """
         return EndpointConfig(
@@ -185,6 +366,7 @@ class EndpointConfig:
             endpoint=endpoint or (self.body.status.endpoint if self.body and self.body.status else None),
             model_versions=model_versions,
             state=state,
+            owner_references=owner_references,
         )
 
     def update(
@@ -210,15 +392,43 @@ class EndpointConfig:
         if not self.body or not self.body.status or not self.body.status.version:
             return self
 
-        body = self.get_body(
-            models=models or self.body.spec.models,
-            endpoint=endpoint or self.body.status.endpoint,
-            model_versions=model_versions or self.body.status.model_versions,
-            state=state or self.body.status.state,
-        )
         api = MLOpsClient.V1Alpha1Api()
-        self.body = api.patch_namespaced_endpoint_config(
-            name=self.body.metadata.name, namespace=self.body.metadata.namespace, body=body
+
+        def write() -> None:
+            if not self.body:
+                return
+            body = self.get_body(
+                models=models or self.body.spec.models,
+                endpoint=endpoint or self.body.status.endpoint,
+                model_versions=model_versions or self.body.status.model_versions,
+                state=state or self.body.status.state,
+            )
+            patch, status = split_status(merge_patch(self.body.dict(), body.dict(include=DELTA_FIELDS)))
+            if patch:
+                self.body = api.patch_namespaced_endpoint_config(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+            if status:
+                self.body = api.patch_namespaced_endpoint_config_status(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(status, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.ENDPOINT_CONFIG_PLURAL)
+        return self
+
+    def refresh(self) -> "EndpointConfig":
+        """
+        Read the endpoint config again from the API server, bypassing the informer cache. Used to retry a write that
+        conflicted with another writer.
+
+        :return: An EndpointConfig object (reference to self for easy chaining).
+        """
+        self.body = MLOpsClient.V1Alpha1Api().read_namespaced_endpoint_config(
+            name=self.named_version, namespace=self.namespace, fresh=True
         )
         return self
 
@@ -241,6 +451,7 @@ class EndpointConfig:
         self.body = None
         return self
 
+    @traced
     def create_handler(self) -> "EndpointConfig":
         """
         Method used for creating associated resources. The method returns a reference to self.
@@ -254,112 +465,397 @@ class EndpointConfig:
 
         endpoint = self.get_endpoint()
 
-        print("detected endpoint", endpoint)
+        logging.debug(f"Detected endpoint {endpoint}")
 
         model_versions = []
         destinations = []
         for n, model in enumerate(self.get_models()):
-            model_ = Model(name=model.name, namespace=self.namespace, version=get_version()).create(
-                image=model.body.spec.image,
-                artifact=model.body.spec.artifact,
-                command=model.body.spec.command,
-                args=model.body.spec.args,
-                endpoint=self.body.status.endpoint,
-                endpoint_config=self.body.status.endpoint_config,
+            model_version, destination = self.create_model_version(
+                model,
+                weight=self.body.spec.models[n].weight,
                 endpoint_config_version=self.body.metadata.name,
+                model_data=self.body.spec.models[n],
             )
-            model_versions.append(model_.body.metadata.name)
-            destinations.append(
-                {
-                    "host": model_.named_version,
-                    "port": 8080,
-                    "weight": self.body.spec.models[n].weight,
-                }
-            )
+            model_versions.append(model_version)
+            destinations.append(destination)
 
         self.virtual_service.create(
             gateway=self.body.status.endpoint,
             hosts=[endpoint.spec.host],
             destinations=destinations,
+            owner_references=owner_references(self.body),
         )
         self.update(model_versions=model_versions)
 
         return self
 
+    @traced
+    async def create_handler_async(self) -> "EndpointConfig":
+        """
+        Same as create_handler, but the variants are read and their new model versions are created concurrently, with
+        the number of in-flight API calls bounded by MLOPS_MAX_CONCURRENCY.
+
+        :return: An EndpointConfig object (reference to self for easy chaining).
+        """
+        if self.body and self.body.status and self.body.status.model_versions:
+            return self
+
+        endpoint, models = await asyncio.gather(
+            MLOpsClient.AsyncV1Alpha1Api().read_namespaced_endpoint(
+                name=self.body.status.endpoint if self.body and self.body.status else None,
+                namespace=self.namespace,
+            ),
+            self.get_models_async(),
+        )
+
+        versions = await gather_bounded(
+            [
+                partial(
+                    self.create_model_version,
+                    model,
+                    weight=self.body.spec.models[n].weight,
+                    endpoint_config_version=self.body.metadata.name,
+                    model_data=self.body.spec.models[n],
+                )
+                for n, model in enumerate(models)
+            ]
+        )
+
+        await run_bounded(
+            lambda: self.virtual_service.create(
+                gateway=self.body.status.endpoint,
+                hosts=[endpoint.spec.host],
+                destinations=[destination for _, destination in versions],
+                owner_references=owner_references(self.body),
+            )
+        )
+        await run_bounded(self.update, model_versions=[model_version for model_version, _ in versions])
+
+        return self
+
+    @traced
+    def create_model_version(
+        self,
+        model: Model,
+        weight: float,
+        endpoint_config_version: str,
+        model_data: Optional[MLOpsClient.V1Alpha1EndpointConfigModel] = None,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Create a new version of a model for this endpoint config, or share the existing one serving the same content.
+        The version of a model version is a hash of its image, artifact, command, args and resources, so identical
+        variants across endpoint configs run a single deployment, owned by every endpoint config version using it and
+        deleted along with the last of them (see utils/owners.py).
+
+        :param model: The model to create a new version of.
+        :param weight: The weight of the traffic routed to the new model version.
+        :param endpoint_config_version: The name of the endpoint config version the model version belongs to.
+        :param model_data: The entry of the endpoint config describing the model resources. Defaults to the first entry
+        of the model.
+        :return: The name of the new model version and its virtual service destination.
+        """
+        model_data = model_data or next((data for data in self.body.spec.models if data.model == model.name), None)
+        version = get_content_version(
+            {
+                **model.body.spec.dict(),
+                **(model_data.dict(exclude={"model", "weight"}) if model_data else {}),
+            }
+        )
+        model_ = Model(name=model.name, namespace=self.namespace, version=version)
+        scaled = (model_.body.metadata.labels or {}).get(MLOpsClient.MODEL_INSTANCES_LABEL) if model_.body else None
+        if model_.body and (
+            model_.body.metadata.deletionTimestamp or (scaled and model_data and scaled != str(model_data.instances))
+        ):
+            # The identical variant is going away, or was scaled in place since: deploy a version of its own rather
+            # than sharing it.
+            model_ = Model(name=model.name, namespace=self.namespace, version=f"{version}-{get_version()}")
+
+        shared = model_.body is not None
+        if not shared:
+            try:
+                model_.create(
+                    image=model.body.spec.image,
+                    artifact=model.body.spec.artifact,
+                    command=model.body.spec.command,
+                    args=model.body.spec.args,
+                    endpoint=self.body.status.endpoint,
+                    endpoint_config=self.body.status.endpoint_config,
+                    endpoint_config_version=endpoint_config_version,
+                    owner_references=owner_references(self.body),
+                )
+            except K8SClient.ApiException as err:
+                if err.status != 409:
+                    raise
+                # Created in the meantime by another endpoint config version.
+                shared = model_.refresh().body is not None
+        if shared:
+            logging.info(f"Sharing model version {model_.named_version} with {endpoint_config_version}")
+            model_.add_owner(self.body)
+        observe_model_version(shared)
+        return model_.body.metadata.name, {"host": model_.named_version, "port": 8080, "weight": weight}
+
+    @traced
+    def update_in_place(self, old_models: List[Dict[str, Any]], new_models: List[Dict[str, Any]]) -> bool:
+        """
+        Apply the changes of the model entries which need no new model version (see get_changes): the traffic is
+        shifted with a single patch of the virtual service route weights, without reading the endpoint, the virtual
+        service or the model versions, and the deployments of the rescaled variants are scaled. A variant shared with
+        other endpoint configs keeps its number of instances, it is rolled out as a new model version instead. Reordered
+        entries keep their model versions, the routes and the model versions of the status follow the new order.
+
+        :param old_models: The old model entries, as dicts.
+        :param new_models: The new model entries, as dicts.
+        :return: True if the changes were applied, False if the model versions have to be rolled out.
+        """
+        changes = self.get_changes(old_models, new_models)
+        current = (self.body.status.model_versions if self.body.status else None) or []
+        if changes is None or REDEPLOY in changes or len(current) != len(changes):
+            return False
+        matched = self.match_models(old_models, new_models)
+        model_versions = [current[n] for n in matched]
+
+        rescaled = {
+            n: Model(name=model_versions[n], namespace=self.namespace)
+            for n, change in enumerate(changes)
+            if change == RESCALE
+        }
+        if not all(version.is_exclusive(self.body) for version in rescaled.values()):
+            return False
+
+        reordered = model_versions != current
+        if reordered or any(old_models[m]["weight"] != model["weight"] for m, model in zip(matched, new_models)):
+            destinations = [
+                {"host": model_version, "weight": model["weight"]}
+                for model_version, model in zip(model_versions, new_models)
+            ]
+            if not IstioVirtualService.set_weights(self.virtual_service_name, self.namespace, destinations, current):
+                return False
+
+        for n, version in rescaled.items():
+            version.scale(new_models[n]["instances"])
+        if reordered:
+            self.update(model_versions=model_versions)
+        return True
+
+    @traced
     def update_handler(self, diff: Optional[Tuple[DiffLineType]] = None) -> "EndpointConfig":
         """
         Update the EndpointConfig. As resources are allocated only when the EndpointConfig is attached to an Endpoint, check if this EndpointConfig is attached to an Endpoint before updating.
         If an endpoint is attached, then:
-        - if only weights are being updated, update the weights of the models on the virtual service;
+        - if only weights are being updated, patch the route weights of the virtual service in a single call;
+        - if only the number of instances of some models changes, scale their deployments in place;
         - if the number of models decreases, delete the models that are no longer needed;
         - if new models are swapped in or added, create new models, add them with the same weights to the virtual service, mark them for monitoring by the daemon, and when all good, delete the old models;
+        The models are matched by variant (the model and its resources), not by position: a variant still configured
+        keeps its model version.
 
         :param diff: The diff between the old and new versions of the CRD as a list of DiffLine objects (see utils.py).
         :return: An EndpointConfig object (reference to self for easy chaining).
         """
+        models_diff = DiffLine.from_iter(diff, "change", ("spec", "models"))
+        if not models_diff or not self.body or not self.body.status or not self.body.status.endpoint:
+            return self
+
+        if self.update_in_place(models_diff.old_value, models_diff.new_value):
+            return self
+
         endpoint = self.get_endpoint()
         if not endpoint:
             return self
 
+        new_models = models_diff.new_value or []
+        kept, current = self.match_model_versions(models_diff.old_value, new_models, self.get_model_version_bodies())
+
+        model_versions = []
+        destinations = []
+        for model, version in zip(new_models, kept):
+            if version:
+                model_version = version.body.metadata.name
+                destination = {"host": version.named_version, "port": 8080, "weight": model["weight"]}
+            else:
+                model_version, destination = self.create_variant(model)
+                Model(name=model_version, namespace=self.namespace).create_handler()
+            model_versions.append(model_version)
+            destinations.append(destination)
+
+        self.virtual_service.update(
+            gateway=endpoint.metadata.name,
+            hosts=[endpoint.spec.host],
+            destinations=destinations,
+            owner_references=owner_references(self.body),
+        )
+        self.update(model_versions=model_versions)
+
+        # The versions of the models swapped out or removed go once the traffic is routed away from them, unless they are
+        # shared with other endpoint config versions.
+        for versions in current.values():
+            for version in versions:
+                version.release(self.body)
+
+        return self
+
+    @traced
+    async def update_handler_async(self, diff: Optional[Tuple[DiffLineType]] = None) -> "EndpointConfig":
+        """
+        Same as update_handler, but the model versions of the new variants are created and deployed concurrently, with
+        the number of in-flight API calls bounded by MLOPS_MAX_CONCURRENCY.
+
+        :param diff: The diff between the old and new versions of the CRD as a list of DiffLine objects (see utils.py).
+        :return: An EndpointConfig object (reference to self for easy chaining).
+        """
         models_diff = DiffLine.from_iter(diff, "change", ("spec", "models"))
-        if not models_diff:
+        if not models_diff or not self.body or not self.body.status or not self.body.status.endpoint:
+            return self
+
+        if await run_bounded(self.update_in_place, models_diff.old_value, models_diff.new_value):
             return self
 
-        new_models = self.get_models(models_diff.new_value)
-        new_model_names = [model.body.status.model for model in new_models]
-        old_models = self.get_models(models_diff.old_value)
-        old_model_names = [model.body.status.model for model in old_models]
+        endpoint, bodies = await gather_bounded([self.get_endpoint, self.get_model_version_bodies])
+        if not endpoint:
+            return self
+
+        new_models = models_diff.new_value or []
+        kept, current = self.match_model_versions(models_diff.old_value, new_models, bodies)
 
-        for model in old_models:
-            if model.name not in new_model_names:
-                model.delete()
+        created = await gather_bounded(
+            [partial(self.create_variant, model) for model, version in zip(new_models, kept) if not version]
+        )
+        versions = await gather_bounded(
+            [partial(Model, name=model_version, namespace=self.namespace) for model_version, _ in created]
+        )
+        await asyncio.gather(*(version.create_handler_async() for version in versions))
 
         model_versions = []
         destinations = []
-        for n, model in enumerate(new_models):
-            if model.body and model.body.status and model.body.status.model in old_model_names:
-                model_versions.append(model.body.metadata.name)
-                destinations.append(
-                    {
-                        "host": model.named_version,
-                        "port": 8080,
-                        "weight": self.body.spec.models[n].weight,
-                    }
-                )
-                continue
-            model_ = Model(name=model.body.status.model, namespace=self.namespace, version=get_version()).create(
-                image=model.body.spec.image,
-                artifact=model.body.spec.artifact,
-                command=model.body.spec.command,
-                args=model.body.spec.args,
-                endpoint=self.body.status.endpoint,
-                endpoint_config=self.body.status.endpoint_config,
-                endpoint_config_version=self.body.status.version,
+        created = iter(created)
+        for model, version in zip(new_models, kept):
+            if version:
+                model_version = version.body.metadata.name
+                destination = {"host": version.named_version, "port": 8080, "weight": model["weight"]}
+            else:
+                model_version, destination = next(created)
+            model_versions.append(model_version)
+            destinations.append(destination)
+
+        await run_bounded(
+            lambda: self.virtual_service.update(
+                gateway=endpoint.metadata.name,
+                hosts=[endpoint.spec.host],
+                destinations=destinations,
+                owner_references=owner_references(self.body),
             )
-            model_versions.append(model_.body.metadata.name)
-            destinations.append(
-                {
-                    "host": model_.named_version,
-                    "port": 8080,
-                    "weight": self.body.spec.models[n].weight,
-                }
+        )
+        await run_bounded(self.update, model_versions=model_versions)
+
+        # The versions of the models swapped out or removed go once the traffic is routed away from them, unless they are
+        # shared with other endpoint config versions.
+        await gather_bounded(
+            [partial(version.release, self.body) for versions in current.values() for version in versions]
+        )
+
+        return self
+
+    def match_model_versions(
+        self,
+        old_models: Optional[List[Dict[str, Any]]],
+        new_models: List[Dict[str, Any]],
+        bodies: Dict[str, MLOpsClient.V1Alpha1Model],
+    ) -> Tuple[List[Optional[Model]], Dict[str, List[Model]]]:
+        """
+        Match the model versions serving the old models with the new models by variant: a new model keeps the version
+        of the same variant.
+
+        :param old_models: The old model entries, as dicts, in the order of the model versions of the status.
+        :param new_models: The new model entries, as dicts.
+        :param bodies: The model versions of the endpoint config, by name (see get_model_version_bodies).
+        :return: The model version kept by each new model entry (None for a new variant), and the model versions left
+        over, by variant.
+        """
+        current: Dict[str, List[Model]] = {}
+        model_versions = (self.body.status.model_versions if self.body.status else None) or []
+        for model, model_version in zip(old_models or [], model_versions):
+            version = Model(name=model_version, namespace=self.namespace, body=bodies.get(model_version))
+            if version.body:
+                current.setdefault(self.variant(model), []).append(version)
+
+        kept = []
+        for model in new_models:
+            versions = current.get(self.variant(model))
+            kept.append(versions.pop(0) if versions else None)
+        return kept, current
+
+    @traced
+    def replace_model_version(self, version: Model, release: bool = True) -> "EndpointConfig":
+        """
+        Roll out the new content of one of the model versions of this endpoint config (e.g. a new artifact): the model
+        version of the new content is created, or shared (see create_model_version), the traffic is routed to it and
+        the previous model version is released.
+
+        :param version: The model version whose spec changed.
+        :param release: Release the previous model version, False when the caller releases it from all of its users.
+        :return: An EndpointConfig object (reference to self for easy chaining).
+        """
+        if not self.body or not self.body.status or not version.body:
+            return self
+        model_versions = list(self.body.status.model_versions or [])
+        positions = [n for n, model_version in enumerate(model_versions) if model_version == version.body.metadata.name]
+        endpoint = self.get_endpoint() if positions else None
+        if not endpoint:
+            return self
+
+        for n in positions:
+            model_data = self.body.spec.models[n]
+            model_versions[n], _ = self.create_model_version(
+                version,
+                weight=model_data.weight,
+                endpoint_config_version=self.body.metadata.name,
+                model_data=model_data,
             )
+            Model(name=model_versions[n], namespace=self.namespace).create_handler()
 
         self.virtual_service.update(
-            gateway=endpoint.name,
+            gateway=endpoint.metadata.name,
             hosts=[endpoint.spec.host],
-            destinations=destinations,
+            destinations=[
+                {"host": model_version, "port": 8080, "weight": model.weight}
+                for model_version, model in zip(model_versions, self.body.spec.models)
+            ],
+            owner_references=owner_references(self.body),
         )
         self.update(model_versions=model_versions)
-
+        if release:
+            version.release(self.body)
         return self
 
+    def create_variant(self, model: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """
+        Create the model version of a new variant, or share the existing one of the same content (see
+        create_model_version).
+
+        :param model: The model entry, as a dict.
+        :return: The name of the model version and its destination in the virtual service.
+        """
+        return self.create_model_version(
+            Model(name=model["model"], namespace=self.namespace),
+            weight=model["weight"],
+            endpoint_config_version=self.body.metadata.name,
+            model_data=MLOpsClient.V1Alpha1EndpointConfigModel.parse_obj(model),
+        )
+
+    @traced
     def delete_handler(self) -> "EndpointConfig":
         """
         Delete the EndpointConfig. Method intended to be used with kopf.on.delete.
 
+        An endpoint config version cloned for an endpoint is owned by it and owns its model versions and virtual
+        service, which the garbage collector deletes along with it. Only the resources of the versions cloned before
+        the owner references were introduced are deleted here.
+
         :return: An EndpointConfig object (reference to self for easy chaining).
         """
+        if is_owned(self.body):
+            return self
+
         for model in self.get_models():
             model.delete()
 
@@ -368,6 +864,22 @@ class EndpointConfig:
 
         return self
 
+    @traced
+    async def delete_handler_async(self) -> "EndpointConfig":
+        """
+        Same as delete_handler, but the models and the virtual service are deleted concurrently.
+
+        :return: An EndpointConfig object (reference to self for easy chaining).
+        """
+        if is_owned(self.body):
+            return self
+
+        models = await self.get_models_async()
+        await gather_bounded([model.delete for model in models] + [lambda: self.virtual_service.delete()])
+        self.virtual_service = None
+
+        return self
+
     def add_finalizers(self, finalizers: List[str]) -> "EndpointConfig":
         """
         Add finalizers to the EndpointConfig. While the finalizers are present, the EndpointConfig cannot be deleted
@@ -377,18 +889,18 @@ class EndpointConfig:
         :param finalizers: A list of finalizers to add (simple strings).
         :return: An EndpointConfig object (reference to self for easy chaining).
         """
-        if isinstance(self.body.metadata.finalizers, list):
-            for finalizer in finalizers:
-                if finalizer not in self.body.metadata.finalizers:
-                    self.body.metadata.finalizers.append(finalizer)
-        else:
-            self.body.metadata.finalizers = finalizers
-
         api = MLOpsClient.V1Alpha1Api()
-        self.body = api.patch_namespaced_endpoint_config(
-            name=self.body.metadata.name, namespace=self.body.metadata.namespace, body=self.body
-        )
 
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, add=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_endpoint_config(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.ENDPOINT_CONFIG_PLURAL)
         return self
 
     def remove_finalizers(self, finalizers: List[str]) -> "EndpointConfig":
@@ -400,14 +912,16 @@ class EndpointConfig:
         :param finalizers: A list of finalizers to remove (simple strings).
         :return: An EndpointConfig object (reference to self for easy chaining).
         """
-        if isinstance(self.body.metadata.finalizers, list):
-            for finalizer in finalizers:
-                if finalizer in self.body.metadata.finalizers:
-                    self.body.metadata.finalizers.remove(finalizer)
-
         api = MLOpsClient.V1Alpha1Api()
-        self.body = api.patch_namespaced_endpoint_config(
-            name=self.body.metadata.name, namespace=self.body.metadata.namespace, body=self.body
-        )
 
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, remove=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_endpoint_config(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.ENDPOINT_CONFIG_PLURAL)
         return self
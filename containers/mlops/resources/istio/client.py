@@ -1,10 +1,18 @@
-from typing import Any, Optional, Type, Union
+from __future__ import annotations
+
+from typing import Any, Callable, Optional, Type, Union
 
 from kubernetes import client as K8SClient
 from pydantic import BaseModel
 from resources.istio.common import *
 from resources.istio.gateway import *
 from resources.istio.virtual_service import *
+from utils.api_client import get_api_client
+from utils.concurrency import AsyncApi
+from utils.decode import TRUSTED_RESPONSES, construct, decode
+from utils.informer import get_informer
+from utils.metrics import observe_cache_lookup
+from utils.patch import patch_content_type
 
 
 class V1Beta1Api:
@@ -15,8 +23,30 @@ class V1Beta1Api:
     group: str = GROUP
     version: str = VERSION
 
-    def __init__(self, api: K8SClient.CustomObjectsApi = None) -> None:
-        self.api = api or K8SClient.CustomObjectsApi()
+    def __init__(self, api: K8SClient.CustomObjectsApi = None, trusted: bool = None) -> None:
+        """
+        @param api: The CustomObjectsApi to use. Defaults to one built on the shared ApiClient.
+        @param trusted: Trust the API server responses (defaults to MLOPS_TRUSTED_RESPONSES): the raw responses are
+        decoded with a fast JSON library and the pydantic models are built through utils.decode.construct.
+        """
+        self.api = api or K8SClient.CustomObjectsApi(get_api_client())
+        self.trusted = TRUSTED_RESPONSES if trusted is None else trusted
+
+    def call(self, function: Callable, *args, **kwargs) -> Any:
+        """
+        Call the CustomObjectsApi. In trusted mode, the raw response is read and decoded directly, skipping the
+        kubernetes client deserialization.
+        """
+        if not self.trusted:
+            return function(*args, **kwargs)
+        return decode(function(*args, _preload_content=False, **kwargs))
+
+    def parse(self, result: dict, format: Type[BaseModel] = None) -> Union[BaseModel, dict]:
+        if not format:
+            return result
+        if self.trusted:
+            return construct(format, result)
+        return format.parse_obj(result)
 
     def read_namespaced(
         self,
@@ -24,6 +54,7 @@ class V1Beta1Api:
         namespace: str = "default",
         plural: str = None,
         format: Type[BaseModel] = None,
+        fresh: bool = False,
     ) -> Optional[Union[BaseModel, dict]]:
         """
         Read a namespaced Istio resource. If the resource doesn't exist, None will be returned.
@@ -31,26 +62,37 @@ class V1Beta1Api:
         @param namespace: Namespace of the resource. Default value is "default".
         @param plural: Plural kind of the resource.
         @param format: Pydantic model to parse the result into. If not provided, the raw dict will be returned.
+        @param fresh: Read from the API server even when an informer caches the plural, e.g. to retry a write after a
+        conflict.
         @return: The resource if it exists in dict or pydantic format (if format was passed), None otherwise.
         """
         if name is None:
             return None
-        try:
-            result = self.api.get_namespaced_custom_object(
-                self.group,
-                self.version,
-                namespace,
-                plural,
-                name,
-            )
-        except K8SClient.ApiException as err:
-            if err.status == 404:
-                return None
-            else:
-                raise
+
+        informer = get_informer(self.group, plural)
+        result = informer.get(namespace, name) if informer and not fresh else None
+        if informer:
+            observe_cache_lookup(plural, hit=result is not None)
+        if result is None:
+            try:
+                result = self.call(
+                    self.api.get_namespaced_custom_object,
+                    self.group,
+                    self.version,
+                    namespace,
+                    plural,
+                    name,
+                )
+            except K8SClient.ApiException as err:
+                if err.status == 404:
+                    return None
+                else:
+                    raise
+            if informer:
+                informer.observe(result)
 
         if format:
-            return format.parse_obj(result)
+            return self.parse(result, format)
 
         return result
 
@@ -73,7 +115,8 @@ class V1Beta1Api:
             body = body.dict()
 
         try:
-            result = self.api.create_namespaced_custom_object(
+            result = self.call(
+                self.api.create_namespaced_custom_object,
                 self.group,
                 self.version,
                 namespace,
@@ -83,8 +126,12 @@ class V1Beta1Api:
         except K8SClient.ApiException as result:
             raise
 
+        informer = get_informer(self.group, plural)
+        if informer:
+            informer.observe(result)
+
         if format:
-            return format.parse_obj(result)
+            return self.parse(result, format)
 
         return result
 
@@ -92,7 +139,7 @@ class V1Beta1Api:
         self,
         name: str,
         namespace: str = "default",
-        body: Union[dict, BaseModel] = None,
+        body: Union[dict, list, BaseModel] = None,
         plural: str = None,
         format: Type[BaseModel] = None,
     ) -> Union[BaseModel, dict]:
@@ -100,7 +147,8 @@ class V1Beta1Api:
         Patch a namespaced Istio resource.
         @param name: Name of the resource. Required.
         @param namespace: Namespace of the resource. Default value is "default".
-        @param body: Body of the resource. Required. Should be a dict or Pydantic model.
+        @param body: Body of the resource. Required. Should be a dict or Pydantic model (sent as a JSON merge patch) or
+        a list of JSON patch operations.
         @param plural: Plural kind of the resource.
         @param format: Pydantic model to parse the result into. If not provided, the raw dict will be returned.
         @return: The patched resource in dict or pydantic format (if format was passed).
@@ -109,19 +157,25 @@ class V1Beta1Api:
             body = body.dict()
 
         try:
-            result = self.api.patch_namespaced_custom_object(
+            result = self.call(
+                self.api.patch_namespaced_custom_object,
                 self.group,
                 self.version,
                 namespace,
                 plural,
                 name,
                 body,
+                _content_type=patch_content_type(body),
             )
         except K8SClient.ApiException as result:
             raise
 
+        informer = get_informer(self.group, plural)
+        if informer:
+            informer.observe(result)
+
         if format:
-            return format.parse_obj(result)
+            return self.parse(result, format)
 
         return result
 
@@ -152,17 +206,24 @@ class V1Beta1Api:
             else:
                 raise
 
+        informer = get_informer(self.group, plural)
+        if informer:
+            informer.forget(namespace, name)
+
         return V1Beta1Status.parse_obj(result)
 
-    def read_namespaced_gateway(self, name: str, namespace: str = "default") -> Optional[V1Beta1Gateway]:
+    def read_namespaced_gateway(
+        self, name: str, namespace: str = "default", fresh: bool = False
+    ) -> Optional[V1Beta1Gateway]:
         """
         Reads an [Istio gateway](https://istio.io/latest/docs/reference/config/networking/gateway/) resource.
         Returns None if the gateway doesn't exist.
         @param name: Name of the gateway.
         @param namespace: Namespace of the gateway. Default value is "default".
+        @param fresh: Bypass the informer cache.
         @return: The gateway resource if it exists, None otherwise.
         """
-        return self.read_namespaced(name, namespace, GATEWAY_PLURAL, V1Beta1Gateway)
+        return self.read_namespaced(name, namespace, GATEWAY_PLURAL, V1Beta1Gateway, fresh=fresh)
 
     def create_namespaced_gateway(
         self, namespace: str = "default", body: Union[dict, V1Beta1Gateway] = None
@@ -196,15 +257,18 @@ class V1Beta1Api:
         """
         return self.delete_namespaced(name, namespace, GATEWAY_PLURAL)
 
-    def read_namespaced_virtual_service(self, name: str, namespace: str = "default") -> Optional[V1Beta1VirtualService]:
+    def read_namespaced_virtual_service(
+        self, name: str, namespace: str = "default", fresh: bool = False
+    ) -> Optional[V1Beta1VirtualService]:
         """
         Reads an [Istio virtual service](https://istio.io/latest/docs/reference/config/networking/virtual-service/) resource.
         Returns None if the virtual service doesn't exist.
         @param name: Name of the virtual service.
         @param namespace: Namespace of the virtual service. Default value is "default".
+        @param fresh: Bypass the informer cache.
         @return: The virtual service resource if it exists, None otherwise.
         """
-        return self.read_namespaced(name, namespace, VIRTUAL_SERVICE_PLURAL, V1Beta1VirtualService)
+        return self.read_namespaced(name, namespace, VIRTUAL_SERVICE_PLURAL, V1Beta1VirtualService, fresh=fresh)
 
     def create_namespaced_virtual_service(
         self, namespace: str = "default", body: Union[dict, V1Beta1VirtualService] = None
@@ -237,3 +301,13 @@ class V1Beta1Api:
         @return: The status of the delete operation, as a pydantic model.
         """
         return self.delete_namespaced(name, namespace, VIRTUAL_SERVICE_PLURAL)
+
+
+class AsyncV1Beta1Api(AsyncApi):
+    """
+    Asyncio flavour of V1Beta1Api. It exposes the same methods, each returning an awaitable, with the calls running in
+    worker threads and bounded by the operator wide concurrency limit (MLOPS_MAX_CONCURRENCY).
+    """
+
+    def __init__(self, api: K8SClient.CustomObjectsApi = None) -> None:
+        super().__init__(V1Beta1Api(api))
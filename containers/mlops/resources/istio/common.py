@@ -1,4 +1,4 @@
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
 from pydantic import BaseModel
 
@@ -6,11 +6,22 @@ GROUP: str = "networking.istio.io"
 VERSION: str = "v1beta1"
 
 
+class V1Beta1OwnerReference(BaseModel):
+    apiVersion: str
+    kind: str
+    name: str
+    uid: str
+    controller: Optional[bool] = None
+
+
 class V1Beta1ObjectMeta(BaseModel):
     name: str
     namespace: str
     labels: Dict[str, str] = {}
     finalizers: List[str] = []
+    resourceVersion: Optional[str] = None
+    uid: Optional[str] = None
+    ownerReferences: List[V1Beta1OwnerReference] = []
 
 
 class V1Beta1Port(BaseModel):
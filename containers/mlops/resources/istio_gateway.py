@@ -1,7 +1,10 @@
-from typing import Dict, List
+from typing import Any, Dict, List
 
 from kubernetes import client as K8SClient
 from resources.istio import client as IstioClient
+from utils.conflicts import retry_on_conflict
+from utils.patch import finalizers_patch, merge_patch, with_resource_version
+from utils.tracing import traced
 
 
 class IstioGateway:
@@ -10,9 +13,16 @@ class IstioGateway:
         self.namespace = namespace
         self.body = IstioClient.V1Beta1Api().read_namespaced_gateway(self.name, self.namespace)
 
-    def get_body(self, labels: Dict[str, str], hosts: List[str], port: int) -> IstioClient.V1Beta1Gateway:
+    def get_body(
+        self, labels: Dict[str, str], hosts: List[str], port: int, owner_references: List[Dict[str, Any]] = None
+    ) -> IstioClient.V1Beta1Gateway:
+        """
+        @param owner_references: The owner references of the gateway, see utils/owners.py.
+        """
         return IstioClient.V1Beta1Gateway(
-            metadata=IstioClient.V1Beta1ObjectMeta(name=self.name, namespace=self.namespace),
+            metadata=IstioClient.V1Beta1ObjectMeta(
+                name=self.name, namespace=self.namespace, ownerReferences=owner_references or []
+            ),
             spec=IstioClient.V1Beta1GatewaySpec(
                 selector=labels,
                 servers=[
@@ -28,25 +38,44 @@ class IstioGateway:
             ),
         )
 
-    def create(self, labels: Dict[str, str], hosts: List[str], port: int) -> "IstioGateway":
+    @traced
+    def create(
+        self, labels: Dict[str, str], hosts: List[str], port: int, owner_references: List[Dict[str, Any]] = None
+    ) -> "IstioGateway":
         if self.body:
-            return self.update(hosts=hosts, port=port)
+            return self.update(labels=labels, hosts=hosts, port=port)
 
         api = IstioClient.V1Beta1Api()
-        body = self.get_body(labels=labels, hosts=hosts, port=port)
+        body = self.get_body(labels=labels, hosts=hosts, port=port, owner_references=owner_references)
         self.body = api.create_namespaced_gateway(namespace=self.namespace, body=body)
 
         return self
 
+    @traced
     def update(self, labels: Dict[str, str], hosts: List[str], port: int) -> "IstioGateway":
         if not self.body:
-            return self.create(hosts=hosts, port=port)
+            return self.create(labels=labels, hosts=hosts, port=port)
 
         api = IstioClient.V1Beta1Api()
         body = self.get_body(labels=labels, hosts=hosts, port=port)
-        self.body = api.patch_namespaced_gateway(name=self.name, namespace=self.namespace, body=body)
+
+        def write() -> None:
+            patch = merge_patch(self.body.dict(), body.dict(include={"spec"})) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_gateway(
+                    name=self.name,
+                    namespace=self.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=IstioClient.GATEWAY_PLURAL)
+        return self
+
+    def refresh(self) -> "IstioGateway":
+        self.body = IstioClient.V1Beta1Api().read_namespaced_gateway(self.name, self.namespace, fresh=True)
         return self
 
+    @traced
     def delete(self) -> "IstioGateway":
         if not self.body:
             return self
@@ -62,19 +91,17 @@ class IstioGateway:
             return self
 
         api = IstioClient.V1Beta1Api()
-        if not self.body.metadata.finalizers:
-            self.body.metadata.finalizers = []
-
-        for finalizer in finalizers:
-            if finalizer not in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.append(finalizer)
 
-        self.body = api.patch_namespaced_gateway(
-            name=self.body.metadata.name,
-            namespace=self.body.metadata.namespace,
-            body=self.body,
-        )
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, add=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_gateway(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
 
+        retry_on_conflict(write, self.refresh, resource=IstioClient.GATEWAY_PLURAL)
         return self
 
     def remove_finalizers(self, finalizers: List[str]) -> "IstioGateway":
@@ -82,14 +109,15 @@ class IstioGateway:
             return self
 
         api = IstioClient.V1Beta1Api()
-        for finalizer in finalizers:
-            if finalizer in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.remove(finalizer)
-
-        self.body = api.patch_namespaced_gateway(
-            name=self.body.metadata.name,
-            namespace=self.body.metadata.namespace,
-            body=self.body,
-        )
 
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, remove=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_gateway(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=IstioClient.GATEWAY_PLURAL)
         return self
@@ -1,7 +1,10 @@
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 
 from kubernetes import client as K8SClient
 from resources.istio import client as IstioClient
+from utils.conflicts import retry_on_conflict
+from utils.patch import finalizers_patch, merge_patch, with_resource_version
+from utils.tracing import traced
 
 
 class IstioVirtualService:
@@ -11,10 +14,19 @@ class IstioVirtualService:
         self.body = IstioClient.V1Beta1Api().read_namespaced_virtual_service(self.name, self.namespace)
 
     def get_body(
-        self, gateway: str, hosts: List[str], destinations: List[Dict[str, str]]
+        self,
+        gateway: str,
+        hosts: List[str],
+        destinations: List[Dict[str, str]],
+        owner_references: List[Dict[str, Any]] = None,
     ) -> IstioClient.V1Beta1VirtualService:
+        """
+        @param owner_references: The owner references of the virtual service, see utils/owners.py.
+        """
         return IstioClient.V1Beta1VirtualService(
-            metadata=IstioClient.V1Beta1ObjectMeta(name=self.name, namespace=self.namespace),
+            metadata=IstioClient.V1Beta1ObjectMeta(
+                name=self.name, namespace=self.namespace, ownerReferences=owner_references or []
+            ),
             spec=IstioClient.V1Beta1VirtualServiceSpec(
                 gateways=[gateway],
                 hosts=hosts,
@@ -35,24 +47,100 @@ class IstioVirtualService:
             ),
         )
 
-    def create(self, gateway: str, hosts: List[str], destinations: List[Dict[str, str]]) -> "IstioVirtualService":
+    @traced
+    def create(
+        self,
+        gateway: str,
+        hosts: List[str],
+        destinations: List[Dict[str, str]],
+        owner_references: List[Dict[str, Any]] = None,
+    ) -> "IstioVirtualService":
         if self.body:
             return self.update(gateway=gateway, hosts=hosts, destinations=destinations)
 
         api = IstioClient.V1Beta1Api()
-        body = self.get_body(gateway=gateway, hosts=hosts, destinations=destinations)
+        body = self.get_body(gateway=gateway, hosts=hosts, destinations=destinations, owner_references=owner_references)
         self.body = api.create_namespaced_virtual_service(namespace=self.namespace, body=body)
         return self
 
-    def update(self, gateway: str, hosts: List[str], destinations: List[Dict[str, str]]) -> "IstioVirtualService":
+    @traced
+    def update(
+        self,
+        gateway: str,
+        hosts: List[str],
+        destinations: List[Dict[str, str]],
+        owner_references: List[Dict[str, Any]] = None,
+    ) -> "IstioVirtualService":
+        """
+        @param owner_references: The owner references of the virtual service, only set if it has to be created.
+        """
         if not self.body:
-            return self.create(gateway=gateway, hosts=hosts, destinations=destinations)
+            return self.create(
+                gateway=gateway, hosts=hosts, destinations=destinations, owner_references=owner_references
+            )
 
         api = IstioClient.V1Beta1Api()
         body = self.get_body(gateway=gateway, hosts=hosts, destinations=destinations)
-        self.body = api.patch_namespaced_virtual_service(name=self.name, namespace=self.namespace, body=body)
+
+        def write() -> None:
+            patch = merge_patch(self.body.dict(), body.dict(include={"spec"})) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_virtual_service(
+                    name=self.name,
+                    namespace=self.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=IstioClient.VIRTUAL_SERVICE_PLURAL)
         return self
 
+    @staticmethod
+    @traced
+    def set_weights(
+        name: str, namespace: str, destinations: List[Dict[str, Any]], hosts: Optional[List[str]] = None
+    ) -> bool:
+        """
+        Shift the traffic between the destinations of a virtual service in a single JSON patch, without reading it
+        first. Each weight replaced is guarded by a test operation on the host of its route, so the patch fails instead
+        of weighting the wrong destination if the routes changed in the meantime.
+        @param name: The name of the virtual service.
+        @param namespace: The namespace of the virtual service.
+        @param destinations: The destinations of the virtual service, in the order of its routes, with their "host" and
+        new "weight".
+        @param hosts: The current hosts of the routes, when the destinations reorder them. Defaults to the hosts of the
+        destinations.
+        @return: True if the weights were patched, False if the routes don't match the destinations and the virtual
+        service has to be updated as a whole.
+        """
+        hosts = hosts or [destination["host"] for destination in destinations]
+        operations = []
+        for n, (host, destination) in enumerate(zip(hosts, destinations)):
+            operations.append({"op": "test", "path": f"/spec/http/{n}/route/0/destination/host", "value": host})
+            if host != destination["host"]:
+                operations.append(
+                    {
+                        "op": "replace",
+                        "path": f"/spec/http/{n}/route/0/destination/host",
+                        "value": destination["host"],
+                    }
+                )
+            operations.append(
+                {"op": "replace", "path": f"/spec/http/{n}/route/0/weight", "value": destination["weight"]}
+            )
+        try:
+            IstioClient.V1Beta1Api().patch_namespaced_virtual_service(name=name, namespace=namespace, body=operations)
+        except K8SClient.ApiException as err:
+            # Not found, or a failed test operation or missing route (422 Unprocessable Entity).
+            if err.status not in (404, 422):
+                raise
+            return False
+        return True
+
+    def refresh(self) -> "IstioVirtualService":
+        self.body = IstioClient.V1Beta1Api().read_namespaced_virtual_service(self.name, self.namespace, fresh=True)
+        return self
+
+    @traced
     def delete(self) -> "IstioVirtualService":
         if self.body is None or self.body.metadata is None:
             return self
@@ -68,16 +156,17 @@ class IstioVirtualService:
             return self
 
         api = IstioClient.V1Beta1Api()
-        if not self.body.metadata.finalizers:
-            self.body.metadata.finalizers = []
 
-        for finalizer in finalizers:
-            if finalizer not in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.append(finalizer)
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, add=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_virtual_service(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
 
-        self.body = api.patch_namespaced_virtual_service(
-            name=self.body.metadata.name, namespace=self.body.metadata.namespace, body=self.body
-        )
+        retry_on_conflict(write, self.refresh, resource=IstioClient.VIRTUAL_SERVICE_PLURAL)
         return self
 
     def remove_finalizers(self, finalizers: List[str]) -> "IstioVirtualService":
@@ -85,11 +174,15 @@ class IstioVirtualService:
             return self
 
         api = IstioClient.V1Beta1Api()
-        for finalizer in finalizers:
-            if finalizer in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.remove(finalizer)
 
-        self.body = api.patch_namespaced_virtual_service(
-            name=self.body.metadata.name, namespace=self.body.metadata.namespace, body=self.body
-        )
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, remove=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_virtual_service(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=IstioClient.VIRTUAL_SERVICE_PLURAL)
         return self
@@ -1,4 +1,6 @@
-from typing import Any, Optional, Type, Union
+from __future__ import annotations
+
+from typing import Any, Callable, Iterator, Optional, Type, Union
 
 from kubernetes import client as K8SClient
 from pydantic import BaseModel
@@ -6,14 +8,43 @@ from resources.mlops.common import *
 from resources.mlops.endpoint import *
 from resources.mlops.endpoint_config import *
 from resources.mlops.model import *
+from utils.api_client import get_api_client
+from utils.concurrency import AsyncApi
+from utils.decode import TRUSTED_RESPONSES, construct, decode
+from utils.informer import get_informer, owner_index
+from utils.metrics import observe_cache_lookup
+from utils.patch import MERGE_PATCH, patch_content_type
 
 
 class V1Alpha1Api:
     group: str = GROUP
     version: str = VERSION
-
-    def __init__(self, api: K8SClient.CustomObjectsApi = None) -> None:
-        self.api = api or K8SClient.CustomObjectsApi()
+    page_size: int = 500
+
+    def __init__(self, api: K8SClient.CustomObjectsApi = None, trusted: bool = None) -> None:
+        """
+        @param api: The CustomObjectsApi to use. Defaults to one built on the shared ApiClient.
+        @param trusted: Trust the API server responses (defaults to MLOPS_TRUSTED_RESPONSES): the raw responses are
+        decoded with a fast JSON library and the pydantic models are built through utils.decode.construct.
+        """
+        self.api = api or K8SClient.CustomObjectsApi(get_api_client())
+        self.trusted = TRUSTED_RESPONSES if trusted is None else trusted
+
+    def call(self, function: Callable, *args, **kwargs) -> Any:
+        """
+        Call the CustomObjectsApi. In trusted mode, the raw response is read and decoded directly, skipping the
+        kubernetes client deserialization.
+        """
+        if not self.trusted:
+            return function(*args, **kwargs)
+        return decode(function(*args, _preload_content=False, **kwargs))
+
+    def parse(self, result: dict, format: Type[BaseModel] = None) -> Union[BaseModel, dict]:
+        if not format:
+            return result
+        if self.trusted:
+            return construct(format, result)
+        return format.parse_obj(result)
 
     def read_namespaced(
         self,
@@ -21,36 +52,57 @@ class V1Alpha1Api:
         namespace: str = "default",
         plural: str = None,
         format: Type[BaseModel] = None,
+        fresh: bool = False,
     ) -> Optional[Union[BaseModel, dict]]:
+        """
+        @param fresh: Read from the API server even when an informer caches the plural, e.g. to retry a write after a
+        conflict.
+        """
         if name is None:
             return None
-        try:
-            result = self.api.get_namespaced_custom_object(
-                self.group,
-                self.version,
-                namespace,
-                plural,
-                name,
-            )
-        except K8SClient.ApiException as err:
-            if err.status == 404:
-                return None
-            else:
-                raise
+
+        informer = get_informer(self.group, plural)
+        result = informer.get(namespace, name) if informer and not fresh else None
+        if informer:
+            observe_cache_lookup(plural, hit=result is not None)
+        if result is None:
+            try:
+                result = self.call(
+                    self.api.get_namespaced_custom_object,
+                    self.group,
+                    self.version,
+                    namespace,
+                    plural,
+                    name,
+                )
+            except K8SClient.ApiException as err:
+                if err.status == 404:
+                    return None
+                else:
+                    raise
+            if informer:
+                informer.observe(result)
 
         if format:
-            return format.parse_obj(result)
+            return self.parse(result, format)
 
         return result
 
-    def list_namespaced(
+    def iter_namespaced(
         self,
         namespace: str = "default",
         field_selector: str = None,
         label_selector: str = None,
         plural: str = None,
         format: Type[BaseModel] = None,
-    ) -> Optional[List[Union[BaseModel, dict]]]:
+        limit: int = None,
+        versions_only: bool = False,
+    ) -> Iterator[Union[BaseModel, dict, V1Alpha1ObjectVersion]]:
+        """
+        Stream the objects of a plural page by page, so only one page is held in memory at a time.
+        :param limit: The page size. Defaults to the page_size class attribute.
+        :param versions_only: Yield only the namespace, name and resourceVersion of each object, skipping parsing.
+        """
         kwargs = {
             "group": self.group,
             "version": self.version,
@@ -58,31 +110,104 @@ class V1Alpha1Api:
             "plural": plural,
             "field_selector": field_selector,
             "label_selector": label_selector,
+            "limit": limit or self.page_size,
         }
 
-        objects = []
         while True:
             try:
-                result = self.api.list_namespaced_custom_object(**kwargs)
+                result = self.call(self.api.list_namespaced_custom_object, **kwargs)
             except K8SClient.ApiException as err:
                 if err.status == 404:
-                    break
+                    return
                 else:
                     raise
 
-            if "continue" in result["metadata"]:
-                kwargs["_continue"] = result["metadata"]["continue"]
+            for item in result.get("items", []):
+                if versions_only:
+                    metadata = item["metadata"]
+                    yield V1Alpha1ObjectVersion(
+                        metadata.get("namespace"), metadata["name"], metadata.get("resourceVersion")
+                    )
+                elif format:
+                    yield self.parse(item, format)
+                else:
+                    yield item
 
-            items = result.get("items", [])
-            if not items:
-                break
+            token = (result.get("metadata") or {}).get("continue")
+            if not token:
+                return
+            kwargs["_continue"] = token
 
-            if format:
-                objects.extend(map(format.parse_obj, items))
-            else:
-                objects.extend(items)
+    def list_namespaced(
+        self,
+        namespace: str = "default",
+        field_selector: str = None,
+        label_selector: str = None,
+        plural: str = None,
+        format: Type[BaseModel] = None,
+    ) -> Optional[List[Union[BaseModel, dict]]]:
+        return list(
+            self.iter_namespaced(
+                namespace=namespace,
+                field_selector=field_selector,
+                label_selector=label_selector,
+                plural=plural,
+                format=format,
+            )
+        )
 
-        return objects
+    def list_namespaced_by_label(
+        self,
+        label: str,
+        value: str,
+        namespace: str = "default",
+        plural: str = None,
+        format: Type[BaseModel] = None,
+    ) -> List[Union[BaseModel, dict]]:
+        """
+        List the objects having a label set to a value. When the informer of the plural indexes the label, the answer
+        comes from the index without any API call; otherwise a single label-selected list is sent.
+        """
+        informer = get_informer(self.group, plural)
+        items = informer.by_index(label, namespace, value) if informer else None
+        if informer:
+            observe_cache_lookup(plural, hit=items is not None)
+        if items is None:
+            return self.list_namespaced(
+                namespace=namespace, label_selector=f"{label}={value}", plural=plural, format=format
+            )
+
+        return [self.parse(item, format) for item in items]
+
+    def list_namespaced_by_owner(
+        self,
+        kind: str,
+        name: str,
+        namespace: str = "default",
+        plural: str = None,
+        format: Type[BaseModel] = None,
+    ) -> List[Union[BaseModel, dict]]:
+        """
+        List the objects having an owner reference to an object of a kind, whether it is their controller or one of
+        the owners sharing them. When the informer of the plural indexes the owner references, the answer comes from
+        the index without any API call; otherwise the API server can't select on the owner references, so the objects
+        of the namespace are listed once and filtered here.
+        """
+        informer = get_informer(self.group, plural)
+        items = informer.by_index(owner_index(kind), namespace, name) if informer else None
+        if informer:
+            observe_cache_lookup(plural, hit=items is not None)
+        if items is None:
+            items = [
+                item
+                for item in self.iter_namespaced(namespace=namespace, plural=plural)
+                if any(
+                    reference.get("kind") == kind and reference.get("name") == name
+                    for reference in item["metadata"].get("ownerReferences") or []
+                )
+            ]
+
+        return [self.parse(item, format) for item in items]
 
     def create_namespaced(
         self,
@@ -94,20 +219,39 @@ class V1Alpha1Api:
         if isinstance(body, BaseModel):
             body = body.dict()
 
+        # The status subresource is ignored on create, so it's set with a second call on the status endpoint.
+        body = dict(body)
+        status = body.pop("status", None)
+
         try:
-            result = self.api.create_namespaced_custom_object(
+            result = self.call(
+                self.api.create_namespaced_custom_object,
                 self.group,
                 self.version,
                 namespace,
                 plural,
                 body,
             )
+            if status:
+                result = self.call(
+                    self.api.patch_namespaced_custom_object_status,
+                    self.group,
+                    self.version,
+                    namespace,
+                    plural,
+                    result["metadata"]["name"],
+                    {"status": status},
+                    _content_type=MERGE_PATCH,
+                )
         except K8SClient.ApiException as result:
             raise
 
+        informer = get_informer(self.group, plural)
+        if informer:
+            informer.observe(result)
+
         if format:
-            formatted = format.parse_obj(result)
-            return formatted
+            return self.parse(result, format)
 
         return result
 
@@ -115,7 +259,7 @@ class V1Alpha1Api:
         self,
         name: str,
         namespace: str = "default",
-        body: Union[dict, BaseModel] = None,
+        body: Union[dict, list, BaseModel] = None,
         plural: str = None,
         format: Type[BaseModel] = None,
     ) -> Union[BaseModel, dict]:
@@ -123,19 +267,56 @@ class V1Alpha1Api:
             body = body.dict()
 
         try:
-            result = self.api.patch_namespaced_custom_object(
+            result = self.call(
+                self.api.patch_namespaced_custom_object,
+                self.group,
+                self.version,
+                namespace,
+                plural,
+                name,
+                body,
+                _content_type=patch_content_type(body),
+            )
+        except K8SClient.ApiException as result:
+            raise
+
+        informer = get_informer(self.group, plural)
+        if informer:
+            informer.observe(result)
+
+        if format:
+            return self.parse(result, format)
+
+        return result
+
+    def patch_namespaced_status(
+        self,
+        name: str,
+        namespace: str = "default",
+        body: Union[dict, list] = None,
+        plural: str = None,
+        format: Type[BaseModel] = None,
+    ) -> Union[BaseModel, dict]:
+        try:
+            result = self.call(
+                self.api.patch_namespaced_custom_object_status,
                 self.group,
                 self.version,
                 namespace,
                 plural,
                 name,
                 body,
+                _content_type=patch_content_type(body),
             )
         except K8SClient.ApiException as result:
             raise
 
+        informer = get_informer(self.group, plural)
+        if informer:
+            informer.observe(result)
+
         if format:
-            return format.parse_obj(result)
+            return self.parse(result, format)
 
         return result
 
@@ -144,7 +325,12 @@ class V1Alpha1Api:
         name: str,
         namespace: str = "default",
         plural: str = None,
+        propagation_policy: Optional[str] = None,
     ) -> Optional[V1Alpha1Status]:
+        """
+        @param propagation_policy: How the dependents of the object are deleted (Background, Foreground or Orphan),
+        defaults to the policy of the plural.
+        """
         try:
             result = self.api.delete_namespaced_custom_object(
                 self.group,
@@ -152,6 +338,7 @@ class V1Alpha1Api:
                 namespace,
                 plural,
                 name,
+                propagation_policy=propagation_policy,
             )
         except K8SClient.ApiException as result:
             if result.status == 404:
@@ -159,10 +346,56 @@ class V1Alpha1Api:
             else:
                 raise
 
+        if result.get("kind") != "Status":
+            # Finalizers hold the deletion: the API server returns the object, now carrying a deletionTimestamp.
+            return V1Alpha1Status(
+                apiVersion=result.get("apiVersion", ""),
+                status="Pending",
+                details={"name": name, "kind": result["kind"]},
+            )
+
+        informer = get_informer(self.group, plural)
+        if informer:
+            informer.forget(namespace, name)
+
         return V1Alpha1Status.parse_obj(result)
 
-    def read_namespaced_model(self, name: str, namespace: str = "default") -> Optional[V1Alpha1Model]:
-        return self.read_namespaced(name, namespace, MODEL_PLURAL, V1Alpha1Model)
+    def read_namespaced_model(
+        self, name: str, namespace: str = "default", fresh: bool = False
+    ) -> Optional[V1Alpha1Model]:
+        return self.read_namespaced(name, namespace, MODEL_PLURAL, V1Alpha1Model, fresh=fresh)
+
+    def list_namespaced_models(
+        self, namespace: str = "default", field_selector: str = None, label_selector: str = None
+    ) -> List[V1Alpha1Model]:
+        return self.list_namespaced(
+            namespace=namespace,
+            plural=MODEL_PLURAL,
+            format=V1Alpha1Model,
+            field_selector=field_selector,
+            label_selector=label_selector,
+        )
+
+    def list_namespaced_models_by_label(
+        self, label: str, value: str, namespace: str = "default"
+    ) -> List[V1Alpha1Model]:
+        return self.list_namespaced_by_label(
+            label, value, namespace=namespace, plural=MODEL_PLURAL, format=V1Alpha1Model
+        )
+
+    def list_namespaced_models_by_owner(self, kind: str, name: str, namespace: str = "default") -> List[V1Alpha1Model]:
+        return self.list_namespaced_by_owner(kind, name, namespace=namespace, plural=MODEL_PLURAL, format=V1Alpha1Model)
+
+    def iter_namespaced_model_versions(
+        self, namespace: str = "default", label_selector: str = None, limit: int = None
+    ) -> Iterator[V1Alpha1ObjectVersion]:
+        return self.iter_namespaced(
+            namespace=namespace,
+            plural=MODEL_PLURAL,
+            label_selector=label_selector,
+            limit=limit,
+            versions_only=True,
+        )
 
     def create_namespaced_model(
         self, namespace: str = "default", body: Union[dict, V1Alpha1Model] = None
@@ -174,13 +407,18 @@ class V1Alpha1Api:
     ) -> V1Alpha1Model:
         return self.patch_namespaced(name, namespace, body, MODEL_PLURAL, V1Alpha1Model)
 
+    def patch_namespaced_model_status(
+        self, name: str, namespace: str = "default", body: Union[dict, list] = None
+    ) -> V1Alpha1Model:
+        return self.patch_namespaced_status(name, namespace, body, MODEL_PLURAL, V1Alpha1Model)
+
     def delete_namespaced_model(self, name: str, namespace: str = "default") -> Optional[V1Alpha1Status]:
         return self.delete_namespaced(name, namespace, MODEL_PLURAL)
 
     def read_namespaced_endpoint_config(
-        self, name: str, namespace: str = "default"
+        self, name: str, namespace: str = "default", fresh: bool = False
     ) -> Optional[V1Alpha1EndpointConfig]:
-        return self.read_namespaced(name, namespace, ENDPOINT_CONFIG_PLURAL, V1Alpha1EndpointConfig)
+        return self.read_namespaced(name, namespace, ENDPOINT_CONFIG_PLURAL, V1Alpha1EndpointConfig, fresh=fresh)
 
     def list_namespaced_endpoint_configs(
         self, namespace: str = "default", field_selector: str = None, label_selector: str = None
@@ -191,7 +429,7 @@ class V1Alpha1Api:
             format=V1Alpha1EndpointConfig,
             field_selector=field_selector,
             label_selector=label_selector,
-        )["items"]
+        )
 
     def create_namespaced_endpoint_config(
         self, namespace: str = "default", body: Union[dict, V1Alpha1EndpointConfig] = None
@@ -203,11 +441,18 @@ class V1Alpha1Api:
     ) -> V1Alpha1EndpointConfig:
         return self.patch_namespaced(name, namespace, body, ENDPOINT_CONFIG_PLURAL, V1Alpha1EndpointConfig)
 
+    def patch_namespaced_endpoint_config_status(
+        self, name: str, namespace: str = "default", body: Union[dict, list] = None
+    ) -> V1Alpha1EndpointConfig:
+        return self.patch_namespaced_status(name, namespace, body, ENDPOINT_CONFIG_PLURAL, V1Alpha1EndpointConfig)
+
     def delete_namespaced_endpoint_config(self, name: str, namespace: str = "default") -> Optional[V1Alpha1Status]:
         return self.delete_namespaced(name, namespace, ENDPOINT_CONFIG_PLURAL)
 
-    def read_namespaced_endpoint(self, name: str, namespace: str = "default") -> Optional[V1Alpha1Endpoint]:
-        return self.read_namespaced(name, namespace, ENDPOINT_PLURAL, V1Alpha1Endpoint)
+    def read_namespaced_endpoint(
+        self, name: str, namespace: str = "default", fresh: bool = False
+    ) -> Optional[V1Alpha1Endpoint]:
+        return self.read_namespaced(name, namespace, ENDPOINT_PLURAL, V1Alpha1Endpoint, fresh=fresh)
 
     def list_namespaced_endpoints(
         self, namespace: str = "default", field_selector: str = None, label_selector: str = None
@@ -218,7 +463,7 @@ class V1Alpha1Api:
             format=V1Alpha1Endpoint,
             field_selector=field_selector,
             label_selector=label_selector,
-        )["items"]
+        )
 
     def create_namespaced_endpoint(
         self, namespace: str = "default", body: Union[dict, V1Alpha1Endpoint] = None
@@ -230,5 +475,22 @@ class V1Alpha1Api:
     ) -> V1Alpha1Endpoint:
         return self.patch_namespaced(name, namespace, body, ENDPOINT_PLURAL, V1Alpha1Endpoint)
 
-    def delete_namespaced_endpoint(self, name: str, namespace: str = "default") -> Optional[V1Alpha1Status]:
-        return self.delete_namespaced(name, namespace, ENDPOINT_PLURAL)
+    def patch_namespaced_endpoint_status(
+        self, name: str, namespace: str = "default", body: Union[dict, list] = None
+    ) -> V1Alpha1Endpoint:
+        return self.patch_namespaced_status(name, namespace, body, ENDPOINT_PLURAL, V1Alpha1Endpoint)
+
+    def delete_namespaced_endpoint(
+        self, name: str, namespace: str = "default", propagation_policy: Optional[str] = None
+    ) -> Optional[V1Alpha1Status]:
+        return self.delete_namespaced(name, namespace, ENDPOINT_PLURAL, propagation_policy=propagation_policy)
+
+
+class AsyncV1Alpha1Api(AsyncApi):
+    """
+    Asyncio flavour of V1Alpha1Api. It exposes the same methods, each returning an awaitable, with the calls running
+    in worker threads and bounded by the operator wide concurrency limit (MLOPS_MAX_CONCURRENCY).
+    """
+
+    def __init__(self, api: K8SClient.CustomObjectsApi = None) -> None:
+        super().__init__(V1Alpha1Api(api))
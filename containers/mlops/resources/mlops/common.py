@@ -1,10 +1,20 @@
 from enum import Enum
-from typing import Dict, List
+from typing import Dict, List, NamedTuple, Optional
 
 from pydantic import BaseModel
 
 GROUP: str = "blue.intranet"
 VERSION: str = "v1alpha1"
+# Deletion propagation letting the garbage collector delete the dependents once their owner is gone.
+BACKGROUND_PROPAGATION: str = "Background"
+
+
+class V1Alpha1OwnerReference(BaseModel):
+    apiVersion: str
+    kind: str
+    name: str
+    uid: str
+    controller: Optional[bool] = None
 
 
 class V1Alpha1ObjectMeta(BaseModel):
@@ -12,6 +22,20 @@ class V1Alpha1ObjectMeta(BaseModel):
     namespace: str
     labels: Dict[str, str] = {}
     finalizers: List[str] = []
+    resourceVersion: Optional[str] = None
+    uid: Optional[str] = None
+    ownerReferences: List[V1Alpha1OwnerReference] = []
+    deletionTimestamp: Optional[str] = None
+
+
+class V1Alpha1ObjectVersion(NamedTuple):
+    """
+    Lightweight reference to an object, as returned by the versions only listings.
+    """
+
+    namespace: Optional[str]
+    name: str
+    resourceVersion: Optional[str]
 
 
 class V1Alpha1Status(BaseModel):
@@ -13,8 +13,8 @@ class V1Alpha1EndpointSpec(BaseModel):
 
 
 class V1Alpha1EndpointStatus(BaseModel):
-    endpoint_config_version: Optional[str]
-    state: Optional[V1Alpha1State]
+    endpoint_config_version: Optional[str] = None
+    state: Optional[V1Alpha1State] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -25,7 +25,7 @@ class V1Alpha1Endpoint(BaseModel):
     kind: str = ENDPOINT_KIND
     metadata: V1Alpha1ObjectMeta
     spec: V1Alpha1EndpointSpec
-    status: Optional[V1Alpha1EndpointStatus]
+    status: Optional[V1Alpha1EndpointStatus] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -18,18 +18,18 @@ class V1Alpha1EndpointConfigModel(BaseModel):
 
 
 class V1Alpha1EndpointConfigSpec(BaseModel):
-    models: Optional[List[V1Alpha1EndpointConfigModel]]
+    models: Optional[List[V1Alpha1EndpointConfigModel]] = None
 
     class Config:
         arbitrary_types_allowed = True
 
 
 class V1Alpha1EndpointConfigStatus(BaseModel):
-    endpoint: Optional[str]
-    endpoint_config: Optional[str]
-    version: Optional[str]
-    model_versions: Optional[List[str]]
-    state: Optional[V1Alpha1State]
+    endpoint: Optional[str] = None
+    endpoint_config: Optional[str] = None
+    version: Optional[str] = None
+    model_versions: Optional[List[str]] = None
+    state: Optional[V1Alpha1State] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -40,7 +40,7 @@ class V1Alpha1EndpointConfig(BaseModel):
     kind: str = ENDPOINT_CONFIG_KIND
     metadata: V1Alpha1ObjectMeta
     spec: V1Alpha1EndpointConfigSpec
-    status: Optional[V1Alpha1EndpointConfigStatus]
+    status: Optional[V1Alpha1EndpointConfigStatus] = None
 
     class Config:
         arbitrary_types_allowed = True
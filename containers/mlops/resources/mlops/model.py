@@ -1,26 +1,30 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from pydantic import BaseModel
 from resources.mlops.common import GROUP, VERSION, V1Alpha1ObjectMeta, V1Alpha1State
 
 MODEL_PLURAL: str = "machinelearningmodels"
 MODEL_KIND: str = "MachineLearningModel"
+# Labels stamped on model versions (and their deployments, services and volumes) by the endpoint config owning them.
+MODEL_OWNER_LABELS: Tuple[str, ...] = ("endpoint", "endpoint_config", "endpoint_config_version")
+# Label of the model versions scaled in place, with their number of instances (see Model.scale).
+MODEL_INSTANCES_LABEL: str = "instances"
 
 
 class V1Alpha1ModelSpec(BaseModel):
     image: str
-    artifact: Optional[str]
-    command: Optional[List[str]]
-    args: Optional[List[str]]
+    artifact: Optional[str] = None
+    command: Optional[List[str]] = None
+    args: Optional[List[str]] = None
 
 
 class V1Alpha1ModelStatus(BaseModel):
-    endpoint: Optional[str]
-    endpoint_config: Optional[str]
-    endpoint_config_version: Optional[str]
-    model: Optional[str]
-    version: Optional[str]
-    state: Optional[V1Alpha1State]
+    endpoint: Optional[str] = None
+    endpoint_config: Optional[str] = None
+    endpoint_config_version: Optional[str] = None
+    model: Optional[str] = None
+    version: Optional[str] = None
+    state: Optional[V1Alpha1State] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -31,7 +35,7 @@ class V1Alpha1Model(BaseModel):
     kind: str = MODEL_KIND
     metadata: V1Alpha1ObjectMeta
     spec: V1Alpha1ModelSpec
-    status: Optional[V1Alpha1ModelStatus]
+    status: Optional[V1Alpha1ModelStatus] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -1,14 +1,33 @@
-from typing import List, Optional, Tuple
+from functools import cached_property, partial
+from typing import Any, Dict, List, Optional, Tuple
 
 from resources.mlops import client as MLOpsClient
 from resources.model_deployment import ModelDeployment
 from resources.model_service import ModelService
 from resources.model_storage import ModelStorage
-from utils import DiffLine, DiffLineType, get_version
+from utils import DiffLine, DiffLineType
+from utils.concurrency import gather_bounded, run_bounded
+from utils.conflicts import retry_on_conflict
+from utils.owners import (
+    add_owner_reference,
+    controller_reference,
+    is_owned,
+    owner_reference,
+    owner_references,
+    remove_owner_reference,
+)
+from utils.patch import DELTA_FIELDS, finalizers_patch, merge_patch, split_status, with_resource_version
+from utils.tracing import traced
 
 
 class Model:
-    def __init__(self, name: str, namespace: str = "default", version: str = ""):
+    def __init__(
+        self,
+        name: str,
+        namespace: str = "default",
+        version: str = "",
+        body: Optional[MLOpsClient.V1Alpha1Model] = None,
+    ):
         """
         How it works:
         * If the model exists, then we get the model body from the API
@@ -16,17 +35,19 @@ class Model:
           and version from the status field
         * If the name and the versions are passed, then we use them to search and intialize the model with the name
           {name}-{version}
+        * If the body is passed (e.g. from a bulk list), it is used as is and the API is not called
         """
         self.name: str = name
         self.namespace: str = namespace
         self.version: str = version
         self.named_version: str = f"{self.name}-{self.version}" if self.version else self.name
 
-        self.body = MLOpsClient.V1Alpha1Api().read_namespaced_model(
+        self.body = body or MLOpsClient.V1Alpha1Api().read_namespaced_model(
             name=self.named_version,
             namespace=namespace,
         )
-        if self.body and self.body.status:
+        # The models applied by a user have no status but the generation the operator observed.
+        if self.body and self.body.status and self.body.status.model:
             self.name = self.body.status.model
             self.version = self.body.status.version
 
@@ -34,9 +55,40 @@ class Model:
         self.service_name: str = self.named_version
         self.storage_name: str = self.named_version
 
-        self.storage = ModelStorage(name=self.storage_name, namespace=self.namespace)
-        self.deployment = ModelDeployment(name=self.deployment_name, namespace=self.namespace)
-        self.service = ModelService(name=self.service_name, namespace=self.namespace)
+    @property
+    def owner_labels(self) -> Dict[str, str]:
+        """
+        The endpoint, endpoint config and endpoint config version labels of the model, propagated to its deployment,
+        service and persistent volume.
+        """
+        if not self.body:
+            return {}
+        labels = self.body.metadata.labels or {}
+        return {label: labels[label] for label in MLOpsClient.MODEL_OWNER_LABELS if labels.get(label)}
+
+    @property
+    def owner_references(self) -> List[Dict[str, Any]]:
+        """
+        The owner reference to the model, set on its deployment, service and persistent volume claim so they are
+        deleted along with it.
+        """
+        return owner_references(self.body)
+
+    @cached_property
+    def storage(self) -> ModelStorage:
+        """
+        The child resources are only read from the API on first access and then memoized for the lifetime of this
+        object (a single reconcile), so callers interested only in the model body don't pay for them.
+        """
+        return ModelStorage(name=self.storage_name, namespace=self.namespace)
+
+    @cached_property
+    def deployment(self) -> ModelDeployment:
+        return ModelDeployment(name=self.deployment_name, namespace=self.namespace)
+
+    @cached_property
+    def service(self) -> ModelService:
+        return ModelService(name=self.service_name, namespace=self.namespace)
 
     def get_body(
         self,
@@ -48,14 +100,23 @@ class Model:
         endpoint_config: str = None,
         endpoint_config_version: str = None,
         state: str = None,
+        owner_references: List[Dict[str, Any]] = None,
     ) -> MLOpsClient.V1Alpha1Model:
         return MLOpsClient.V1Alpha1Model(
             metadata=MLOpsClient.V1Alpha1ObjectMeta(
                 name=self.named_version,
                 namespace=self.namespace,
+                ownerReferences=owner_references or [],
                 labels={
                     "model": self.name,
                     "version": self.version,
+                    **{
+                        label: value
+                        for label, value in zip(
+                            MLOpsClient.MODEL_OWNER_LABELS, (endpoint, endpoint_config, endpoint_config_version)
+                        )
+                        if value
+                    },
                 },
             ),
             spec=MLOpsClient.V1Alpha1ModelSpec(
@@ -75,7 +136,7 @@ class Model:
         )
 
     def get_endpoint_config(self) -> MLOpsClient.V1Alpha1EndpointConfig:
-        if not any([self.body, self.deployment, self.service, self.storage.pv, self.storage.pvc]):
+        if not self.body:
             return None
 
         api = MLOpsClient.V1Alpha1Api()
@@ -96,7 +157,12 @@ class Model:
         endpoint_config: str = None,
         endpoint_config_version: str = None,
         state: str = None,
+        owner_references: List[Dict[str, Any]] = None,
     ) -> "Model":
+        """
+        @param owner_references: The owner references of the model version, to the endpoint config version it belongs
+        to (see utils/owners.py).
+        """
         if self.body:
             return self
 
@@ -110,6 +176,7 @@ class Model:
             endpoint_config=endpoint_config,
             endpoint_config_version=endpoint_config_version,
             state=state,
+            owner_references=owner_references,
         )
         self.body = api.create_namespaced_model(body=body, namespace=self.namespace)
         return self
@@ -129,19 +196,167 @@ class Model:
             return self
 
         api = MLOpsClient.V1Alpha1Api()
-        body = self.get_body(
-            image=image or self.body.spec.image,
-            artifact=artifact or self.body.spec.artifact,
-            command=command or self.body.spec.command,
-            args=args or self.body.spec.args,
-            endpoint=endpoint or self.body.status.endpoint,
-            endpoint_config=endpoint_config or self.body.status.endpoint_config,
-            endpoint_config_version=endpoint_config_version or self.body.status.endpoint_config_version,
-            state=state or self.body.status.state,
+
+        def write() -> None:
+            if not self.body:
+                return
+            body = self.get_body(
+                image=image or self.body.spec.image,
+                artifact=artifact or self.body.spec.artifact,
+                command=command or self.body.spec.command,
+                args=args or self.body.spec.args,
+                endpoint=endpoint or self.body.status.endpoint,
+                endpoint_config=endpoint_config or self.body.status.endpoint_config,
+                endpoint_config_version=endpoint_config_version or self.body.status.endpoint_config_version,
+                state=state or self.body.status.state,
+            )
+            patch, status = split_status(merge_patch(self.body.dict(), body.dict(include=DELTA_FIELDS)))
+            if patch:
+                self.body = api.patch_namespaced_model(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+            if status:
+                self.body = api.patch_namespaced_model_status(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(status, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.MODEL_PLURAL)
+        return self
+
+    def refresh(self) -> "Model":
+        """
+        Read the model again from the API server, bypassing the informer cache, e.g. to retry a conflicting write.
+        """
+        self.body = MLOpsClient.V1Alpha1Api().read_namespaced_model(
+            name=self.named_version, namespace=self.namespace, fresh=True
         )
-        self.body = api.patch_namespaced_model(
-            name=self.body.metadata.name, namespace=self.body.metadata.namespace, body=body
+        return self
+
+    def set_state(self, state: MLOpsClient.V1Alpha1State) -> "Model":
+        """
+        Write the state of the model through the status subresource, only if it changed.
+        """
+        api = MLOpsClient.V1Alpha1Api()
+
+        def write() -> None:
+            if not self.body or (self.body.status and self.body.status.state == state):
+                return
+            self.body = api.patch_namespaced_model_status(
+                name=self.body.metadata.name,
+                namespace=self.body.metadata.namespace,
+                body=with_resource_version({"status": {"state": state}}, self.body.metadata.resourceVersion),
+            )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.MODEL_PLURAL)
+        return self
+
+    def add_owner(self, owner: Any) -> "Model":
+        """
+        Share this model version with one more endpoint config version: it is then deleted along with the last of its
+        owners (see utils/owners.py).
+        @param owner: The endpoint config version using the model version.
+        """
+        api = MLOpsClient.V1Alpha1Api()
+
+        def write() -> None:
+            if not self.body:
+                return
+            references = [reference.dict() for reference in self.body.metadata.ownerReferences]
+            shared = add_owner_reference(references, owner_reference(owner))
+            if shared != references:
+                self.body = api.patch_namespaced_model(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(
+                        {"metadata": {"ownerReferences": shared}}, self.body.metadata.resourceVersion
+                    ),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.MODEL_PLURAL)
+        return self
+
+    def is_exclusive(self, owner: Any) -> bool:
+        """
+        Check if this model version is used by a single endpoint config version, so it can be changed in place.
+        @param owner: The endpoint config version using the model version.
+        """
+        reference = owner_reference(owner)
+        return bool(self.body and reference) and all(
+            other.uid == reference["uid"] for other in self.body.metadata.ownerReferences
         )
+
+    @traced
+    def scale(self, instances: int) -> "Model":
+        """
+        Change the number of replicas of the deployment of this model version in place. The model version is labelled
+        with the new number of instances, as its content version was computed with the old one: identical variants of
+        other endpoint configs are then no longer given it (see EndpointConfig.create_model_version).
+        @param instances: The new number of replicas.
+        """
+        self.deployment.scale(instances)
+        api = MLOpsClient.V1Alpha1Api()
+
+        def write() -> None:
+            if not self.body or (self.body.metadata.labels or {}).get(MLOpsClient.MODEL_INSTANCES_LABEL) == str(
+                instances
+            ):
+                return
+            self.body = api.patch_namespaced_model(
+                name=self.body.metadata.name,
+                namespace=self.body.metadata.namespace,
+                body=with_resource_version(
+                    {"metadata": {"labels": {MLOpsClient.MODEL_INSTANCES_LABEL: str(instances)}}},
+                    self.body.metadata.resourceVersion,
+                ),
+            )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.MODEL_PLURAL)
+        return self
+
+    def release(self, *owners: Any) -> "Model":
+        """
+        Stop using this model version from endpoint config versions. A model version still used by other endpoint
+        config versions only loses their owner references, the last user deletes it (as well as the model versions
+        created before the owner references). When the controller changes, the labels and the status of the model
+        version are moved to the new one, so the endpoint config versions it was released from no longer find it.
+        @param owners: The endpoint config versions which stopped using the model version, released in a single write.
+        """
+        api = MLOpsClient.V1Alpha1Api()
+        references = [owner_reference(owner) for owner in owners]
+
+        def write() -> None:
+            if not self.body:
+                return
+            current = [reference.dict() for reference in self.body.metadata.ownerReferences]
+            remaining = current
+            for reference in references:
+                remaining = remove_owner_reference(remaining, reference["uid"] if reference else None)
+            if not remaining:
+                self.delete()
+            elif remaining != current:
+                self.body = api.patch_namespaced_model(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(
+                        {"metadata": {"ownerReferences": remaining}}, self.body.metadata.resourceVersion
+                    ),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.MODEL_PLURAL)
+
+        controller = controller_reference(self.body)
+        if controller and self.body.status and controller["name"] != self.body.status.endpoint_config_version:
+            endpoint_config = api.read_namespaced_endpoint_config(name=controller["name"], namespace=self.namespace)
+            if endpoint_config and endpoint_config.status:
+                self.update(
+                    endpoint=endpoint_config.status.endpoint,
+                    endpoint_config=endpoint_config.status.endpoint_config,
+                    endpoint_config_version=endpoint_config.metadata.name,
+                )
         return self
 
     def delete(self) -> "Model":
@@ -153,23 +368,27 @@ class Model:
         self.body = None
         return self
 
-    def create_handler(self) -> "Model":
+    def get_model_data(self) -> Optional[MLOpsClient.V1Alpha1EndpointConfigModel]:
         endpoint_config = self.get_endpoint_config()
         if not endpoint_config:
-            return self
+            return None
 
-        model_data = None
         for model in endpoint_config.spec.models:
             if model.model == self.body.status.model:
-                model_data = model
-                break
+                return model
+        return None
 
+    @traced
+    def create_handler(self) -> "Model":
+        model_data = self.get_model_data()
         if not model_data:
             return self
 
         self.storage.create(
             size=model_data.size,
             path=model_data.path,
+            labels=self.owner_labels,
+            owner_references=self.owner_references,
         )
         self.deployment.create(
             image=self.body.spec.image,
@@ -179,28 +398,63 @@ class Model:
             instances=model_data.instances,
             cpus=model_data.cpus,
             memory=model_data.memory,
+            labels=self.owner_labels,
+            owner_references=self.owner_references,
+        )
+        self.service.create(labels=self.owner_labels, owner_references=self.owner_references)
+        return self
+
+    @traced
+    async def create_handler_async(self) -> "Model":
+        """
+        Same as create_handler, but the storage, the deployment and the service are created concurrently.
+        """
+        model_data = await run_bounded(self.get_model_data)
+        if not model_data:
+            return self
+
+        await gather_bounded(
+            [
+                lambda: self.storage.create(
+                    size=model_data.size,
+                    path=model_data.path,
+                    labels=self.owner_labels,
+                    owner_references=self.owner_references,
+                ),
+                lambda: self.deployment.create(
+                    image=self.body.spec.image,
+                    artifact=self.body.spec.artifact,
+                    command=self.body.spec.command,
+                    args=self.body.spec.args,
+                    instances=model_data.instances,
+                    cpus=model_data.cpus,
+                    memory=model_data.memory,
+                    labels=self.owner_labels,
+                    owner_references=self.owner_references,
+                ),
+                lambda: self.service.create(labels=self.owner_labels, owner_references=self.owner_references),
+            ]
         )
-        self.service.create()
         return self
 
+    @traced
     def update_handler(self, diff: Optional[Tuple[DiffLineType, ...]] = None) -> "Model":
         """
         Some changes should trigger a redeployment (version change)
-        - create a copy of the main object with a different version (in k8s, that's why kopf doesn't handle create for this objects)
-        - deploy the new object (create attached resources)
-        - add finalizers to the main object
-        - delete the main object
-        - check if the new object is ready, and if so, remove the finalizers on the main object
-        - the method should return a reference to the new object
+        - every endpoint config version using this model version creates (or shares) the model version of the new
+          content, the same way as its variants (see EndpointConfig.create_model_version)
+        - deploy the new object (create attached resources) and route the traffic to it
+        - release the main object, deleted along with its last user (see Model.release)
         Changes that might trigger a redeployment:
         - image
         - artifact
         - command
         - args
         - path
-        Also, this handler should receive diff objects
+        Also, this handler should receive diff objects. The diff is classified first: the children of the model version
+        are only read on the branches redeploying it.
         """
-        if not self.body or not self.storage or not self.deployment:
+        if not self.body:
             return self
 
         image = DiffLine.from_iter(diff, "change", ("spec", "image"))
@@ -209,72 +463,136 @@ class Model:
         args = DiffLine.from_iter(diff, ["add", "change"], ("spec", "args"))
 
         if artifact:
-            new_model = (
-                Model(name=self.body.metadata.labels["model"], namespace=self.namespace, version=get_version())
-                .create(
-                    image=self.body.spec.image,
-                    artifact=self.body.spec.artifact,
-                    command=self.body.spec.command,
-                    args=self.body.spec.args,
-                    endpoint=self.body.status.endpoint,
-                    endpoint_config=self.body.status.endpoint_config,
-                    endpoint_config_version=self.body.status.endpoint_config_version,
-                )
-                .create_handler(
-                    instances=self.deployment.body.spec.replicas,
-                    cpus=self.deployment.body.spec.template.spec.containers[0].resources.limits["cpu"],
-                    memory=self.deployment.body.spec.template.spec.containers[0].resources.limits["memory"],
-                    size=self.storage.pv.body.spec.capacity["storage"],
-                    path=self.storage.pv.body.spec.host_path.path,
-                )
+            # Every endpoint config version using this model version rolls out the model version of the new content,
+            # then releases this one. The endpoint config imports this module, hence the local import.
+            from resources.endpoint_config import EndpointConfig
+
+            for name in self.get_endpoint_config_versions():
+                EndpointConfig(name=name, namespace=self.namespace).replace_model_version(self)
+            return self
+
+        if not any([image, command, args]):
+            return self
+
+        # The image, command or args changed: converge the deployment of this model version in place. The planner
+        # imports this module, hence the local import.
+        from resources.planner import plan_model
+
+        plan_model(self).apply()
+        return self
+
+    @traced
+    async def update_handler_async(self, diff: Optional[Tuple[DiffLineType, ...]] = None) -> "Model":
+        """
+        Same as update_handler, but the endpoint config versions using this model version roll out its new content
+        concurrently.
+        """
+        if not self.body:
+            return self
+
+        image = DiffLine.from_iter(diff, "change", ("spec", "image"))
+        artifact = DiffLine.from_iter(diff, "change", ("spec", "artifact"))
+        command = DiffLine.from_iter(diff, ["add", "change"], ("spec", "command"))
+        args = DiffLine.from_iter(diff, ["add", "change"], ("spec", "args"))
+
+        if artifact:
+            from resources.endpoint_config import EndpointConfig
+
+            def replace(name: str) -> EndpointConfig:
+                return EndpointConfig(name=name, namespace=self.namespace).replace_model_version(self, release=False)
+
+            endpoint_configs = await gather_bounded(
+                [partial(replace, name) for name in self.get_endpoint_config_versions()]
             )
-            self.add_finalizers([new_model.body.metadata.name])
-            self.delete()
-            return new_model
+            # Released once by all of them, rather than by racing writes of the owner references.
+            await run_bounded(
+                self.release,
+                *[
+                    endpoint_config.body
+                    for endpoint_config in endpoint_configs
+                    if endpoint_config.body
+                    and endpoint_config.body.status
+                    and self.body.metadata.name not in (endpoint_config.body.status.model_versions or [])
+                ],
+            )
+            return self
 
         if not any([image, command, args]):
             return self
 
-        self.deployment.update(
-            image=self.body.spec.image,
-            artifact=self.body.spec.artifact,
-            command=self.body.spec.command,
-            args=self.body.spec.args,
-        )
+        from resources.planner import plan_model
 
-        self.storage.update(
-            size=self.storage.pv.body.spec.capacity["storage"],
-            path=self.storage.pv.body.spec.host_path.path,
-        )
-        self.deployment.update(
-            image=self.body.spec.image,
-            artifact=self.body.spec.artifact,
-            command=self.body.spec.command,
-            args=self.body.spec.args,
-            instances=self.deployment.spec.replicas,
-            cpus=self.deployment.spec.template.spec.containers[0].resources.limits["cpu"],
-            memory=self.deployment.spec.template.spec.containers[0].resources.limits["memory"],
-        )
+        await run_bounded(lambda: plan_model(self).apply())
         return self
 
+    def get_endpoint_config_versions(self) -> List[str]:
+        """
+        The names of the endpoint config versions using this model version.
+        @return: The names of the owner endpoint config versions.
+        """
+        if not self.body:
+            return []
+        names = [
+            reference.name
+            for reference in self.body.metadata.ownerReferences
+            if reference.kind == MLOpsClient.ENDPOINT_CONFIG_KIND
+        ]
+        # The model versions created before the owner references only know their endpoint config version.
+        names = names or ([self.body.status.endpoint_config_version] if self.body.status else [])
+        return [name for name in names if name]
+
+    @traced
     def delete_handler(self):
+        """
+        A model version with an owner was created with owned children, which the garbage collector deletes along with
+        it (the persistent volume is left to the orphan sweeper). Only the children of the model versions created before
+        the owner references are deleted here.
+        """
+        if is_owned(self.body):
+            return self
         self.service.delete()
         self.deployment.delete()
         self.storage.delete()
         return self
 
+    @traced
+    async def delete_handler_async(self) -> "Model":
+        """
+        Same as delete_handler, but the service, the deployment and the storage are deleted concurrently.
+        """
+        if is_owned(self.body):
+            return self
+        await gather_bounded(
+            [lambda: self.service.delete(), lambda: self.deployment.delete(), lambda: self.storage.delete()]
+        )
+        return self
+
     def add_finalizers(self, finalizers: List[str]) -> "Model":
         api = MLOpsClient.V1Alpha1Api()
-        for finalizer in finalizers:
-            if finalizer not in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.append(finalizer)
-        self.body = api.update_namespaced_model(name=self.name, namespace=self.namespace, body=self.body)
+
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, add=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_model(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.MODEL_PLURAL)
         return self
 
     def remove_finalizers(self, finalizers: List[str]) -> "Model":
         api = MLOpsClient.V1Alpha1Api()
-        for finalizer in finalizers:
-            if finalizer in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.remove(finalizer)
-        self.body = api.update_namespaced_model(name=self.name, namespace=self.namespace, body=self.body)
+
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, remove=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_model(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resourceVersion),
+                )
+
+        retry_on_conflict(write, self.refresh, resource=MLOpsClient.MODEL_PLURAL)
         return self
@@ -1,6 +1,13 @@
-from typing import Any, List, Optional
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
 
 from kubernetes import client as K8SClient
+from utils.api_client import get_api_client
+from utils.conflicts import is_already_exists, retry_on_conflict
+from utils.owners import k8s_owner_references
+from utils.patch import JSON_PATCH, MERGE_PATCH, finalizers_patch, with_resource_version
+from utils.tracing import traced
 
 
 class ModelDeployment:
@@ -10,8 +17,10 @@ class ModelDeployment:
 
         self.pvc_name = f"{self.name}-pvc"
         self.body: Optional[K8SClient.V1Deployment] = None
+        self.refresh()
 
-        api = K8SClient.AppsV1Api()
+    def refresh(self) -> "ModelDeployment":
+        api = K8SClient.AppsV1Api(get_api_client())
         try:
             self.body = api.read_namespaced_deployment(name=self.name, namespace=self.namespace)
         except K8SClient.ApiException as err:
@@ -19,6 +28,7 @@ class ModelDeployment:
                 self.body = None
             else:
                 raise
+        return self
 
     def get_deployment_body(
         self,
@@ -31,12 +41,19 @@ class ModelDeployment:
         args: List[str] = None,
         init_image: str = "quay.io/bdobrica/ml-operator-tools:model-init-latest",
         finalizers: List[str] = None,
+        labels: Dict[str, str] = None,
+        owner_references: List[Dict[str, Any]] = None,
     ) -> K8SClient.V1Deployment:
         deployment_body = K8SClient.V1Deployment(
             metadata=K8SClient.V1ObjectMeta(
                 name=self.name,
                 namespace=self.namespace,
+                labels={
+                    **(labels or {}),
+                    "model": self.name,
+                },
                 finalizers=finalizers,
+                owner_references=k8s_owner_references(owner_references),
             ),
             spec=K8SClient.V1DeploymentSpec(
                 replicas=instances,
@@ -174,6 +191,7 @@ class ModelDeployment:
         )
         return deployment_body
 
+    @traced
     def create(
         self,
         instances: int,
@@ -184,11 +202,14 @@ class ModelDeployment:
         command: List[str] = None,
         args: List[str] = None,
         init_image: str = "quay.io/bdobrica/ml-operator-tools:model-init-latest",
+        labels: Dict[str, str] = None,
+        owner_references: List[Dict[str, Any]] = None,
     ) -> "ModelDeployment":
         if self.body is not None:
-            return self.update()
+            # Already deployed, e.g. for a model version shared by several endpoint config versions.
+            return self
 
-        api = K8SClient.AppsV1Api()
+        api = K8SClient.AppsV1Api(get_api_client())
         deployment_body = self.get_deployment_body(
             instances=instances,
             artifact=artifact,
@@ -198,13 +219,22 @@ class ModelDeployment:
             command=command,
             args=args,
             init_image=init_image,
+            labels=labels,
+            owner_references=owner_references,
         )
-        self.body = api.create_namespaced_deployment(
-            namespace=self.namespace,
-            body=deployment_body,
-        )
+        try:
+            self.body = api.create_namespaced_deployment(
+                namespace=self.namespace,
+                body=deployment_body,
+            )
+        except K8SClient.ApiException as err:
+            # Created concurrently, e.g. for a model version shared by several endpoint config versions.
+            if not is_already_exists(err):
+                raise
+            self.refresh()
         return self
 
+    @traced
     def update(
         self,
         instances: int,
@@ -216,11 +246,12 @@ class ModelDeployment:
         args: List[str] = None,
         init_image: str = "quay.io/bdobrica/ml-operator-tools:model-init-latest",
         finalizers: List[str] = None,
+        labels: Dict[str, str] = None,
     ) -> "ModelDeployment":
         if self.body is None:
             return self.create()
 
-        api = K8SClient.AppsV1Api()
+        api = K8SClient.AppsV1Api(get_api_client())
         deployment_body = self.get_deployment_body(
             instances=instances,
             artifact=artifact,
@@ -231,19 +262,49 @@ class ModelDeployment:
             args=args,
             init_image=init_image,
             finalizers=finalizers,
+            labels=labels,
         )
-        self.body = api.patch_namespaced_deployment(
-            name=self.name,
-            namespace=self.namespace,
-            body=deployment_body,
-        )
+
+        def write() -> None:
+            if self.body is None:
+                return
+            deployment_body.metadata.resource_version = self.body.metadata.resource_version
+            self.body = api.patch_namespaced_deployment(
+                name=self.name,
+                namespace=self.namespace,
+                body=deployment_body,
+            )
+
+        retry_on_conflict(write, self.refresh, resource="deployments")
         return self
 
+    @traced
+    def scale(self, instances: int) -> "ModelDeployment":
+        """
+        Change the number of replicas only, leaving the pods running untouched.
+        @param instances: The new number of replicas.
+        """
+        api = K8SClient.AppsV1Api(get_api_client())
+
+        def write() -> None:
+            if self.body is None or self.body.spec.replicas == instances:
+                return
+            self.body = api.patch_namespaced_deployment(
+                name=self.name,
+                namespace=self.namespace,
+                body=with_resource_version({"spec": {"replicas": instances}}, self.body.metadata.resource_version),
+                _content_type=MERGE_PATCH,
+            )
+
+        retry_on_conflict(write, self.refresh, resource="deployments")
+        return self
+
+    @traced
     def delete(self) -> "ModelDeployment":
         if self.body is None or self.body.metadata is None:
             return self
 
-        api = K8SClient.AppsV1Api()
+        api = K8SClient.AppsV1Api(get_api_client())
         api.delete_namespaced_deployment(
             name=self.body.metadata.name,
             namespace=self.body.metadata.namespace,
@@ -256,34 +317,36 @@ class ModelDeployment:
         if self.body is None or not self.body.metadata:
             return self
 
-        api = K8SClient.AppsV1Api()
-        if not self.body.metadata.finalizers:
-            self.body.metadata.finalizers = []
+        api = K8SClient.AppsV1Api(get_api_client())
 
-        for finalizer in finalizers:
-            if finalizer not in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.append(finalizer)
-        self.body = api.patch_namespaced_deployment(
-            name=self.body.metadata.name,
-            namespace=self.body.metadata.namespace,
-            body=self.body,
-        )
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, add=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_deployment(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resource_version),
+                    _content_type=JSON_PATCH,
+                )
 
+        retry_on_conflict(write, self.refresh, resource="deployments")
         return self
 
     def remove_finalizers(self, finalizers: List[str]) -> "ModelDeployment":
         if self.body is None or not self.body.metadata or not self.body.metadata.finalizers:
             return self
 
-        api = K8SClient.AppsV1Api()
+        api = K8SClient.AppsV1Api(get_api_client())
 
-        for finalizer in finalizers:
-            if finalizer in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.remove(finalizer)
-        self.body = api.patch_namespaced_deployment(
-            name=self.body.metadata.name,
-            namespace=self.body.metadata.namespace,
-            body=self.body,
-        )
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, remove=finalizers) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_deployment(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resource_version),
+                    _content_type=JSON_PATCH,
+                )
 
+        retry_on_conflict(write, self.refresh, resource="deployments")
         return self
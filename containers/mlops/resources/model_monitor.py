@@ -0,0 +1,102 @@
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from resources.mlops import client as MLOpsClient
+from resources.model import Model
+from utils.metrics import observe_model_ready
+
+
+class ModelMonitor:
+    """
+    Follows the readiness of the model deployments from a single Deployment watch (see monitor_deployment_fn in
+    mlops.py) and reports the transitions to the owning Model custom resources. A model deployment is named after the
+    versioned model it serves, so the owning Model is found by name.
+
+    Only transitions are dispatched: the many intermediate events a rollout produces (pods scheduled, images pulled,
+    replicas becoming available one by one) don't cause any API call.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.readiness: Dict[Tuple[str, str], bool] = {}
+
+    @staticmethod
+    def is_ready(body: dict) -> bool:
+        """
+        A deployment is ready when the controller observed its latest generation and all the desired replicas are
+        updated and available.
+        @param body: The raw deployment, as received from the watch.
+        """
+        metadata = body.get("metadata") or {}
+        spec = body.get("spec") or {}
+        status = body.get("status") or {}
+        if status.get("observedGeneration", 0) < metadata.get("generation", 0):
+            return False
+
+        replicas = spec.get("replicas", 1)
+        return status.get("updatedReplicas", 0) == replicas and status.get("availableReplicas", 0) == replicas
+
+    def transition(self, event_type: str, body: dict) -> Optional[MLOpsClient.V1Alpha1State]:
+        """
+        Record a deployment event and return the state the owning model should move to, or None if the readiness of
+        the deployment didn't change.
+        @param event_type: The watch event type (ADDED, MODIFIED, DELETED or None for the initial listing).
+        @param body: The raw deployment.
+        """
+        key = (body["metadata"]["namespace"], body["metadata"]["name"])
+        with self._lock:
+            if event_type == "DELETED":
+                self.readiness.pop(key, None)
+                return None
+
+            ready = self.is_ready(body)
+            previous = self.readiness.get(key)
+            self.readiness[key] = ready
+
+        if previous == ready:
+            return None
+        if ready:
+            return MLOpsClient.V1Alpha1State.AVAILABLE
+        if previous is not None:
+            return MLOpsClient.V1Alpha1State.UPDATING
+        return None
+
+    @staticmethod
+    def age(obj: dict, now: Optional[datetime] = None) -> Optional[float]:
+        """
+        Seconds since the creation of an object, None if it has no creation timestamp.
+        @param obj: The raw object.
+        """
+        created = (obj.get("metadata") or {}).get("creationTimestamp")
+        if not created:
+            return None
+        created = datetime.strptime(created, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+        return ((now or datetime.now(timezone.utc)) - created).total_seconds()
+
+    def observe(self, event_type: str, body: dict) -> Optional[Model]:
+        """
+        Record a deployment event and, on a readiness transition, write the new state of the owning model. The first
+        time a model version becomes available, the time since its creation is recorded in the metrics.
+        @return: The owning model if its state was written, None otherwise.
+        """
+        state = self.transition(event_type, body)
+        if state is None:
+            return None
+
+        api = MLOpsClient.V1Alpha1Api()
+        raw = api.read_namespaced(body["metadata"]["name"], body["metadata"]["namespace"], MLOpsClient.MODEL_PLURAL)
+        if raw is None:
+            return None
+
+        model = Model(
+            name=body["metadata"]["name"],
+            namespace=body["metadata"]["namespace"],
+            body=api.parse(raw, MLOpsClient.V1Alpha1Model),
+        )
+        previous = model.body.status.state if model.body.status else None
+        if state == MLOpsClient.V1Alpha1State.AVAILABLE and previous in (None, MLOpsClient.V1Alpha1State.CREATING):
+            seconds = self.age(raw)
+            if seconds is not None:
+                observe_model_ready(seconds)
+        return model.set_state(state)
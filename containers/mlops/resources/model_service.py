@@ -1,7 +1,14 @@
-from typing import List, Optional
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
 
 from kubernetes import client as K8SClient
 from pydantic import BaseModel
+from utils.api_client import get_api_client
+from utils.conflicts import is_already_exists, retry_on_conflict
+from utils.owners import k8s_owner_references
+from utils.patch import JSON_PATCH, finalizers_patch, with_resource_version
+from utils.tracing import traced
 
 
 class ModelService:
@@ -10,8 +17,10 @@ class ModelService:
         self.namespace = namespace
 
         self.body: Optional[K8SClient.V1Service] = None
+        self.refresh()
 
-        api = K8SClient.CoreV1Api()
+    def refresh(self) -> "ModelService":
+        api = K8SClient.CoreV1Api(get_api_client())
         try:
             self.body = api.read_namespaced_service(name=self.name, namespace=self.namespace)
         except K8SClient.ApiException as err:
@@ -19,13 +28,24 @@ class ModelService:
                 self.body = None
             else:
                 raise
+        return self
 
-    def get_service_body(self, finalizers: List[str] = None) -> K8SClient.V1Service:
+    def get_service_body(
+        self,
+        finalizers: List[str] = None,
+        labels: Dict[str, str] = None,
+        owner_references: List[Dict[str, Any]] = None,
+    ) -> K8SClient.V1Service:
         service = K8SClient.V1Service(
             metadata=K8SClient.V1ObjectMeta(
                 name=self.name,
                 namespace=self.namespace,
+                labels={
+                    **(labels or {}),
+                    "model": self.name,
+                },
                 finalizers=finalizers,
+                owner_references=k8s_owner_references(owner_references),
             ),
             spec=K8SClient.V1ServiceSpec(
                 type="ClusterIP",
@@ -43,23 +63,30 @@ class ModelService:
         )
         return service
 
-    def create(self) -> "ModelService":
+    @traced
+    def create(self, labels: Dict[str, str] = None, owner_references: List[Dict[str, Any]] = None) -> "ModelService":
         if self.body:
             return self
 
-        api = K8SClient.CoreV1Api()
-        service_body = self.get_service_body()
-        self.body = api.create_namespaced_service(
-            namespace=self.namespace,
-            body=service_body,
-        )
+        api = K8SClient.CoreV1Api(get_api_client())
+        service_body = self.get_service_body(labels=labels, owner_references=owner_references)
+        try:
+            self.body = api.create_namespaced_service(
+                namespace=self.namespace,
+                body=service_body,
+            )
+        except K8SClient.ApiException as err:
+            if not is_already_exists(err):
+                raise
+            self.refresh()
         return self
 
+    @traced
     def delete(self) -> "ModelService":
         if self.body is None or self.body.metadata is None:
             return self
 
-        api = K8SClient.CoreV1Api()
+        api = K8SClient.CoreV1Api(get_api_client())
         api.delete_namespaced_service(
             name=self.body.metadata.name,
             namespace=self.body.metadata.namespace,
@@ -72,31 +99,36 @@ class ModelService:
         if self.body is None or self.body.metadata is None:
             return self
 
-        api = K8SClient.CoreV1Api()
-        if self.body.metadata.finalizers is None:
-            self.body.metadata.finalizers = []
-        for finalizer in finalizers:
-            if finalizer not in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.append(finalizer)
-        self.body = api.patch_namespaced_service(
-            name=self.body.metadata.name,
-            namespace=self.body.metadata.namespace,
-            body=self.body,
-        )
+        api = K8SClient.CoreV1Api(get_api_client())
+
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, add=finalizers or []) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_service(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resource_version),
+                    _content_type=JSON_PATCH,
+                )
+
+        retry_on_conflict(write, self.refresh, resource="services")
         return self
 
     def remove_finalizers(self, finalizers: List[str] = None):
         if self.body is None or self.body.metadata is None or not self.body.metadata.finalizers:
             return self
 
-        api = K8SClient.CoreV1Api()
-        for finalizer in finalizers:
-            if finalizer in self.body.metadata.finalizers:
-                self.body.metadata.finalizers.remove(finalizer)
-        self.body = api.patch_namespaced_service(
-            name=self.body.metadata.name,
-            namespace=self.body.metadata.namespace,
-            body=self.body,
-        )
+        api = K8SClient.CoreV1Api(get_api_client())
+
+        def write() -> None:
+            patch = finalizers_patch(self.body.metadata.finalizers, remove=finalizers or []) if self.body else None
+            if patch:
+                self.body = api.patch_namespaced_service(
+                    name=self.body.metadata.name,
+                    namespace=self.body.metadata.namespace,
+                    body=with_resource_version(patch, self.body.metadata.resource_version),
+                    _content_type=JSON_PATCH,
+                )
 
+        retry_on_conflict(write, self.refresh, resource="services")
         return self
@@ -1,9 +1,19 @@
+from __future__ import annotations
+
 from pathlib import Path
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 from kubernetes import client as K8SClient
 from kubernetes.utils import parse_quantity
 from pydantic import BaseModel
+from utils.api_client import get_api_client
+from utils.conflicts import is_already_exists, retry_on_conflict
+from utils.owners import k8s_owner_references
+from utils.patch import JSON_PATCH, MERGE_PATCH, finalizers_patch, with_resource_version
+from utils.tracing import traced
+
+# kubernetes>=29 split the claim resources out of V1ResourceRequirements.
+VolumeResourceRequirements = getattr(K8SClient, "V1VolumeResourceRequirements", K8SClient.V1ResourceRequirements)
 
 
 class ModelStorage:
@@ -17,7 +27,11 @@ class ModelStorage:
         self.pv: Optional[K8SClient.V1PersistentVolume] = None
         self.pvc: Optional[K8SClient.V1PersistentVolumeClaim] = None
 
-        api = K8SClient.CoreV1Api()
+        self.refresh_pv()
+        self.refresh_pvc()
+
+    def refresh_pv(self) -> "ModelStorage":
+        api = K8SClient.CoreV1Api(get_api_client())
         try:
             self.pv = api.read_persistent_volume(self.pv_name)
         except K8SClient.ApiException as err:
@@ -25,16 +39,21 @@ class ModelStorage:
                 self.pv = None
             else:
                 raise
+        return self
+
+    def refresh_pvc(self) -> "ModelStorage":
+        api = K8SClient.CoreV1Api(get_api_client())
         try:
-            self.pvc = api.read_namespaced_persistent_volume_claim(name=self.pv_name, namespace=self.namespace)
+            self.pvc = api.read_namespaced_persistent_volume_claim(name=self.pvc_name, namespace=self.namespace)
         except K8SClient.ApiException as err:
             if err.status == 404:
                 self.pvc = None
             else:
                 raise
+        return self
 
     def get_pv_body(
-        self, size: str, path: Union[str, Path], finalizers: List[str] = None
+        self, size: str, path: Union[str, Path], finalizers: List[str] = None, labels: Dict[str, str] = None
     ) -> K8SClient.V1PersistentVolume:
         if isinstance(path, str):
             path = Path(path)
@@ -43,6 +62,7 @@ class ModelStorage:
             metadata=K8SClient.V1ObjectMeta(
                 name=self.pv_name,
                 labels={
+                    **(labels or {}),
                     "type": "local",
                     "namespace": self.namespace,
                     "model": self.name,
@@ -57,16 +77,22 @@ class ModelStorage:
             ),
         )
 
-    def get_pvc_body(self, size: str, finalizers: List[str] = None) -> K8SClient.V1PersistentVolumeClaim:
+    def get_pvc_body(
+        self, size: str, finalizers: List[str] = None, owner_references: List[Dict[str, Any]] = None
+    ) -> K8SClient.V1PersistentVolumeClaim:
+        """
+        The claim can be owned by the model version; the persistent volume can't, being cluster scoped.
+        """
         return K8SClient.V1PersistentVolumeClaim(
             metadata=K8SClient.V1ObjectMeta(
                 name=self.pvc_name,
                 namespace=self.namespace,
                 finalizers=finalizers,
+                owner_references=k8s_owner_references(owner_references),
             ),
             spec=K8SClient.V1PersistentVolumeClaimSpec(
                 access_modes=["ReadWriteOnce"],
-                resources=K8SClient.V1ResourceRequirements(requests={"storage": size}),
+                resources=VolumeResourceRequirements(requests={"storage": size}),
                 storage_class_name="manual",
                 selector=K8SClient.V1LabelSelector(
                     match_labels={
@@ -78,40 +104,75 @@ class ModelStorage:
             ),
         )
 
-    def create(self, size: str, path: Union[str, Path]) -> "ModelStorage":
+    @traced
+    def create(
+        self,
+        size: str,
+        path: Union[str, Path],
+        labels: Dict[str, str] = None,
+        owner_references: List[Dict[str, Any]] = None,
+    ) -> "ModelStorage":
         if isinstance(path, str):
             path = Path(path)
 
-        api = K8SClient.CoreV1Api()
+        api = K8SClient.CoreV1Api(get_api_client())
 
         if self.pv is None:
-            pv_body = self.get_pv_body(size=size, path=path)
-            self.pv = api.create_persistent_volume(body=pv_body)
+            pv_body = self.get_pv_body(size=size, path=path, labels=labels)
+            try:
+                self.pv = api.create_persistent_volume(body=pv_body)
+            except K8SClient.ApiException as err:
+                if not is_already_exists(err):
+                    raise
+                self.refresh_pv()
 
         if self.pvc is None:
-            pvc_body = self.get_pvc_body(size=size)
-            self.pvc = api.create_namespaced_persistent_volume_claim(namespace=self.namespace, body=pvc_body)
+            pvc_body = self.get_pvc_body(size=size, owner_references=owner_references)
+            try:
+                self.pvc = api.create_namespaced_persistent_volume_claim(namespace=self.namespace, body=pvc_body)
+            except K8SClient.ApiException as err:
+                if not is_already_exists(err):
+                    raise
+                self.refresh_pvc()
         return self
 
+    @traced
     def update(self, size: Optional[str] = None) -> "ModelStorage":
         if not self.pv or not self.pvc:
             return self
 
         if size and parse_quantity(size) > parse_quantity(self.pv.spec.capacity["storage"]):
-            self.pv.spec.capacity["storage"] = size
-            self.pvc.spec.resources.requests["storage"] = size
-            api = K8SClient.CoreV1Api()
-            self.pv = api.patch_persistent_volume(name=self.pv.metadata.name, body=self.pv)
-            self.pvc = api.patch_namespaced_persistent_volume_claim(
-                name=self.pvc.metadata.name,
-                namespace=self.pvc.metadata.namespace,
-                body=self.pvc,
-            )
+            api = K8SClient.CoreV1Api(get_api_client())
+
+            def write_pv() -> None:
+                if self.pv:
+                    self.pv = api.patch_persistent_volume(
+                        name=self.pv.metadata.name,
+                        body=with_resource_version(
+                            {"spec": {"capacity": {"storage": size}}}, self.pv.metadata.resource_version
+                        ),
+                        _content_type=MERGE_PATCH,
+                    )
+
+            def write_pvc() -> None:
+                if self.pvc:
+                    self.pvc = api.patch_namespaced_persistent_volume_claim(
+                        name=self.pvc.metadata.name,
+                        namespace=self.pvc.metadata.namespace,
+                        body=with_resource_version(
+                            {"spec": {"resources": {"requests": {"storage": size}}}}, self.pvc.metadata.resource_version
+                        ),
+                        _content_type=MERGE_PATCH,
+                    )
+
+            retry_on_conflict(write_pv, self.refresh_pv, resource="persistentvolumes")
+            retry_on_conflict(write_pvc, self.refresh_pvc, resource="persistentvolumeclaims")
 
         return self
 
+    @traced
     def delete(self) -> "ModelStorage":
-        api = K8SClient.CoreV1Api()
+        api = K8SClient.CoreV1Api(get_api_client())
 
         if self.pvc and self.pvc.metadata:
             api.delete_namespaced_persistent_volume_claim(
@@ -125,41 +186,35 @@ class ModelStorage:
         return self
 
     def add_finalizers(self, finalizers: List[str]) -> "ModelStorage":
-        api = K8SClient.CoreV1Api()
-        if self.pv and self.pv.metadata:
-            if self.pv.metadata.finalizers is None:
-                self.pv.metadata.finalizers = []
-            for finalizer in finalizers:
-                if finalizer not in self.pv.metadata.finalizers:
-                    self.pv.metadata.finalizers.append(finalizer)
-            self.pv = api.patch_persistent_volume(name=self.pv.metadata.name, body=self.pv)
-        if self.pvc and self.pvc.metadata:
-            for finalizer in finalizers:
-                if finalizer not in self.pvc.metadata.finalizers:
-                    self.pvc.metadata.finalizers.append(finalizer)
-            self.pvc = api.patch_namespaced_persistent_volume_claim(
-                name=self.pvc.metadata.name,
-                namespace=self.pvc.metadata.namespace,
-                body=self.pvc,
-            )
-        return self
+        return self.patch_finalizers(add=finalizers)
 
     def remove_finalizers(self, finalizers: List[str]) -> "ModelStorage":
-        api = K8SClient.CoreV1Api()
-        if self.pv and self.pv.metadata and self.pv.metadata.finalizers:
-            if self.pv.metadata.finalizers is None:
-                self.pv.metadata.finalizers = []
-            for finalizer in finalizers:
-                if finalizer in self.pv.metadata.finalizers:
-                    self.pv.metadata.finalizers.remove(finalizer)
-            self.pv = api.patch_persistent_volume(name=self.pv.metadata.name, body=self.pv)
-        if self.pvc and self.pvc.metadata and self.pvc.metadata.finalizers:
-            for finalizer in finalizers:
-                if finalizer in self.pvc.metadata.finalizers:
-                    self.pvc.metadata.finalizers.remove(finalizer)
-            self.pvc = api.patch_namespaced_persistent_volume_claim(
-                name=self.pvc.metadata.name,
-                namespace=self.pvc.metadata.namespace,
-                body=self.pvc,
-            )
+        return self.patch_finalizers(remove=finalizers)
+
+    def patch_finalizers(self, add: List[str] = (), remove: List[str] = ()) -> "ModelStorage":
+        api = K8SClient.CoreV1Api(get_api_client())
+
+        def write_pv() -> None:
+            if self.pv and self.pv.metadata:
+                patch = finalizers_patch(self.pv.metadata.finalizers, add=add, remove=remove)
+                if patch:
+                    self.pv = api.patch_persistent_volume(
+                        name=self.pv.metadata.name,
+                        body=with_resource_version(patch, self.pv.metadata.resource_version),
+                        _content_type=JSON_PATCH,
+                    )
+
+        def write_pvc() -> None:
+            if self.pvc and self.pvc.metadata:
+                patch = finalizers_patch(self.pvc.metadata.finalizers, add=add, remove=remove)
+                if patch:
+                    self.pvc = api.patch_namespaced_persistent_volume_claim(
+                        name=self.pvc.metadata.name,
+                        namespace=self.pvc.metadata.namespace,
+                        body=with_resource_version(patch, self.pvc.metadata.resource_version),
+                        _content_type=JSON_PATCH,
+                    )
+
+        retry_on_conflict(write_pv, self.refresh_pv, resource="persistentvolumes")
+        retry_on_conflict(write_pvc, self.refresh_pvc, resource="persistentvolumeclaims")
         return self
@@ -0,0 +1,479 @@
+"""
+Desired-state planner for the Endpoint -> EndpointConfig -> Model graph.
+
+The planner renders every resource an endpoint should own (the gateway, the virtual service of its endpoint config
+version, and for each model version the Model custom resource, its persistent volume and claim, deployment and
+service), compares it with what the API server holds and only issues the create/patch/delete calls needed to close the
+gap. Reconciling an endpoint which is already in its desired state makes no write call at all. The owner references
+are part of the desired state (see utils/owners.py), so resources created before them are adopted on their next
+reconcile.
+
+Usage (from containers/mlops): python -m resources.planner --namespace titanic --endpoint titanic [--dry-run]
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from kubernetes import client as K8SClient
+from kubernetes import config as K8SConfig
+from resources.endpoint_config import EndpointConfig
+from resources.istio import client as IstioClient
+from resources.mlops import client as MLOpsClient
+from resources.model import Model
+from utils.api_client import get_api_client
+from utils.conflicts import retry_on_conflict
+from utils.owners import add_owner_reference, is_owned, owner_reference, owner_references
+from utils.patch import MERGE_PATCH, converge_patch, with_resource_version
+from utils.tracing import traced
+
+if TYPE_CHECKING:
+    from resources.endpoint import Endpoint
+
+DRY_RUN: bool = os.environ.get("MLOPS_DRY_RUN", "false").lower() == "true"
+
+CREATE: str = "create"
+PATCH: str = "patch"
+DELETE: str = "delete"
+READ: str = "read"
+
+
+class Operation(NamedTuple):
+    """
+    A single write call: the full body for a create, the merge patch for a patch, nothing for a delete. Patches also
+    carry the fields they converge and the resourceVersion they were computed from, sent as a precondition.
+    """
+
+    action: str
+    kind: str
+    namespace: Optional[str]
+    name: str
+    body: Any = None
+    managed: Optional[Dict[str, Any]] = None
+    resource_version: Optional[str] = None
+
+    def __str__(self) -> str:
+        target = f"{self.kind} {self.namespace}/{self.name}" if self.namespace else f"{self.kind} {self.name}"
+        if self.action == PATCH:
+            return f"{self.action} {target} {json.dumps(self.body, sort_keys=True, default=str)}"
+        return f"{self.action} {target}"
+
+
+class Resource(NamedTuple):
+    """
+    A desired resource and its observed counterpart.
+    @param body: The full desired body, sent when the resource is missing.
+    @param managed: The part of the desired body owned by the operator, compared with the observed resource.
+    @param observed: The observed resource as a dict, None if it doesn't exist.
+    """
+
+    kind: str
+    namespace: Optional[str]
+    name: str
+    body: Any
+    managed: Dict[str, Any]
+    observed: Optional[Dict[str, Any]]
+
+
+def serialize(obj: Any) -> Any:
+    """
+    Turn a pydantic model or a kubernetes client model into the dict the API server would return (camelCase keys, no
+    None values).
+    """
+    if obj is None:
+        return None
+    # Recent kubernetes clients build their models on pydantic too, their dict() has snake_case keys: leave them to
+    # sanitize_for_serialization, which knows their attribute maps.
+    if hasattr(obj, "dict") and not hasattr(obj, "openapi_types") and not isinstance(obj, dict):
+        obj = obj.dict()
+    return get_api_client().sanitize_for_serialization(obj)
+
+
+def managed(body: Dict[str, Any], spec: Any = None) -> Dict[str, Any]:
+    """
+    The fields of a body owned by the operator: its labels, its owner references if any and its spec (or the given
+    part of it).
+    """
+    metadata = body.get("metadata") or {}
+    result = {"metadata": {"labels": metadata.get("labels") or {}}}
+    if metadata.get("ownerReferences"):
+        result["metadata"]["ownerReferences"] = metadata["ownerReferences"]
+    result["spec"] = body.get("spec") if spec is None else spec
+    return result
+
+
+class Plan:
+    """
+    An ordered list of write operations. Creations come first, in dependency order (storage before the deployment
+    mounting it, model versions before the virtual service routing to them); deletions come last.
+    """
+
+    def __init__(self, operations: List[Operation] = None) -> None:
+        self.operations: List[Operation] = list(operations or [])
+
+    @staticmethod
+    def from_resources(resources: List[Resource], deletions: List[Tuple[str, Optional[str], str]] = ()) -> "Plan":
+        operations = []
+        for resource in resources:
+            if resource.observed is None:
+                operations.append(Operation(CREATE, resource.kind, resource.namespace, resource.name, resource.body))
+                continue
+            patch = converge_patch(resource.observed, resource.managed)
+            if patch:
+                operations.append(
+                    Operation(
+                        PATCH,
+                        resource.kind,
+                        resource.namespace,
+                        resource.name,
+                        patch,
+                        resource.managed,
+                        (resource.observed.get("metadata") or {}).get("resourceVersion"),
+                    )
+                )
+        operations.extend(Operation(DELETE, kind, namespace, name) for kind, namespace, name in deletions)
+        return Plan(operations)
+
+    def __iter__(self) -> Iterator[Operation]:
+        return iter(self.operations)
+
+    def __len__(self) -> int:
+        return len(self.operations)
+
+    def __str__(self) -> str:
+        if not self.operations:
+            return "no changes"
+        return "\n".join(str(operation) for operation in self.operations)
+
+    @traced
+    def apply(self, dry_run: bool = None) -> "Plan":
+        """
+        Run the operations of the plan, or only log them in dry-run mode (MLOPS_DRY_RUN by default). A patch
+        conflicting with another writer is planned again against a fresh read of its object, see converge.
+        """
+        dry_run = DRY_RUN if dry_run is None else dry_run
+        for operation in self.operations:
+            if dry_run:
+                logging.info(f"[dry-run] {operation}")
+                continue
+            if operation.action == PATCH and operation.managed is not None:
+                converge(operation)
+            else:
+                execute(operation)
+        return self
+
+
+def _executors() -> Dict[str, Dict[str, Callable[[Operation], Any]]]:
+    mlops = MLOpsClient.V1Alpha1Api()
+    istio = IstioClient.V1Beta1Api()
+    core = K8SClient.CoreV1Api(get_api_client())
+    apps = K8SClient.AppsV1Api(get_api_client())
+
+    return {
+        MLOpsClient.MODEL_KIND: {
+            READ: lambda op: mlops.read_namespaced_model(name=op.name, namespace=op.namespace, fresh=True),
+            CREATE: lambda op: mlops.create_namespaced_model(namespace=op.namespace, body=op.body),
+            PATCH: lambda op: mlops.patch_namespaced_model(name=op.name, namespace=op.namespace, body=op.body),
+            DELETE: lambda op: mlops.delete_namespaced_model(name=op.name, namespace=op.namespace),
+        },
+        MLOpsClient.ENDPOINT_CONFIG_KIND: {
+            READ: lambda op: mlops.read_namespaced_endpoint_config(name=op.name, namespace=op.namespace, fresh=True),
+            CREATE: lambda op: mlops.create_namespaced_endpoint_config(namespace=op.namespace, body=op.body),
+            PATCH: lambda op: mlops.patch_namespaced_endpoint_config(
+                name=op.name, namespace=op.namespace, body=op.body
+            ),
+            DELETE: lambda op: mlops.delete_namespaced_endpoint_config(name=op.name, namespace=op.namespace),
+        },
+        IstioClient.GATEWAY_KIND: {
+            READ: lambda op: istio.read_namespaced_gateway(name=op.name, namespace=op.namespace, fresh=True),
+            CREATE: lambda op: istio.create_namespaced_gateway(namespace=op.namespace, body=op.body),
+            PATCH: lambda op: istio.patch_namespaced_gateway(name=op.name, namespace=op.namespace, body=op.body),
+            DELETE: lambda op: istio.delete_namespaced_gateway(name=op.name, namespace=op.namespace),
+        },
+        IstioClient.VIRTUAL_SERVICE_KIND: {
+            READ: lambda op: istio.read_namespaced_virtual_service(name=op.name, namespace=op.namespace, fresh=True),
+            CREATE: lambda op: istio.create_namespaced_virtual_service(namespace=op.namespace, body=op.body),
+            PATCH: lambda op: istio.patch_namespaced_virtual_service(
+                name=op.name, namespace=op.namespace, body=op.body
+            ),
+            DELETE: lambda op: istio.delete_namespaced_virtual_service(name=op.name, namespace=op.namespace),
+        },
+        "PersistentVolume": {
+            READ: lambda op: core.read_persistent_volume(name=op.name),
+            CREATE: lambda op: core.create_persistent_volume(body=op.body),
+            PATCH: lambda op: core.patch_persistent_volume(name=op.name, body=op.body, _content_type=MERGE_PATCH),
+            DELETE: lambda op: core.delete_persistent_volume(name=op.name),
+        },
+        "PersistentVolumeClaim": {
+            READ: lambda op: core.read_namespaced_persistent_volume_claim(name=op.name, namespace=op.namespace),
+            CREATE: lambda op: core.create_namespaced_persistent_volume_claim(namespace=op.namespace, body=op.body),
+            PATCH: lambda op: core.patch_namespaced_persistent_volume_claim(
+                name=op.name, namespace=op.namespace, body=op.body, _content_type=MERGE_PATCH
+            ),
+            DELETE: lambda op: core.delete_namespaced_persistent_volume_claim(name=op.name, namespace=op.namespace),
+        },
+        "Deployment": {
+            READ: lambda op: apps.read_namespaced_deployment(name=op.name, namespace=op.namespace),
+            CREATE: lambda op: apps.create_namespaced_deployment(namespace=op.namespace, body=op.body),
+            PATCH: lambda op: apps.patch_namespaced_deployment(
+                name=op.name, namespace=op.namespace, body=op.body, _content_type=MERGE_PATCH
+            ),
+            DELETE: lambda op: apps.delete_namespaced_deployment(name=op.name, namespace=op.namespace),
+        },
+        "Service": {
+            READ: lambda op: core.read_namespaced_service(name=op.name, namespace=op.namespace),
+            CREATE: lambda op: core.create_namespaced_service(namespace=op.namespace, body=op.body),
+            PATCH: lambda op: core.patch_namespaced_service(
+                name=op.name, namespace=op.namespace, body=op.body, _content_type=MERGE_PATCH
+            ),
+            DELETE: lambda op: core.delete_namespaced_service(name=op.name, namespace=op.namespace),
+        },
+    }
+
+
+def execute(operation: Operation) -> Any:
+    if operation.action == PATCH:
+        operation = operation._replace(body=with_resource_version(operation.body, operation.resource_version))
+    return _executors()[operation.kind][operation.action](operation)
+
+
+def read(operation: Operation) -> Optional[Dict[str, Any]]:
+    """
+    Read the object targeted by an operation from the API server, bypassing the informer caches.
+    @return: The object as a dict, None if it doesn't exist anymore.
+    """
+    try:
+        return serialize(_executors()[operation.kind][READ](operation))
+    except K8SClient.ApiException as err:
+        if err.status == 404:
+            return None
+        raise
+
+
+def converge(operation: Operation) -> Any:
+    """
+    Run a patch operation. When the object changed since it was planned, the patch is computed again from a fresh read
+    and sent with the new resourceVersion, a bounded number of times; nothing is sent when the object converged or
+    disappeared in the meantime.
+    """
+    current = [operation]
+
+    def write() -> Any:
+        return execute(current[0]) if current[0] else None
+
+    def refresh() -> None:
+        observed = read(operation)
+        patch = converge_patch(observed, operation.managed) if observed else None
+        current[0] = (
+            operation._replace(body=patch, resource_version=(observed.get("metadata") or {}).get("resourceVersion"))
+            if patch
+            else None
+        )
+
+    return retry_on_conflict(write, refresh, resource=operation.kind)
+
+
+def owner_labels(model: Model) -> Dict[str, str]:
+    """
+    The owner labels of a model version, from its status, so model versions created before the labels were introduced
+    get them too.
+    """
+    status = model.body.status
+    if not status:
+        return model.owner_labels
+    values = (status.endpoint, status.endpoint_config, status.endpoint_config_version)
+    return {label: value for label, value in zip(MLOpsClient.MODEL_OWNER_LABELS, values) if value}
+
+
+def render_model(
+    model: Model,
+    model_data: MLOpsClient.V1Alpha1EndpointConfigModel,
+    model_version: bool = True,
+    owner: Optional[MLOpsClient.V1Alpha1EndpointConfig] = None,
+) -> List[Resource]:
+    """
+    Render the resources of a model version: its custom resource labels, storage, deployment and service.
+    @param model: The model version, as read from the API.
+    @param model_data: The entry of the endpoint config describing the model resources.
+    @param model_version: Also render the labels of the Model custom resource.
+    @param owner: The endpoint config version owning the model version, if known.
+    """
+    resources = []
+    labels = owner_labels(model)
+    references = model.owner_references
+
+    if model_version:
+        body = serialize(model.body)
+        metadata = {"labels": labels}
+        if owner is not None and owner_reference(owner):
+            # A model version shared by several endpoint config versions keeps its other owners.
+            metadata["ownerReferences"] = add_owner_reference(
+                body["metadata"].get("ownerReferences") or [], owner_reference(owner)
+            )
+        resources.append(
+            Resource(
+                MLOpsClient.MODEL_KIND, model.namespace, model.body.metadata.name, body, {"metadata": metadata}, body
+            )
+        )
+
+    storage = model.storage
+    pv = serialize(storage.get_pv_body(size=model_data.size, path=model_data.path, labels=labels))
+    resources.append(Resource("PersistentVolume", None, storage.pv_name, pv, managed(pv), serialize(storage.pv)))
+    pvc = serialize(storage.get_pvc_body(size=model_data.size, owner_references=references))
+    # The claim has no labels, and only its requested size can change.
+    pvc_managed = {"spec": {"resources": pvc["spec"]["resources"]}}
+    if references:
+        pvc_managed["metadata"] = {"ownerReferences": pvc["metadata"]["ownerReferences"]}
+    resources.append(
+        Resource("PersistentVolumeClaim", model.namespace, storage.pvc_name, pvc, pvc_managed, serialize(storage.pvc))
+    )
+
+    deployment = serialize(
+        model.deployment.get_deployment_body(
+            instances=model_data.instances,
+            artifact=model.body.spec.artifact,
+            image=model.body.spec.image,
+            cpus=model_data.cpus,
+            memory=model_data.memory,
+            command=model.body.spec.command,
+            args=model.body.spec.args,
+            labels=labels,
+            owner_references=references,
+        )
+    )
+    resources.append(
+        Resource(
+            "Deployment",
+            model.namespace,
+            model.deployment_name,
+            deployment,
+            managed(deployment),
+            serialize(model.deployment.body),
+        )
+    )
+
+    service = serialize(model.service.get_service_body(labels=labels, owner_references=references))
+    resources.append(
+        Resource(
+            "Service", model.namespace, model.service_name, service, managed(service), serialize(model.service.body)
+        )
+    )
+    return resources
+
+
+def render_endpoint(endpoint: "Endpoint") -> Tuple[List[Resource], List[Tuple[str, Optional[str], str]]]:
+    """
+    Render the resources of an endpoint and find the model versions of its endpoint config version which are not
+    referenced anymore. Only the model versions no other endpoint config version uses are deleted, the shared ones are
+    released by their users (see Model.release).
+    @return: The desired resources and the (kind, namespace, name) of the resources to delete.
+    """
+    resources = []
+    deletions = []
+    if not endpoint.body:
+        return resources, deletions
+
+    gateway = endpoint.gateway
+    body = serialize(
+        gateway.get_body(
+            labels={"endpoint": endpoint.name},
+            hosts=[endpoint.body.spec.host],
+            port=8080,
+            owner_references=owner_references(endpoint.body),
+        )
+    )
+    resources.append(
+        Resource(
+            IstioClient.GATEWAY_KIND,
+            endpoint.namespace,
+            gateway.name,
+            body,
+            managed(body),
+            serialize(gateway.body),
+        )
+    )
+
+    config_version = endpoint.body.status.endpoint_config_version if endpoint.body.status else None
+    if not config_version:
+        return resources, deletions
+
+    endpoint_config = EndpointConfig(name=config_version, namespace=endpoint.namespace)
+    model_versions = (endpoint_config.body.status.model_versions or []) if endpoint_config.body else []
+    if not model_versions:
+        return resources, deletions
+
+    bodies = endpoint_config.get_model_version_bodies()
+    destinations = []
+    for name, model_data in zip(model_versions, endpoint_config.body.spec.models or []):
+        model = Model(name=name, namespace=endpoint.namespace, body=bodies.get(name))
+        if not model.body:
+            continue
+        resources.extend(render_model(model, model_data, owner=endpoint_config.body))
+        destinations.append({"host": model.named_version, "port": 8080, "weight": model_data.weight})
+
+    virtual_service = endpoint_config.virtual_service
+    body = serialize(
+        virtual_service.get_body(
+            gateway=endpoint.name,
+            hosts=[endpoint.body.spec.host],
+            destinations=destinations,
+            owner_references=owner_references(endpoint_config.body),
+        )
+    )
+    resources.append(
+        Resource(
+            IstioClient.VIRTUAL_SERVICE_KIND,
+            endpoint.namespace,
+            virtual_service.name,
+            body,
+            managed(body),
+            serialize(virtual_service.body),
+        )
+    )
+
+    for name in sorted(set(bodies) - set(model_versions)):
+        stale = Model(name=name, namespace=endpoint.namespace, body=bodies[name])
+        if not is_owned(stale.body) or stale.is_exclusive(endpoint_config.body):
+            deletions.append((MLOpsClient.MODEL_KIND, endpoint.namespace, name))
+
+    return resources, deletions
+
+
+def plan_endpoint(endpoint: "Endpoint") -> Plan:
+    return Plan.from_resources(*render_endpoint(endpoint))
+
+
+def plan_model(model: Model) -> Plan:
+    """
+    Plan the resources of a single model version, described by the endpoint config version it belongs to.
+    """
+    model_data = model.get_model_data() if model.body else None
+    if not model_data:
+        return Plan()
+    return Plan.from_resources(render_model(model, model_data, model_version=False))
+
+
+def main() -> None:
+    from resources.endpoint import Endpoint
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--namespace", default="default")
+    parser.add_argument("--endpoint", required=True)
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without applying it")
+    arguments = parser.parse_args()
+
+    try:
+        K8SConfig.load_incluster_config()
+    except K8SConfig.ConfigException:
+        K8SConfig.load_kube_config()
+
+    plan = plan_endpoint(Endpoint(arguments.endpoint, arguments.namespace))
+    print(plan)
+    if not arguments.dry_run:
+        plan.apply(dry_run=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""
+Bulk rollout of a model to many endpoints: in the endpoint configs of the endpoints matching a label selector, a model
+is swapped for another one (typically its retrained copy), wave after wave.
+
+Each endpoint is rolled out by patching the models of its endpoint config version, the one cloned for it (the endpoint
+config of the user may be shared with endpoints left out of the rollout), with a resourceVersion precondition. The
+operator then runs EndpointConfig.update_handler, which creates and deploys the new model version, routes the traffic
+to it and deletes the old one. The rollout waits for the model versions of the endpoint to be available, so the latency
+reported for an endpoint is the time from its patch to it serving the new model.
+
+The endpoints are rolled out in waves of --wave-size endpoints, --concurrency of them at a time. The outcome and latency
+of each endpoint are logged as it completes, the progress and the tail latency after each wave, and the rollout stops
+before the next wave once the share of failed endpoints exceeds --max-failure-ratio. An endpoint fails when its patch is
+rejected, when one of its model versions fails, or when they are not available after --timeout seconds. The endpoints
+not using the model, including the ones already rolled out, are skipped: a stopped rollout is resumed by running it
+again.
+
+With --artifact, the new model is first created in each namespace as a copy of the old model serving that artifact.
+
+Usage (from containers/mlops):
+    python rollout.py --selector team=fraud --model fraud-rfc --to-model fraud-rfc-retrained [--dry-run]
+    python rollout.py --namespace fraud --model fraud-rfc --artifact s3://models/fraud-rfc-2 --wave-size 50
+"""
+
+import argparse
+import json
+import logging
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from kubernetes import client as K8SClient
+from kubernetes import config as K8SConfig
+from resources.endpoint_config import EndpointConfig
+from resources.mlops import client as MLOpsClient
+from resources.model import Model
+from resources.planner import DRY_RUN
+from resources.sweeper import list_objects
+from utils import get_version
+from utils.api_client import get_api_client
+from utils.conflicts import retry_on_conflict
+from utils.patch import with_resource_version
+
+SUCCEEDED: str = "succeeded"
+FAILED: str = "failed"
+SKIPPED: str = "skipped"
+PLANNED: str = "planned"
+
+
+class RolloutError(Exception):
+    """
+    An endpoint which couldn't be rolled out.
+    """
+
+
+class Change(NamedTuple):
+    """
+    The change rolled out: the model swapped out of the endpoint configs and the model swapped in. With an artifact, the
+    new model is created as a copy of the old one serving it.
+    """
+
+    model: str
+    new_model: str
+    artifact: Optional[str] = None
+
+    def apply(self, models: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """
+        The models of an endpoint config with the change applied.
+        @return: The new models, None if the endpoint config doesn't use the model.
+        """
+        if not any(model["model"] == self.model for model in models):
+            return None
+        return [{**model, "model": self.new_model} if model["model"] == self.model else model for model in models]
+
+
+class EndpointResult(NamedTuple):
+    namespace: str
+    name: str
+    outcome: str
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    def __str__(self) -> str:
+        error = f": {self.error}" if self.error else ""
+        return f"{self.namespace}/{self.name} {self.outcome} in {self.seconds:.1f}s{error}"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    The nearest-rank percentile of a list of values, 0 if it is empty.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class RolloutReport:
+    """
+    The outcome of each endpoint rolled out so far, in the order they completed.
+    """
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.results: List[EndpointResult] = []
+        self.waves: int = 0
+        self.stopped: bool = False
+
+    def add(self, result: EndpointResult) -> None:
+        self.results.append(result)
+
+    def count(self, outcome: str) -> int:
+        return sum(1 for result in self.results if result.outcome == outcome)
+
+    @property
+    def failure_ratio(self) -> float:
+        """
+        The share of failed endpoints among the ones using the model.
+        """
+        attempted = len(self.results) - self.count(SKIPPED)
+        return self.count(FAILED) / attempted if attempted else 0.0
+
+    @property
+    def latencies(self) -> List[float]:
+        return [result.seconds for result in self.results if result.outcome == SUCCEEDED]
+
+    def summary(self) -> Dict[str, Any]:
+        latencies = self.latencies
+        return {
+            "endpoints": self.total,
+            "waves": self.waves,
+            **{outcome: self.count(outcome) for outcome in (SUCCEEDED, FAILED, SKIPPED, PLANNED)},
+            "pending": self.total - len(self.results),
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(max(latencies, default=0.0), 3),
+            "stopped": self.stopped,
+        }
+
+    def slowest(self, count: int = 5) -> List[EndpointResult]:
+        return sorted(
+            (result for result in self.results if result.outcome == SUCCEEDED), key=lambda result: -result.seconds
+        )[:count]
+
+
+class Rollout:
+    """
+    Roll a model change out to the endpoints matching a label selector.
+    @param change: The model swapped out and the one swapped in.
+    @param selector: The label selector of the endpoints, all the endpoints if None.
+    @param namespace: The namespace of the endpoints, all the namespaces if None.
+    @param wave_size: The number of endpoints of a wave.
+    @param concurrency: The number of endpoints of a wave rolled out at the same time.
+    @param max_failure_ratio: The share of failed endpoints above which the rollout stops after the current wave.
+    @param timeout: The seconds an endpoint has to serve the new model once patched.
+    @param poll_interval: The seconds between two checks of the model versions of an endpoint.
+    @param dry_run: Only report the endpoints which would be rolled out, MLOPS_DRY_RUN by default.
+    """
+
+    def __init__(
+        self,
+        change: Change,
+        selector: Optional[str] = None,
+        namespace: Optional[str] = None,
+        wave_size: int = 20,
+        concurrency: int = 10,
+        max_failure_ratio: float = 0.05,
+        timeout: float = 900.0,
+        poll_interval: float = 5.0,
+        dry_run: Optional[bool] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.change = change
+        self.selector = selector
+        self.namespace = namespace
+        self.wave_size = max(1, wave_size)
+        self.concurrency = max(1, concurrency)
+        self.max_failure_ratio = max_failure_ratio
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.dry_run = DRY_RUN if dry_run is None else dry_run
+        self.clock = clock
+        self.sleep = sleep
+        # The namespaces where the new model doesn't exist, the endpoints there fail without being patched.
+        self.missing: Set[str] = set()
+
+    def targets(self) -> List[Tuple[str, str]]:
+        """
+        The namespace and name of the endpoints matching the selector, in a stable order.
+        """
+        api = K8SClient.CustomObjectsApi(get_api_client())
+        group, version, plural = MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.ENDPOINT_PLURAL
+        if self.namespace:
+            items = list_objects(
+                api.list_namespaced_custom_object, group, version, self.namespace, plural, label_selector=self.selector
+            )
+        else:
+            items = list_objects(api.list_cluster_custom_object, group, version, plural, label_selector=self.selector)
+        return sorted(
+            (item["metadata"]["namespace"], item["metadata"]["name"])
+            for item in items
+            if not item["metadata"].get("deletionTimestamp")
+        )
+
+    def prepare(self, namespaces: List[str]) -> None:
+        """
+        Make sure the new model exists in every namespace rolled out, creating it when an artifact is given.
+        """
+        for namespace in namespaces:
+            if Model(name=self.change.new_model, namespace=namespace).body:
+                continue
+            model = Model(name=self.change.model, namespace=namespace)
+            if self.change.artifact and model.body:
+                if not self.dry_run:
+                    Model(name=self.change.new_model, namespace=namespace).create(
+                        image=model.body.spec.image,
+                        artifact=self.change.artifact,
+                        command=model.body.spec.command,
+                        args=model.body.spec.args,
+                    )
+                    logging.info(f"Created model {self.change.new_model} in namespace {namespace}")
+                continue
+            self.missing.add(namespace)
+
+    def write(self, endpoint_config: EndpointConfig) -> bool:
+        """
+        Patch the models of an endpoint config version, unless it doesn't use the model.
+        @return: Whether the endpoint config version uses the model.
+        """
+        api = MLOpsClient.V1Alpha1Api()
+        changed = False
+
+        def write() -> None:
+            nonlocal changed
+            models = self.change.apply([model.dict() for model in endpoint_config.body.spec.models or []])
+            changed = models is not None
+            if not changed:
+                return
+            if endpoint_config.namespace in self.missing:
+                raise RolloutError(f"model {self.change.new_model} not found")
+            if self.dry_run:
+                return
+            endpoint_config.body = api.patch_namespaced_endpoint_config(
+                name=endpoint_config.body.metadata.name,
+                namespace=endpoint_config.namespace,
+                body=with_resource_version({"spec": {"models": models}}, endpoint_config.body.metadata.resourceVersion),
+            )
+
+        retry_on_conflict(write, endpoint_config.refresh, resource=MLOpsClient.ENDPOINT_CONFIG_PLURAL)
+        return changed
+
+    def wait(self, endpoint_config: EndpointConfig, before: MLOpsClient.V1Alpha1EndpointConfig) -> None:
+        """
+        Wait for the operator to replace the model versions of an endpoint config version and for all of them to be
+        available.
+        @param before: The endpoint config version before the patch.
+        @raise RolloutError: A model version failed, or they are not available in time.
+        """
+        previous = (before.status.model_versions if before.status else None) or []
+        deadline = self.clock() + self.timeout
+        while True:
+            endpoint_config.refresh()
+            if not endpoint_config.body:
+                raise RolloutError(f"endpoint config {endpoint_config.named_version} deleted")
+            model_versions = (endpoint_config.body.status.model_versions if endpoint_config.body.status else None) or []
+            if model_versions and model_versions != previous:
+                # The model versions shared with other endpoint config versions may be labelled with another one.
+                bodies = endpoint_config.get_model_version_bodies()
+                models = [
+                    Model(name=name, namespace=endpoint_config.namespace, body=bodies.get(name))
+                    for name in model_versions
+                ]
+                states = {
+                    name: model.body.status.state if model.body and model.body.status else None
+                    for name, model in zip(model_versions, models)
+                }
+                failed = [name for name in model_versions if states.get(name) == MLOpsClient.V1Alpha1State.FAILED]
+                if failed:
+                    raise RolloutError(f"model versions {', '.join(failed)} failed")
+                if all(states.get(name) == MLOpsClient.V1Alpha1State.AVAILABLE for name in model_versions):
+                    return
+            if self.clock() >= deadline:
+                raise RolloutError(f"model versions not available after {self.timeout:.0f}s")
+            self.sleep(self.poll_interval)
+
+    def roll_out(self, namespace: str, name: str) -> EndpointResult:
+        """
+        Roll the change out to a single endpoint.
+        """
+        started = self.clock()
+        try:
+            endpoint = MLOpsClient.V1Alpha1Api().read_namespaced_endpoint(name=name, namespace=namespace)
+            config_version = endpoint.status.endpoint_config_version if endpoint and endpoint.status else None
+            endpoint_config = EndpointConfig(name=config_version, namespace=namespace) if config_version else None
+            if not endpoint_config or not endpoint_config.body:
+                raise RolloutError("no endpoint config version")
+            before = endpoint_config.body
+            if not self.write(endpoint_config):
+                return EndpointResult(namespace, name, SKIPPED, self.clock() - started)
+            if self.dry_run:
+                return EndpointResult(namespace, name, PLANNED, self.clock() - started)
+            self.wait(endpoint_config, before)
+        except RolloutError as err:
+            return EndpointResult(namespace, name, FAILED, self.clock() - started, str(err))
+        except K8SClient.ApiException as err:
+            return EndpointResult(namespace, name, FAILED, self.clock() - started, f"{err.status} {err.reason}")
+        return EndpointResult(namespace, name, SUCCEEDED, self.clock() - started)
+
+    def run(self, targets: Optional[List[Tuple[str, str]]] = None) -> RolloutReport:
+        """
+        Roll the change out wave by wave.
+        @param targets: The namespace and name of the endpoints, the ones matching the selector by default.
+        @return: The report of the rollout, stopped if the failure threshold was exceeded.
+        """
+        targets = self.targets() if targets is None else targets
+        report = RolloutReport(len(targets))
+        self.prepare(sorted({namespace for namespace, _ in targets}))
+
+        waves = math.ceil(len(targets) / self.wave_size)
+        for start in range(0, len(targets), self.wave_size):
+            wave = targets[start : start + self.wave_size]
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(wave))) as executor:
+                futures = [executor.submit(self.roll_out, namespace, name) for namespace, name in wave]
+                for future in as_completed(futures):
+                    result = future.result()
+                    report.add(result)
+                    (logging.warning if result.outcome == FAILED else logging.info)(str(result))
+            report.waves += 1
+
+            summary = report.summary()
+            logging.info(
+                f"Wave {report.waves}/{waves}: {len(report.results)}/{report.total} endpoints, "
+                f"{summary[FAILED]} failed, p50 {summary['p50']:.1f}s p95 {summary['p95']:.1f}s "
+                f"p99 {summary['p99']:.1f}s"
+            )
+            if report.failure_ratio > self.max_failure_ratio:
+                report.stopped = True
+                logging.error(
+                    f"Stopping the rollout: {report.failure_ratio:.0%} of the endpoints failed, above the "
+                    f"{self.max_failure_ratio:.0%} threshold"
+                )
+                break
+
+        return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--selector", default=None, help="label selector of the endpoints, e.g. team=fraud")
+    parser.add_argument("--namespace", default=None, help="roll out a single namespace instead of the whole cluster")
+    parser.add_argument("--model", required=True, help="the model swapped out of the endpoint configs")
+    parser.add_argument("--to-model", default=None, help="the model swapped in")
+    parser.add_argument(
+        "--artifact", default=None, help="create the model swapped in from the old one and this artifact"
+    )
+    parser.add_argument("--wave-size", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10, help="endpoints of a wave rolled out at the same time")
+    parser.add_argument("--max-failure-ratio", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=900.0, help="seconds an endpoint has to serve the new model")
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument("--dry-run", action="store_true", help="list the endpoints without rolling them out")
+    arguments = parser.parse_args()
+    if not arguments.to_model and not arguments.artifact:
+        parser.error("one of --to-model and --artifact is required")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        K8SConfig.load_incluster_config()
+    except K8SConfig.ConfigException:
+        K8SConfig.load_kube_config()
+
+    change = Change(
+        model=arguments.model,
+        new_model=arguments.to_model or f"{arguments.model}-{get_version()}",
+        artifact=arguments.artifact,
+    )
+    report = Rollout(
+        change,
+        selector=arguments.selector,
+        namespace=arguments.namespace,
+        wave_size=arguments.wave_size,
+        concurrency=arguments.concurrency,
+        max_failure_ratio=arguments.max_failure_ratio,
+        timeout=arguments.timeout,
+        poll_interval=arguments.poll_interval,
+        dry_run=arguments.dry_run or None,
+    ).run()
+
+    print(json.dumps(report.summary()))
+    for result in report.slowest():
+        print(f"slowest: {result}")
+    sys.exit(1 if report.stopped or report.count(FAILED) else 0)
+
+
+if __name__ == "__main__":
+    main()
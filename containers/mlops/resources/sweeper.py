@@ -0,0 +1,296 @@
+"""
+Orphan sweeper: the safety net of the owner references (see utils/owners.py).
+
+The objects created before the owner references were introduced are adopted by their owner, found through the naming
+and labelling conventions of the operator, so they get deleted along with it from then on. The ones whose owner is gone
+(e.g. the operator stopped in the middle of a delete handler) are deleted, as are the persistent volumes of the deleted
+model versions, which can't be owned being cluster scoped. Objects already having an owner are left to the garbage
+collector of the API server, objects which can't be attributed to the operator are never touched.
+
+The objects of each kind are listed once per sweep, the dependents before their owners: an owner missing from its list
+was deleted, not created after it was listed. Only the namespaces owned by this replica are swept (see
+utils/sharding.py). The sweep runs every MLOPS_ORPHAN_SWEEP_INTERVAL seconds from a background thread of the operator,
+and honors MLOPS_DRY_RUN.
+
+Usage (from containers/mlops): python -m resources.sweeper [--namespace titanic] [--dry-run]
+"""
+
+import argparse
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from kubernetes import client as K8SClient
+from kubernetes import config as K8SConfig
+from resources.istio import client as IstioClient
+from resources.mlops import client as MLOpsClient
+from resources.planner import Plan, Resource, serialize
+from utils.api_client import get_api_client
+from utils.metrics import observe_orphan
+from utils.owners import is_owned, owner_reference
+from utils.sharding import owns
+
+SWEEP_INTERVAL: float = float(os.environ.get("MLOPS_ORPHAN_SWEEP_INTERVAL", "600"))
+PAGE_SIZE: int = 500
+
+# Objects by namespace and name.
+Index = Dict[str, Dict[str, dict]]
+
+
+def list_objects(function: Callable[..., Any], *args: Any, **kwargs: Any) -> List[dict]:
+    """
+    List all the objects of a kind page by page, as dicts.
+    """
+    items: List[dict] = []
+    token = None
+    while True:
+        page = serialize(function(*args, limit=PAGE_SIZE, _continue=token, **kwargs))
+        items.extend(page.get("items") or [])
+        token = (page.get("metadata") or {}).get("continue")
+        if not token:
+            return items
+
+
+def index(objects: List[dict]) -> Index:
+    result: Index = defaultdict(dict)
+    for obj in objects:
+        result[obj["metadata"].get("namespace") or ""][obj["metadata"]["name"]] = obj
+    return result
+
+
+class Snapshot:
+    """
+    The objects the sweeper looks at, listed across all namespaces (or a single one).
+    """
+
+    def __init__(self, namespace: Optional[str] = None) -> None:
+        custom = K8SClient.CustomObjectsApi(get_api_client())
+        core = K8SClient.CoreV1Api(get_api_client())
+        apps = K8SClient.AppsV1Api(get_api_client())
+
+        def custom_objects(group: str, version: str, plural: str) -> List[dict]:
+            if namespace:
+                return list_objects(custom.list_namespaced_custom_object, group, version, namespace, plural)
+            return list_objects(custom.list_cluster_custom_object, group, version, plural)
+
+        def core_objects(namespaced: Callable, cluster: Callable, **kwargs: Any) -> List[dict]:
+            if namespace:
+                return list_objects(namespaced, namespace, **kwargs)
+            return list_objects(cluster, **kwargs)
+
+        # Dependents first, owners last.
+        self.persistent_volumes: List[dict] = list_objects(
+            core.list_persistent_volume, label_selector="type=local,model"
+        )
+        if namespace:
+            self.persistent_volumes = [
+                pv for pv in self.persistent_volumes if pv["metadata"]["labels"].get("namespace") == namespace
+            ]
+        self.deployments = core_objects(
+            apps.list_namespaced_deployment, apps.list_deployment_for_all_namespaces, label_selector="model"
+        )
+        self.services = core_objects(
+            core.list_namespaced_service, core.list_service_for_all_namespaces, label_selector="model"
+        )
+        self.claims = core_objects(
+            core.list_namespaced_persistent_volume_claim, core.list_persistent_volume_claim_for_all_namespaces
+        )
+        self.virtual_services = custom_objects(
+            IstioClient.GROUP, IstioClient.VERSION, IstioClient.VIRTUAL_SERVICE_PLURAL
+        )
+        self.gateways = index(custom_objects(IstioClient.GROUP, IstioClient.VERSION, IstioClient.GATEWAY_PLURAL))
+        self.models = index(custom_objects(MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.MODEL_PLURAL))
+        self.endpoint_configs = index(
+            custom_objects(MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.ENDPOINT_CONFIG_PLURAL)
+        )
+        self.endpoints = index(custom_objects(MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.ENDPOINT_PLURAL))
+
+
+class Sweep:
+    """
+    The adoptions and deletions found in a snapshot.
+    """
+
+    def __init__(self) -> None:
+        self.adoptions: List[Resource] = []
+        self.deletions: List[Tuple[str, Optional[str], str]] = []
+
+    def adopt(self, kind: str, obj: dict, owner: dict) -> None:
+        references = [owner_reference(owner)]
+        managed = {"metadata": {"ownerReferences": references}}
+        metadata = obj["metadata"]
+        self.adoptions.append(Resource(kind, metadata.get("namespace"), metadata["name"], None, managed, obj))
+        observe_orphan(kind, "adopt")
+
+    def delete(self, kind: str, obj: dict) -> None:
+        self.deletions.append((kind, obj["metadata"].get("namespace"), obj["metadata"]["name"]))
+        observe_orphan(kind, "delete")
+
+    def attach(self, kind: str, obj: dict, owner: Optional[dict]) -> None:
+        """
+        Adopt an object by its owner, or delete it when the owner is gone.
+        """
+        if owner is not None:
+            self.adopt(kind, obj, owner)
+        else:
+            self.delete(kind, obj)
+
+    def plan(self) -> Plan:
+        return Plan.from_resources(self.adoptions, self.deletions)
+
+
+def candidates(objects: List[dict]) -> List[dict]:
+    """
+    The objects the sweeper may act on: in a namespace owned by this replica, without an owner and not being deleted.
+    """
+    return [
+        obj
+        for obj in objects
+        if owns(obj["metadata"].get("namespace") or (obj["metadata"].get("labels") or {}).get("namespace") or "")
+        and not is_owned(obj)
+        and not obj["metadata"].get("deletionTimestamp")
+    ]
+
+
+def plan_sweep(snapshot: Snapshot) -> Plan:
+    """
+    Plan the adoption or the deletion of the orphans of a snapshot. The conventions attributing an object to the
+    operator, and to its owner, are those of the resource classes.
+    """
+    sweep = Sweep()
+    models = snapshot.models
+
+    for pv in candidates(snapshot.persistent_volumes):
+        labels = pv["metadata"].get("labels") or {}
+        # The persistent volumes can't be adopted: they are only deleted once their model version is gone.
+        if (
+            pv["metadata"]["name"] == f"{labels['model']}-pv"
+            and labels["model"] not in models[labels.get("namespace", "")]
+        ):
+            sweep.delete("PersistentVolume", pv)
+
+    for kind, objects in (("Deployment", snapshot.deployments), ("Service", snapshot.services)):
+        for obj in candidates(objects):
+            model = obj["metadata"]["labels"]["model"]
+            if obj["metadata"]["name"] == model:
+                sweep.attach(kind, obj, models[obj["metadata"]["namespace"]].get(model))
+
+    for claim in candidates(snapshot.claims):
+        model = (((claim.get("spec") or {}).get("selector") or {}).get("matchLabels") or {}).get("model")
+        if model and claim["metadata"]["name"] == f"{model}-pvc":
+            sweep.attach("PersistentVolumeClaim", claim, models[claim["metadata"]["namespace"]].get(model))
+
+    for virtual_service in candidates(snapshot.virtual_services):
+        namespace, name = virtual_service["metadata"]["namespace"], virtual_service["metadata"]["name"]
+        # The virtual service of an endpoint config version has its name and references the endpoint as gateway.
+        gateways = (virtual_service.get("spec") or {}).get("gateways") or []
+        endpoint_config = snapshot.endpoint_configs[namespace].get(name)
+        if endpoint_config is not None:
+            sweep.adopt(IstioClient.VIRTUAL_SERVICE_KIND, virtual_service, endpoint_config)
+        elif (
+            len(gateways) == 1
+            and gateways[0] not in snapshot.endpoints[namespace]
+            and gateways[0] not in snapshot.gateways[namespace]
+        ):
+            sweep.delete(IstioClient.VIRTUAL_SERVICE_KIND, virtual_service)
+
+    for namespace, gateways in snapshot.gateways.items():
+        for gateway in candidates(list(gateways.values())):
+            endpoint = ((gateway.get("spec") or {}).get("selector") or {}).get("endpoint")
+            if endpoint and gateway["metadata"]["name"] == f"{endpoint}-gw":
+                sweep.attach(IstioClient.GATEWAY_KIND, gateway, snapshot.endpoints[namespace].get(endpoint))
+
+    for namespace, objects in models.items():
+        for model in candidates(list(objects.values())):
+            # Only the model versions belong to an endpoint config version, the models are created by the users.
+            endpoint_config = (model["metadata"].get("labels") or {}).get("endpoint_config_version") or (
+                model.get("status") or {}
+            ).get("endpoint_config_version")
+            if endpoint_config:
+                sweep.attach(MLOpsClient.MODEL_KIND, model, snapshot.endpoint_configs[namespace].get(endpoint_config))
+
+    for namespace, objects in snapshot.endpoint_configs.items():
+        for endpoint_config in candidates(list(objects.values())):
+            # Only the versions cloned for an endpoint belong to it, the endpoint configs are created by the users.
+            status = endpoint_config.get("status") or {}
+            if status.get("version") and status.get("endpoint"):
+                sweep.attach(
+                    MLOpsClient.ENDPOINT_CONFIG_KIND,
+                    endpoint_config,
+                    snapshot.endpoints[namespace].get(status["endpoint"]),
+                )
+
+    # The claims go before their volumes, which are protected while bound.
+    sweep.deletions.sort(key=lambda deletion: deletion[0] == "PersistentVolume")
+    return sweep.plan()
+
+
+def sweep(namespace: Optional[str] = None, dry_run: bool = None) -> Plan:
+    """
+    Adopt or delete the orphans of a namespace, or of the whole cluster.
+    """
+    plan = plan_sweep(Snapshot(namespace))
+    if plan:
+        logging.info(f"Sweeping {len(plan)} orphans:\n{plan}")
+    return plan.apply(dry_run=dry_run)
+
+
+class Sweeper:
+    """
+    Runs the sweep periodically from a daemon thread.
+    """
+
+    def __init__(self, interval: float = SWEEP_INTERVAL) -> None:
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                sweep()
+            except Exception as err:
+                # Any failure (API error, dropped connection, timeout...) only skips this sweep.
+                logging.warning(f"Orphan sweep failed, retrying in {self.interval}s: {err!r}")
+
+    def start(self) -> "Sweeper":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="orphan-sweeper", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def start_sweeper(interval: float = SWEEP_INTERVAL) -> Optional[Sweeper]:
+    """
+    Start the periodic sweep, unless MLOPS_ORPHAN_SWEEP_INTERVAL is 0. The first sweep runs after one interval, once
+    the operator caught up with the existing objects.
+    """
+    if interval <= 0:
+        return None
+    return Sweeper(interval).start()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--namespace", default=None, help="sweep a single namespace instead of the whole cluster")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without applying it")
+    arguments = parser.parse_args()
+
+    try:
+        K8SConfig.load_incluster_config()
+    except K8SConfig.ConfigException:
+        K8SConfig.load_kube_config()
+
+    plan = plan_sweep(Snapshot(arguments.namespace))
+    print(plan)
+    if not arguments.dry_run:
+        plan.apply(dry_run=False)
+
+
+if __name__ == "__main__":
+    main()
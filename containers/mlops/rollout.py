@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+"""
+Bulk rollout of a model to the endpoints matching a label selector, see resources/rollout.py.
+
+Usage (from containers/mlops):
+    python rollout.py --selector team=fraud --model fraud-rfc --to-model fraud-rfc-retrained [--dry-run]
+"""
+
+from resources.rollout import main
+
+if __name__ == "__main__":
+    main()
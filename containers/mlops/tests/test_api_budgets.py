@@ -0,0 +1,361 @@
+"""
+API call budgets of the reconciles: each test runs one operation against the in-memory API server of
+benchmarks/fake_kubernetes.py and checks the calls it sends, per verb and plural, against its budget. A change adding
+calls fails with the table of the calls over budget; when a change saves calls, lower the budget to lock the gain in.
+"""
+
+import asyncio
+import copy
+import time
+from typing import Dict, Iterator, List
+
+import pytest
+from benchmarks.bench_reconcile import reconcile
+from benchmarks.fake_kubernetes import FakeKubernetes, seed_endpoint
+from kubernetes import client as K8SClient
+from resources import Endpoint, EndpointConfig, Model
+from resources.mlops import client as MLOpsClient
+from utils.api_client import RecordingClient, get_api_client
+
+NAMESPACE = "titanic"
+MODELS = 2
+
+
+def over_budget(recorder: RecordingClient, budget: Dict[str, int]) -> List[str]:
+    """
+    The calls of the recorder exceeding the budget, as the rows of a table, empty if the budget holds.
+    @param budget: The allowed number of calls, by "verb plural", e.g. {"get machinelearningmodels": 1}.
+    """
+    actual = {f"{verb} {plural}": count for (verb, plural), count in recorder.summary().items()}
+    rows = [
+        f"{call:<50} {budget.get(call, 0):>6} {count:>6} {count - budget.get(call, 0):>+6}"
+        for call, count in actual.items()
+        if count > budget.get(call, 0)
+    ]
+    if rows:
+        rows.insert(0, f"{'call':<50} {'budget':>6} {'actual':>6} {'diff':>6}")
+    return rows
+
+
+def assert_within_budget(recorder: RecordingClient, budget: Dict[str, int]) -> None:
+    rows = over_budget(recorder, budget)
+    assert not rows, "API calls over budget:\n" + "\n".join(rows)
+
+
+@pytest.fixture
+def fake() -> Iterator[FakeKubernetes]:
+    fake = FakeKubernetes()
+    with fake.installed():
+        seed_endpoint(fake, namespace=NAMESPACE, name="titanic", models=MODELS)
+        yield fake
+
+
+@pytest.fixture
+def deployed(fake: FakeKubernetes) -> FakeKubernetes:
+    reconcile(NAMESPACE, "titanic")
+    return fake
+
+
+def get_endpoint_config_version(fake: FakeKubernetes) -> dict:
+    endpoint = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_PLURAL, "titanic", NAMESPACE)
+    return fake.get(
+        MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, endpoint["status"]["endpoint_config_version"], NAMESPACE
+    )
+
+
+def patch_spec(plural: str, name: str, spec: dict) -> None:
+    # Edit an object as a user would, outside of the recorded operation.
+    K8SClient.CustomObjectsApi(get_api_client()).patch_namespaced_custom_object(
+        MLOpsClient.GROUP, MLOpsClient.VERSION, NAMESPACE, plural, name, {"spec": spec}
+    )
+
+
+def test_over_budget_lists_the_extra_calls(fake):
+    with RecordingClient() as recorder:
+        Model(name="titanic-model-0", namespace=NAMESPACE)
+        Model(name="titanic-model-0", namespace=NAMESPACE)
+
+    rows = over_budget(recorder, {"get machinelearningmodels": 1})
+    assert len(rows) == 2
+    assert rows[1].split() == ["get", "machinelearningmodels", "1", "2", "+1"]
+    assert over_budget(recorder, {"get machinelearningmodels": 2}) == []
+
+
+def test_model_construction_budget(deployed):
+    name = get_endpoint_config_version(deployed)["status"]["model_versions"][0]
+    with RecordingClient() as recorder:
+        Model(name=name, namespace=NAMESPACE)
+    assert_within_budget(recorder, {"get machinelearningmodels": 1})
+
+
+def test_endpoint_create_handler_budget(fake):
+    with RecordingClient() as recorder:
+        Endpoint(name="titanic", namespace=NAMESPACE).create_handler()
+    assert_within_budget(
+        recorder,
+        {
+            "get machinelearningendpoints": 1,
+            "patch machinelearningendpoints/status": 1,
+            "get machinelearningendpointconfigs": 3,
+            "create machinelearningendpointconfigs": 1,
+            "patch machinelearningendpointconfigs/status": 1,
+            "get gateways": 2,
+            "create gateways": 1,
+        },
+    )
+
+
+def test_endpoint_config_weight_change_budget(deployed):
+    endpoint_config = get_endpoint_config_version(deployed)
+    old_models = endpoint_config["spec"]["models"]
+    new_models = copy.deepcopy(old_models)
+    new_models[0]["weight"], new_models[1]["weight"] = 80, 20
+    patch_spec(MLOpsClient.ENDPOINT_CONFIG_PLURAL, endpoint_config["metadata"]["name"], {"models": new_models})
+
+    with RecordingClient() as recorder:
+        EndpointConfig(name=endpoint_config["metadata"]["name"], namespace=NAMESPACE).update_handler(
+            (("change", ("spec", "models"), old_models, new_models),)
+        )
+    assert_within_budget(
+        recorder,
+        {
+            "get machinelearningendpointconfigs": 1,
+            # The route weights, shifted in a single JSON patch.
+            "patch virtualservices": 1,
+        },
+    )
+    virtual_service = deployed.get(
+        "networking.istio.io", "virtualservices", endpoint_config["metadata"]["name"], NAMESPACE
+    )
+    assert [http["route"][0]["weight"] for http in virtual_service["spec"]["http"]] == [80, 20]
+
+
+def test_endpoint_config_weight_change_of_stale_routes(deployed):
+    endpoint_config = get_endpoint_config_version(deployed)
+    name = endpoint_config["metadata"]["name"]
+    K8SClient.CustomObjectsApi(get_api_client()).patch_namespaced_custom_object(
+        "networking.istio.io", "v1beta1", NAMESPACE, "virtualservices", name, {"spec": {"http": []}}
+    )
+    old_models = endpoint_config["spec"]["models"]
+    new_models = copy.deepcopy(old_models)
+    new_models[0]["weight"], new_models[1]["weight"] = 80, 20
+    patch_spec(MLOpsClient.ENDPOINT_CONFIG_PLURAL, name, {"models": new_models})
+
+    # The routes don't match the model versions anymore: the virtual service is updated as a whole.
+    EndpointConfig(name=name, namespace=NAMESPACE).update_handler(
+        (("change", ("spec", "models"), old_models, new_models),)
+    )
+    virtual_service = deployed.get("networking.istio.io", "virtualservices", name, NAMESPACE)
+    assert [
+        (http["route"][0]["destination"]["host"], http["route"][0]["weight"])
+        for http in virtual_service["spec"]["http"]
+    ] == list(zip(endpoint_config["status"]["model_versions"], [80, 20]))
+
+
+def test_endpoint_config_reorder_budget(deployed):
+    endpoint_config = get_endpoint_config_version(deployed)
+    name = endpoint_config["metadata"]["name"]
+    old_models = endpoint_config["spec"]["models"]
+    new_models = copy.deepcopy(old_models[::-1])
+    new_models[0]["weight"], new_models[1]["weight"] = 80, 20
+    patch_spec(MLOpsClient.ENDPOINT_CONFIG_PLURAL, name, {"models": new_models})
+
+    # The models are matched by name: the model versions are kept, only the routes and the status are reordered.
+    with RecordingClient() as recorder:
+        EndpointConfig(name=name, namespace=NAMESPACE).update_handler(
+            (("change", ("spec", "models"), old_models, new_models),)
+        )
+    assert_within_budget(
+        recorder,
+        {
+            "get machinelearningendpointconfigs": 1,
+            "patch virtualservices": 1,
+            "patch machinelearningendpointconfigs/status": 1,
+        },
+    )
+    model_versions = endpoint_config["status"]["model_versions"][::-1]
+    assert get_endpoint_config_version(deployed)["status"]["model_versions"] == model_versions
+    virtual_service = deployed.get("networking.istio.io", "virtualservices", name, NAMESPACE)
+    assert [
+        (http["route"][0]["destination"]["host"], http["route"][0]["weight"])
+        for http in virtual_service["spec"]["http"]
+    ] == list(zip(model_versions, [80, 20]))
+    assert len(deployed.list("apps", "deployments", NAMESPACE)) == MODELS
+
+
+def test_endpoint_config_instances_change_budget(deployed):
+    endpoint_config = get_endpoint_config_version(deployed)
+    old_models = endpoint_config["spec"]["models"]
+    new_models = copy.deepcopy(old_models)
+    new_models[1]["instances"] = 3
+    patch_spec(MLOpsClient.ENDPOINT_CONFIG_PLURAL, endpoint_config["metadata"]["name"], {"models": new_models})
+
+    with RecordingClient() as recorder:
+        EndpointConfig(name=endpoint_config["metadata"]["name"], namespace=NAMESPACE).update_handler(
+            (("change", ("spec", "models"), old_models, new_models),)
+        )
+    assert_within_budget(
+        recorder,
+        {
+            "get machinelearningendpointconfigs": 1,
+            "get machinelearningmodels": 1,
+            # The instances label of the model version.
+            "patch machinelearningmodels": 1,
+            "get deployments": 1,
+            "patch deployments": 1,
+        },
+    )
+    name = endpoint_config["status"]["model_versions"][1]
+    assert deployed.get("apps", "deployments", name, NAMESPACE)["spec"]["replicas"] == 3
+    assert len(deployed.list("apps", "deployments", NAMESPACE)) == MODELS
+
+
+def test_model_artifact_change_budget(deployed):
+    name = get_endpoint_config_version(deployed)["status"]["model_versions"][0]
+    model = deployed.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, name, NAMESPACE)
+    patch_spec(MLOpsClient.MODEL_PLURAL, name, {"artifact": "s3://models/titanic-model-0-retrained"})
+
+    with RecordingClient() as recorder:
+        Model(name=name, namespace=NAMESPACE).update_handler(
+            (("change", ("spec", "artifact"), model["spec"]["artifact"], "s3://models/titanic-model-0-retrained"),)
+        )
+    assert_within_budget(
+        recorder,
+        {
+            # The current version, the version of the new content before it is created, and once created.
+            "get machinelearningmodels": 3,
+            "create machinelearningmodels": 1,
+            "patch machinelearningmodels/status": 1,
+            # The current version is released by its only user, then deleted.
+            "delete machinelearningmodels": 1,
+            # The endpoint config version using the current version, and read again by the new one.
+            "get machinelearningendpointconfigs": 2,
+            "get machinelearningendpoints": 1,
+            # The traffic routed to the new version.
+            "get virtualservices": 1,
+            "patch virtualservices": 1,
+            "patch machinelearningendpointconfigs/status": 1,
+            # Read by the new version before creating it, the children of the current version are left alone.
+            "get persistentvolumes": 1,
+            "create persistentvolumes": 1,
+            "get persistentvolumeclaims": 1,
+            "create persistentvolumeclaims": 1,
+            "get deployments": 1,
+            "create deployments": 1,
+            "get services": 1,
+            "create services": 1,
+        },
+    )
+    endpoint_config = get_endpoint_config_version(deployed)
+    model_versions = endpoint_config["status"]["model_versions"]
+    assert name not in model_versions
+    virtual_service = deployed.get(
+        "networking.istio.io", "virtualservices", endpoint_config["metadata"]["name"], NAMESPACE
+    )
+    assert [http["route"][0]["destination"]["host"] for http in virtual_service["spec"]["http"]] == model_versions
+
+
+@pytest.mark.parametrize(
+    "diff",
+    [
+        (),
+        (("change", ("metadata", "labels", "team"), "a", "b"),),
+    ],
+    ids=["no-op", "labels"],
+)
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_model_update_without_redeploy_leaves_the_children_alone(deployed, diff, asynchronous):
+    name = get_endpoint_config_version(deployed)["status"]["model_versions"][0]
+    with RecordingClient() as recorder:
+        model = Model(name=name, namespace=NAMESPACE)
+        if asynchronous:
+            asyncio.run(model.update_handler_async(diff))
+        else:
+            model.update_handler(diff)
+    assert_within_budget(recorder, {"get machinelearningmodels": 1})
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_endpoint_config_swap(deployed, asynchronous):
+    seed_endpoint(deployed, namespace=NAMESPACE, name="other", models=1)
+    previous = get_endpoint_config_version(deployed)
+    endpoint = deployed.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_PLURAL, "titanic", NAMESPACE)
+    patch_spec(MLOpsClient.ENDPOINT_PLURAL, "titanic", {"config": "other-config"})
+
+    diff = (("change", ("spec", "config"), endpoint["spec"]["config"], "other-config"),)
+    if asynchronous:
+        asyncio.run(Endpoint(name="titanic", namespace=NAMESPACE).update_handler_async(diff))
+    else:
+        Endpoint(name="titanic", namespace=NAMESPACE).update_handler(diff)
+    endpoint_config = get_endpoint_config_version(deployed)
+    assert endpoint_config["metadata"]["name"].startswith("other-config-")
+    (model_version,) = endpoint_config["status"]["model_versions"]
+    assert model_version.startswith("other-model-0-")
+    virtual_service = deployed.get(
+        "networking.istio.io", "virtualservices", endpoint_config["metadata"]["name"], NAMESPACE
+    )
+    assert [http["route"][0]["destination"]["host"] for http in virtual_service["spec"]["http"]] == [model_version]
+    # The previous endpoint config version is gone, and so are its model versions.
+    name = previous["metadata"]["name"]
+    assert deployed.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, name, NAMESPACE) is None
+    assert [deployment["metadata"]["name"] for deployment in deployed.list("apps", "deployments", NAMESPACE)] == [
+        model_version
+    ]
+
+
+def test_endpoint_config_swap_creates_the_variants_concurrently():
+    fake = FakeKubernetes(latency=0.01)
+    with fake.installed():
+        seed_endpoint(fake, namespace=NAMESPACE, name="titanic", models=1)
+        seed_endpoint(fake, namespace=NAMESPACE, name="other", models=10)
+        clone = EndpointConfig(name="other-config", namespace=NAMESPACE).clone(endpoint="titanic")
+
+        started = time.monotonic()
+        with RecordingClient() as recorder:
+            asyncio.run(clone.create_handler_async())
+        elapsed = time.monotonic() - started
+
+        # Far less than the latencies of the calls added up.
+        assert elapsed < recorder.total() * fake.latency / 2
+        assert len(clone.body.status.model_versions) == 10
+
+
+def test_endpoint_delete_cascade_budget(deployed):
+    endpoint_config = get_endpoint_config_version(deployed)
+    model_versions = endpoint_config["status"]["model_versions"]
+
+    with RecordingClient() as recorder:
+        endpoint = Endpoint(name="titanic", namespace=NAMESPACE)
+        # kopf runs the delete handlers of the endpoint and of its descendants before releasing their finalizers:
+        # everything being owned, they have nothing left to delete.
+        endpoint.delete_handler()
+        EndpointConfig(name=endpoint_config["metadata"]["name"], namespace=NAMESPACE).delete_handler()
+        for name in model_versions:
+            Model(name=name, namespace=NAMESPACE).delete_handler()
+        endpoint.delete()
+    assert_within_budget(
+        recorder,
+        {
+            "get machinelearningendpoints": 1,
+            "get machinelearningendpointconfigs": 2,
+            "get machinelearningmodels": MODELS,
+            "delete machinelearningendpoints": 1,
+        },
+    )
+    # The garbage collector deletes the tree, except the persistent volumes left to the orphan sweeper. The models and
+    # the endpoint config created by the user are kept.
+    for group, plural in (
+        ("networking.istio.io", "virtualservices"),
+        ("networking.istio.io", "gateways"),
+        ("apps", "deployments"),
+        ("", "services"),
+        ("", "persistentvolumeclaims"),
+    ):
+        assert deployed.list(group, plural, NAMESPACE) == []
+    assert len(deployed.list("", "persistentvolumes")) == MODELS
+    assert [item["metadata"]["name"] for item in deployed.list(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL)] == [
+        f"titanic-model-{n}" for n in range(MODELS)
+    ]
+    assert [
+        item["metadata"]["name"] for item in deployed.list(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL)
+    ] == ["titanic-config"]
@@ -0,0 +1,40 @@
+import socket
+import threading
+
+from benchmarks.bench_api_client import ApiStandIn
+from kubernetes import client as K8SClient
+from prometheus_client import REGISTRY
+from utils.api_client import ApiClientSettings, RecordingClient, connection_count, new_api_client
+
+
+def test_shared_client_reuses_connections():
+    server = ApiStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        configuration = K8SClient.Configuration()
+        configuration.host = server.host
+        api = K8SClient.CustomObjectsApi(new_api_client(configuration, ApiClientSettings()))
+
+        labels = {"verb": "get", "plural": "machinelearningmodels"}
+        count = REGISTRY.get_sample_value("mlops_api_request_duration_seconds_count", labels) or 0
+        with RecordingClient(api.api_client) as recorder:
+            for n in range(10):
+                result = api.get_namespaced_custom_object(
+                    "blue.intranet", "v1alpha1", "titanic", "machinelearningmodels", f"titanic-rfc-{n}"
+                )
+                assert result["metadata"]["name"] == f"titanic-rfc-{n}"
+
+        assert server.connections == 1
+        assert connection_count(api.api_client) == 1
+        assert recorder.summary() == {("get", "machinelearningmodels"): 10}
+        # All of them succeeded.
+        assert REGISTRY.get_sample_value("mlops_api_request_duration_seconds_count", labels) == count + 10
+    finally:
+        server.shutdown()
+
+
+def test_settings_enable_keepalive(monkeypatch):
+    monkeypatch.setenv("MLOPS_API_POOL_MAXSIZE", "4")
+    settings = ApiClientSettings()
+    assert settings.pool_maxsize == 4
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in settings.socket_options()
@@ -0,0 +1,144 @@
+import asyncio
+import copy
+
+from benchmarks.bench_reconcile import reconcile as reconcile_endpoint
+from benchmarks.fake_kubernetes import FakeKubernetes, seed_endpoint
+from kubernetes import client as K8SClient
+from resources import EndpointConfig
+from resources.mlops import client as MLOpsClient
+from utils.api_client import RecordingClient, get_api_client
+from utils.coalesce import Coalescer
+from utils.concurrency import run_bounded
+from utils.diff import diff
+
+NAMESPACE = "titanic"
+
+
+def get_endpoint_config(generation: int, weight: int) -> dict:
+    return {
+        "metadata": {"name": "titanic-config", "namespace": "titanic", "generation": generation},
+        "spec": {"models": [{"model": "titanic-rfc", "weight": weight}]},
+    }
+
+
+def test_diff_matches_kopf_format():
+    assert diff({"spec": {"image": "a", "args": None}}, {"spec": {"image": "b", "args": ["x"]}}) == (
+        ("change", ("spec", "image"), "a", "b"),
+        ("add", ("spec", "args"), None, ["x"]),
+    )
+    assert diff({"spec": {"models": [1]}}, {"spec": {"models": [1]}}) == ()
+
+
+def test_burst_of_updates_is_reconciled_once():
+    coalescer = Coalescer(window=0.05)
+    current = {"body": get_endpoint_config(1, 0)}
+    reconciles = []
+
+    async def burst():
+        for weight in range(1, 21):
+            current["body"] = get_endpoint_config(weight + 1, weight)
+            await asyncio.sleep(0.001)
+
+    async def kopf_worker(old: dict):
+        # Kopf calls the update handler of an object once per event, one event at a time.
+        results = []
+        for generation in range(2, 22):
+            results.append(
+                await coalescer.reconcile(
+                    ("machinelearningendpointconfigs", "titanic", "titanic-config"),
+                    generation,
+                    old,
+                    read=lambda: copy.deepcopy(current["body"]),
+                    handler=reconciles.append,
+                )
+            )
+        return results
+
+    async def main():
+        await asyncio.gather(burst(), kopf_worker(get_endpoint_config(1, 0)))
+
+    asyncio.run(main())
+
+    assert reconciles == [
+        (
+            (
+                "change",
+                ("spec", "models"),
+                [{"model": "titanic-rfc", "weight": 0}],
+                [{"model": "titanic-rfc", "weight": 20}],
+            ),
+        )
+    ]
+
+
+def test_events_within_the_window_patch_the_virtual_service_once():
+    fake = FakeKubernetes()
+    with fake.installed():
+        seed_endpoint(fake, namespace=NAMESPACE, name="titanic", models=2)
+        reconcile_endpoint(NAMESPACE, "titanic")
+        endpoint = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_PLURAL, "titanic", NAMESPACE)
+        name = endpoint["status"]["endpoint_config_version"]
+        old = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, name, NAMESPACE)
+        api = MLOpsClient.V1Alpha1Api()
+        coalescer = Coalescer(window=0.1)
+        handled = []
+
+        def handler(net_diff):
+            handled.append(net_diff)
+            return EndpointConfig(name=name, namespace=NAMESPACE).update_handler(net_diff)
+
+        async def event(weight: int):
+            models = copy.deepcopy(old["spec"]["models"])
+            models[0]["weight"], models[1]["weight"] = weight, 100 - weight
+            body = await run_bounded(
+                K8SClient.CustomObjectsApi(get_api_client()).patch_namespaced_custom_object,
+                MLOpsClient.GROUP,
+                MLOpsClient.VERSION,
+                NAMESPACE,
+                MLOpsClient.ENDPOINT_CONFIG_PLURAL,
+                name,
+                {"spec": {"models": models}},
+            )
+            # Each event is handled as it arrives, without waiting for the previous ones.
+            return await coalescer.reconcile(
+                (MLOpsClient.ENDPOINT_CONFIG_PLURAL, NAMESPACE, name),
+                body["metadata"]["generation"],
+                old,
+                read=lambda: api.read_namespaced(name, NAMESPACE, MLOpsClient.ENDPOINT_CONFIG_PLURAL),
+                handler=handler,
+            )
+
+        async def burst():
+            events = []
+            for weight in range(51, 61):
+                events.append(asyncio.create_task(event(weight)))
+                await asyncio.sleep(0.001)
+            await asyncio.gather(*events)
+
+        with RecordingClient() as recorder:
+            asyncio.run(burst())
+
+    assert len(handled) == 1
+    assert recorder.calls[("patch", "virtualservices")] == 1
+    virtual_service = fake.get("networking.istio.io", "virtualservices", name, NAMESPACE)
+    assert [http["route"][0]["weight"] for http in virtual_service["spec"]["http"]] == [60, 40]
+
+
+def test_coroutine_handlers_are_awaited():
+    coalescer = Coalescer(window=0)
+    reconciles = []
+
+    async def handler(net_diff):
+        reconciles.append(net_diff)
+        return len(net_diff)
+
+    result = asyncio.run(
+        coalescer.reconcile(
+            ("machinelearningendpointconfigs", "titanic", "titanic-config"),
+            2,
+            get_endpoint_config(1, 10),
+            read=lambda: get_endpoint_config(2, 20),
+            handler=handler,
+        )
+    )
+    assert result == 1 and len(reconciles) == 1
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+import time
+
+from utils import concurrency
+from utils.concurrency import AsyncApi, gather_bounded
+
+
+def test_gather_bounded_limits_in_flight_calls(monkeypatch):
+    monkeypatch.setattr(concurrency, "MAX_CONCURRENCY", 3)
+    lock = threading.Lock()
+    in_flight = {"now": 0, "max": 0}
+
+    def call(n: int) -> int:
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        time.sleep(0.05)
+        with lock:
+            in_flight["now"] -= 1
+        return n
+
+    started = time.monotonic()
+    results = asyncio.run(gather_bounded([lambda n=n: call(n) for n in range(9)]))
+    elapsed = time.monotonic() - started
+
+    assert results == list(range(9))
+    assert in_flight["max"] == 3
+    assert elapsed < 9 * 0.05
+
+
+def test_async_api_wraps_client_methods():
+    class Api:
+        group = "blue.intranet"
+
+        def read_namespaced(self, name: str, namespace: str = "default") -> str:
+            return f"{namespace}/{name}"
+
+    api = AsyncApi(Api())
+    assert api.group == "blue.intranet"
+    assert asyncio.run(api.read_namespaced("titanic-rfc", namespace="titanic")) == "titanic/titanic-rfc"
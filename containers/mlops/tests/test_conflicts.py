@@ -0,0 +1,102 @@
+import pytest
+from benchmarks.fake_kubernetes import FakeKubernetes, seed_endpoint
+from kubernetes import client as K8SClient
+from kubernetes.client.rest import ApiException
+from resources import Endpoint, EndpointConfig
+from resources.mlops import client as MLOpsClient
+from resources.planner import Plan, Resource, managed, serialize
+from utils.api_client import RecordingClient, get_api_client
+from utils.conflicts import is_conflict, retry_on_conflict
+from utils.patch import MERGE_PATCH
+
+NAMESPACE = "titanic"
+
+
+@pytest.fixture
+def fake():
+    fake = FakeKubernetes()
+    with fake.installed():
+        seed_endpoint(fake, namespace=NAMESPACE, name="titanic", models=1)
+        yield fake
+
+
+def touch(plural: str, name: str) -> None:
+    # Another writer changes the object between the read and the write of the operator.
+    K8SClient.CustomObjectsApi(get_api_client()).patch_namespaced_custom_object(
+        MLOpsClient.GROUP, MLOpsClient.VERSION, NAMESPACE, plural, name, {"metadata": {"labels": {"team": "data"}}}
+    )
+
+
+def test_conflicting_update_costs_one_round_trip(fake):
+    endpoint = Endpoint(name="titanic", namespace=NAMESPACE)
+    touch(MLOpsClient.ENDPOINT_PLURAL, "titanic")
+
+    with RecordingClient() as recorder:
+        endpoint.update(host="titanic.example.org")
+    # The rejected patch, the fresh read and the patch computed from it.
+    assert recorder.summary() == {("get", MLOpsClient.ENDPOINT_PLURAL): 1, ("patch", MLOpsClient.ENDPOINT_PLURAL): 2}
+
+    stored = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_PLURAL, "titanic", NAMESPACE)
+    assert stored["spec"]["host"] == "titanic.example.org"
+    assert stored["metadata"]["labels"]["team"] == "data"
+
+
+def test_conflicting_finalizers_patch_is_retried(fake):
+    endpoint_config = EndpointConfig(name="titanic-config", namespace=NAMESPACE)
+    touch(MLOpsClient.ENDPOINT_CONFIG_PLURAL, "titanic-config")
+
+    endpoint_config.add_finalizers(["titanic-model-0"])
+    stored = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, "titanic-config", NAMESPACE)
+    assert stored["metadata"]["finalizers"] == ["titanic-model-0"]
+    assert stored["metadata"]["labels"]["team"] == "data"
+
+
+def test_conflicting_plan_operation_is_planned_again(fake):
+    apps = K8SClient.AppsV1Api(get_api_client())
+    desired = serialize(
+        K8SClient.V1Deployment(
+            metadata=K8SClient.V1ObjectMeta(name="titanic-rfc-1", namespace=NAMESPACE),
+            spec=K8SClient.V1DeploymentSpec(
+                replicas=1,
+                selector=K8SClient.V1LabelSelector(match_labels={"model": "titanic-rfc-1"}),
+                template=K8SClient.V1PodTemplateSpec(),
+            ),
+        )
+    )
+    observed = serialize(apps.create_namespaced_deployment(namespace=NAMESPACE, body=desired))
+    desired["spec"]["replicas"] = 2
+    plan = Plan.from_resources(
+        [Resource("Deployment", NAMESPACE, "titanic-rfc-1", desired, managed(desired), observed)]
+    )
+    apps.patch_namespaced_deployment(
+        name="titanic-rfc-1",
+        namespace=NAMESPACE,
+        body={"metadata": {"labels": {"team": "data"}}},
+        _content_type=MERGE_PATCH,
+    )
+
+    plan.apply(dry_run=False)
+    assert fake.get("apps", "deployments", "titanic-rfc-1", NAMESPACE)["spec"]["replicas"] == 2
+    assert fake.calls[("patch", "deployments")] == 3
+
+
+def test_retries_are_bounded():
+    attempts, refreshes = [], []
+
+    def write():
+        attempts.append(1)
+        raise ApiException(status=409, reason="Conflict")
+
+    with pytest.raises(ApiException):
+        retry_on_conflict(write, lambda: refreshes.append(1), retries=2)
+    assert (len(attempts), len(refreshes)) == (3, 2)
+
+
+def test_only_failed_preconditions_are_conflicts():
+    assert is_conflict(ApiException(status=409, reason="Conflict"))
+    assert is_conflict(ApiException(status=422, reason="testing value /metadata/resourceVersion failed: test failed"))
+    assert not is_conflict(ApiException(status=422, reason="spec.replicas: Invalid value"))
+    exists = ApiException(status=409, reason="Conflict")
+    exists.body = '{"kind": "Status", "reason": "AlreadyExists", "code": 409}'
+    assert not is_conflict(exists)
+    assert not is_conflict(ApiException(status=500, reason="Internal Server Error"))
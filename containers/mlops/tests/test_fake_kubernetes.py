@@ -0,0 +1,112 @@
+import pytest
+from benchmarks.fake_kubernetes import FakeKubernetes, seed_endpoint
+from kubernetes import client as K8SClient
+from kubernetes.client.rest import ApiException
+from prometheus_client import REGISTRY
+from resources import Endpoint, EndpointConfig
+from resources.mlops import client as MLOpsClient
+from utils.ratelimit import RetryPolicy
+
+GROUP, VERSION, PLURAL = "blue.intranet", "v1alpha1", "machinelearningmodels"
+
+
+def get_model(name: str, labels: dict = None) -> dict:
+    return {
+        "apiVersion": f"{GROUP}/{VERSION}",
+        "kind": "MachineLearningModel",
+        "metadata": {"name": name, "labels": labels or {}},
+        "spec": {"image": "model:v1"},
+    }
+
+
+def test_custom_objects_follow_the_api_server_semantics():
+    fake = FakeKubernetes()
+    api = K8SClient.CustomObjectsApi(fake.api_client())
+
+    created = api.create_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, get_model("rfc"))
+    assert created["metadata"]["generation"] == 1
+    with pytest.raises(ApiException) as err:
+        api.create_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, get_model("rfc"))
+    assert err.value.status == 409
+
+    patched = api.patch_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, "rfc", {"spec": {"image": "v2"}})
+    assert patched["metadata"]["generation"] == 2
+    assert int(patched["metadata"]["resourceVersion"]) > int(created["metadata"]["resourceVersion"])
+
+    status = api.patch_namespaced_custom_object_status(
+        GROUP, VERSION, "titanic", PLURAL, "rfc", {"status": {"state": "available"}}
+    )
+    assert status["metadata"]["generation"] == 2
+    assert fake.get(GROUP, PLURAL, "rfc", "titanic")["status"] == {"state": "available"}
+
+    stale = dict(patched, spec={"image": "v3"})
+    with pytest.raises(ApiException) as err:
+        api.replace_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, "rfc", stale)
+    assert err.value.status == 409
+
+    with pytest.raises(ApiException) as err:
+        api.get_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, "missing")
+    assert err.value.status == 404
+
+
+def test_finalizers_hold_the_deletion():
+    fake = FakeKubernetes()
+    api = K8SClient.CustomObjectsApi(fake.api_client())
+    body = get_model("rfc")
+    body["metadata"]["finalizers"] = ["kopf"]
+    api.create_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, body)
+
+    api.delete_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, "rfc")
+    assert fake.get(GROUP, PLURAL, "rfc", "titanic")["metadata"]["deletionTimestamp"]
+
+    api.patch_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, "rfc", {"metadata": {"finalizers": []}})
+    assert fake.get(GROUP, PLURAL, "rfc", "titanic") is None
+
+
+def test_lists_are_filtered_and_paged():
+    fake = FakeKubernetes()
+    for n in range(5):
+        fake.create(GROUP, VERSION, PLURAL, get_model(f"rfc-{n}", {"model": "rfc" if n % 2 else "svm"}), "titanic")
+    api = K8SClient.CustomObjectsApi(fake.api_client())
+
+    selected = api.list_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, label_selector="model=rfc")
+    assert [item["metadata"]["name"] for item in selected["items"]] == ["rfc-1", "rfc-3"]
+
+    names, token = [], None
+    while True:
+        page = api.list_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, limit=2, _continue=token)
+        names += [item["metadata"]["name"] for item in page["items"]]
+        token = page["metadata"].get("continue")
+        if not token:
+            break
+    assert names == [f"rfc-{n}" for n in range(5)]
+
+
+def test_injected_errors_are_counted_as_failed_calls():
+    fake = FakeKubernetes(error_rate=1.0, error_status=429, seed=0)
+    api = K8SClient.CustomObjectsApi(fake.api_client(retry=RetryPolicy(retries=0)))
+    labels = {"verb": "get", "plural": PLURAL, "code": "429"}
+    errors = REGISTRY.get_sample_value("mlops_api_request_error_duration_seconds_count", labels) or 0
+
+    with pytest.raises(ApiException) as err:
+        api.get_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, "rfc")
+    assert err.value.status == 429
+    assert err.value.headers["Retry-After"] == "1"
+    assert REGISTRY.get_sample_value("mlops_api_request_error_duration_seconds_count", labels) == errors + 1
+
+
+def test_endpoint_pipeline_runs_against_the_fake():
+    fake = FakeKubernetes()
+    with fake.installed():
+        seed_endpoint(fake, namespace="titanic", name="titanic", models=2)
+        endpoint = Endpoint(name="titanic", namespace="titanic").create_handler()
+        endpoint_config = EndpointConfig(name=endpoint.body.status.endpoint_config_version, namespace="titanic")
+        endpoint_config.create_handler()
+        for model in endpoint_config.get_models():
+            model.create_handler()
+
+    assert len(fake.list("apps", "deployments", "titanic")) == 2
+    assert len(fake.list("networking.istio.io", "virtualservices", "titanic")) == 1
+    versions = fake.list(GROUP, MLOpsClient.MODEL_PLURAL, "titanic")
+    assert len(versions) == 4
+    assert fake.calls[("create", "deployments")] == 2
@@ -0,0 +1,97 @@
+import asyncio
+
+import kopf
+import mlops
+from benchmarks.bench_reconcile import reconcile
+from benchmarks.fake_kubernetes import FakeKubernetes, seed_endpoint
+from resources import EndpointConfig, Model
+from resources.mlops import client as MLOpsClient
+from utils.generation import changes_paths, is_observed
+
+NAMESPACE = "titanic"
+RESOURCE = kopf.Resource(MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.ENDPOINT_CONFIG_PLURAL)
+
+WEIGHTS = (("change", ("spec", "models"), [{"weight": 50}], [{"weight": 80}]),)
+LABELS = (("add", ("metadata", "labels", "instances"), None, "3"),)
+
+
+def test_only_changes_of_the_watched_paths_are_handled():
+    assert changes_paths(WEIGHTS)
+    assert changes_paths((("add", (), None, {"spec": {}}),))
+    assert not changes_paths(LABELS)
+    assert not changes_paths(WEIGHTS, paths=[("spec", "host")])
+    assert changes_paths(WEIGHTS + LABELS, paths=[("spec", "host"), ("spec", "models")])
+
+
+def test_a_generation_already_reconciled_is_observed():
+    assert not is_observed({"generation": 2}, None)
+    assert not is_observed({"generation": 2}, {"observedGeneration": 1})
+    assert is_observed({"generation": 2}, {"observedGeneration": 2})
+    # Objects without a generation can't be told apart, they are always handled.
+    assert not is_observed({}, {"observedGeneration": 2})
+
+
+def test_the_events_of_the_operator_writes_are_dropped():
+    fake = FakeKubernetes()
+    with fake.installed():
+        seed_endpoint(fake, namespace=NAMESPACE, name="titanic", models=1)
+        config = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, "titanic-config", NAMESPACE)
+
+        def handled(diff):
+            return mlops.spec_changed(resource=RESOURCE, diff=diff, meta=config["metadata"], status=config["status"])
+
+        generation = config["metadata"]["generation"]
+        assert handled(WEIGHTS) and not handled(LABELS)
+
+        asyncio.run(
+            mlops.observe_generation(
+                MLOpsClient.ENDPOINT_CONFIG_PLURAL, "titanic-config", NAMESPACE, config["status"], generation
+            )
+        )
+        config = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, "titanic-config", NAMESPACE)
+        assert config["status"]["observedGeneration"] == generation
+        # The event of the status write, or of the same generation replayed, is dropped, the next spec change isn't.
+        assert not handled(WEIGHTS)
+        config["metadata"]["generation"] = generation + 1
+        assert handled(WEIGHTS)
+
+        # Nothing to record for an object replaced in the meantime.
+        asyncio.run(mlops.observe_generation(MLOpsClient.MODEL_PLURAL, "gone", NAMESPACE, None, generation))
+
+
+def test_base_objects_keep_their_names_once_observed():
+    fake = FakeKubernetes()
+    with fake.installed():
+        seed_endpoint(fake, namespace=NAMESPACE, name="titanic", models=1)
+        # As applied by a user: no status.
+        api = MLOpsClient.V1Alpha1Api()
+        for plural, name in (
+            (MLOpsClient.MODEL_PLURAL, "titanic-model-0"),
+            (MLOpsClient.ENDPOINT_CONFIG_PLURAL, "titanic-config"),
+        ):
+            body = fake.get(MLOpsClient.GROUP, plural, name, NAMESPACE)
+            api.delete_namespaced(name, NAMESPACE, plural)
+            body["metadata"] = {key: body["metadata"][key] for key in ("name", "namespace", "labels", "finalizers")}
+            del body["status"]
+            fake.create(MLOpsClient.GROUP, MLOpsClient.VERSION, plural, body, namespace=NAMESPACE)
+
+        for generation in (1, 2):
+            asyncio.run(
+                mlops.observe_generation(MLOpsClient.MODEL_PLURAL, "titanic-model-0", NAMESPACE, None, generation)
+            )
+            asyncio.run(
+                mlops.observe_generation(
+                    MLOpsClient.ENDPOINT_CONFIG_PLURAL, "titanic-config", NAMESPACE, None, generation
+                )
+            )
+            assert Model(name="titanic-model-0", namespace=NAMESPACE).name == "titanic-model-0"
+            endpoint_config = EndpointConfig(name="titanic-config", namespace=NAMESPACE)
+            assert endpoint_config.name == "titanic-config" and endpoint_config.get_endpoint() is None
+
+        # The versions cloned from the base objects are still named after them.
+        reconcile(NAMESPACE, "titanic")
+        endpoint = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_PLURAL, "titanic", NAMESPACE)
+        endpoint_config_version = endpoint["status"]["endpoint_config_version"]
+        assert endpoint_config_version.startswith("titanic-config-")
+        version = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, endpoint_config_version, NAMESPACE)
+        assert all(name.startswith("titanic-model-0-") for name in version["status"]["model_versions"])
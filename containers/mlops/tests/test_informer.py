@@ -0,0 +1,189 @@
+import time
+
+from resources.mlops import client as MLOpsClient
+from urllib3.exceptions import ProtocolError
+from utils import informer as informer_module
+from utils.informer import (
+    Informer,
+    Store,
+    label_indexer,
+    owner_index,
+    owner_indexer,
+    register_informer,
+    stop_informers,
+)
+
+
+def get_model(name: str, resource_version: str, image: str = "model:latest", labels: dict = None) -> dict:
+    return {
+        "apiVersion": "blue.intranet/v1alpha1",
+        "kind": "MachineLearningModel",
+        "metadata": {"name": name, "namespace": "titanic", "resourceVersion": resource_version, "labels": labels or {}},
+        "spec": {"image": image, "artifact": None, "command": None, "args": None},
+        "status": None,
+    }
+
+
+class CountingCustomObjectsApi:
+    def __init__(self, objects: list):
+        self.objects = objects
+        self.gets = 0
+
+    def list_cluster_custom_object(self, group, version, plural, **kwargs):
+        return {"metadata": {"resourceVersion": "10"}, "items": self.objects}
+
+    def get_namespaced_custom_object(self, group, version, namespace, plural, name):
+        self.gets += 1
+        return get_model(name, "1")
+
+    def patch_namespaced_custom_object(self, group, version, namespace, plural, name, body, **kwargs):
+        return get_model(name, "12", image=body["spec"]["image"])
+
+
+def test_store_ignores_stale_resource_versions():
+    store = Store()
+    assert store.put(get_model("titanic-rfc", "5"))
+    assert not store.put(get_model("titanic-rfc", "4", image="stale"))
+    assert store.get("titanic", "titanic-rfc")["spec"]["image"] == "model:latest"
+
+    store.delete("titanic", "titanic-rfc")
+    assert store.get("titanic", "titanic-rfc") is None
+    assert not store.put(get_model("titanic-rfc", "3"))
+
+
+def test_store_forgets_the_oldest_deletions(monkeypatch):
+    monkeypatch.setattr(informer_module, "MAX_TOMBSTONES", 2)
+    store = Store()
+    for name in ("titanic-a", "titanic-b", "titanic-c"):
+        store.delete("titanic", name, 5)
+    # The oldest deletion is forgotten, the newest ones still reject stale writes.
+    assert store.put(get_model("titanic-a", "3"))
+    assert not store.put(get_model("titanic-c", "3"))
+
+
+class BrokenWatchApi(CountingCustomObjectsApi):
+    def __init__(self, objects: list):
+        super().__init__(objects)
+        self.informer = None
+        self.synced_on_list = []
+
+    def list_cluster_custom_object(self, group, version, plural, **kwargs):
+        if kwargs.get("watch"):
+            raise ProtocolError("Connection broken: ConnectionResetError(104, 'Connection reset by peer')")
+        self.synced_on_list.append(self.informer.synced.is_set())
+        return super().list_cluster_custom_object(group, version, plural, **kwargs)
+
+
+def test_informer_survives_transport_errors(monkeypatch):
+    monkeypatch.setattr(informer_module, "RESTART_BACKOFF", 0.01)
+    api = BrokenWatchApi([get_model("titanic-rfc", "5")])
+    informer = Informer(MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.MODEL_PLURAL, api=api)
+    api.informer = informer
+    informer.start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(api.synced_on_list) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert informer._thread.is_alive()
+    finally:
+        informer.stop()
+    # Each failure marks the store stale, so the reads go to the API server until it is listed again.
+    assert api.synced_on_list[:3] == [False, False, False]
+
+
+def test_informer_applies_watch_events():
+    informer = Informer(
+        MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.MODEL_PLURAL, api=CountingCustomObjectsApi([])
+    )
+    informer.relist()
+    informer.apply({"type": "ADDED", "object": get_model("titanic-rfc", "11")})
+    assert informer.get("titanic", "titanic-rfc")["metadata"]["resourceVersion"] == "11"
+    assert informer.resource_version == "11"
+
+    informer.apply({"type": "DELETED", "object": get_model("titanic-rfc", "13")})
+    assert informer.get("titanic", "titanic-rfc") is None
+
+
+def test_reads_are_served_from_the_informer():
+    api = CountingCustomObjectsApi([get_model("titanic-rfc", "9")])
+    informer = register_informer(Informer(MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.MODEL_PLURAL, api=api))
+    try:
+        informer.relist()
+        client = MLOpsClient.V1Alpha1Api(api=api)
+
+        model = client.read_namespaced_model("titanic-rfc", "titanic")
+        assert model.spec.image == "model:latest"
+        assert api.gets == 0
+
+        client.patch_namespaced_model("titanic-rfc", "titanic", {"spec": {"image": "model:v2"}})
+        assert client.read_namespaced_model("titanic-rfc", "titanic").spec.image == "model:v2"
+
+        client.read_namespaced_model("titanic-lr", "titanic")
+        assert api.gets == 1
+    finally:
+        stop_informers()
+
+
+def test_store_index_follows_label_changes():
+    store = Store({"endpoint_config_version": label_indexer("endpoint_config_version")})
+    store.replace([get_model("titanic-rfc-1", "1", labels={"endpoint_config_version": "titanic-config-1"})])
+    store.put(get_model("titanic-lr-1", "2", labels={"endpoint_config_version": "titanic-config-1"}))
+    assert [
+        obj["metadata"]["name"] for obj in store.by_index("endpoint_config_version", "titanic", "titanic-config-1")
+    ] == [
+        "titanic-lr-1",
+        "titanic-rfc-1",
+    ]
+
+    store.put(get_model("titanic-lr-1", "3", labels={"endpoint_config_version": "titanic-config-2"}))
+    store.delete("titanic", "titanic-rfc-1")
+    assert store.by_index("endpoint_config_version", "titanic", "titanic-config-1") == []
+    assert len(store.by_index("endpoint_config_version", "titanic", "titanic-config-2")) == 1
+    assert store.by_index("endpoint_config_version", "other", "titanic-config-2") == []
+
+
+def test_store_indexes_shared_objects_under_each_owner():
+    def owned(name: str, resource_version: str, *owners: str) -> dict:
+        model = get_model(name, resource_version)
+        model["metadata"]["ownerReferences"] = [
+            {"kind": "MachineLearningEndpointConfig", "name": owner, "uid": owner} for owner in owners
+        ]
+        return model
+
+    index = owner_index("MachineLearningEndpointConfig")
+    store = Store({index: owner_indexer("MachineLearningEndpointConfig")})
+    store.replace([owned("titanic-rfc-1", "1", "titanic-config-1", "titanic-b-config-1")])
+    assert [obj["metadata"]["name"] for obj in store.by_index(index, "titanic", "titanic-b-config-1")] == [
+        "titanic-rfc-1"
+    ]
+
+    store.put(owned("titanic-rfc-1", "2", "titanic-b-config-1"))
+    assert store.by_index(index, "titanic", "titanic-config-1") == []
+    assert len(store.by_index(index, "titanic", "titanic-b-config-1")) == 1
+
+
+def test_label_lookups_are_served_from_the_index():
+    api = CountingCustomObjectsApi(
+        [
+            get_model("titanic-rfc-1", "1", labels={"endpoint_config_version": "titanic-config-1"}),
+            get_model("titanic-lr-1", "2", labels={"endpoint_config_version": "titanic-config-2"}),
+        ]
+    )
+    informer = register_informer(
+        Informer(
+            MLOpsClient.GROUP,
+            MLOpsClient.VERSION,
+            MLOpsClient.MODEL_PLURAL,
+            api=api,
+            indexers={"endpoint_config_version": label_indexer("endpoint_config_version")},
+        )
+    )
+    try:
+        informer.relist()
+        client = MLOpsClient.V1Alpha1Api(api=api)
+
+        models = client.list_namespaced_models_by_label("endpoint_config_version", "titanic-config-1", "titanic")
+        assert [model.metadata.name for model in models] == ["titanic-rfc-1"]
+        assert api.gets == 0
+    finally:
+        stop_informers()
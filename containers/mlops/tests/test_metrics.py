@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from kubernetes import client as K8SClient
+from prometheus_client import REGISTRY
+from utils import metrics
+from utils.metrics import describe_request, observe_api_request, timed
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_describe_request():
+    base = "https://10.0.0.1:443"
+    assert describe_request("GET", f"{base}/apis/apps/v1/namespaces/ml/deployments/titanic-rfc") == (
+        "get",
+        "deployments",
+    )
+    assert describe_request("GET", f"{base}/apis/blue.intranet/v1alpha1/namespaces/ml/models?limit=500") == (
+        "list",
+        "models",
+    )
+    assert describe_request("GET", f"{base}/apis/blue.intranet/v1alpha1/models?watch=True") == ("watch", "models")
+    assert describe_request("PATCH", f"{base}/apis/blue.intranet/v1alpha1/namespaces/ml/models/titanic/status") == (
+        "patch",
+        "models/status",
+    )
+    assert describe_request("POST", f"{base}/api/v1/namespaces/ml/services") == ("create", "services")
+    assert describe_request("DELETE", f"{base}/api/v1/persistentvolumes/titanic-pv") == ("delete", "persistentvolumes")
+    assert describe_request("GET", f"{base}/api/v1/namespaces/ml") == ("get", "namespaces")
+
+
+def test_api_requests_are_recorded_by_verb_and_plural():
+    url = "https://10.0.0.1/apis/networking.istio.io/v1beta1/namespaces/ml/virtualservices/titanic"
+    count = sample("mlops_api_request_duration_seconds_count", verb="patch", plural="virtualservices")
+    errors = sample(
+        "mlops_api_request_error_duration_seconds_count", verb="patch", plural="virtualservices", code="429"
+    )
+
+    observe_api_request("PATCH", url, 0.01)
+    observe_api_request("PATCH", url, 0.5, error=K8SClient.ApiException(status=429))
+    observe_api_request("GET", "https://10.0.0.1/apis/networking.istio.io/v1beta1/virtualservices?watch=true", 300)
+
+    assert sample("mlops_api_request_duration_seconds_count", verb="patch", plural="virtualservices") == count + 1
+    assert (
+        sample("mlops_api_request_error_duration_seconds_count", verb="patch", plural="virtualservices", code="429")
+        == errors + 1
+    )
+    assert sample("mlops_api_request_duration_seconds_count", verb="watch", plural="virtualservices") == 0
+
+
+def test_handlers_are_timed_with_their_outcome():
+    @timed
+    async def reconcile_fn(fail: bool = False):
+        if fail:
+            raise ValueError("boom")
+        return "done"
+
+    assert asyncio.run(reconcile_fn()) == "done"
+    with pytest.raises(ValueError):
+        asyncio.run(reconcile_fn(fail=True))
+
+    assert sample("mlops_reconcile_duration_seconds_count", handler="reconcile_fn", outcome="success") == 1
+    assert sample("mlops_reconcile_duration_seconds_count", handler="reconcile_fn", outcome="error") == 1
+    assert metrics.enabled()
@@ -0,0 +1,100 @@
+import json
+
+from resources.mlops import client as MLOpsClient
+
+
+def get_model(n: int) -> dict:
+    return {
+        "apiVersion": "blue.intranet/v1alpha1",
+        "kind": "MachineLearningModel",
+        "metadata": {"name": f"titanic-rfc-{n}", "namespace": "titanic", "resourceVersion": str(n)},
+        "spec": {"image": "model:latest", "artifact": None, "command": None, "args": None},
+        "status": None,
+    }
+
+
+class PagedCustomObjectsApi:
+    def __init__(self, count: int, continue_on_last_page: bool = False):
+        self.count = count
+        self.continue_on_last_page = continue_on_last_page
+        self.calls = []
+
+    def list_namespaced_custom_object(self, group, version, namespace, plural, **kwargs):
+        self.calls.append(kwargs)
+        start = int(kwargs.get("_continue") or 0)
+        end = min(start + kwargs["limit"], self.count)
+        metadata = {"resourceVersion": "1"}
+        if end < self.count:
+            metadata["continue"] = str(end)
+        elif self.continue_on_last_page:
+            metadata["continue"] = ""
+        return {"metadata": metadata, "items": [get_model(n) for n in range(start, end)]}
+
+
+def test_iter_namespaced_streams_pages():
+    api = PagedCustomObjectsApi(count=25)
+    client = MLOpsClient.V1Alpha1Api(api=api)
+
+    models = client.iter_namespaced(namespace="titanic", plural=MLOpsClient.MODEL_PLURAL, limit=10)
+    assert not api.calls
+    assert next(models)["metadata"]["name"] == "titanic-rfc-0"
+    assert len(api.calls) == 1
+    assert len(list(models)) == 24
+    assert [call.get("_continue") for call in api.calls] == [None, "10", "20"]
+
+
+def test_iter_namespaced_stops_without_continue_token():
+    api = PagedCustomObjectsApi(count=5, continue_on_last_page=True)
+    client = MLOpsClient.V1Alpha1Api(api=api)
+
+    assert len(client.list_namespaced_models(namespace="titanic")) == 5
+    assert len(api.calls) == 1
+
+
+def test_iter_namespaced_model_versions():
+    client = MLOpsClient.V1Alpha1Api(api=PagedCustomObjectsApi(count=3))
+
+    versions = list(client.iter_namespaced_model_versions(namespace="titanic", limit=2))
+    assert versions[2] == MLOpsClient.V1Alpha1ObjectVersion("titanic", "titanic-rfc-2", "2")
+
+
+class RawResponse:
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class RawCustomObjectsApi:
+    def get_namespaced_custom_object(self, group, version, namespace, plural, name, _preload_content=True):
+        assert not _preload_content
+        model = get_model(1)
+        model["metadata"]["name"] = name
+        model["status"] = {
+            "endpoint": None,
+            "endpoint_config": None,
+            "endpoint_config_version": None,
+            "model": "titanic-rfc",
+            "version": "1",
+            "state": "available",
+        }
+        return RawResponse(json.dumps(model).encode())
+
+
+def test_trusted_read():
+    client = MLOpsClient.V1Alpha1Api(api=RawCustomObjectsApi(), trusted=True)
+
+    model = client.read_namespaced_model("titanic-rfc-1", namespace="titanic")
+    assert isinstance(model, MLOpsClient.V1Alpha1Model)
+    assert isinstance(model.metadata, MLOpsClient.V1Alpha1ObjectMeta)
+    assert model.metadata.name == "titanic-rfc-1"
+    assert model.metadata.finalizers == []
+    assert model.status.state == MLOpsClient.V1Alpha1State.AVAILABLE
+    assert model.spec.artifact is None
+    assert model.dict() == MLOpsClient.V1Alpha1Model.parse_obj(model.dict()).dict()
+
+
+def test_label_lookups_fall_back_to_a_selected_list():
+    api = PagedCustomObjectsApi(count=3)
+    client = MLOpsClient.V1Alpha1Api(api=api)
+
+    assert len(client.list_namespaced_models_by_label("endpoint_config_version", "titanic-config-1", "titanic")) == 3
+    assert [call["label_selector"] for call in api.calls] == ["endpoint_config_version=titanic-config-1"]
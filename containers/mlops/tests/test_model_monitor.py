@@ -0,0 +1,29 @@
+from resources.mlops import client as MLOpsClient
+from resources.model_monitor import ModelMonitor
+
+
+def get_deployment(available: int, replicas: int = 2, generation: int = 1, observed: int = 1) -> dict:
+    return {
+        "metadata": {"name": "titanic-rfc-0001", "namespace": "titanic", "generation": generation},
+        "spec": {"replicas": replicas},
+        "status": {"observedGeneration": observed, "updatedReplicas": available, "availableReplicas": available},
+    }
+
+
+def test_is_ready():
+    assert ModelMonitor.is_ready(get_deployment(available=2))
+    assert not ModelMonitor.is_ready(get_deployment(available=1))
+    assert not ModelMonitor.is_ready(get_deployment(available=2, generation=2, observed=1))
+
+
+def test_only_transitions_are_dispatched():
+    monitor = ModelMonitor()
+    assert monitor.transition(None, get_deployment(available=0)) is None
+    assert monitor.transition("MODIFIED", get_deployment(available=1)) is None
+    assert monitor.transition("MODIFIED", get_deployment(available=2)) == MLOpsClient.V1Alpha1State.AVAILABLE
+    assert monitor.transition("MODIFIED", get_deployment(available=2)) is None
+    assert monitor.transition("MODIFIED", get_deployment(available=2, generation=2)) == (
+        MLOpsClient.V1Alpha1State.UPDATING
+    )
+    assert monitor.transition("DELETED", get_deployment(available=0)) is None
+    assert monitor.readiness == {}
@@ -0,0 +1,83 @@
+from utils.patch import (
+    JSON_PATCH,
+    MERGE_PATCH,
+    converge_patch,
+    converges,
+    finalizers_patch,
+    merge_patch,
+    patch_content_type,
+    split_status,
+    with_resource_version,
+)
+
+
+def test_merge_patch_only_contains_changes():
+    old = {
+        "metadata": {"labels": {"model": "titanic-rfc"}},
+        "spec": {"image": "model:latest", "command": ["serve"]},
+        "status": {"state": "creating", "model": "titanic-rfc"},
+    }
+    new = {
+        "metadata": {"labels": {"model": "titanic-rfc"}},
+        "spec": {"image": "model:latest", "command": ["serve"]},
+        "status": {"state": "available", "model": "titanic-rfc"},
+    }
+    assert merge_patch(old, old) == {}
+    assert merge_patch(old, new) == {"status": {"state": "available"}}
+    assert merge_patch(old, {"spec": {"command": None}}) == {"spec": {"command": None}}
+
+
+def test_split_status():
+    patch, status = split_status({"spec": {"image": "model:v2"}, "status": {"state": "updating"}})
+    assert patch == {"spec": {"image": "model:v2"}}
+    assert status == {"status": {"state": "updating"}}
+    assert split_status({"spec": {"image": "model:v2"}})[1] is None
+
+
+def test_finalizers_patch():
+    assert finalizers_patch(["a"], add=["a"]) == []
+    assert finalizers_patch(None, add=["a", "b"]) == [
+        {"op": "add", "path": "/metadata/finalizers", "value": ["a", "b"]}
+    ]
+    assert finalizers_patch(["a"], add=["b"]) == [{"op": "add", "path": "/metadata/finalizers/-", "value": "b"}]
+    assert finalizers_patch(["a", "b", "c"], remove=["a", "c"]) == [
+        {"op": "test", "path": "/metadata/finalizers/2", "value": "c"},
+        {"op": "remove", "path": "/metadata/finalizers/2"},
+        {"op": "test", "path": "/metadata/finalizers/0", "value": "a"},
+        {"op": "remove", "path": "/metadata/finalizers/0"},
+    ]
+
+
+def test_patch_content_type():
+    assert patch_content_type([{"op": "remove", "path": "/metadata/finalizers/0"}]) == JSON_PATCH
+    assert patch_content_type({"spec": {}}) == MERGE_PATCH
+
+
+def test_converge_patch_ignores_server_side_fields():
+    desired = {"spec": {"replicas": 1, "resources": {"limits": {"cpu": "100m", "memory": "1Gi"}}, "args": ["serve"]}}
+    observed = {
+        "metadata": {"resourceVersion": "42"},
+        "spec": {"replicas": 1, "resources": {"limits": {"cpu": "0.1", "memory": "1024Mi"}}, "args": ["serve"]},
+    }
+    assert converges(observed, desired)
+    assert converge_patch(observed, desired) == {}
+    assert converge_patch(observed, {"spec": {"replicas": 2, "args": ["serve", "--debug"]}}) == {
+        "spec": {"replicas": 2, "args": ["serve", "--debug"]}
+    }
+    assert converge_patch(None, desired) == desired
+
+
+def test_with_resource_version():
+    assert with_resource_version({"spec": {"replicas": 2}}, "42") == {
+        "spec": {"replicas": 2},
+        "metadata": {"resourceVersion": "42"},
+    }
+    assert with_resource_version({"metadata": {"labels": {"a": "b"}}}, "42") == {
+        "metadata": {"labels": {"a": "b"}, "resourceVersion": "42"}
+    }
+    assert with_resource_version([{"op": "remove", "path": "/metadata/finalizers/0"}], "42") == [
+        {"op": "test", "path": "/metadata/resourceVersion", "value": "42"},
+        {"op": "remove", "path": "/metadata/finalizers/0"},
+    ]
+    assert with_resource_version({}, "42") == {}
+    assert with_resource_version({"spec": {}}, None) == {"spec": {}}
@@ -0,0 +1,78 @@
+import copy
+
+from kubernetes import client as K8SClient
+from resources import planner
+from resources.planner import CREATE, DELETE, PATCH, Operation, Plan, Resource, managed, serialize
+
+
+def get_deployment(image: str = "model:v1", cpu: str = "100m") -> dict:
+    return serialize(
+        K8SClient.V1Deployment(
+            metadata=K8SClient.V1ObjectMeta(name="titanic-rfc-1", namespace="titanic", labels={"model": "titanic-rfc"}),
+            spec=K8SClient.V1DeploymentSpec(
+                replicas=1,
+                selector=K8SClient.V1LabelSelector(match_labels={"model": "titanic-rfc-1"}),
+                template=K8SClient.V1PodTemplateSpec(
+                    spec=K8SClient.V1PodSpec(
+                        containers=[
+                            K8SClient.V1Container(
+                                name="model",
+                                image=image,
+                                resources=K8SClient.V1ResourceRequirements(limits={"cpu": cpu, "memory": "1Gi"}),
+                            )
+                        ]
+                    )
+                ),
+            ),
+        )
+    )
+
+
+def get_observed(desired: dict) -> dict:
+    # What the API server returns: defaulted fields, normalized quantities, server-side metadata and status.
+    observed = copy.deepcopy(desired)
+    observed["metadata"].update({"resourceVersion": "42", "uid": "1234", "finalizers": ["kopf"]})
+    observed["spec"]["progressDeadlineSeconds"] = 600
+    container = observed["spec"]["template"]["spec"]["containers"][0]
+    container["terminationMessagePath"] = "/dev/termination-log"
+    container["resources"]["limits"]["cpu"] = "0.1"
+    container["resources"]["limits"]["memory"] = "1024Mi"
+    observed["status"] = {"replicas": 1}
+    return observed
+
+
+def get_resource(desired: dict, observed: dict = None) -> Resource:
+    return Resource("Deployment", "titanic", "titanic-rfc-1", desired, managed(desired), observed)
+
+
+def test_converged_resources_make_an_empty_plan():
+    desired = get_deployment()
+    plan = Plan.from_resources([get_resource(desired, get_observed(desired))])
+    assert len(plan) == 0
+    assert str(plan) == "no changes"
+
+
+def test_plan_only_contains_the_changes():
+    desired = get_deployment(image="model:v2")
+    plan = Plan.from_resources(
+        [get_resource(desired, get_observed(get_deployment())), get_resource(desired)],
+        deletions=[("MachineLearningModel", "titanic", "titanic-rfc-0")],
+    )
+    assert [(operation.action, operation.kind) for operation in plan] == [
+        (PATCH, "Deployment"),
+        (CREATE, "Deployment"),
+        (DELETE, "MachineLearningModel"),
+    ]
+    patch = plan.operations[0].body
+    assert list(patch) == ["spec"]
+    assert patch["spec"]["template"]["spec"]["containers"][0]["image"] == "model:v2"
+
+
+def test_dry_run_makes_no_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(planner, "execute", calls.append)
+    plan = Plan([Operation(DELETE, "Service", "titanic", "titanic-rfc-0")])
+    plan.apply(dry_run=True)
+    assert calls == []
+    plan.apply(dry_run=False)
+    assert calls == plan.operations
@@ -0,0 +1,84 @@
+import pytest
+from benchmarks.fake_kubernetes import FakeKubernetes
+from kubernetes import client as K8SClient
+from kubernetes.client.rest import ApiException
+from urllib3.exceptions import ReadTimeoutError
+from utils.ratelimit import RateLimiter, RetryPolicy, TokenBucket, is_retryable, parse_limits, retry_after
+
+GROUP, VERSION, PLURAL = "blue.intranet", "v1alpha1", "machinelearningmodels"
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_token_bucket_lets_bursts_through_then_paces_the_calls():
+    clock = Clock()
+    bucket = TokenBucket(qps=10, burst=3, clock=clock, sleep=clock.sleep)
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() == pytest.approx(0.1)
+    assert bucket.acquire() == pytest.approx(0.1)
+
+    bucket.pause(2)
+    assert bucket.acquire() == pytest.approx(2)
+    assert not TokenBucket(qps=0, burst=1, clock=clock).reserve()
+
+
+def test_limits_are_configured_per_verb():
+    assert parse_limits("20, list=5,patch=10", float) == {"*": 20, "list": 5, "patch": 10}
+    limiter = RateLimiter(qps=parse_limits("20,list=5", float), burst=parse_limits("40", int))
+    assert (limiter.bucket("list").qps, limiter.bucket("list").burst) == (5, 40)
+    assert limiter.bucket("get") is limiter.bucket("patch") is limiter.buckets["*"]
+
+
+def test_backoff_honors_retry_after():
+    retry = RetryPolicy(retries=3, base=0.1, cap=1)
+    assert all(0 <= retry.delay(attempt) <= min(1, 0.1 * 2**attempt) for attempt in range(10))
+    assert retry.delay(0, retry_after=5) == 5
+    assert retry_after({"Retry-After": "2"}) == 2
+    assert retry_after({}) is None
+
+
+def test_transient_errors_are_retryable():
+    assert is_retryable("POST", 429)
+    assert is_retryable("GET", 503)
+    assert not is_retryable("POST", 503)
+    assert not is_retryable("PATCH", 409)
+    assert is_retryable("GET", error=ReadTimeoutError(None, "/", "read timed out"))
+    assert not is_retryable("GET", error=ValueError())
+
+
+def test_throttled_calls_are_retried():
+    fake = FakeKubernetes(qps=50, burst=2, retry_after=0)
+    unlimited = RateLimiter(qps={"*": 0}, burst={"*": 1})
+    api = K8SClient.CustomObjectsApi(
+        fake.api_client(rate_limiter=unlimited, retry=RetryPolicy(retries=20, base=0.01, cap=0.05))
+    )
+    for n in range(10):
+        api.create_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, {"metadata": {"name": f"rfc-{n}"}})
+    assert len(fake.list(GROUP, PLURAL, "titanic")) == 10
+    assert fake.calls[("create", PLURAL)] > 10
+
+    # Without retries, a burst over the server limit fails.
+    api = K8SClient.CustomObjectsApi(fake.api_client(rate_limiter=unlimited, retry=RetryPolicy(retries=0)))
+    with pytest.raises(ApiException) as err:
+        for _ in range(5):
+            api.list_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL)
+    assert err.value.status == 429
+
+
+def test_client_rate_limit_avoids_the_throttling():
+    fake = FakeKubernetes(qps=100, burst=2, retry_after=0)
+    api = K8SClient.CustomObjectsApi(
+        fake.api_client(rate_limiter=RateLimiter(qps={"*": 80}, burst={"*": 2}), retry=RetryPolicy(retries=0))
+    )
+    for n in range(10):
+        api.create_namespaced_custom_object(GROUP, VERSION, "titanic", PLURAL, {"metadata": {"name": f"rfc-{n}"}})
+    assert fake.calls[("create", PLURAL)] == 10
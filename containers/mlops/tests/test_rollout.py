@@ -0,0 +1,139 @@
+from typing import Iterator, List, Sequence
+
+import pytest
+from benchmarks.bench_reconcile import reconcile
+from benchmarks.fake_kubernetes import FakeKubernetes, seed_endpoint
+from kubernetes import client as K8SClient
+from resources import EndpointConfig
+from resources.mlops import client as MLOpsClient
+from resources.rollout import FAILED, PLANNED, SKIPPED, SUCCEEDED, Change, Rollout, percentile
+from utils.version import CONTENT_VERSION_LENGTH
+
+NAMESPACE = "fraud"
+ENDPOINTS = 5
+
+
+def create_model(fake: FakeKubernetes, name: str, artifact: str) -> None:
+    model = fake.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, "fraud-0-model-0", NAMESPACE)
+    model["metadata"] = {"name": name, "namespace": NAMESPACE, "labels": {}, "finalizers": []}
+    model["spec"]["artifact"] = artifact
+    model["status"]["model"] = name
+    fake.create(MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.MODEL_PLURAL, model, namespace=NAMESPACE)
+
+
+def patch(fake: FakeKubernetes, plural: str, name: str, body: dict) -> None:
+    K8SClient.CustomObjectsApi(fake.api_client()).patch_namespaced_custom_object(
+        MLOpsClient.GROUP, MLOpsClient.VERSION, NAMESPACE, plural, name, body
+    )
+
+
+@pytest.fixture
+def fleet() -> Iterator[FakeKubernetes]:
+    # Endpoints sharing the fraud-rfc model, all but the last one labelled team=fraud.
+    fake = FakeKubernetes()
+    with fake.installed():
+        for n in range(ENDPOINTS + 1):
+            seed_endpoint(fake, namespace=NAMESPACE, name=f"fraud-{n}", models=1)
+        create_model(fake, "fraud-rfc", "s3://models/fraud-rfc")
+        for n in range(ENDPOINTS + 1):
+            config = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, f"fraud-{n}-config", NAMESPACE)
+            models = [{**config["spec"]["models"][0], "model": "fraud-rfc"}]
+            patch(fake, MLOpsClient.ENDPOINT_CONFIG_PLURAL, f"fraud-{n}-config", {"spec": {"models": models}})
+            if n < ENDPOINTS:
+                patch(fake, MLOpsClient.ENDPOINT_PLURAL, f"fraud-{n}", {"metadata": {"labels": {"team": "fraud"}}})
+            reconcile(NAMESPACE, f"fraud-{n}")
+        yield fake
+
+
+class InProcessRollout(Rollout):
+    """
+    Runs the update handler of the operator on every endpoint config version patched, and marks the new model versions
+    available as the model monitor would, except for the endpoints listed as failing.
+    """
+
+    def __init__(self, *args, failing: Sequence[str] = (), **kwargs) -> None:
+        super().__init__(*args, timeout=5.0, poll_interval=0.01, **kwargs)
+        self.failing = failing
+
+    def wait(self, endpoint_config, before):
+        old = [model.dict() for model in before.spec.models]
+        new = [model.dict() for model in endpoint_config.body.spec.models]
+        updated = EndpointConfig(name=endpoint_config.named_version, namespace=NAMESPACE).update_handler(
+            (("change", ("spec", "models"), old, new),)
+        )
+        state = FAILED if endpoint_config.body.status.endpoint in self.failing else MLOpsClient.V1Alpha1State.AVAILABLE
+        api = MLOpsClient.V1Alpha1Api()
+        for name in updated.body.status.model_versions:
+            api.patch_namespaced_model_status(name=name, namespace=NAMESPACE, body={"status": {"state": state}})
+        return super().wait(endpoint_config, before)
+
+
+def models_of(fake: FakeKubernetes, endpoint: str) -> List[str]:
+    name = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_PLURAL, endpoint, NAMESPACE)["status"][
+        "endpoint_config_version"
+    ]
+    config = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, name, NAMESPACE)
+    return [
+        fake.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, version, NAMESPACE)["status"]["model"]
+        for version in config["status"]["model_versions"]
+    ]
+
+
+def test_rollout_swaps_the_model_wave_by_wave(fleet):
+    create_model(fleet, "fraud-rfc-retrained", "s3://models/fraud-rfc-retrained")
+
+    rollout = InProcessRollout(Change("fraud-rfc", "fraud-rfc-retrained"), selector="team=fraud", wave_size=2)
+    report = rollout.run()
+
+    assert report.summary()["succeeded"] == ENDPOINTS
+    assert report.waves == 3 and not report.stopped
+    assert percentile(report.latencies, 50) <= percentile(report.latencies, 99)
+    for n in range(ENDPOINTS):
+        assert models_of(fleet, f"fraud-{n}") == ["fraud-rfc-retrained"]
+    assert models_of(fleet, f"fraud-{ENDPOINTS}") == ["fraud-rfc"]
+    # The endpoints rolled out share a single new model version and deployment, the old one is only kept for the
+    # endpoint left out, and the endpoint configs of the users are untouched.
+    assert sorted(
+        deployment["metadata"]["name"][: -CONTENT_VERSION_LENGTH - 1]
+        for deployment in fleet.list("apps", "deployments", NAMESPACE)
+    ) == ["fraud-rfc", "fraud-rfc-retrained"]
+    config = fleet.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, "fraud-0-config", NAMESPACE)
+    assert config["spec"]["models"][0]["model"] == "fraud-rfc"
+
+    # Running it again resumes it: the endpoints already rolled out are skipped.
+    report = rollout.run()
+    assert [result.outcome for result in report.results] == [SKIPPED] * ENDPOINTS
+
+
+def test_rollout_stops_on_the_failure_threshold(fleet):
+    create_model(fleet, "fraud-rfc-retrained", "s3://models/fraud-rfc-retrained")
+
+    rollout = InProcessRollout(
+        Change("fraud-rfc", "fraud-rfc-retrained"),
+        selector="team=fraud",
+        wave_size=2,
+        concurrency=1,
+        max_failure_ratio=0.2,
+        failing=["fraud-1"],
+    )
+    report = rollout.run()
+
+    assert report.stopped and report.waves == 1
+    assert sorted(result.outcome for result in report.results) == [FAILED, SUCCEEDED]
+    assert report.summary()["pending"] == ENDPOINTS - 2
+    assert models_of(fleet, "fraud-2") == ["fraud-rfc"]
+
+
+def test_rollout_of_an_artifact(fleet):
+    change = Change("fraud-rfc", "fraud-rfc-2", artifact="s3://models/fraud-rfc-2")
+
+    report = InProcessRollout(change, namespace=NAMESPACE, dry_run=True).run()
+    assert [result.outcome for result in report.results] == [PLANNED] * (ENDPOINTS + 1)
+    assert fleet.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, "fraud-rfc-2", NAMESPACE) is None
+    assert models_of(fleet, "fraud-0") == ["fraud-rfc"]
+
+    report = InProcessRollout(change, namespace=NAMESPACE, concurrency=3).run()
+    assert report.count(SUCCEEDED) == ENDPOINTS + 1
+    model = fleet.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, "fraud-rfc-2", NAMESPACE)
+    assert model["spec"]["artifact"] == "s3://models/fraud-rfc-2"
+    assert models_of(fleet, f"fraud-{ENDPOINTS}") == ["fraud-rfc-2"]
@@ -0,0 +1,127 @@
+import copy
+from datetime import datetime, timedelta, timezone
+
+from kubernetes import client as K8SClient
+from urllib3.exceptions import ProtocolError
+from utils.sharding import (
+    KOPF_FINALIZER,
+    ShardCoordinator,
+    ShardSettings,
+    foreign_finalizers,
+    shard_of,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += timedelta(seconds=seconds)
+
+
+class LeaseApiStandIn:
+    """
+    In-memory coordination.k8s.io API, with the resourceVersion checks of the API server.
+    """
+
+    def __init__(self):
+        self.leases = {}
+        self.resource_version = 0
+
+    def _store(self, lease: K8SClient.V1Lease) -> K8SClient.V1Lease:
+        self.resource_version += 1
+        lease = copy.deepcopy(lease)
+        lease.metadata.resource_version = str(self.resource_version)
+        self.leases[lease.metadata.name] = lease
+        return copy.deepcopy(lease)
+
+    def read_namespaced_lease(self, name, namespace):
+        if name not in self.leases:
+            raise K8SClient.ApiException(status=404)
+        return copy.deepcopy(self.leases[name])
+
+    def create_namespaced_lease(self, namespace, body):
+        if body.metadata.name in self.leases:
+            raise K8SClient.ApiException(status=409)
+        return self._store(body)
+
+    def replace_namespaced_lease(self, name, namespace, body):
+        if self.leases[name].metadata.resource_version != body.metadata.resource_version:
+            raise K8SClient.ApiException(status=409)
+        return self._store(body)
+
+    def list_namespaced_lease(self, namespace, label_selector):
+        label, value = label_selector.split("=")
+        items = [lease for lease in self.leases.values() if (lease.metadata.labels or {}).get(label) == value]
+        return K8SClient.V1LeaseList(items=copy.deepcopy(items))
+
+
+def get_replica(identity: str, api: LeaseApiStandIn, clock: Clock, shards: int = 4) -> ShardCoordinator:
+    settings = ShardSettings()
+    settings.shards = shards
+    settings.identity = identity
+    settings.lease_duration = 15
+    return ShardCoordinator(settings, api=api, clock=clock)
+
+
+def test_shards_are_rebalanced_when_replicas_join_and_die():
+    api, clock = LeaseApiStandIn(), Clock()
+    a = get_replica("operator-a", api, clock)
+    b = get_replica("operator-b", api, clock)
+
+    assert a.tick() == [0, 1, 2, 3]
+
+    # b joins: a hands over the shards above its fair share, b picks them up.
+    b.tick()
+    a.tick()
+    b.tick()
+    assert sorted(a.owned() + b.owned()) == [0, 1, 2, 3]
+    assert len(a.owned()) == len(b.owned()) == 2
+    assert all(a.owns(namespace) != b.owns(namespace) for namespace in ["titanic", "iris", "mnist", "default"])
+
+    # b dies: its leases expire and a takes its shards over.
+    for _ in range(4):
+        clock.advance(5)
+        a.tick()
+    assert a.owned() == [0, 1, 2, 3]
+    assert b.owned() == []
+
+
+def test_shards_are_given_up_when_renewal_fails():
+    api, clock = LeaseApiStandIn(), Clock()
+    a = get_replica("operator-a", api, clock)
+    assert a.renew() == [0, 1, 2, 3]
+
+    def broken(name, namespace):
+        raise ProtocolError("Connection broken: ConnectionResetError(104, 'Connection reset by peer')")
+
+    api.read_namespaced_lease = broken
+    assert a.renew() == []
+    assert not a.owns("titanic")
+
+
+def test_concurrent_acquisitions_have_a_single_winner():
+    api, clock = LeaseApiStandIn(), Clock()
+    a = get_replica("operator-a", api, clock, shards=1)
+    b = get_replica("operator-b", api, clock, shards=1)
+
+    assert a._write(a.shard_name(0), None, a._spec(clock()))
+    assert not b._write(b.shard_name(0), None, b._spec(clock()))
+    stale = api.read_namespaced_lease(a.shard_name(0), "ml")
+    assert a._write(a.shard_name(0), copy.deepcopy(stale), a._spec(clock()))
+    assert not b._write(b.shard_name(0), stale, b._spec(clock()))
+
+
+def test_shard_of_is_stable():
+    assert shard_of("titanic", 4) == shard_of("titanic", 4)
+    assert {shard_of(f"namespace-{n}", 4) for n in range(100)} == {0, 1, 2, 3}
+
+
+def test_foreign_finalizers():
+    own = "shard.blue.intranet/operator-a"
+    finalizers = [own, "shard.blue.intranet/operator-b", KOPF_FINALIZER, "operator-b-model-version"]
+    assert foreign_finalizers(finalizers, own) == ["shard.blue.intranet/operator-b", KOPF_FINALIZER]
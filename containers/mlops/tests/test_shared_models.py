@@ -0,0 +1,270 @@
+import asyncio
+import copy
+import time
+from typing import Iterator, List
+
+import pytest
+from benchmarks.bench_reconcile import reconcile
+from benchmarks.fake_kubernetes import FakeKubernetes, seed_endpoint
+from resources import Endpoint, EndpointConfig, Model
+from resources.mlops import client as MLOpsClient
+from resources.planner import plan_endpoint
+from utils.api_client import RecordingClient
+from utils.owners import owner_reference
+
+NAMESPACE = "titanic"
+MODELS = 2
+
+
+@pytest.fixture
+def twins() -> Iterator[FakeKubernetes]:
+    # Two endpoints serving the same endpoint config, hence identical variants.
+    fake = FakeKubernetes()
+    with fake.installed():
+        seed_endpoint(fake, namespace=NAMESPACE, name="titanic", models=MODELS)
+        endpoint = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_PLURAL, "titanic", NAMESPACE)
+        endpoint["metadata"] = {"name": "titanic-b", "namespace": NAMESPACE, "labels": {}, "finalizers": []}
+        endpoint["spec"]["host"] = "titanic-b.example.com"
+        fake.create(MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.ENDPOINT_PLURAL, endpoint, namespace=NAMESPACE)
+        reconcile(NAMESPACE, "titanic")
+        reconcile(NAMESPACE, "titanic-b")
+        yield fake
+
+
+def get_endpoint_config_version(fake: FakeKubernetes, endpoint: str) -> dict:
+    endpoint = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_PLURAL, endpoint, NAMESPACE)
+    return fake.get(
+        MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL, endpoint["status"]["endpoint_config_version"], NAMESPACE
+    )
+
+
+def owners(fake: FakeKubernetes, model_version: str) -> List[str]:
+    model = fake.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, model_version, NAMESPACE)
+    return [reference["name"] for reference in model["metadata"]["ownerReferences"]]
+
+
+def test_identical_variants_share_their_model_versions(twins):
+    first = get_endpoint_config_version(twins, "titanic")
+    second = get_endpoint_config_version(twins, "titanic-b")
+
+    assert first["metadata"]["name"] != second["metadata"]["name"]
+    assert first["status"]["model_versions"] == second["status"]["model_versions"]
+    for model_version in first["status"]["model_versions"]:
+        assert owners(twins, model_version) == [first["metadata"]["name"], second["metadata"]["name"]]
+    assert len(twins.list("apps", "deployments", NAMESPACE)) == MODELS
+    assert len(twins.list("", "persistentvolumes")) == MODELS
+
+
+def test_shared_model_versions_go_with_their_last_user(twins):
+    model_versions = get_endpoint_config_version(twins, "titanic")["status"]["model_versions"]
+    second = get_endpoint_config_version(twins, "titanic-b")["metadata"]["name"]
+
+    Endpoint(name="titanic", namespace=NAMESPACE).delete()
+    for model_version in model_versions:
+        assert owners(twins, model_version) == [second]
+    assert len(twins.list("apps", "deployments", NAMESPACE)) == MODELS
+
+    Endpoint(name="titanic-b", namespace=NAMESPACE).delete()
+    assert twins.list("apps", "deployments", NAMESPACE) == []
+    assert all(
+        twins.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, name, NAMESPACE) is None for name in model_versions
+    )
+
+
+def test_a_changed_variant_gets_its_own_model_version(twins):
+    endpoint_config = get_endpoint_config_version(twins, "titanic")
+    shared = endpoint_config["status"]["model_versions"]
+    second = get_endpoint_config_version(twins, "titanic-b")["metadata"]["name"]
+
+    old_models = endpoint_config["spec"]["models"]
+    new_models = copy.deepcopy(old_models)
+    new_models[0]["model"] = "titanic-model-1"
+    new_models[0]["instances"] = 2
+    MLOpsClient.V1Alpha1Api().patch_namespaced_endpoint_config(
+        name=endpoint_config["metadata"]["name"], namespace=NAMESPACE, body={"spec": {"models": new_models}}
+    )
+    EndpointConfig(name=endpoint_config["metadata"]["name"], namespace=NAMESPACE).update_handler(
+        (("change", ("spec", "models"), old_models, new_models),)
+    )
+
+    model_versions = get_endpoint_config_version(twins, "titanic")["status"]["model_versions"]
+    # The second model is unchanged and still shared, the first one is a new variant of titanic-model-1.
+    assert model_versions[1] == shared[1]
+    assert model_versions[0] not in shared
+    assert owners(twins, model_versions[0]) == [endpoint_config["metadata"]["name"]]
+    # The model version swapped out is still used by the other endpoint.
+    assert owners(twins, shared[0]) == [second]
+    assert len(twins.list("apps", "deployments", NAMESPACE)) == MODELS + 1
+
+
+def test_a_shared_variant_is_rescaled_as_a_model_version_of_its_own(twins):
+    endpoint_config = get_endpoint_config_version(twins, "titanic")
+    shared = endpoint_config["status"]["model_versions"]
+
+    old_models = endpoint_config["spec"]["models"]
+    new_models = copy.deepcopy(old_models)
+    new_models[0]["instances"] = 3
+    MLOpsClient.V1Alpha1Api().patch_namespaced_endpoint_config(
+        name=endpoint_config["metadata"]["name"], namespace=NAMESPACE, body={"spec": {"models": new_models}}
+    )
+    EndpointConfig(name=endpoint_config["metadata"]["name"], namespace=NAMESPACE).update_handler(
+        (("change", ("spec", "models"), old_models, new_models),)
+    )
+
+    # The other endpoint keeps the number of instances of the shared deployment.
+    model_versions = get_endpoint_config_version(twins, "titanic")["status"]["model_versions"]
+    assert model_versions[0] not in shared and model_versions[1] == shared[1]
+    assert twins.get("apps", "deployments", shared[0], NAMESPACE)["spec"]["replicas"] == old_models[0]["instances"]
+    assert twins.get("apps", "deployments", model_versions[0], NAMESPACE)["spec"]["replicas"] == 3
+
+
+def test_new_variants_are_rolled_out_concurrently(twins):
+    endpoint_config = get_endpoint_config_version(twins, "titanic")
+    shared = endpoint_config["status"]["model_versions"]
+    second = get_endpoint_config_version(twins, "titanic-b")["metadata"]["name"]
+
+    old_models = endpoint_config["spec"]["models"]
+    new_models = copy.deepcopy(old_models)
+    for model in new_models:
+        model["memory"] = "512Mi"
+    MLOpsClient.V1Alpha1Api().patch_namespaced_endpoint_config(
+        name=endpoint_config["metadata"]["name"], namespace=NAMESPACE, body={"spec": {"models": new_models}}
+    )
+    asyncio.run(
+        EndpointConfig(name=endpoint_config["metadata"]["name"], namespace=NAMESPACE).update_handler_async(
+            (("change", ("spec", "models"), old_models, new_models),)
+        )
+    )
+
+    model_versions = get_endpoint_config_version(twins, "titanic")["status"]["model_versions"]
+    assert not set(model_versions) & set(shared)
+    for model_version in model_versions:
+        assert owners(twins, model_version) == [endpoint_config["metadata"]["name"]]
+        assert twins.get("apps", "deployments", model_version, NAMESPACE)
+    for model_version in shared:
+        assert owners(twins, model_version) == [second]
+    virtual_service = twins.get(
+        "networking.istio.io", "virtualservices", endpoint_config["metadata"]["name"], NAMESPACE
+    )
+    assert [http["route"][0]["destination"]["host"] for http in virtual_service["spec"]["http"]] == model_versions
+
+
+def test_model_versions_still_shared_are_not_deleted_by_the_planner(twins):
+    endpoint_config = get_endpoint_config_version(twins, "titanic")
+    name = endpoint_config["metadata"]["name"]
+    shared = endpoint_config["status"]["model_versions"]
+    second = get_endpoint_config_version(twins, "titanic-b")
+
+    old_models = endpoint_config["spec"]["models"]
+    new_models = copy.deepcopy(old_models)
+    new_models[0]["memory"] = "512Mi"
+    MLOpsClient.V1Alpha1Api().patch_namespaced_endpoint_config(
+        name=name, namespace=NAMESPACE, body={"spec": {"models": new_models}}
+    )
+    EndpointConfig(name=name, namespace=NAMESPACE).update_handler(
+        (("change", ("spec", "models"), old_models, new_models),)
+    )
+
+    # The model version released by the first endpoint config version now belongs to the second one.
+    model = twins.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, shared[0], NAMESPACE)
+    assert model["metadata"]["labels"]["endpoint_config_version"] == second["metadata"]["name"]
+    assert model["status"]["endpoint_config_version"] == second["metadata"]["name"]
+    assert model["status"]["endpoint"] == "titanic-b"
+
+    plan_endpoint(Endpoint(name="titanic", namespace=NAMESPACE)).apply()
+    plan_endpoint(Endpoint(name="titanic-b", namespace=NAMESPACE)).apply()
+    deployment = twins.get("apps", "deployments", shared[0], NAMESPACE)
+    assert deployment["metadata"]["labels"]["endpoint"] == "titanic-b"
+
+    # Still labelled after the first endpoint config version and owned by both, as if the release was interrupted: the
+    # planner of the first endpoint leaves it to the second one.
+    model = twins.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, shared[0], NAMESPACE)
+    MLOpsClient.V1Alpha1Api().patch_namespaced_model(
+        name=shared[0],
+        namespace=NAMESPACE,
+        body={
+            "metadata": {
+                "labels": {"endpoint": "titanic", "endpoint_config_version": name},
+                "ownerReferences": [*model["metadata"]["ownerReferences"], owner_reference(endpoint_config)],
+            }
+        },
+    )
+    plan_endpoint(Endpoint(name="titanic", namespace=NAMESPACE)).apply()
+    assert twins.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, shared[0], NAMESPACE)
+    assert twins.get("apps", "deployments", shared[0], NAMESPACE)
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_a_new_artifact_of_a_shared_model_version_is_shared_too(twins, asynchronous):
+    shared = get_endpoint_config_version(twins, "titanic")["status"]["model_versions"]
+    model = twins.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, shared[0], NAMESPACE)
+    artifact = "s3://models/titanic-model-0-retrained"
+    MLOpsClient.V1Alpha1Api().patch_namespaced_model(
+        name=shared[0], namespace=NAMESPACE, body={"spec": {"artifact": artifact}}
+    )
+    diff = (("change", ("spec", "artifact"), model["spec"]["artifact"], artifact),)
+    if asynchronous:
+        asyncio.run(Model(name=shared[0], namespace=NAMESPACE).update_handler_async(diff))
+    else:
+        Model(name=shared[0], namespace=NAMESPACE).update_handler(diff)
+
+    first = get_endpoint_config_version(twins, "titanic")
+    second = get_endpoint_config_version(twins, "titanic-b")
+    assert first["status"]["model_versions"] == second["status"]["model_versions"]
+    assert first["status"]["model_versions"][0] != shared[0] and first["status"]["model_versions"][1] == shared[1]
+    assert sorted(owners(twins, first["status"]["model_versions"][0])) == sorted(
+        [first["metadata"]["name"], second["metadata"]["name"]]
+    )
+    assert twins.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, shared[0], NAMESPACE) is None
+    assert len(twins.list("apps", "deployments", NAMESPACE)) == MODELS
+
+
+def test_a_new_artifact_is_rolled_out_by_its_users_concurrently():
+    fake = FakeKubernetes(latency=0.01)
+    with fake.installed():
+        seed_endpoint(fake, namespace=NAMESPACE, name="titanic", models=1)
+        reconcile(NAMESPACE, "titanic")
+        for n in range(5):
+            endpoint = fake.get(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_PLURAL, "titanic", NAMESPACE)
+            endpoint["metadata"] = {"name": f"titanic-{n}", "namespace": NAMESPACE, "labels": {}, "finalizers": []}
+            endpoint["spec"]["host"] = f"titanic-{n}.example.com"
+            fake.create(
+                MLOpsClient.GROUP, MLOpsClient.VERSION, MLOpsClient.ENDPOINT_PLURAL, endpoint, namespace=NAMESPACE
+            )
+            reconcile(NAMESPACE, f"titanic-{n}")
+        shared = get_endpoint_config_version(fake, "titanic")["status"]["model_versions"][0]
+        model = fake.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, shared, NAMESPACE)
+        artifact = "s3://models/titanic-model-0-retrained"
+        MLOpsClient.V1Alpha1Api().patch_namespaced_model(
+            name=shared, namespace=NAMESPACE, body={"spec": {"artifact": artifact}}
+        )
+
+        started = time.monotonic()
+        with RecordingClient() as recorder:
+            asyncio.run(
+                Model(name=shared, namespace=NAMESPACE).update_handler_async(
+                    (("change", ("spec", "artifact"), model["spec"]["artifact"], artifact),)
+                )
+            )
+        elapsed = time.monotonic() - started
+
+        # Far less than the latencies of the calls added up.
+        assert elapsed < recorder.total() * fake.latency / 2
+        model_versions = {
+            get_endpoint_config_version(fake, endpoint)["status"]["model_versions"][0]
+            for endpoint in ["titanic"] + [f"titanic-{n}" for n in range(5)]
+        }
+        assert len(model_versions) == 1 and shared not in model_versions
+        assert fake.get(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL, shared, NAMESPACE) is None
+
+
+def test_the_shared_model_versions_are_listed_with_their_other_owners(twins):
+    first = get_endpoint_config_version(twins, "titanic")
+    second = get_endpoint_config_version(twins, "titanic-b")
+    endpoint_config = EndpointConfig(name=second["metadata"]["name"], namespace=NAMESPACE)
+
+    with RecordingClient() as recorder:
+        models = endpoint_config.get_models()
+    # The label only finds the model versions controlled by the first endpoint config version.
+    assert [model.body.metadata.name for model in models] == first["status"]["model_versions"]
+    assert recorder.summary() == {("list", MLOpsClient.MODEL_PLURAL): 2}
@@ -0,0 +1,38 @@
+from prometheus_client import REGISTRY
+from utils.informer import Informer, register_informer, stop_informers
+from utils.startup import IMPORT_BUDGET, Phase, StartupTimeline, measure_import, timeline
+
+
+def test_phases_are_recorded_once():
+    startup = StartupTimeline()
+    first = startup.mark(Phase.STARTUP)
+    assert first > 0
+    assert startup.mark(Phase.STARTUP) is None
+    assert startup.as_dict() == {"startup": first}
+    assert REGISTRY.get_sample_value("mlops_startup_seconds", {"phase": "startup"}) == first
+
+
+class FakeCustomObjectsApi:
+    def list_cluster_custom_object(self, group, version, plural, **kwargs):
+        return {"metadata": {"resourceVersion": "1"}, "items": []}
+
+
+def test_cache_synced_once_every_informer_listed():
+    timeline.phases.pop(Phase.CACHE_SYNCED.value, None)
+    informers = [
+        register_informer(Informer("blue.intranet", "v1alpha1", plural, api=FakeCustomObjectsApi()))
+        for plural in ("machinelearningmodels", "machinelearningendpoints")
+    ]
+    try:
+        informers[0].relist()
+        assert Phase.CACHE_SYNCED.value not in timeline.as_dict()
+        informers[1].relist()
+        assert Phase.CACHE_SYNCED.value in timeline.as_dict()
+    finally:
+        stop_informers()
+
+
+def test_operator_imports_within_budget():
+    # Also checks that mlops.py imports without a cluster, the configuration being loaded by the startup handler. The
+    # test runners are shared, hence the slack: CI checks the budget itself with python -m utils.startup.
+    assert measure_import("mlops", repeat=1) < IMPORT_BUDGET * 2
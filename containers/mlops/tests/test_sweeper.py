@@ -0,0 +1,120 @@
+import json
+import time
+from typing import Iterator
+
+import pytest
+from benchmarks.bench_reconcile import reconcile
+from benchmarks.fake_kubernetes import FakeKubernetes, seed_endpoint
+from kubernetes import client as K8SClient
+from resources import Endpoint
+from resources.mlops import client as MLOpsClient
+from resources import sweeper as sweeper_module
+from resources.sweeper import Snapshot, Sweeper, plan_sweep, sweep
+from urllib3.exceptions import ProtocolError
+from utils.api_client import get_api_client
+
+NAMESPACE = "titanic"
+MODELS = 2
+
+
+@pytest.fixture
+def deployed() -> Iterator[FakeKubernetes]:
+    fake = FakeKubernetes()
+    with fake.installed():
+        seed_endpoint(fake, namespace=NAMESPACE, name="titanic", models=MODELS)
+        reconcile(NAMESPACE, "titanic")
+        yield fake
+
+
+def forget_owners(fake: FakeKubernetes) -> None:
+    # Turn the objects into the ones created before the owner references.
+    for objects in fake.objects.values():
+        for key, data in objects.items():
+            obj = json.loads(data)
+            obj["metadata"].pop("ownerReferences", None)
+            objects[key] = json.dumps(obj).encode()
+
+
+def assert_only_user_objects(fake: FakeKubernetes) -> None:
+    for group, plural in (
+        ("networking.istio.io", "virtualservices"),
+        ("networking.istio.io", "gateways"),
+        ("apps", "deployments"),
+        ("", "services"),
+        ("", "persistentvolumeclaims"),
+    ):
+        assert fake.list(group, plural, NAMESPACE) == []
+    assert [item["metadata"]["name"] for item in fake.list(MLOpsClient.GROUP, MLOpsClient.MODEL_PLURAL)] == [
+        f"titanic-model-{n}" for n in range(MODELS)
+    ]
+    assert [item["metadata"]["name"] for item in fake.list(MLOpsClient.GROUP, MLOpsClient.ENDPOINT_CONFIG_PLURAL)] == [
+        "titanic-config"
+    ]
+
+
+def test_owned_objects_make_an_empty_sweep(deployed):
+    assert len(plan_sweep(Snapshot())) == 0
+
+
+def test_legacy_objects_are_adopted(deployed):
+    forget_owners(deployed)
+
+    plan = sweep(dry_run=False)
+    # The gateway, the endpoint config version, its virtual service and model versions, and the deployment, service
+    # and claim of each model version.
+    assert [operation.action for operation in plan] == ["patch"] * (3 + MODELS * 4)
+    assert len(plan_sweep(Snapshot())) == 0
+
+    Endpoint(name="titanic", namespace=NAMESPACE).delete()
+    assert_only_user_objects(deployed)
+
+
+def test_orphans_are_deleted(deployed):
+    forget_owners(deployed)
+    K8SClient.CustomObjectsApi(get_api_client()).delete_namespaced_custom_object(
+        MLOpsClient.GROUP, MLOpsClient.VERSION, NAMESPACE, MLOpsClient.ENDPOINT_PLURAL, "titanic"
+    )
+
+    plan = sweep(namespace=NAMESPACE, dry_run=False)
+    # The gateway and the endpoint config version have lost their owner, the rest of the tree is adopted by them and
+    # collected along with them.
+    assert [operation.kind for operation in plan if operation.action == "delete"] == [
+        "Gateway",
+        MLOpsClient.ENDPOINT_CONFIG_KIND,
+    ]
+    assert_only_user_objects(deployed)
+
+    # The persistent volumes go on the next sweep, once their model versions are gone.
+    assert [operation.kind for operation in sweep(namespace=NAMESPACE, dry_run=False)] == ["PersistentVolume"] * MODELS
+    assert deployed.list("", "persistentvolumes") == []
+
+
+def test_persistent_volumes_of_deleted_models_are_deleted(deployed):
+    Endpoint(name="titanic", namespace=NAMESPACE).delete()
+    assert_only_user_objects(deployed)
+    assert len(deployed.list("", "persistentvolumes")) == MODELS
+
+    plan = sweep(dry_run=True)
+    assert [operation.kind for operation in plan] == ["PersistentVolume"] * MODELS
+    assert len(deployed.list("", "persistentvolumes")) == MODELS
+
+    sweep(dry_run=False)
+    assert deployed.list("", "persistentvolumes") == []
+
+
+def test_the_sweeper_survives_transport_errors(monkeypatch):
+    calls = []
+
+    def broken_sweep():
+        calls.append(time.monotonic())
+        raise ProtocolError("Connection broken: ConnectionResetError(104, 'Connection reset by peer')")
+
+    monkeypatch.setattr(sweeper_module, "sweep", broken_sweep)
+    sweeper = Sweeper(interval=0.01).start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(calls) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        sweeper.stop()
+    assert len(calls) >= 2
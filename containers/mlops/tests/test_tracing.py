@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from utils import tracing
+from utils.concurrency import run_sync
+from utils.tracing import Tracer, span, timeline, traced, traced_handler
+from utils.workqueue import WorkQueue
+
+
+class MemoryExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, spans):
+        self.traces.append(spans)
+
+
+class Resource:
+    def __init__(self, name: str):
+        self.name = name
+        self.namespace = "titanic"
+
+    @traced
+    def create(self):
+        with span("POST deployments", root=False, kind="deployments"):
+            return self
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = MemoryExporter()
+    monkeypatch.setattr(tracing, "tracer", Tracer(exporter))
+    return exporter
+
+
+def test_spans_nest_across_threads_and_the_work_queue(exporter):
+    queue = WorkQueue(workers=2)
+
+    @traced_handler
+    async def ml_model_create_fn(name: str, namespace: str, **kwargs):
+        async def reconcile():
+            return await run_sync(Resource(name).create)
+
+        return await queue.submit((namespace, name), reconcile)
+
+    async def main():
+        await ml_model_create_fn(name="titanic-rfc", namespace="titanic")
+        await queue.stop()
+
+    asyncio.run(main())
+
+    [spans] = exporter.traces
+    by_name = {span["name"]: span for span in spans}
+    root = by_name["ml_model_create_fn"]
+    assert root["parent_id"] is None
+    assert root["attributes"] == {"name": "titanic-rfc", "namespace": "titanic"}
+    assert by_name["Resource.create"]["parent_id"] == root["span_id"]
+    assert by_name["Resource.create"]["attributes"] == {
+        "kind": "Resource",
+        "name": "titanic-rfc",
+        "namespace": "titanic",
+    }
+    assert by_name["POST deployments"]["parent_id"] == by_name["Resource.create"]["span_id"]
+    assert len({span["trace_id"] for span in spans}) == 1
+    assert "Resource.create" in timeline(spans)
+
+
+def test_api_calls_outside_traces_and_unsampled_traces_are_not_recorded(exporter):
+    with span("GET models", root=False):
+        pass
+    assert exporter.traces == []
+
+    tracing.tracer.sample_ratio = 0
+    assert Resource("titanic-rfc").create()
+    assert exporter.traces == []
+
+
+def test_errors_are_recorded(exporter):
+    with pytest.raises(ValueError):
+        with span("ml_endpoint_update_fn"):
+            raise ValueError("boom")
+    assert exporter.traces[0][0]["error"] == "ValueError: boom"
@@ -0,0 +1,95 @@
+import asyncio
+
+from resources.endpoint_config import EndpointConfig
+from utils.workqueue import Lane, WorkQueue
+
+
+def test_keys_are_serialized_and_run_in_parallel():
+    queue = WorkQueue(workers=4)
+    log = []
+
+    def work(key: str, n: int):
+        async def function():
+            log.append(("start", key, n))
+            await asyncio.sleep(0.01)
+            log.append(("end", key, n))
+            return n
+
+        return function
+
+    async def main():
+        results = await asyncio.gather(
+            *(queue.submit(key, work(key, n)) for n in range(3) for key in ["titanic", "iris"])
+        )
+        await queue.stop()
+        return results
+
+    assert asyncio.run(main()) == [0, 0, 1, 1, 2, 2]
+    for key in ["titanic", "iris"]:
+        assert [(event, n) for event, k, n in log if k == key] == [
+            ("start", 0),
+            ("end", 0),
+            ("start", 1),
+            ("end", 1),
+            ("start", 2),
+            ("end", 2),
+        ]
+    # Both keys were in flight at the same time.
+    assert log[:2] == [("start", "titanic", 0), ("start", "iris", 0)]
+
+
+def test_urgent_lanes_jump_ahead():
+    queue = WorkQueue(workers=1)
+    order = []
+
+    def work(name: str):
+        async def function():
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+        return function
+
+    async def main():
+        busy = asyncio.ensure_future(queue.submit("busy", work("busy"), Lane.ROLLOUT))
+        await asyncio.sleep(0)
+        await asyncio.gather(
+            busy,
+            queue.submit("rollout", work("rollout"), Lane.ROLLOUT),
+            queue.submit("weights", work("weights"), Lane.WEIGHTS),
+            queue.submit("delete", work("delete"), Lane.DELETE),
+        )
+        await queue.stop()
+
+    asyncio.run(main())
+    assert order == ["busy", "delete", "weights", "rollout"]
+    stats = queue.stats.as_dict()
+    assert stats["rollout"]["waits"] == 2
+    assert stats["rollout"]["depth"] == 0
+    assert stats["delete"]["max_wait_seconds"] > 0
+
+
+def test_errors_are_raised_to_the_submitter():
+    queue = WorkQueue(workers=1)
+
+    async def fail():
+        raise ValueError("boom")
+
+    async def main():
+        try:
+            await queue.submit("titanic", fail)
+        except ValueError as err:
+            return str(err)
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main()) == "boom"
+
+
+def test_is_weight_only():
+    old = [{"model": "titanic-rfc", "weight": 50}, {"model": "titanic-lr", "weight": 50}]
+    new = [{"model": "titanic-rfc", "weight": 80}, {"model": "titanic-lr", "weight": 20}]
+    assert EndpointConfig.is_weight_only((("change", ("spec", "models"), old, new),))
+    assert not EndpointConfig.is_weight_only((("change", ("spec", "models"), old, new[:1]),))
+    assert not EndpointConfig.is_weight_only(
+        (("change", ("spec", "models"), old, [{**new[0], "model": "titanic-svm"}, new[1]]),)
+    )
@@ -1,2 +1,2 @@
 from .diff import DiffLine, DiffLineType
-from .version import get_version
+from .version import get_content_version, get_version
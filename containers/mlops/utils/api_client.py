@@ -0,0 +1,225 @@
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from kubernetes import client as K8SClient
+from urllib3.connection import HTTPConnection
+from utils.metrics import describe_request, observe_api_request, observe_api_retry, observe_api_throttle
+from utils.ratelimit import RateLimiter, RetryPolicy, is_retryable, limiter, retry_after
+from utils.tracing import span
+
+
+class ApiClientSettings:
+    """
+    Tuning knobs for the shared Kubernetes API client, read from the environment:
+    - MLOPS_API_POOL_MAXSIZE: maximum number of pooled connections kept open to the API server (default 32).
+    - MLOPS_API_KEEPALIVE: enable TCP keep-alive probes on the pooled connections (default true).
+    - MLOPS_API_KEEPALIVE_IDLE: seconds of idleness before the first keep-alive probe (default 30).
+    - MLOPS_API_CONNECT_TIMEOUT: connect timeout in seconds (default 10).
+    - MLOPS_API_READ_TIMEOUT: read timeout in seconds, not applied to watches (default none).
+    """
+
+    def __init__(self) -> None:
+        self.pool_maxsize: int = int(os.environ.get("MLOPS_API_POOL_MAXSIZE", "32"))
+        self.keepalive: bool = os.environ.get("MLOPS_API_KEEPALIVE", "true").lower() == "true"
+        self.keepalive_idle: int = int(os.environ.get("MLOPS_API_KEEPALIVE_IDLE", "30"))
+        self.connect_timeout: float = float(os.environ.get("MLOPS_API_CONNECT_TIMEOUT", "10"))
+        read_timeout = os.environ.get("MLOPS_API_READ_TIMEOUT")
+        self.read_timeout: Optional[float] = float(read_timeout) if read_timeout else None
+
+    def socket_options(self) -> list:
+        options = list(HTTPConnection.default_socket_options)
+        if self.keepalive:
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle))
+        return options
+
+
+_lock = threading.Lock()
+_api_client: Optional[K8SClient.ApiClient] = None
+
+
+def _is_watch(url: str, kwargs: dict) -> bool:
+    return "watch=true" in url.lower() or ("watch", True) in (kwargs.get("query_params") or [])
+
+
+def instrument(
+    api_client: K8SClient.ApiClient,
+    settings: ApiClientSettings,
+    rate_limiter: Optional[RateLimiter] = None,
+    retry: Optional[RetryPolicy] = None,
+) -> K8SClient.ApiClient:
+    """
+    Wrap the REST client of an ApiClient so every request gets the default timeouts and is recorded in the Prometheus
+    histograms of utils/metrics.py and traced (utils/tracing.py). Count the calls of a block with RecordingClient.
+    The requests other than watches also go through the rate limiter and the retries of utils/ratelimit.py, every
+    attempt being recorded.
+    @param rate_limiter: Defaults to the limiter shared by all the clients of the process.
+    @param retry: Defaults to the retry policy read from the environment.
+    """
+    rate_limiter = rate_limiter or limiter
+    retry = retry or RetryPolicy()
+    rest_client = api_client.rest_client
+    request = rest_client.request
+
+    def instrumented_request(method: str, url: str, *args, **kwargs):
+        if kwargs.get("_request_timeout") is None:
+            read_timeout = None if _is_watch(url, kwargs) else settings.read_timeout
+            kwargs["_request_timeout"] = (settings.connect_timeout, read_timeout)
+
+        with span("api", root=False) as current:
+            if current:
+                verb, plural = describe_request(method, url)
+                current.name = f"{verb} {plural}"
+                current.set_attribute("kind", plural)
+                current.set_attribute("path", urlsplit(url).path)
+
+            started = time.monotonic()
+            try:
+                response = request(method, url, *args, **kwargs)
+            except Exception as err:
+                seconds = time.monotonic() - started
+                observe_api_request(method, url, seconds, error=err)
+                if current:
+                    current.set_attribute("status", getattr(err, "status", None))
+                raise
+            seconds = time.monotonic() - started
+            # Recent kubernetes clients return the 4xx/5xx responses here and raise later, in the ApiClient.
+            failed = getattr(response, "status", 200) >= 400
+            observe_api_request(method, url, seconds, error=response if failed else None)
+            if current:
+                current.set_attribute("status", getattr(response, "status", None))
+            return response
+
+    def throttled_request(method: str, url: str, *args, **kwargs):
+        if _is_watch(url, kwargs):
+            return instrumented_request(method, url, *args, **kwargs)
+
+        verb, _ = describe_request(method, url)
+        attempt = 0
+        while True:
+            observe_api_throttle(verb, rate_limiter.acquire(verb))
+            try:
+                response = instrumented_request(method, url, *args, **kwargs)
+            except Exception as err:
+                status = getattr(err, "status", None)
+                if attempt >= retry.retries or not is_retryable(method, status, err):
+                    raise
+                headers, reason = getattr(err, "headers", None), str(status or type(err).__name__)
+            else:
+                status = getattr(response, "status", 200)
+                if status < 400 or attempt >= retry.retries or not is_retryable(method, status):
+                    return response
+                headers, reason = getattr(response, "headers", None), str(status)
+
+            delay = retry.delay(attempt, retry_after(headers))
+            if status == 429:
+                rate_limiter.pause(delay)
+            observe_api_retry(verb, reason)
+            time.sleep(delay)
+            attempt += 1
+
+    rest_client.request = throttled_request
+    return api_client
+
+
+def new_api_client(
+    configuration: Optional[K8SClient.Configuration] = None, settings: Optional[ApiClientSettings] = None
+) -> K8SClient.ApiClient:
+    """
+    Build an ApiClient tuned with the given settings. The configuration defaults to the one loaded by
+    K8SConfig.load_incluster_config/load_kube_config.
+    """
+    settings = settings or ApiClientSettings()
+    configuration = configuration or K8SClient.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = settings.pool_maxsize
+    configuration.socket_options = settings.socket_options()
+    return instrument(K8SClient.ApiClient(configuration), settings)
+
+
+def get_api_client() -> K8SClient.ApiClient:
+    """
+    Get the process wide ApiClient. All the API wrappers (K8SClient.AppsV1Api, K8SClient.CoreV1Api,
+    K8SClient.CustomObjectsApi) should be built on top of it, so they share a single connection pool to the API
+    server instead of opening new connections for every call.
+    """
+    global _api_client
+    if _api_client is None:
+        with _lock:
+            if _api_client is None:
+                _api_client = new_api_client()
+    return _api_client
+
+
+def set_api_client(api_client: Optional[K8SClient.ApiClient]) -> None:
+    """
+    Replace the process wide ApiClient (e.g. with one pointing to a test API server). Passing None resets it, so the
+    next call to get_api_client builds a new one from the default configuration.
+    """
+    global _api_client
+    with _lock:
+        _api_client = api_client
+
+
+class RecordingClient:
+    """
+    Count the calls sent through an ApiClient by (verb, plural), e.g. ("get", "machinelearningmodels") or
+    ("patch", "machinelearningendpointconfigs/status"), while the block runs:
+
+        with RecordingClient() as recorder:
+            Model(name, namespace)
+        assert recorder.calls[("get", "machinelearningmodels")] == 1
+
+    Every call is counted, including the failed ones. The watches are not counted.
+    @param api_client: The ApiClient to record, defaults to the process wide one.
+    """
+
+    def __init__(self, api_client: Optional[K8SClient.ApiClient] = None) -> None:
+        self.api_client = api_client
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._request = None
+
+    def __enter__(self) -> "RecordingClient":
+        self.api_client = self.api_client or get_api_client()
+        rest_client = self.api_client.rest_client
+        self._request = request = rest_client.request
+
+        def recorded_request(method: str, url: str, *args, **kwargs):
+            verb, plural = describe_request(method, url)
+            if verb != "watch":
+                with self._lock:
+                    self.calls[(verb, plural)] += 1
+            return request(method, url, *args, **kwargs)
+
+        rest_client.request = recorded_request
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.api_client.rest_client.request = self._request
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+
+    def total(self, verb: Optional[str] = None) -> int:
+        return sum(count for (call_verb, _), count in self.calls.items() if verb is None or call_verb == verb)
+
+    def summary(self) -> Dict[Tuple[str, str], int]:
+        """
+        The recorded calls, sorted by plural then verb.
+        """
+        return dict(sorted(self.calls.items(), key=lambda item: (item[0][1], item[0][0])))
+
+
+def connection_count(api_client: K8SClient.ApiClient) -> int:
+    """
+    Number of connections opened so far by the pools of an ApiClient.
+    """
+    pools = api_client.rest_client.pool_manager.pools
+    return sum(pools[key].num_connections for key in pools.keys())
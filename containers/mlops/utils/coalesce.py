@@ -0,0 +1,85 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from utils.concurrency import run_bounded, run_sync
+from utils.diff import DiffLineType, diff
+
+T = TypeVar("T")
+
+COALESCE_WINDOW: float = float(os.environ.get("MLOPS_COALESCE_WINDOW", "0.5"))
+
+
+class Coalescer:
+    """
+    Merge bursts of update events for the same object into a single reconcile.
+
+    The first event of an object opens a coalescing window for it: the events arriving within the window join it, and
+    once it is over the object is read again and reconciled once, with the net difference between the last handled spec
+    (kopf's old) and the current one. Kopf hands the events of an object to its handlers one at a time, so the events of
+    a burst also queue up behind the first one: they carry a generation that is already reconciled by then, and are
+    skipped. An event arriving after the object was read opens the next window.
+    """
+
+    def __init__(self, window: float = COALESCE_WINDOW) -> None:
+        self.window = window
+        self.reconciled: Dict[Hashable, int] = {}
+        self.pending: Dict[Hashable, asyncio.Future] = {}
+
+    async def reconcile(
+        self,
+        key: Hashable,
+        generation: int,
+        old: Optional[dict],
+        read: Callable[[], Optional[dict]],
+        handler: Callable[[Tuple[DiffLineType, ...]], T],
+        submit: Optional[Callable[[Callable[[], Awaitable[Optional[T]]]], Awaitable[Optional[T]]]] = None,
+    ) -> Optional[T]:
+        """
+        Reconcile an update event, unless a previous coalesced reconcile already covered it.
+        @param key: The key identifying the object, e.g. (plural, namespace, name).
+        @param generation: The metadata.generation of the object in the event.
+        @param old: The last handled state of the object, as passed by kopf to the update handlers.
+        @param read: Blocking function reading the current state of the object as a dict (None if it's gone).
+        @param handler: Function reconciling the object, given the net diff: a blocking one runs in a worker thread, a
+        coroutine function is awaited.
+        @param submit: Runs the reconcile once the window is over, e.g. through the work queue. Defaults to running it
+        right away.
+        @return: The result of the handler, or None if the event was coalesced or nothing changed.
+        """
+        while self.reconciled.get(key, -1) < generation:
+            pending = self.pending.get(key)
+            if pending is None:
+                break
+            # Join the window already open, then check if its reconcile covered this event.
+            await asyncio.shield(pending)
+        else:
+            return None
+
+        window = self.pending[key] = asyncio.get_running_loop().create_future()
+
+        async def reconcile() -> Optional[T]:
+            current = await run_bounded(read)
+            if current is None:
+                return None
+
+            net = diff({"spec": (old or {}).get("spec")}, {"spec": current.get("spec")})
+            if not net:
+                result = None
+            elif asyncio.iscoroutinefunction(handler):
+                result = await handler(net)
+            else:
+                result = await run_sync(handler, net)
+            self.reconciled[key] = max(generation, (current.get("metadata") or {}).get("generation") or 0)
+            return result
+
+        try:
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            return await (submit(reconcile) if submit else reconcile())
+        finally:
+            del self.pending[key]
+            window.set_result(None)
+
+    def forget(self, key: Hashable) -> None:
+        self.reconciled.pop(key, None)
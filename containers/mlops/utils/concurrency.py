@@ -0,0 +1,66 @@
+import asyncio
+import functools
+import os
+import weakref
+from typing import Any, Callable, Iterable, List, TypeVar
+
+T = TypeVar("T")
+
+MAX_CONCURRENCY: int = int(os.environ.get("MLOPS_MAX_CONCURRENCY", "8"))
+
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def get_semaphore() -> asyncio.Semaphore:
+    """
+    Get the semaphore bounding the number of in-flight API calls for the running event loop. It is shared by all the
+    async clients and the bounded helpers below, so the limit holds for the whole operator and not per handler.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _semaphores[loop]
+
+
+async def run_sync(function: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run a blocking function in a worker thread without taking a slot from the shared semaphore. Meant for whole
+    synchronous handlers, which would otherwise hold a slot for their full duration.
+    """
+    return await asyncio.to_thread(function, *args, **kwargs)
+
+
+async def run_bounded(function: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run a blocking function (usually a single API call) in a worker thread, waiting for a free slot first.
+    """
+    async with get_semaphore():
+        return await asyncio.to_thread(function, *args, **kwargs)
+
+
+async def gather_bounded(functions: Iterable[Callable[[], T]]) -> List[T]:
+    """
+    Run the blocking callables concurrently, at most MAX_CONCURRENCY at a time, and return the results in order.
+    """
+    return await asyncio.gather(*(run_bounded(function) for function in functions))
+
+
+class AsyncApi:
+    """
+    Asyncio flavour of a synchronous API client: every method of the wrapped client returns an awaitable which runs
+    the call in a worker thread, bounded by the shared semaphore.
+    """
+
+    def __init__(self, api: Any) -> None:
+        self.api = api
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self.api, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def wrapper(*args, **kwargs) -> Any:
+            return await run_bounded(attribute, *args, **kwargs)
+
+        return wrapper
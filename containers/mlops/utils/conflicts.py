@@ -0,0 +1,74 @@
+"""
+Optimistic concurrency for the writes of the operator: patches are sent with the resourceVersion of the object they
+were computed from (see utils.patch.with_resource_version), so a write racing with another writer (kopf, a user, a
+second replica of the operator) fails instead of silently overwriting the other change. The failed write is then
+retried a bounded number of times, each time against a fresh read of the object.
+"""
+
+import logging
+import os
+import re
+from typing import Any, Callable, Optional, TypeVar
+
+from kubernetes.client.rest import ApiException
+from utils.metrics import observe_conflict
+
+T = TypeVar("T")
+
+CONFLICT_RETRIES: int = int(os.environ.get("MLOPS_CONFLICT_RETRIES", "3"))
+
+
+def is_conflict(err: Any) -> bool:
+    """
+    Check if an error is a failed precondition: 409 Conflict for a stale resourceVersion in a merge patch or a replace,
+    422 Unprocessable Entity for a failed test operation in a JSON patch (on the resourceVersion or on a finalizer).
+    """
+    if not isinstance(err, ApiException):
+        return False
+    if err.status == 409:
+        # Creating an object that already exists is a 409 too, retrying it wouldn't help.
+        return "AlreadyExists" not in str(err.body)
+    # The API server reports "testing value /metadata/resourceVersion failed: test failed".
+    return err.status == 422 and re.search(r"test (operation )?failed", f"{err.reason} {err.body}") is not None
+
+
+def is_already_exists(err: Any) -> bool:
+    """
+    Check if an error is a create racing with another create of the same object, e.g. the children of a model version
+    shared by several endpoint config versions.
+    """
+    return isinstance(err, ApiException) and err.status == 409 and "AlreadyExists" in str(err.body)
+
+
+def retry_on_conflict(
+    write: Callable[[], T],
+    refresh: Callable[[], Any],
+    retries: Optional[int] = None,
+    resource: str = "",
+) -> T:
+    """
+    Run a write, re-reading the object and running the write again when it conflicts. The write has to compute its
+    patch from the refreshed object, not from values captured before the first attempt. There is no backoff: a conflict
+    means the object just changed, the fresh read already has the change.
+    @param write: The write to run, returning its result.
+    @param refresh: Reads the object again, bypassing the informer caches.
+    @param retries: The number of retries after the first attempt, MLOPS_CONFLICT_RETRIES by default.
+    @param resource: The plural or the kind of the object, for the logs and metrics.
+    @return: The result of the write.
+    @raise ApiException: The last conflict when the retries are exhausted, or any other error right away.
+    """
+    retries = CONFLICT_RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        try:
+            return write()
+        except ApiException as err:
+            if not is_conflict(err):
+                raise
+            observe_conflict(resource, retried=attempt < retries)
+            if attempt >= retries:
+                logging.warning(f"Write to {resource or 'object'} still conflicting after {retries} retries")
+                raise
+            attempt += 1
+            logging.debug(f"Write to {resource or 'object'} conflicted, retrying ({attempt}/{retries})")
+            refresh()
@@ -0,0 +1,90 @@
+import json
+import os
+import typing
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Dict, Tuple, Type, TypeVar, Union
+
+from pydantic import VERSION as PYDANTIC_VERSION
+from pydantic import BaseModel
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:  # pragma: no cover
+    loads = json.loads
+
+T = TypeVar("T", bound=BaseModel)
+
+PYDANTIC_V2: bool = PYDANTIC_VERSION.startswith("2.")
+
+TRUSTED_RESPONSES: bool = os.environ.get("MLOPS_TRUSTED_RESPONSES", "false").lower() == "true"
+
+
+@lru_cache(maxsize=None)
+def _fields(format: Type[BaseModel]) -> Dict[str, Tuple[Any, bool]]:
+    """
+    Map the fields of a model to their type hint and whether they must be set to None explicitly when missing, which
+    is the case for Optional fields without a default on pydantic 2.
+    """
+    hints = typing.get_type_hints(format)
+    fields = getattr(format, "model_fields", None) or format.__fields__
+    return {
+        name: (
+            hints[name],
+            typing.get_origin(hints[name]) is Union
+            and type(None) in typing.get_args(hints[name])
+            and (field.is_required() if hasattr(field, "is_required") else field.required),
+        )
+        for name, field in fields.items()
+    }
+
+
+def _construct_value(hint: Any, value: Any) -> Any:
+    if value is None:
+        return None
+
+    origin = typing.get_origin(hint)
+    if origin is Union:
+        for argument in typing.get_args(hint):
+            if argument is not type(None):
+                return _construct_value(argument, value)
+        return value
+    if origin in (list, typing.List) and isinstance(value, list):
+        (argument,) = typing.get_args(hint) or (Any,)
+        return [_construct_value(argument, item) for item in value]
+    if isinstance(hint, type) and issubclass(hint, BaseModel) and isinstance(value, dict):
+        return construct(hint, value)
+    if isinstance(hint, type) and issubclass(hint, Enum) and not isinstance(value, Enum):
+        return hint(value)
+    return value
+
+
+def construct(format: Type[T], data: Dict[str, Any]) -> T:
+    """
+    Build a pydantic model, including its nested models, from trusted data. Meant for objects coming from the API
+    server, which have already been validated against the CRD schema. On pydantic 1 the data is not validated at all;
+    on pydantic 2 the compiled validator is faster than any construction done in Python, so it is used instead.
+    Unknown fields (resourceVersion, managedFields, ...) are dropped, as parse_obj would do.
+    @param format: The pydantic model to build.
+    @param data: The decoded object.
+    @return: The pydantic model instance.
+    """
+    if PYDANTIC_V2:
+        return format.model_validate(data)
+
+    values = {}
+    for name, (hint, nullable) in _fields(format).items():
+        if name in data:
+            values[name] = _construct_value(hint, data[name])
+        elif nullable:
+            values[name] = None
+    return format.construct(**values)
+
+
+def decode(response: Any) -> Any:
+    """
+    Decode a raw response returned by a kubernetes client call made with _preload_content=False.
+    """
+    return loads(response.data)
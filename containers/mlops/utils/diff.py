@@ -1,15 +1,15 @@
-from typing import Iterable, List, Optional, Tuple, Union
+from typing import Any, Iterable, List, Optional, Tuple, Union
 
 from pydantic import BaseModel
 
-DiffLineType = Tuple[str, Tuple[str, ...], Union[str, None], Union[str, None]]
+DiffLineType = Tuple[str, Tuple[str, ...], Any, Any]
 
 
 class DiffLine(BaseModel):
     action: str
     path: Tuple[str, ...]
-    old_value: Union[str, None]
-    new_value: Union[str, None]
+    old_value: Any = None
+    new_value: Any = None
 
     @staticmethod
     def from_tuple(diff_line: DiffLineType) -> "DiffLine":
@@ -41,3 +41,26 @@ class DiffLine(BaseModel):
             )
         except StopIteration:
             return None
+
+
+def diff(old: Any, new: Any, path: Tuple[str, ...] = ()) -> Tuple[DiffLineType, ...]:
+    """
+    Compute the difference between two objects, in the same format as the diffs kopf passes to the update handlers:
+    dictionaries are compared key by key, any other value (including lists) is compared as a whole.
+    :param old: The old object.
+    :param new: The new object.
+    :param path: The path of the objects inside their parent.
+    :return: A tuple of (action, path, old value, new value) lines.
+    """
+    if old == new:
+        return ()
+    if isinstance(old, dict) and isinstance(new, dict):
+        lines = []
+        for key in list(old) + [key for key in new if key not in old]:
+            lines.extend(diff(old.get(key), new.get(key), path + (key,)))
+        return tuple(lines)
+    if old is None:
+        return (("add", path, None, new),)
+    if new is None:
+        return (("remove", path, old, None),)
+    return (("change", path, old, new),)
@@ -0,0 +1,60 @@
+"""
+Drop the update events the operator causes itself.
+
+Every reconcile writes back to the objects it handles: the status (state, model versions, ...) and some metadata
+(labels, owner references, finalizers, kopf's own annotations). Kopf compares the objects without their status, so the
+status writes don't call the update handlers, but the label writes still do, and each reconcile could then cause more
+reconciles. The update handlers only run for what a user can change:
+- the events not changing the watched paths (the spec) are dropped;
+- the API server increments metadata.generation on spec changes only, and the operator records the last generation it
+  reconciled in status.observedGeneration, through the status subresource: the events of a generation already
+  reconciled are dropped as well, e.g. the events queued during a coalesced burst, or replayed after a restart.
+"""
+
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from utils.diff import DiffLineType
+
+OBSERVED_GENERATION: str = "observedGeneration"
+SPEC: Tuple[Tuple[str, ...], ...] = (("spec",),)
+
+
+def observed_generation(status: Optional[Dict[str, Any]]) -> int:
+    """
+    @param status: The status of the object, as a dict.
+    @return: The last generation reconciled by the operator, 0 if none was recorded.
+    """
+    return (status or {}).get(OBSERVED_GENERATION) or 0
+
+
+def changes_paths(diff: Optional[Iterable[DiffLineType]], paths: Iterable[Tuple[str, ...]] = SPEC) -> bool:
+    """
+    Check if a diff changes any of the given paths, or anything below them.
+    @param diff: The diff of the event, as passed by kopf.
+    @param paths: The watched paths. Defaults to the spec.
+    """
+    paths = list(paths)
+    for line in diff or ():
+        changed = tuple(line[1])
+        # A change of a parent (e.g. the whole spec added) changes its children too.
+        if any(changed[: len(path)] == path or path[: len(changed)] == changed for path in paths):
+            return True
+    return False
+
+
+def is_observed(meta: Optional[Dict[str, Any]], status: Optional[Dict[str, Any]]) -> bool:
+    """
+    Check if the generation of an object was already reconciled.
+    @param meta: The metadata of the object, as a dict.
+    @param status: The status of the object, as a dict.
+    """
+    generation = (meta or {}).get("generation")
+    return bool(generation) and generation <= observed_generation(status)
+
+
+def generation_patch(generation: int) -> Dict[str, Any]:
+    """
+    @param generation: The generation reconciled.
+    @return: The merge patch of the status subresource recording it.
+    """
+    return {"status": {OBSERVED_GENERATION: generation}}
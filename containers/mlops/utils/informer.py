@@ -0,0 +1,340 @@
+from __future__ import annotations
+
+import copy
+import logging
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from kubernetes import client as K8SClient
+from kubernetes import watch as K8SWatch
+from utils.api_client import get_api_client
+from utils.startup import Phase, timeline
+
+StoreKey = Tuple[str, str]
+# An indexer returns the value an object is indexed under, or several of them (e.g. the names of its owners).
+Indexer = Callable[[dict], Union[None, str, Iterable[str]]]
+
+# Deleted objects remembered to reject stale writes of them, the oldest being forgotten first. They are all forgotten on
+# relist.
+MAX_TOMBSTONES: int = 10000
+# Seconds an informer waits before restarting after a failure, doubling up to the maximum.
+RESTART_BACKOFF: float = 1.0
+RESTART_BACKOFF_MAX: float = 30.0
+
+
+def label_indexer(label: str) -> Indexer:
+    """
+    Index objects by the value of one of their labels.
+    """
+    return lambda obj: ((obj.get("metadata") or {}).get("labels") or {}).get(label)
+
+
+def owner_index(kind: str) -> str:
+    """
+    The name of the index of the objects by their owners of a kind, see owner_indexer.
+    """
+    return f"ownerReferences.{kind}"
+
+
+def owner_indexer(kind: str) -> Indexer:
+    """
+    Index objects by the names of their owners of a kind. An object shared by several owners is indexed under each of
+    them, not only under its controller.
+    """
+    return lambda obj: [
+        reference["name"]
+        for reference in (obj.get("metadata") or {}).get("ownerReferences") or []
+        if reference.get("kind") == kind
+    ]
+
+
+def _index_values(indexer: Indexer, obj: dict) -> Tuple[str, ...]:
+    values = indexer(obj)
+    if values is None:
+        return ()
+    return (values,) if isinstance(values, str) else tuple(values)
+
+
+def _resource_version(obj: dict) -> Optional[int]:
+    """
+    Resource versions are opaque strings for the API server, but etcd backed clusters hand out monotonically
+    increasing integers. When the value can't be compared, None is returned and the newer write always wins.
+    """
+    try:
+        return int(obj["metadata"]["resourceVersion"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class Store:
+    """
+    Thread safe in-process store for custom objects, keyed by (namespace, name). Secondary indexes map the value an
+    indexer computes for each object to the keys of the objects in the same namespace sharing it, so lookups such as
+    "the models of an endpoint config" don't need to scan the store.
+    """
+
+    def __init__(self, indexers: Dict[str, Indexer] = None) -> None:
+        self._lock = threading.RLock()
+        self._objects: Dict[StoreKey, dict] = {}
+        self._deleted: Dict[StoreKey, Optional[int]] = {}
+        self._indexers: Dict[str, Indexer] = dict(indexers or {})
+        self._indexes: Dict[str, Dict[StoreKey, Set[StoreKey]]] = {name: defaultdict(set) for name in self._indexers}
+
+    @staticmethod
+    def key(obj: dict) -> StoreKey:
+        return obj["metadata"].get("namespace", ""), obj["metadata"]["name"]
+
+    def get(self, namespace: str, name: str) -> Optional[dict]:
+        with self._lock:
+            obj = self._objects.get((namespace, name))
+            return copy.deepcopy(obj) if obj is not None else None
+
+    def list(self, namespace: Optional[str] = None) -> List[dict]:
+        with self._lock:
+            return [
+                copy.deepcopy(obj) for key, obj in self._objects.items() if namespace is None or key[0] == namespace
+            ]
+
+    def has_index(self, index: str) -> bool:
+        return index in self._indexers
+
+    def by_index(self, index: str, namespace: str, value: str) -> List[dict]:
+        """
+        List the objects of a namespace for which the indexer returns the given value.
+        """
+        with self._lock:
+            keys = self._indexes[index].get((namespace, value), ())
+            return [copy.deepcopy(self._objects[key]) for key in sorted(keys)]
+
+    def _index(self, key: StoreKey, obj: dict) -> None:
+        for name, indexer in self._indexers.items():
+            for value in _index_values(indexer, obj):
+                self._indexes[name][(key[0], value)].add(key)
+
+    def _unindex(self, key: StoreKey, obj: Optional[dict]) -> None:
+        if obj is None:
+            return
+        for name, indexer in self._indexers.items():
+            for value in _index_values(indexer, obj):
+                keys = self._indexes[name].get((key[0], value))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._indexes[name][(key[0], value)]
+
+    def put(self, obj: dict) -> bool:
+        """
+        Store an object unless the store already holds a newer resourceVersion of it.
+        @param obj: The object as returned by the API server.
+        @return: True if the store was updated, False if the object was stale.
+        """
+        key = self.key(obj)
+        version = _resource_version(obj)
+        with self._lock:
+            current = self._objects.get(key)
+            current_version = _resource_version(current) if current is not None else self._deleted.get(key)
+            if version is not None and current_version is not None and version < current_version:
+                return False
+            self._unindex(key, current)
+            self._objects[key] = obj
+            self._index(key, obj)
+            self._deleted.pop(key, None)
+            return True
+
+    def delete(self, namespace: str, name: str, resource_version: Optional[int] = None) -> None:
+        with self._lock:
+            current = self._objects.pop((namespace, name), None)
+            self._unindex((namespace, name), current)
+            if resource_version is None and current is not None:
+                resource_version = _resource_version(current)
+            self._deleted.pop((namespace, name), None)
+            self._deleted[(namespace, name)] = resource_version
+            while len(self._deleted) > MAX_TOMBSTONES:
+                del self._deleted[next(iter(self._deleted))]
+
+    def replace(self, objects: Iterable[dict]) -> None:
+        with self._lock:
+            self._objects = {self.key(obj): obj for obj in objects}
+            self._deleted = {}
+            self._indexes = {name: defaultdict(set) for name in self._indexers}
+            for key, obj in self._objects.items():
+                self._index(key, obj)
+
+
+class Informer:
+    """
+    Keeps a Store in sync with the API server using one list and one long running watch per plural. Reads are served
+    from the store, while writes made by the operator itself are recorded through observe/forget so that the store
+    never lags behind our own changes.
+    """
+
+    def __init__(
+        self,
+        group: str,
+        version: str,
+        plural: str,
+        namespace: Optional[str] = None,
+        api: K8SClient.CustomObjectsApi = None,
+        timeout_seconds: int = 300,
+        indexers: Dict[str, Indexer] = None,
+    ) -> None:
+        self.group = group
+        self.version = version
+        self.plural = plural
+        self.namespace = namespace
+        self.api = api or K8SClient.CustomObjectsApi(get_api_client())
+        self.timeout_seconds = timeout_seconds
+
+        self.store = Store(indexers)
+        self.resource_version: Optional[str] = None
+        self.synced = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _list(self, **kwargs) -> dict:
+        if self.namespace:
+            return self.api.list_namespaced_custom_object(
+                self.group, self.version, self.namespace, self.plural, **kwargs
+            )
+        return self.api.list_cluster_custom_object(self.group, self.version, self.plural, **kwargs)
+
+    def _list_function(self):
+        if self.namespace:
+            return self.api.list_namespaced_custom_object, (self.group, self.version, self.namespace, self.plural)
+        return self.api.list_cluster_custom_object, (self.group, self.version, self.plural)
+
+    def relist(self) -> None:
+        result = self._list()
+        self.store.replace(result.get("items", []))
+        self.resource_version = result.get("metadata", {}).get("resourceVersion")
+        self.synced.set()
+        if all(informer.synced.is_set() for informer in _informers.values()):
+            timeline.mark(Phase.CACHE_SYNCED)
+
+    def apply(self, event: dict) -> None:
+        """
+        Apply a single watch event to the store.
+        @param event: A watch event with "type" and "object" keys.
+        """
+        obj = event["object"]
+        if event["type"] == "BOOKMARK":
+            self.resource_version = obj["metadata"]["resourceVersion"]
+            return
+        if event["type"] == "ERROR":
+            # The resource version we're watching from is too old (410 Gone), start over with a full list.
+            self.resource_version = None
+            return
+
+        self.resource_version = obj["metadata"].get("resourceVersion", self.resource_version)
+        if event["type"] == "DELETED":
+            namespace, name = self.store.key(obj)
+            self.store.delete(namespace, name, _resource_version(obj))
+        else:
+            self.store.put(obj)
+
+    def run(self) -> None:
+        """
+        List and watch until stopped. On any failure (an API error, but also a dropped connection, a read timeout or
+        an undecodable event), the reads fall back to the API server until the store is listed again, after a backoff.
+        """
+        backoff = RESTART_BACKOFF
+        while not self._stopped.is_set():
+            try:
+                if self.resource_version is None:
+                    self.relist()
+                function, args = self._list_function()
+                for event in K8SWatch.Watch().stream(
+                    function,
+                    *args,
+                    resource_version=self.resource_version,
+                    timeout_seconds=self.timeout_seconds,
+                    allow_watch_bookmarks=True,
+                ):
+                    timeline.mark(Phase.FIRST_WATCH)
+                    self.apply(event)
+                    backoff = RESTART_BACKOFF
+                    if self._stopped.is_set() or self.resource_version is None:
+                        break
+            except Exception as err:
+                logging.warning(f"Informer for {self.plural} restarting in {backoff}s after error: {err!r}")
+                self.synced.clear()
+                self.resource_version = None
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+
+    def start(self) -> "Informer":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name=f"informer-{self.plural}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def get(self, namespace: str, name: str) -> Optional[dict]:
+        """
+        Read an object from the store. Returns None when the store isn't synced yet or the object is unknown, in
+        which case the caller should fall back to a live read.
+        """
+        if not self.synced.is_set():
+            return None
+        return self.store.get(namespace, name)
+
+    def by_index(self, index: str, namespace: str, value: str) -> Optional[List[dict]]:
+        """
+        List objects through one of the secondary indexes. Returns None when the store isn't synced yet or doesn't
+        have the index, in which case the caller should fall back to a live list.
+        """
+        if not self.synced.is_set() or not self.store.has_index(index):
+            return None
+        return self.store.by_index(index, namespace, value)
+
+    def observe(self, obj: Optional[dict]) -> None:
+        """
+        Record an object returned by one of our own create/patch calls.
+        """
+        if isinstance(obj, dict) and obj.get("metadata", {}).get("name"):
+            self.store.put(obj)
+
+    def forget(self, namespace: str, name: str) -> None:
+        """
+        Record one of our own deletes.
+        """
+        self.store.delete(namespace, name)
+
+
+_informers: Dict[Tuple[str, str], Informer] = {}
+
+
+def register_informer(informer: Informer) -> Informer:
+    _informers[(informer.group, informer.plural)] = informer
+    return informer
+
+
+def get_informer(group: str, plural: str) -> Optional[Informer]:
+    return _informers.get((group, plural))
+
+
+def start_informers(
+    group: str,
+    version: str,
+    plurals: List[str],
+    namespace: Optional[str] = None,
+    indexers: Dict[str, Dict[str, Indexer]] = None,
+) -> List[Informer]:
+    """
+    Start one informer per plural and register it so that the V1Alpha1Api/V1Beta1Api clients serve reads from it.
+    @param indexers: The secondary indexes to maintain, by plural.
+    """
+    indexers = indexers or {}
+    return [
+        register_informer(Informer(group, version, plural, namespace=namespace, indexers=indexers.get(plural))).start()
+        for plural in plurals
+    ]
+
+
+def stop_informers() -> None:
+    for informer in _informers.values():
+        informer.stop()
+    _informers.clear()
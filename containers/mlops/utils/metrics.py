@@ -0,0 +1,237 @@
+import functools
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple, TypeVar
+from urllib.parse import parse_qs, urlsplit
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+T = TypeVar("T")
+
+METRICS_PORT: int = int(os.environ.get("MLOPS_METRICS_PORT", "9090"))
+
+# API calls range from a few milliseconds (informer misses, status patches) to several seconds (throttled writes).
+API_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Reconciles and model rollouts range from a few hundred milliseconds to several minutes (image pulls, PV binding).
+RECONCILE_BUCKETS: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+if prometheus_client is not None:
+    API_REQUEST_SECONDS = prometheus_client.Histogram(
+        "mlops_api_request_duration_seconds",
+        "Latency of the Kubernetes API calls, by verb and plural.",
+        ["verb", "plural"],
+        buckets=API_BUCKETS,
+    )
+    API_ERROR_SECONDS = prometheus_client.Histogram(
+        "mlops_api_request_error_duration_seconds",
+        "Latency of the failed Kubernetes API calls, by verb, plural and status code (429 means throttled).",
+        ["verb", "plural", "code"],
+        buckets=API_BUCKETS,
+    )
+    API_RETRIES = prometheus_client.Counter(
+        "mlops_api_retries_total",
+        "Kubernetes API calls retried after a transient failure, by verb and reason (status code or error class).",
+        ["verb", "reason"],
+    )
+    API_THROTTLE_SECONDS = prometheus_client.Histogram(
+        "mlops_api_throttle_seconds",
+        "Time the Kubernetes API calls waited for the client-side rate limiter, by verb.",
+        ["verb"],
+        buckets=API_BUCKETS,
+    )
+    RECONCILE_SECONDS = prometheus_client.Histogram(
+        "mlops_reconcile_duration_seconds",
+        "Duration of the kopf handlers, by handler and outcome.",
+        ["handler", "outcome"],
+        buckets=RECONCILE_BUCKETS,
+    )
+    QUEUE_DEPTH = prometheus_client.Gauge(
+        "mlops_work_queue_depth", "Work items waiting for a worker, by lane.", ["lane"]
+    )
+    QUEUE_WAIT_SECONDS = prometheus_client.Histogram(
+        "mlops_work_queue_wait_seconds",
+        "Time the work items spent waiting for a worker, by lane.",
+        ["lane"],
+        buckets=RECONCILE_BUCKETS,
+    )
+    CACHE_LOOKUPS = prometheus_client.Counter(
+        "mlops_cache_lookups_total",
+        "Reads served by the informer caches (hit) or sent to the API server (miss), by plural.",
+        ["plural", "result"],
+    )
+    CONFLICTS = prometheus_client.Counter(
+        "mlops_write_conflicts_total",
+        "Writes rejected because the object changed since it was read, by resource and outcome (retried or exhausted).",
+        ["resource", "outcome"],
+    )
+    ORPHANS = prometheus_client.Counter(
+        "mlops_orphans_total",
+        "Objects of the operator found without owner references by the sweeper, by kind and action (adopt or delete).",
+        ["kind", "action"],
+    )
+    MODEL_VERSIONS = prometheus_client.Counter(
+        "mlops_model_versions_total",
+        "Model versions requested by the endpoint configs, by outcome (created, or shared with an identical variant).",
+        ["outcome"],
+    )
+    DROPPED_EVENTS = prometheus_client.Counter(
+        "mlops_dropped_events_total",
+        "Update events dropped without a reconcile, by plural and reason (no watched field changed, or generation "
+        "already observed).",
+        ["plural", "reason"],
+    )
+    STARTUP_SECONDS = prometheus_client.Gauge(
+        "mlops_startup_seconds", "Seconds from the start of the process to each startup phase.", ["phase"]
+    )
+    MODEL_READY_SECONDS = prometheus_client.Histogram(
+        "mlops_model_ready_seconds",
+        "Time from the creation of a model version to its deployment being ready.",
+        buckets=RECONCILE_BUCKETS,
+    )
+
+
+def enabled() -> bool:
+    return prometheus_client is not None
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> bool:
+    """
+    Serve the metrics on http://0.0.0.0:{port}/metrics from a background thread. MLOPS_METRICS_PORT=0 disables it.
+    @return: Whether the server was started.
+    """
+    if not enabled() or not port:
+        return False
+    prometheus_client.start_http_server(port)
+    logging.info(f"Serving Prometheus metrics on port {port}")
+    return True
+
+
+def describe_request(method: str, url: str) -> Tuple[str, str]:
+    """
+    Map a REST call to the Kubernetes verb and the plural (with its subresource, e.g. models/status) it targets.
+    @param method: The HTTP method.
+    @param url: The full request URL, e.g. https://host/apis/apps/v1/namespaces/ml/deployments/titanic-rfc.
+    @return: The (verb, plural) pair.
+    """
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split("/") if segment]
+    if segments[:1] == ["api"]:
+        segments = segments[2:]
+    elif segments[:1] == ["apis"]:
+        segments = segments[3:]
+    if segments[:1] == ["namespaces"] and len(segments) > 2:
+        segments = segments[2:]
+
+    plural = segments[0] if segments else ""
+    named = len(segments) > 1
+    if len(segments) > 2:
+        plural = f"{plural}/{segments[2]}"
+
+    method = method.upper()
+    if method == "GET":
+        if parse_qs(parts.query).get("watch", [""])[0].lower() == "true":
+            verb = "watch"
+        else:
+            verb = "get" if named else "list"
+    elif method == "DELETE":
+        verb = "delete" if named else "deletecollection"
+    else:
+        verb = {"POST": "create", "PUT": "update", "PATCH": "patch"}.get(method, method.lower())
+    return verb, plural
+
+
+def observe_api_request(method: str, url: str, seconds: float, error: Optional[Any] = None) -> None:
+    """
+    Record an API call. Watches are long-lived by design, so only their errors are recorded.
+    @param error: The exception raised by the call, or the failed response; both carry the status code.
+    """
+    if not enabled():
+        return
+    verb, plural = describe_request(method, url)
+    if error is not None:
+        code = str(getattr(error, "status", None) or "error")
+        API_ERROR_SECONDS.labels(verb=verb, plural=plural, code=code).observe(seconds)
+    elif verb != "watch":
+        API_REQUEST_SECONDS.labels(verb=verb, plural=plural).observe(seconds)
+
+
+def observe_api_retry(verb: str, reason: str) -> None:
+    if enabled():
+        API_RETRIES.labels(verb=verb, reason=reason).inc()
+
+
+def observe_api_throttle(verb: str, seconds: float) -> None:
+    if enabled():
+        API_THROTTLE_SECONDS.labels(verb=verb).observe(seconds)
+
+
+def observe_cache_lookup(plural: str, hit: bool) -> None:
+    if enabled():
+        CACHE_LOOKUPS.labels(plural=plural, result="hit" if hit else "miss").inc()
+
+
+def observe_conflict(resource: str, retried: bool) -> None:
+    if enabled():
+        CONFLICTS.labels(resource=resource, outcome="retried" if retried else "exhausted").inc()
+
+
+def observe_orphan(kind: str, action: str) -> None:
+    if enabled():
+        ORPHANS.labels(kind=kind, action=action).inc()
+
+
+def observe_model_version(shared: bool) -> None:
+    if enabled():
+        MODEL_VERSIONS.labels(outcome="shared" if shared else "created").inc()
+
+
+def observe_dropped_event(plural: str, reason: str) -> None:
+    if enabled():
+        DROPPED_EVENTS.labels(plural=plural, reason=reason).inc()
+
+
+def observe_queue_wait(lane: str, seconds: float) -> None:
+    if enabled():
+        QUEUE_WAIT_SECONDS.labels(lane=lane).observe(seconds)
+
+
+def track_queue_depth(lane: str, depth: Callable[[], float]) -> None:
+    """
+    Export the depth of a work queue lane, read when the metrics are scraped.
+    """
+    if enabled():
+        QUEUE_DEPTH.labels(lane=lane).set_function(depth)
+
+
+def observe_model_ready(seconds: float) -> None:
+    if enabled():
+        MODEL_READY_SECONDS.observe(seconds)
+
+
+def observe_startup_phase(phase: str, seconds: float) -> None:
+    if enabled():
+        STARTUP_SECONDS.labels(phase=phase).set(seconds)
+
+
+def timed(function: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """
+    Record the duration of an async kopf handler, labelled with the handler name and its outcome.
+    """
+
+    @functools.wraps(function)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            result = await function(*args, **kwargs)
+            outcome = "success"
+            return result
+        finally:
+            if enabled():
+                RECONCILE_SECONDS.labels(handler=function.__name__, outcome=outcome).observe(time.monotonic() - started)
+
+    return wrapper
@@ -0,0 +1,120 @@
+"""
+Owner references of the objects created by the operator. Every child points at the custom resource it was created for:
+- an Endpoint owns its Gateway and its EndpointConfig version;
+- an EndpointConfig version owns its VirtualService and its Model versions;
+- a Model version owns its Deployment, Service and PersistentVolumeClaim.
+
+Deleting an endpoint is then a single call: the garbage collector of the API server deletes the whole tree in the
+background, instead of the delete handlers walking it call by call. PersistentVolumes are cluster scoped, so they
+can't be owned by a namespaced object: they are deleted by the orphan sweeper (resources/sweeper.py), which also adopts
+the objects created before the owner references were introduced.
+
+A model version serving the same content as one already deployed is shared (see EndpointConfig.create_model_version):
+every endpoint config version using it is one of its owners, so the owner references count its users and the garbage
+collector deletes it, and its children, along with the last one. Its endpoint, endpoint_config and
+endpoint_config_version labels and status fields name its controller, the first of its owners (see Model.release).
+"""
+
+from typing import Any, Dict, List, Optional, Set
+
+from kubernetes import client as K8SClient
+from pydantic import BaseModel
+
+
+def _as_dict(obj: Any) -> Dict[str, Any]:
+    if obj is None:
+        return {}
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    return obj
+
+
+def owner_reference(owner: Any) -> Optional[Dict[str, Any]]:
+    """
+    The owner reference pointing at a custom resource, as read from the API server.
+    @param owner: The owner, either a pydantic model or a dict.
+    @return: The owner reference, None if the owner has no uid yet (e.g. a body built but not created).
+    """
+    body = _as_dict(owner)
+    metadata = body.get("metadata") or {}
+    if not metadata.get("uid"):
+        return None
+    return {
+        "apiVersion": body.get("apiVersion"),
+        "kind": body.get("kind"),
+        "name": metadata.get("name"),
+        "uid": metadata.get("uid"),
+        "controller": True,
+    }
+
+
+def owner_references(owner: Any) -> List[Dict[str, Any]]:
+    """
+    The owner references of the children of an object: a single reference to it, or none if it doesn't exist.
+    """
+    reference = owner_reference(owner)
+    return [reference] if reference else []
+
+
+def add_owner_reference(references: List[Dict[str, Any]], reference: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The owner references of an object shared by several owners, with one more owner: the garbage collector only
+    deletes the object along with the last of them. Only the first owner is the controller, the API server rejecting
+    a second one.
+    """
+    if not reference or any(owner.get("uid") == reference["uid"] for owner in references):
+        return list(references)
+    controlled = any(owner.get("controller") for owner in references)
+    return [*references, {**reference, "controller": not controlled}]
+
+
+def remove_owner_reference(references: List[Dict[str, Any]], uid: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    The owner references of a shared object without one of its owners. The next owner becomes the controller when the
+    controller is removed.
+    """
+    remaining = [dict(owner) for owner in references if owner.get("uid") != uid]
+    if remaining and not any(owner.get("controller") for owner in remaining):
+        remaining[0]["controller"] = True
+    return remaining
+
+
+def controller_reference(obj: Any) -> Optional[Dict[str, Any]]:
+    """
+    The owner reference of the controller of an object, given as a pydantic model or as a dict read from the API server.
+    """
+    metadata = _as_dict(obj).get("metadata") or {}
+    return next((reference for reference in metadata.get("ownerReferences") or [] if reference.get("controller")), None)
+
+
+def k8s_owner_references(references: Optional[List[Dict[str, Any]]]) -> Optional[List[K8SClient.V1OwnerReference]]:
+    """
+    The owner references as kubernetes client models, for the metadata of the core and apps kinds.
+    """
+    if not references:
+        return None
+    return [
+        K8SClient.V1OwnerReference(
+            api_version=reference["apiVersion"],
+            kind=reference["kind"],
+            name=reference["name"],
+            uid=reference["uid"],
+            controller=reference.get("controller"),
+        )
+        for reference in references
+    ]
+
+
+def owner_uids(obj: Any) -> Set[str]:
+    """
+    The uids of the owners of an object, given as a pydantic model or as a dict read from the API server.
+    """
+    metadata = _as_dict(obj).get("metadata") or {}
+    return {reference.get("uid") for reference in metadata.get("ownerReferences") or []}
+
+
+def is_owned(obj: Any) -> bool:
+    """
+    Whether an object has an owner, in which case the garbage collector deletes it along with its owner.
+    """
+    return bool(owner_uids(obj))
@@ -0,0 +1,151 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from kubernetes.utils import parse_quantity
+
+JSON_PATCH: str = "application/json-patch+json"
+MERGE_PATCH: str = "application/merge-patch+json"
+
+PatchType = Union[Dict[str, Any], List[Dict[str, Any]]]
+
+# The fields of the custom resources managed by their update methods. Finalizers are left out on purpose, they are
+# managed through finalizers_patch.
+DELTA_FIELDS: Dict[str, Any] = {"metadata": {"labels"}, "spec": ..., "status": ...}
+
+
+def patch_content_type(patch: PatchType) -> str:
+    """
+    JSON patches (RFC 6902) are lists of operations, everything else is sent as a JSON merge patch (RFC 7386).
+    """
+    return JSON_PATCH if isinstance(patch, list) else MERGE_PATCH
+
+
+def merge_patch(old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the smallest JSON merge patch that turns old into new. Only the keys present in new are considered, so
+    fields owned by someone else (server defaults, other controllers) are never removed; set a key to None in new to
+    remove it explicitly. Lists are compared as a whole, as merge patches can't address list items.
+    @param old: The current object, as a dict.
+    @param new: The desired object, as a dict.
+    @return: The merge patch, empty when nothing changed.
+    """
+    old = old or {}
+    patch = {}
+    for key, value in new.items():
+        current = old.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            nested = merge_patch(current, value)
+            if nested:
+                patch[key] = nested
+        elif value != current:
+            patch[key] = value
+    return patch
+
+
+def _quantity(value: Any) -> Any:
+    try:
+        return parse_quantity(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def converges(observed: Any, desired: Any) -> bool:
+    """
+    Check if an observed value already satisfies a desired one: dictionaries only need the desired keys, lists need
+    the same length and converging items, and quantities ("0.1" and "100m", "1Gi" and "1024Mi") are compared by value.
+    The fields the API server adds or normalizes (defaults, clusterIP, ...) so don't cause endless patches.
+    """
+    if isinstance(desired, dict):
+        return isinstance(observed, dict) and all(converges(observed.get(key), value) for key, value in desired.items())
+    if isinstance(desired, list):
+        return (
+            isinstance(observed, list)
+            and len(observed) == len(desired)
+            and all(converges(current, value) for current, value in zip(observed, desired))
+        )
+    if observed == desired:
+        return True
+    if isinstance(desired, str) and isinstance(observed, (str, int, float)):
+        quantity = _quantity(desired)
+        return quantity is not None and quantity == _quantity(observed)
+    return False
+
+
+def converge_patch(observed: Optional[Dict[str, Any]], desired: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Same as merge_patch, but for an observed object read back from the API server: values are compared with converges,
+    so the patch is empty when the object already is in the desired state.
+    @param observed: The observed object, as a dict.
+    @param desired: The desired object, as a dict, restricted to the fields managed by the operator.
+    @return: The merge patch, empty when nothing has to change.
+    """
+    observed = observed or {}
+    patch = {}
+    for key, value in desired.items():
+        current = observed.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            nested = converge_patch(current, value)
+            if nested:
+                patch[key] = nested
+        elif not converges(current, value):
+            patch[key] = value
+    return patch
+
+
+def split_status(patch: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Split a merge patch into the part sent to the main resource and the part sent to the status subresource.
+    @param patch: A merge patch built with merge_patch.
+    @return: The main resource patch and the status subresource patch (None if the status didn't change).
+    """
+    patch = dict(patch)
+    status = patch.pop("status", None)
+    return patch, {"status": status} if status else None
+
+
+def finalizers_patch(
+    current: Optional[List[str]], add: Iterable[str] = (), remove: Iterable[str] = ()
+) -> List[Dict[str, Any]]:
+    """
+    Build a JSON patch adding and removing finalizers. Finalizers are removed by index, each removal guarded by a test
+    operation so the patch fails instead of removing the wrong entry if the list changed in the meantime.
+    @param current: The finalizers currently set on the object.
+    @param add: Finalizers to add, if missing.
+    @param remove: Finalizers to remove, if present.
+    @return: The JSON patch operations, empty when nothing changed.
+    """
+    current = list(current or [])
+    remove = set(remove)
+
+    operations = []
+    for index in reversed(range(len(current))):
+        if current[index] in remove:
+            path = f"/metadata/finalizers/{index}"
+            operations.append({"op": "test", "path": path, "value": current[index]})
+            operations.append({"op": "remove", "path": path})
+
+    remaining = [finalizer for finalizer in current if finalizer not in remove]
+    missing = [finalizer for finalizer in dict.fromkeys(add) if finalizer not in remaining]
+    if not current and missing:
+        operations.append({"op": "add", "path": "/metadata/finalizers", "value": missing})
+    else:
+        operations.extend({"op": "add", "path": "/metadata/finalizers/-", "value": finalizer} for finalizer in missing)
+
+    return operations
+
+
+def with_resource_version(patch: PatchType, resource_version: Optional[str]) -> PatchType:
+    """
+    Make a patch conditional on the version of the object it was computed from: merge patches carry the
+    metadata.resourceVersion, which the API server rejects with 409 Conflict when the object changed since; JSON
+    patches start with a test operation on it, failing with 422 instead. Empty patches are returned as is, so nothing is
+    sent for them.
+    @param patch: A merge patch or a JSON patch.
+    @param resource_version: The resourceVersion of the object the patch was computed from, None to patch
+    unconditionally.
+    @return: A new patch, the given one is not changed.
+    """
+    if not patch or not resource_version:
+        return patch
+    if isinstance(patch, list):
+        return [{"op": "test", "path": "/metadata/resourceVersion", "value": resource_version}] + patch
+    return {**patch, "metadata": {**patch.get("metadata", {}), "resourceVersion": resource_version}}
@@ -0,0 +1,206 @@
+"""
+Client-side throttling of the Kubernetes API calls, shared by every ApiClient of the process:
+- a token bucket per verb caps the rate of the calls (MLOPS_API_QPS) while letting short bursts through
+  (MLOPS_API_BURST), so a mass rollout queues up in the operator instead of being answered 429 by the API Priority and
+  Fairness of the API server;
+- the transient failures (429, 5xx, timeouts and dropped connections) are retried with an exponential backoff with full
+  jitter, waiting at least as long as the Retry-After header of the response asks. A 429 also pauses the buckets, so the
+  other calls back off too.
+
+Both settings take a default optionally followed by per verb values, e.g. MLOPS_API_QPS="20,list=5,patch=10".
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, Optional, TypeVar
+
+from urllib3.exceptions import HTTPError
+
+T = TypeVar("T")
+
+DEFAULT: str = "*"
+# The calls safe to send twice: a create sent again after a 5xx or a timeout may have been applied the first time.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "PATCH", "DELETE")
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def parse_limits(value: str, cast: Callable[[str], T]) -> Dict[str, T]:
+    """
+    Parse a limit setting: "20" or "20,list=5,patch=10".
+    @return: The limits by verb, the default one under "*".
+    """
+    limits = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        verb, _, limit = item.rpartition("=")
+        limits[verb.strip().lower() or DEFAULT] = cast(limit)
+    return limits
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket: tokens are added at qps per second, up to burst; every call takes one, waiting for it if
+    needed. A qps of 0 disables the bucket.
+    """
+
+    def __init__(
+        self,
+        qps: float,
+        burst: int,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.qps = qps
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.tokens: float = self.burst
+        self.updated: float = clock()
+        self.paused_until: float = 0.0
+
+    def reserve(self) -> float:
+        """
+        Take a token, possibly one that will only be available in the future.
+        @return: The seconds to wait before using it.
+        """
+        with self._lock:
+            now = self.clock()
+            if self.qps > 0:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.qps)
+            self.updated = now
+            wait = max(0.0, self.paused_until - now)
+            if self.qps <= 0:
+                return wait
+            self.tokens -= 1
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.qps)
+            return wait
+
+    def try_acquire(self) -> bool:
+        """
+        Take a token only if one is available right away, as an API server does before answering 429.
+        """
+        with self._lock:
+            now = self.clock()
+            if self.qps > 0:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.qps)
+            self.updated = now
+            if now < self.paused_until or (self.qps > 0 and self.tokens < 1):
+                return False
+            if self.qps > 0:
+                self.tokens -= 1
+            return True
+
+    def acquire(self) -> float:
+        """
+        Take a token, waiting for it.
+        @return: The seconds waited.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold every call for the given number of seconds, e.g. after a 429.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class RateLimiter:
+    """
+    One token bucket per verb (get, list, create, patch, ...), the verbs without their own limits sharing the default
+    bucket.
+    @param qps: Calls per second by verb, the default one under "*".
+    @param burst: Burst size by verb, the default one under "*".
+    """
+
+    def __init__(self, qps: Mapping[str, float], burst: Mapping[str, int], **bucket_options: Any) -> None:
+        self.qps = dict(qps)
+        self.burst = dict(burst)
+        default = TokenBucket(self.qps.get(DEFAULT, 0), self.burst.get(DEFAULT, 1), **bucket_options)
+        self.buckets: Dict[str, TokenBucket] = {DEFAULT: default}
+        for verb in set(self.qps) | set(self.burst):
+            if verb != DEFAULT:
+                self.buckets[verb] = TokenBucket(
+                    self.qps.get(verb, default.qps), self.burst.get(verb, default.burst), **bucket_options
+                )
+
+    @staticmethod
+    def from_env() -> "RateLimiter":
+        return RateLimiter(
+            qps=parse_limits(os.environ.get("MLOPS_API_QPS", "50"), float),
+            burst=parse_limits(os.environ.get("MLOPS_API_BURST", "100"), int),
+        )
+
+    def bucket(self, verb: str) -> TokenBucket:
+        return self.buckets.get(verb, self.buckets[DEFAULT])
+
+    def acquire(self, verb: str) -> float:
+        return self.bucket(verb).acquire()
+
+    def pause(self, seconds: float) -> None:
+        for bucket in self.buckets.values():
+            bucket.pause(seconds)
+
+
+class RetryPolicy:
+    """
+    Retries of the transient API failures, read from the environment:
+    - MLOPS_API_RETRIES: retries after the first attempt (default 5, 0 disables them).
+    - MLOPS_API_BACKOFF_BASE: seconds of the first backoff, doubled at every retry (default 0.2).
+    - MLOPS_API_BACKOFF_MAX: cap of the backoff, in seconds (default 30). Retry-After is honored even above it.
+    """
+
+    def __init__(
+        self, retries: Optional[int] = None, base: Optional[float] = None, cap: Optional[float] = None
+    ) -> None:
+        self.retries: int = int(os.environ.get("MLOPS_API_RETRIES", "5")) if retries is None else retries
+        self.base: float = float(os.environ.get("MLOPS_API_BACKOFF_BASE", "0.2")) if base is None else base
+        self.cap: float = float(os.environ.get("MLOPS_API_BACKOFF_MAX", "30")) if cap is None else cap
+        self.random = random.Random()
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        The backoff before a retry: full jitter over an exponential window, but never less than Retry-After.
+        @param attempt: The number of the failed attempt, starting at 0.
+        """
+        backoff = self.random.uniform(0, min(self.cap, self.base * 2**attempt))
+        return max(backoff, retry_after) if retry_after is not None else backoff
+
+
+def retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """
+    The seconds of a Retry-After header, None if missing. HTTP dates are not used by the API server.
+    """
+    value = headers.get("Retry-After") if headers else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_retryable(method: str, status: Optional[int] = None, error: Optional[BaseException] = None) -> bool:
+    """
+    Classify a failed call: throttling (429) is always retried, as the API server didn't process the call; server
+    errors (5xx), timeouts and dropped connections only for the idempotent methods.
+    @param status: The status code of the response, if one was received.
+    @param error: The exception raised instead of a response, if any.
+    """
+    if status == 429:
+        return True
+    if method.upper() not in IDEMPOTENT_METHODS:
+        return False
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    return isinstance(error, (HTTPError, ConnectionError, TimeoutError))
+
+
+limiter: RateLimiter = RateLimiter.from_env()
@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import os
+import socket
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from kubernetes import client as K8SClient
+from utils.api_client import get_api_client
+
+MEMBER_LABEL: str = "blue.intranet/mlops-shard-member"
+FINALIZER_PREFIX: str = "shard.blue.intranet/"
+# The finalizer kopf uses by default, set on the objects handled before sharding was enabled.
+KOPF_FINALIZER: str = "kopf.zalando.org/KopfFinalizerMarker"
+
+
+class ShardSettings:
+    """
+    Sharding settings, read from the environment:
+    - MLOPS_SHARDS: number of shards the namespaces are hashed onto; 0 disables sharding (default 0).
+    - MLOPS_SHARD_IDENTITY: identity of this replica in the Leases (default POD_NAME, then the hostname).
+    - MLOPS_SHARD_LEASE_NAMESPACE: namespace holding the Leases (default POD_NAMESPACE, then ml).
+    - MLOPS_SHARD_LEASE_PREFIX: prefix of the Lease names (default mlops-shard).
+    - MLOPS_SHARD_LEASE_DURATION: seconds after which a Lease that wasn't renewed can be taken over (default 15).
+    - MLOPS_SHARD_RENEW_INTERVAL: seconds between two renewals (default 5).
+    """
+
+    def __init__(self) -> None:
+        self.shards: int = int(os.environ.get("MLOPS_SHARDS", "0"))
+        self.identity: str = (
+            os.environ.get("MLOPS_SHARD_IDENTITY") or os.environ.get("POD_NAME") or socket.gethostname()
+        )
+        self.namespace: str = os.environ.get("MLOPS_SHARD_LEASE_NAMESPACE") or os.environ.get("POD_NAMESPACE") or "ml"
+        self.prefix: str = os.environ.get("MLOPS_SHARD_LEASE_PREFIX", "mlops-shard")
+        self.lease_duration: int = int(os.environ.get("MLOPS_SHARD_LEASE_DURATION", "15"))
+        self.renew_interval: float = float(os.environ.get("MLOPS_SHARD_RENEW_INTERVAL", "5"))
+
+    @property
+    def enabled(self) -> bool:
+        return self.shards > 0
+
+
+def shard_of(key: str, shards: int) -> int:
+    """
+    Stable shard of a key (the builtin hash is salted per process, so it can't be shared between replicas).
+    """
+    return zlib.crc32(key.encode()) % shards
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ShardCoordinator:
+    """
+    Spreads the shards over the live operator replicas using coordination.k8s.io Leases:
+    - every replica renews a member Lease, so the replicas know how many of them are alive;
+    - every shard has its own Lease, held by the replica owning it.
+
+    On each tick, a replica renews the shard Leases it holds, releases the ones above its fair share (when a replica
+    joins) and takes over free or expired ones up to its fair share (when a replica dies). Writes are guarded by the
+    Lease resourceVersion, so two replicas racing for the same shard can't both win.
+    """
+
+    def __init__(
+        self,
+        settings: ShardSettings,
+        api: K8SClient.CoordinationV1Api = None,
+        clock: Callable[[], datetime] = _now,
+    ) -> None:
+        self.settings = settings
+        self.api = api or K8SClient.CoordinationV1Api(get_api_client())
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._owned: Dict[int, datetime] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def finalizer(self) -> str:
+        """
+        The kopf finalizer of this replica. Replicas must not share it: kopf removes its finalizer from the objects
+        none of its handlers match, which is the case of every object outside the shards of a replica.
+        """
+        return f"{FINALIZER_PREFIX}{self.settings.identity}"
+
+    def shard_name(self, shard: int) -> str:
+        return f"{self.settings.prefix}-{shard}"
+
+    def member_name(self) -> str:
+        return f"{self.settings.prefix}-member-{self.settings.identity}"
+
+    def owned(self) -> List[int]:
+        """
+        The shards this replica owns. A shard is given up as soon as its Lease may have expired, even if it couldn't
+        be renewed because the API server was unreachable.
+        """
+        now = self.clock()
+        with self._lock:
+            return sorted(shard for shard, expires in self._owned.items() if expires > now)
+
+    def owns(self, namespace: str) -> bool:
+        return shard_of(namespace, self.settings.shards) in self.owned()
+
+    def _expired(self, lease: K8SClient.V1Lease, now: datetime) -> bool:
+        spec = lease.spec
+        if not spec or not spec.holder_identity or not spec.renew_time:
+            return True
+        return spec.renew_time + timedelta(seconds=spec.lease_duration_seconds or 0) <= now
+
+    def _spec(
+        self, now: datetime, acquire_time: Optional[datetime] = None, transitions: int = 0
+    ) -> K8SClient.V1LeaseSpec:
+        return K8SClient.V1LeaseSpec(
+            holder_identity=self.settings.identity,
+            lease_duration_seconds=self.settings.lease_duration,
+            acquire_time=acquire_time or now,
+            renew_time=now,
+            lease_transitions=transitions,
+        )
+
+    def _read(self, name: str) -> Optional[K8SClient.V1Lease]:
+        try:
+            return self.api.read_namespaced_lease(name=name, namespace=self.settings.namespace)
+        except K8SClient.ApiException as err:
+            if err.status == 404:
+                return None
+            raise
+
+    def _write(self, name: str, lease: Optional[K8SClient.V1Lease], spec: K8SClient.V1LeaseSpec, labels=None) -> bool:
+        """
+        Create or replace a Lease. Returns False if another replica wrote it in the meantime.
+        """
+        try:
+            if lease is None:
+                self.api.create_namespaced_lease(
+                    namespace=self.settings.namespace,
+                    body=K8SClient.V1Lease(
+                        metadata=K8SClient.V1ObjectMeta(name=name, namespace=self.settings.namespace, labels=labels),
+                        spec=spec,
+                    ),
+                )
+            else:
+                lease.spec = spec
+                self.api.replace_namespaced_lease(name=name, namespace=self.settings.namespace, body=lease)
+        except K8SClient.ApiException as err:
+            if err.status == 409:
+                return False
+            raise
+        return True
+
+    def _live_members(self, now: datetime) -> List[str]:
+        leases = self.api.list_namespaced_lease(
+            namespace=self.settings.namespace, label_selector=f"{MEMBER_LABEL}=true"
+        )
+        members = {lease.spec.holder_identity for lease in leases.items if not self._expired(lease, now)}
+        return sorted(members | {self.settings.identity})
+
+    def _preference(self, shard: int) -> str:
+        # Rendezvous hashing: each replica prefers a different order of the free shards, which spreads the takeovers.
+        return hashlib.sha1(f"{self.settings.identity}/{shard}".encode()).hexdigest()
+
+    def tick(self) -> List[int]:
+        """
+        Renew, release and acquire Leases once.
+        @return: The shards owned after the tick.
+        """
+        now = self.clock()
+        expires = now + timedelta(seconds=self.settings.lease_duration)
+
+        member = self._read(self.member_name())
+        self._write(self.member_name(), member, self._spec(now), labels={MEMBER_LABEL: "true"})
+        target = math.ceil(self.settings.shards / len(self._live_members(now)))
+
+        leases = {shard: self._read(self.shard_name(shard)) for shard in range(self.settings.shards)}
+        mine = [
+            shard
+            for shard, lease in leases.items()
+            if lease is not None
+            and not self._expired(lease, now)
+            and lease.spec.holder_identity == self.settings.identity
+        ]
+        free = [shard for shard, lease in leases.items() if lease is None or self._expired(lease, now)]
+
+        owned = {}
+        for shard in sorted(mine, key=self._preference):
+            lease = leases[shard]
+            if len(owned) >= target:
+                # Above the fair share: hand the shard over by letting its Lease expire right away.
+                lease.spec.holder_identity = None
+                lease.spec.renew_time = None
+                self._write(self.shard_name(shard), lease, lease.spec)
+                continue
+            if self._write(
+                self.shard_name(shard),
+                lease,
+                self._spec(now, lease.spec.acquire_time, lease.spec.lease_transitions or 0),
+            ):
+                owned[shard] = expires
+
+        for shard in sorted(free, key=self._preference):
+            if len(owned) >= target:
+                break
+            lease = leases[shard]
+            transitions = ((lease.spec.lease_transitions or 0) + 1) if lease is not None and lease.spec else 0
+            if self._write(self.shard_name(shard), lease, self._spec(now, transitions=transitions)):
+                owned[shard] = expires
+
+        with self._lock:
+            self._owned = owned
+        return sorted(owned)
+
+    def renew(self) -> List[int]:
+        """
+        Run a tick, giving up every shard if it fails for any reason (API error, dropped connection, timeout...): the
+        Leases may not have been renewed, and another replica may take them over before the next tick succeeds.
+        @return: The shards owned after the tick.
+        """
+        owned = self.owned()
+        try:
+            if self.tick() != owned:
+                logging.info(f"Replica {self.settings.identity} now owns shards {self.owned()}")
+        except Exception as err:
+            logging.warning(f"Shard coordination failed, giving up shards {owned} until it succeeds: {err!r}")
+            with self._lock:
+                self._owned = {}
+        return self.owned()
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            self.renew()
+            self._stopped.wait(self.settings.renew_interval)
+
+    def start(self) -> "ShardCoordinator":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="shard-coordinator", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def foreign_finalizers(finalizers: Optional[List[str]], own: str) -> List[str]:
+    """
+    The operator finalizers set by other replicas (previous owners of the shard of an object), which the owner must
+    release, otherwise the object can't be deleted once they are gone.
+    """
+    return [
+        finalizer
+        for finalizer in finalizers or []
+        if finalizer != own and (finalizer.startswith(FINALIZER_PREFIX) or finalizer == KOPF_FINALIZER)
+    ]
+
+
+_coordinator: Optional[ShardCoordinator] = None
+
+
+def start_sharding(settings: Optional[ShardSettings] = None) -> Optional[ShardCoordinator]:
+    """
+    Start the shard coordination if MLOPS_SHARDS is set. Until then, and when sharding is disabled, this replica owns
+    every namespace.
+    """
+    global _coordinator
+    settings = settings or ShardSettings()
+    if not settings.enabled:
+        return None
+    _coordinator = ShardCoordinator(settings).start()
+    return _coordinator
+
+
+def stop_sharding() -> None:
+    global _coordinator
+    if _coordinator is not None:
+        _coordinator.stop()
+    _coordinator = None
+
+
+def get_coordinator() -> Optional[ShardCoordinator]:
+    return _coordinator
+
+
+def owns(namespace: str) -> bool:
+    """
+    Whether this replica reconciles the objects of a namespace.
+    """
+    return _coordinator is None or _coordinator.owns(namespace)
@@ -0,0 +1,133 @@
+"""
+Startup timeline of the operator, measured from the start of the process:
+- imports: mlops.py and its dependencies are loaded;
+- startup: the kopf startup handler is done (metrics server, sharding and informers started);
+- first_watch: the first event is received from a watch, either kopf's or an informer's;
+- cache_synced: every informer listed its objects (only with MLOPS_INFORMERS=true).
+
+Each phase is logged once, exported as mlops_startup_seconds{phase} and reported by the startup probe of the kopf
+liveness endpoint.
+
+The import time of the operator is budgeted for CI: `python -m utils.startup --budget 1.5` imports mlops.py in fresh
+interpreters and exits with 1 when the fastest import takes longer than the budget, listing the slowest modules.
+"""
+
+import argparse
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from utils.metrics import observe_startup_phase
+
+_imported = time.monotonic()
+
+# Seconds, on the development machines mlops.py imports in about 0.7s, most of it in kopf and the kubernetes client.
+IMPORT_BUDGET: float = 1.5
+
+
+class Phase(Enum):
+    IMPORTS = "imports"
+    STARTUP = "startup"
+    FIRST_WATCH = "first_watch"
+    CACHE_SYNCED = "cache_synced"
+
+
+def process_age() -> float:
+    """
+    Seconds since the process started, interpreter startup included where /proc is available.
+    """
+    try:
+        with open("/proc/self/stat") as stat:
+            # The process name may contain spaces, the fields are read after it. starttime is the 22nd field.
+            started = int(stat.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as uptime:
+            return float(uptime.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _imported
+
+
+class StartupTimeline:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: Phase) -> Optional[float]:
+        """
+        Record a phase the first time it is reached, later calls are ignored.
+        @return: The seconds since the process started, or None if the phase was already recorded.
+        """
+        if phase.value in self.phases:
+            return None
+        with self._lock:
+            if phase.value in self.phases:
+                return None
+            seconds = self.phases[phase.value] = round(process_age(), 3)
+        logging.info(f"Startup: {phase.value} after {seconds:.3f}s")
+        observe_startup_phase(phase.value, seconds)
+        return seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(self.phases)
+
+
+timeline = StartupTimeline()
+
+
+def measure_import(module: str = "mlops", repeat: int = 3) -> float:
+    """
+    Import a module in fresh interpreters and return the fastest import time, in seconds.
+    """
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    return min(
+        float(subprocess.run([sys.executable, "-c", code], **_run_options()).stdout.split()[-1]) for _ in range(repeat)
+    )
+
+
+def slowest_imports(module: str = "mlops", top: int = 10) -> List[Tuple[str, float]]:
+    """
+    The top level packages taking the longest to import along with a module, from python -X importtime.
+    @return: The (package, seconds) pairs, slowest first.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], **_run_options())
+    packages: Dict[str, float] = defaultdict(float)
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)", line)
+        if match:
+            packages[match.group(2).split(".")[0]] += int(match.group(1)) / 1e6
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def _run_options() -> dict:
+    return {
+        "cwd": Path(__file__).resolve().parent.parent,
+        "capture_output": True,
+        "text": True,
+        "check": True,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the import time of the operator against a budget.")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="Seconds.")
+    parser.add_argument("--module", default="mlops")
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+
+    seconds = measure_import(arguments.module, arguments.repeat)
+    print(f"import {arguments.module}: {seconds:.3f}s (budget {arguments.budget:.3f}s)")
+    for package, package_seconds in slowest_imports(arguments.module):
+        print(f"  {package:<40} {package_seconds:.3f}s")
+    if seconds > arguments.budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+Lightweight tracing of the reconciles: every kopf handler opens a root span, the resource methods it goes through and
+the Kubernetes API calls they send open nested spans, so a slow endpoint swap can be broken down into its steps.
+
+Usage (from containers/mlops): python -m utils.tracing traces.jsonl [--trace TRACE_ID] prints a timeline per trace.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class TracingSettings:
+    """
+    Tracing settings, read from the environment:
+    - MLOPS_TRACING: exporter of the spans, one of off, jsonl or otlp (default off).
+    - MLOPS_TRACING_PATH: file the jsonl exporter appends the spans to (default /tmp/mlops-traces.jsonl).
+    - MLOPS_TRACING_OTLP_ENDPOINT: base URL of the OTLP/HTTP collector (default http://localhost:4318).
+    - MLOPS_TRACING_SAMPLE_RATIO: share of the reconciles traced, between 0 and 1 (default 1).
+    """
+
+    def __init__(self) -> None:
+        self.exporter: str = os.environ.get("MLOPS_TRACING", "off").lower()
+        self.path: str = os.environ.get("MLOPS_TRACING_PATH", "/tmp/mlops-traces.jsonl")
+        self.otlp_endpoint: str = os.environ.get("MLOPS_TRACING_OTLP_ENDPOINT", "http://localhost:4318")
+        self.sample_ratio: float = float(os.environ.get("MLOPS_TRACING_SAMPLE_RATIO", "1"))
+
+
+class _Trace:
+    """
+    The spans of one trace, exported together when its root span ends.
+    """
+
+    def __init__(self, trace_id: str, sampled: bool) -> None:
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List[Dict[str, Any]] = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, trace: _Trace, name: str, parent: Optional["Span"], attributes: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent = parent
+        self.attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.start = time.time_ns()
+        self.end: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("mlops_span", default=None)
+
+
+class JsonLinesExporter:
+    """
+    Append the spans to a local file, one JSON object per line.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+        with self._lock, open(self.path, "a") as file:
+            file.write(lines)
+
+
+class OtlpExporter:
+    """
+    Send the spans to an OpenTelemetry collector with the OTLP/HTTP JSON protocol, from a background thread so the
+    reconciles never wait for the collector.
+    """
+
+    def __init__(self, endpoint: str, service: str = "mlops-operator") -> None:
+        self.url = f"{endpoint.rstrip('/')}/v1/traces"
+        self.service = service
+        self._queue: "queue.Queue[List[Dict[str, Any]]]" = queue.Queue(maxsize=1000)
+        self._thread = threading.Thread(target=self._run, name="tracing-otlp", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def payload(self, spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [self._attribute("service.name", self.service)]},
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "mlops"},
+                            "spans": [
+                                {
+                                    "traceId": span["trace_id"],
+                                    "spanId": span["span_id"],
+                                    "parentSpanId": span["parent_id"] or "",
+                                    "name": span["name"],
+                                    "kind": 1,
+                                    "startTimeUnixNano": str(span["start"]),
+                                    "endTimeUnixNano": str(span["end"]),
+                                    "attributes": [self._attribute(k, v) for k, v in span["attributes"].items()],
+                                    "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+                                }
+                                for span in spans
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            logging.warning(f"Dropping {len(spans)} spans, the OTLP collector at {self.url} is not keeping up")
+
+    def _run(self) -> None:
+        while True:
+            spans = self._queue.get()
+            request = urllib.request.Request(
+                self.url,
+                data=json.dumps(self.payload(spans)).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+            except OSError as err:
+                logging.warning(f"Failed to export {len(spans)} spans to {self.url}: {err}")
+
+
+class Tracer:
+    def __init__(self, exporter: Any = None, sample_ratio: float = 1.0) -> None:
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextlib.contextmanager
+    def span(self, operation: str, root: bool = True, **attributes: Any) -> Iterator[Optional[Span]]:
+        """
+        Open a span nested in the current one.
+        @param operation: The name of the span, e.g. the function or the API call it covers.
+        @param root: Start a new trace when there's no current span. Spans with root=False (the API calls) are only
+        recorded inside a trace, so the background watches don't produce traces of their own.
+        @param attributes: The attributes of the span, e.g. the kind and the name of the resource.
+        @return: The span, None if it isn't recorded.
+        """
+        parent = _current.get()
+        if not self.enabled or (parent is None and not root) or (parent is not None and not parent.trace.sampled):
+            yield None
+            return
+
+        if parent is None:
+            trace = _Trace(f"{random.getrandbits(128):032x}", random.random() < self.sample_ratio)
+            if not trace.sampled:
+                # Unsampled traces still set a current span, so the spans nested in them don't start new traces.
+                token = _current.set(Span(trace, operation, None, {}))
+                try:
+                    yield None
+                finally:
+                    _current.reset(token)
+                return
+        else:
+            trace = parent.trace
+
+        span = Span(trace, operation, parent, attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as err:
+            span.error = f"{type(err).__name__}: {err}"
+            raise
+        finally:
+            _current.reset(token)
+            span.end = time.time_ns()
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        trace = span.trace
+        with trace.lock:
+            if trace.closed:
+                spans = [span.as_dict()]
+            else:
+                trace.spans.append(span.as_dict())
+                if span.parent is not None:
+                    return
+                trace.closed = True
+                spans, trace.spans = trace.spans, []
+        try:
+            self.exporter.export(spans)
+        except OSError as err:
+            logging.warning(f"Failed to export {len(spans)} spans: {err}")
+
+
+def new_tracer(settings: Optional[TracingSettings] = None) -> Tracer:
+    settings = settings or TracingSettings()
+    if settings.exporter == "jsonl":
+        return Tracer(JsonLinesExporter(settings.path), settings.sample_ratio)
+    if settings.exporter == "otlp":
+        return Tracer(OtlpExporter(settings.otlp_endpoint), settings.sample_ratio)
+    return Tracer()
+
+
+tracer = new_tracer()
+
+
+def set_tracer(new: Tracer) -> None:
+    global tracer
+    tracer = new
+
+
+def span(operation: str, root: bool = True, **attributes: Any) -> contextlib.AbstractContextManager:
+    return tracer.span(operation, root=root, **attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def _method_attributes(instance: Any) -> Dict[str, Any]:
+    return {
+        "kind": type(instance).__name__,
+        "name": getattr(instance, "named_version", None) or getattr(instance, "name", None),
+        "namespace": getattr(instance, "namespace", None),
+    }
+
+
+def traced(function: Callable[..., T]) -> Callable[..., T]:
+    """
+    Trace a method of a resource class, with the kind, the name and the namespace of the resource as attributes.
+    """
+    operation = function.__qualname__
+
+    if asyncio.iscoroutinefunction(function):
+
+        @functools.wraps(function)
+        async def async_wrapper(self, *args, **kwargs):
+            with tracer.span(operation, **_method_attributes(self)):
+                return await function(self, *args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        with tracer.span(operation, **_method_attributes(self)):
+            return function(self, *args, **kwargs)
+
+    return wrapper
+
+
+def traced_handler(function: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """
+    Trace an async kopf handler: each call is the root span of a trace, with the plural, the name and the namespace of
+    the object being handled as attributes.
+    """
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        resource = kwargs.get("resource")
+        with tracer.span(
+            function.__name__,
+            kind=getattr(resource, "plural", None),
+            name=kwargs.get("name"),
+            namespace=kwargs.get("namespace"),
+        ):
+            return await function(*args, **kwargs)
+
+    return wrapper
+
+
+def propagate(function: Callable[[], Awaitable[T]]) -> Callable[[], Awaitable[T]]:
+    """
+    Bind a coroutine function to the current span, for coroutines run by long-lived worker tasks (e.g. the work
+    queue), which don't inherit the context of the caller.
+    """
+    parent = _current.get()
+    if parent is None:
+        return function
+
+    async def wrapper() -> T:
+        token = _current.set(parent)
+        try:
+            return await function()
+        finally:
+            _current.reset(token)
+
+    return wrapper
+
+
+def read_spans(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                span = json.loads(line)
+                traces.setdefault(span["trace_id"], []).append(span)
+    return traces
+
+
+def timeline(spans: List[Dict[str, Any]], width: int = 40) -> str:
+    """
+    Render the spans of a trace as a flame-style timeline: one line per span, nested under its parent, with a bar
+    showing when it ran relative to the whole trace.
+    """
+    start = min(span["start"] for span in spans)
+    total = max(max(span["end"] for span in spans) - start, 1)
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {span["span_id"] for span in spans}
+    for span in sorted(spans, key=lambda span: span["start"]):
+        parent = span["parent_id"] if span["parent_id"] in ids else None
+        children.setdefault(parent, []).append(span)
+
+    lines = []
+
+    def render(span: Dict[str, Any], depth: int) -> None:
+        offset = int((span["start"] - start) / total * width)
+        length = max(int((span["end"] - span["start"]) / total * width), 1)
+        bar = (" " * offset + "#" * length).ljust(width)
+        attributes = " ".join(f"{key}={value}" for key, value in span["attributes"].items())
+        error = f" ERROR {span['error']}" if span["error"] else ""
+        lines.append(
+            f"|{bar}| {(span['start'] - start) / 1e9:9.3f}s {(span['end'] - span['start']) / 1e9:9.3f}s "
+            f"{'  ' * depth}{span['name']} {attributes}{error}".rstrip()
+        )
+        for child in children.get(span["span_id"], []):
+            render(child, depth + 1)
+
+    for root in children.get(None, []):
+        render(root, 0)
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="spans written by the jsonl exporter")
+    parser.add_argument("--trace", help="only show this trace")
+    arguments = parser.parse_args()
+
+    for trace_id, spans in read_spans(arguments.path).items():
+        if arguments.trace and trace_id != arguments.trace:
+            continue
+        print(f"trace {trace_id}")
+        print(timeline(spans))
+        print()
+
+
+if __name__ == "__main__":
+    main()
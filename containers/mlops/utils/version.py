@@ -1,4 +1,10 @@
+import hashlib
+import json
 import time
+from typing import Any, Dict
+
+# Hex digits of the content hash used as the version of the model versions.
+CONTENT_VERSION_LENGTH: int = 10
 
 
 def dec_to_base(number: int, base: int, digits: int = 4) -> str:
@@ -27,3 +33,13 @@ def get_version():
             dec_to_base(int(1000 * (timestamp - int(timestamp))), 36, 2),
         ]
     )
+
+
+def get_content_version(content: Dict[str, Any]) -> str:
+    """
+    A version derived from a content rather than from the time: the same content always gets the same version.
+    @param content: Any JSON serializable content, e.g. the image, artifact, command, args and resources of a model.
+    @return: A prefix of the SHA-256 of the content, usable in the name of any Kubernetes object.
+    """
+    digest = hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+    return digest[:CONTENT_VERSION_LENGTH]
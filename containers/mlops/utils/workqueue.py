@@ -0,0 +1,164 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import defaultdict, deque
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple, TypeVar
+
+from utils.metrics import observe_queue_wait, track_queue_depth
+from utils.tracing import propagate
+
+T = TypeVar("T")
+
+WORKERS: int = int(os.environ.get("MLOPS_WORKERS", "4"))
+
+
+class Lane(IntEnum):
+    """
+    Priority lanes of the work queue, the lowest value runs first.
+    """
+
+    DELETE = 0
+    WEIGHTS = 1
+    UPDATE = 2
+    ROLLOUT = 3
+
+
+class QueueStats:
+    """
+    Per-lane queue depth and time spent waiting for a worker.
+    """
+
+    def __init__(self) -> None:
+        self.depth: Dict[Lane, int] = defaultdict(int)
+        self.waits: Dict[Lane, int] = defaultdict(int)
+        self.wait_seconds: Dict[Lane, float] = defaultdict(float)
+        self.max_wait_seconds: Dict[Lane, float] = defaultdict(float)
+
+    def record_wait(self, lane: Lane, seconds: float) -> None:
+        self.waits[lane] += 1
+        self.wait_seconds[lane] += seconds
+        self.max_wait_seconds[lane] = max(self.max_wait_seconds[lane], seconds)
+        observe_queue_wait(lane.name.lower(), seconds)
+
+    def export(self) -> None:
+        """
+        Export the depth of each lane as a Prometheus gauge.
+        """
+        for lane in Lane:
+            track_queue_depth(lane.name.lower(), lambda lane=lane: self.depth[lane])
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            lane.name.lower(): {
+                "depth": self.depth[lane],
+                "waits": self.waits[lane],
+                "wait_seconds": round(self.wait_seconds[lane], 6),
+                "max_wait_seconds": round(self.max_wait_seconds[lane], 6),
+            }
+            for lane in Lane
+        }
+
+
+class _Item:
+    def __init__(self, lane: Lane, function: Callable[[], Awaitable[Any]], future: asyncio.Future) -> None:
+        self.lane = lane
+        self.function = function
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class WorkQueue:
+    """
+    Bounded pool of workers running the reconciles of the operator:
+    - the work items of one key (usually one object) run one at a time, in the order they were submitted;
+    - the work items of different keys run in parallel, at most `workers` at a time;
+    - when more keys are ready than there are free workers, the one with the most urgent lane at the head of its queue
+      goes first (deletes, then weight-only changes, then the other updates, then model rollouts), so a burst of slow
+      rollouts doesn't hold back a delete.
+    """
+
+    def __init__(self, workers: int = WORKERS) -> None:
+        self.workers = workers
+        self.stats = QueueStats()
+
+        self._pending: Dict[Hashable, Deque[_Item]] = {}
+        self._active: Set[Hashable] = set()
+        self._ready: List[Tuple[int, int, Hashable]] = []
+        self._sequence = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Condition()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    def _schedule(self, key: Hashable) -> None:
+        """
+        Mark a key as ready to run if it is idle and has pending items.
+        """
+        queue = self._pending.get(key)
+        if key in self._active or not queue:
+            return
+        heapq.heappush(self._ready, (queue[0].lane, next(self._sequence), key))
+
+    async def submit(self, key: Hashable, function: Callable[[], Awaitable[T]], lane: Lane = Lane.UPDATE) -> T:
+        """
+        Queue a coroutine function and wait for its result.
+        @param key: The serialization key, e.g. (plural, namespace, name).
+        @param function: The coroutine function to run, without arguments.
+        @param lane: The priority lane of the work item.
+        @return: The result of the coroutine.
+        """
+        self._start()
+        # The workers are long-lived tasks: bind the item to the span of the caller, so its spans nest under it.
+        item = _Item(lane, propagate(function), self._loop.create_future())
+        async with self._wakeup:
+            self._pending.setdefault(key, deque()).append(item)
+            self.stats.depth[lane] += 1
+            if len(self._pending[key]) == 1:
+                self._schedule(key)
+            self._wakeup.notify()
+        return await item.future
+
+    async def _work(self) -> None:
+        while True:
+            async with self._wakeup:
+                while not self._ready:
+                    await self._wakeup.wait()
+                _, _, key = heapq.heappop(self._ready)
+                self._active.add(key)
+                item = self._pending[key].popleft()
+                self.stats.depth[item.lane] -= 1
+                self.stats.record_wait(item.lane, time.monotonic() - item.enqueued)
+
+            try:
+                result = await item.function()
+            except Exception as err:
+                if not item.future.done():
+                    item.future.set_exception(err)
+            else:
+                if not item.future.done():
+                    item.future.set_result(result)
+
+            async with self._wakeup:
+                self._active.discard(key)
+                if self._pending[key]:
+                    self._schedule(key)
+                    self._wakeup.notify()
+                else:
+                    del self._pending[key]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None